@@ -0,0 +1,87 @@
+"""Benchmark per-token delta extraction over long multi-choice generations.
+
+Simulates the cumulative outputs the engine yields for a long generation with
+several choices and times only the delta extraction, reporting the mean cost per
+token for each window of the generation. A flat profile means the per-step work
+does not grow with the length of the generation.
+
+Usage:
+    python benchmarks/bench_delta_tracker.py --tokens 8192 --n 4
+"""
+
+import argparse
+import time
+from types import SimpleNamespace
+
+from backend.vllm_server.engine.delta import DeltaTracker
+
+PIECES = [" the", " quick", " brown", " fox", " jumps", " over", " lazy", " dog"]
+
+
+class PreviousTextTracker:
+    """Reference implementation keeping the previously streamed text per choice."""
+
+    def __init__(self, n: int):
+        """Initialize the tracker for `n` choices."""
+        self.previous_texts = [""] * n
+        self.previous_num_tokens = [0] * n
+
+    def advance(self, output):
+        """Slice the delta relative to the previously streamed text."""
+        i = output.index
+        delta_token_ids = output.token_ids[self.previous_num_tokens[i] :]
+        top_logprobs = (
+            output.logprobs[self.previous_num_tokens[i] :] if output.logprobs else None
+        )
+        delta_text = output.text[len(self.previous_texts[i]) :]
+        self.previous_texts[i] = output.text
+        self.previous_num_tokens[i] = len(output.token_ids)
+        return delta_text, delta_token_ids, top_logprobs
+
+
+def run(tracker, num_tokens: int, n: int, window: int) -> list:
+    """Feed cumulative outputs to `tracker` and time each window of tokens."""
+    outputs = [
+        SimpleNamespace(index=i, text="", token_ids=[], logprobs=[]) for i in range(n)
+    ]
+    windows = []
+    elapsed = 0
+    for step in range(num_tokens):
+        for output in outputs:
+            # Building the cumulative output is the engine's work, not ours
+            output.text = output.text + PIECES[step % len(PIECES)]
+            output.token_ids.append(step)
+            output.logprobs.append({step: -1.0})
+
+        start = time.perf_counter_ns()
+        for output in outputs:
+            tracker.advance(output)
+        elapsed += time.perf_counter_ns() - start
+
+        if (step + 1) % window == 0:
+            windows.append(elapsed / (window * n))
+            elapsed = 0
+    return windows
+
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--tokens", type=int, default=8192)
+    parser.add_argument("--n", type=int, default=4)
+    parser.add_argument("--window", type=int, default=1024)
+    args = parser.parse_args()
+
+    baseline = run(PreviousTextTracker(args.n), args.tokens, args.n, args.window)
+    tracker = run(DeltaTracker(args.n), args.tokens, args.n, args.window)
+
+    print(f"tokens={args.tokens} n={args.n} (ns per token per choice)")
+    print(f"{'window':>12} {'previous-text':>14} {'delta-tracker':>14}")
+    for i, (old, new) in enumerate(zip(baseline, tracker)):
+        start = i * args.window
+        label = f"{start}-{start + args.window}"
+        print(f"{label:>12} {old:>14.1f} {new:>14.1f}")
+
+
+if __name__ == "__main__":
+    main()
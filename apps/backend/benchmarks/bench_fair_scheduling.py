@@ -0,0 +1,113 @@
+"""Benchmark interactive time to first token while a batch tenant saturates.
+
+Simulates a model container admitting requests with the `AdmissionController`.
+A batch tenant keeps many requests in flight while a few interactive users send
+a request every so often. An admitted request holds its tokens for its prefill
+and decoding time. The time to first token of the interactive users is compared
+between arrival order admission, fair admission between tenants, and fair
+admission with the batch tenant in the batch priority class.
+
+Usage:
+    python benchmarks/bench_fair_scheduling.py --batch-concurrency 64 --duration 5
+"""
+
+import argparse
+import asyncio
+import random
+import statistics
+import time
+
+from backend.vllm_server.admission import AdmissionController
+from backend.vllm_server.fair_queue import BATCH, INTERACTIVE, Scheduling
+
+PROMPT_TOKENS = 512
+MAX_TOKENS = 256
+
+
+async def generate(
+    controller: AdmissionController,
+    scheduling: Scheduling,
+    args: argparse.Namespace,
+) -> float:
+    """Admit and serve a request, returning its time to first token."""
+    start = time.perf_counter()
+    admission = await controller.acquire(PROMPT_TOKENS + MAX_TOKENS, scheduling)
+    try:
+        await asyncio.sleep(args.prefill_ms / 1000)
+        ttft = time.perf_counter() - start
+        await asyncio.sleep(MAX_TOKENS * args.token_ms / 1000)
+    finally:
+        admission.release()
+    return ttft
+
+
+async def batch_tenant(controller, scheduling, args, stop: asyncio.Event) -> int:
+    """Keep the batch concurrency requests in flight, returning the completions."""
+    completed = 0
+
+    async def worker():
+        nonlocal completed
+        while not stop.is_set():
+            await generate(controller, scheduling, args)
+            completed += 1
+
+    await asyncio.gather(*(worker() for _ in range(args.batch_concurrency)))
+    return completed
+
+
+async def interactive_user(controller, user: int, mode: str, args, stop, ttfts):
+    """Send a request every interval, recording its time to first token."""
+    rng = random.Random(user)
+    scheduling = Scheduling("batch" if mode == "fifo" else f"user-{user}", INTERACTIVE)
+    while not stop.is_set():
+        await asyncio.sleep(rng.expovariate(1 / args.interval))
+        ttfts.append(await generate(controller, scheduling, args))
+
+
+async def run(mode: str, args: argparse.Namespace):
+    """Run a scenario, returning the interactive TTFTs and batch completions."""
+    budget = args.budget_requests * (PROMPT_TOKENS + MAX_TOKENS)
+    controller = AdmissionController(budget, max_queue_wait=3600)
+    batch_scheduling = Scheduling("batch", BATCH if mode == "priority" else INTERACTIVE)
+
+    stop = asyncio.Event()
+    ttfts = []
+    batch = asyncio.create_task(batch_tenant(controller, batch_scheduling, args, stop))
+    # Let the batch tenant saturate the server first
+    await asyncio.sleep(0.1)
+    users = [
+        asyncio.create_task(interactive_user(controller, i, mode, args, stop, ttfts))
+        for i in range(args.users)
+    ]
+    await asyncio.sleep(args.duration)
+    stop.set()
+    completed = await batch
+    await asyncio.gather(*users)
+    return ttfts, completed
+
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--budget-requests", type=int, default=16)
+    parser.add_argument("--batch-concurrency", type=int, default=64)
+    parser.add_argument("--users", type=int, default=4)
+    parser.add_argument("--interval", type=float, default=0.2)
+    parser.add_argument("--prefill-ms", type=float, default=20.0)
+    parser.add_argument("--token-ms", type=float, default=0.5)
+    parser.add_argument("--duration", type=float, default=5.0)
+    args = parser.parse_args()
+
+    print(f"{'admission':<12}{'TTFT p50':>12}{'TTFT p99':>12}{'batch done':>12}")
+    for mode in ("fifo", "fair", "priority"):
+        ttfts, completed = asyncio.run(run(mode, args))
+        ttfts.sort()
+        p99 = ttfts[max(0, int(len(ttfts) * 0.99) - 1)]
+        print(
+            f"{mode:<12}{statistics.median(ttfts) * 1e3:>10.1f}ms"
+            f"{p99 * 1e3:>10.1f}ms{completed:>12}"
+        )
+
+
+if __name__ == "__main__":
+    main()
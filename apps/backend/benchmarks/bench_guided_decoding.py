@@ -0,0 +1,78 @@
+"""Benchmark cold and warm guided decoding processor lookups.
+
+Requests the logits processor of the agent's `TakeAction` JSON schema, a regex and
+a choice constraint from the `GuidedDecodingCache`. The first request for each
+constraint compiles its state machine, later requests, including ones sending the
+schema with a different key order, copy the cached processor.
+
+Requires vLLM and outlines.
+
+Usage:
+    python benchmarks/bench_guided_decoding.py --warm-requests 100
+"""
+
+import argparse
+import asyncio
+import json
+import statistics
+import time
+
+from backend.functions import TakeAction
+from backend.vllm_server.config import BASE_MODEL
+from backend.vllm_server.engine.guided_decoding import GuidedDecodingCache
+from backend.vllm_server.schema.chat import ChatCompletionRequest
+from transformers import AutoTokenizer
+
+MESSAGES = [{"role": "user", "content": "What datasets are available?"}]
+
+
+def make_requests() -> dict:
+    """Create a request for each kind of constraint."""
+    schema = TakeAction.model_json_schema()
+    return {
+        "json": {"guided_json": schema},
+        "json (reordered)": {
+            "guided_json": json.dumps(dict(reversed(list(schema.items()))), indent=2)
+        },
+        "regex": {"guided_regex": r"\d{4}-\d{2}-\d{2}"},
+        "choice": {"guided_choice": ["ListDatasets", "DescribeDataset", "Think"]},
+    }
+
+
+async def lookup(cache: GuidedDecodingCache, request: ChatCompletionRequest) -> float:
+    """Return the time taken to get the processor of a request."""
+    start = time.perf_counter()
+    await cache.get_logits_processor(request)
+    return time.perf_counter() - start
+
+
+async def run(tokenizer, warm_requests: int):
+    """Time the cold and warm lookups of every constraint."""
+    cache = GuidedDecodingCache(tokenizer)
+    print(f"{'constraint':<18}{'cold':>12}{'warm p50':>12}{'warm p99':>12}")
+    for name, fields in make_requests().items():
+        request = ChatCompletionRequest(model=BASE_MODEL, messages=MESSAGES, **fields)
+        cold = await lookup(cache, request)
+        warm = sorted([await lookup(cache, request) for _ in range(warm_requests)])
+        print(
+            f"{name:<18}{cold * 1e3:>10.1f}ms"
+            f"{statistics.median(warm) * 1e3:>10.3f}ms"
+            f"{warm[int(len(warm) * 0.99) - 1] * 1e3:>10.3f}ms"
+        )
+    print(f"compiles: {cache.misses}, cache hits: {cache.hits}")
+    cache.shutdown()
+
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--tokenizer", default=BASE_MODEL)
+    parser.add_argument("--warm-requests", type=int, default=100)
+    args = parser.parse_args()
+
+    tokenizer = AutoTokenizer.from_pretrained(args.tokenizer)
+    asyncio.run(run(tokenizer, args.warm_requests))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""Measure the import time of the vLLM server modules.
+
+Imports each module in a fresh interpreter with `python -X importtime` and reports
+its cumulative import time, whether it pulled in vLLM, torch or Modal, and the
+slowest top-level packages it imported. Modules failing to import, such as the
+Modal apps when Modal is not installed, are reported as such.
+
+Usage:
+    python benchmarks/bench_importtime.py
+    python benchmarks/bench_importtime.py --module backend.vllm_server.service --top 5
+"""
+
+import argparse
+import subprocess
+import sys
+from typing import Dict, List, Optional, Tuple
+
+MODULES = [
+    "backend.vllm_server.config",
+    "backend.vllm_server.schema.chat",
+    "backend.vllm_server.service",
+    "backend.vllm_server.api_server",
+    "backend.vllm_server.model",
+]
+HEAVY = ("vllm", "torch", "modal")
+
+
+def import_times(module: str) -> Optional[Dict[str, Tuple[int, int]]]:
+    """Import the module in a fresh interpreter.
+
+    Returns:
+        The self and cumulative microseconds of every imported module, or None if
+        the module failed to import.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode:
+        return None
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:") :].split("|")
+        if not self_us.strip().isdigit():
+            continue
+        times[name.strip()] = (int(self_us), int(cumulative_us))
+    return times
+
+
+def top_level(times: Dict[str, Tuple[int, int]]) -> List[Tuple[str, int]]:
+    """Sum the self time of the imported modules by top-level package."""
+    packages: Dict[str, int] = {}
+    for name, (self_us, _) in times.items():
+        package = name.split(".")[0]
+        packages[package] = packages.get(package, 0) + self_us
+    return sorted(packages.items(), key=lambda item: item[1], reverse=True)
+
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--module", action="append", dest="modules")
+    parser.add_argument("--top", type=int, default=3)
+    args = parser.parse_args()
+
+    for module in args.modules or MODULES:
+        times = import_times(module)
+        if times is None:
+            print(f"{module:40} failed to import")
+            continue
+        total = times[module][1] if module in times else 0
+        heavy = [name for name in HEAVY if name in times] or ["none"]
+        slowest = ", ".join(
+            f"{package} {us / 1e3:.0f} ms"
+            for package, us in top_level(times)[: args.top]
+        )
+        print(
+            f"{module:40} {total / 1e3:8.1f} ms  heavy: {','.join(heavy):16} "
+            f"slowest: {slowest}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""Benchmark applying a large logit bias map on every decoding step.
+
+Compares the Python closure looping over the bias map, as previously installed by
+`to_sampling_params`, with the compiled `LogitBiasProcessor`.
+
+Usage:
+    python benchmarks/bench_logit_bias.py --biases 500 --steps 1000 --device cpu
+"""
+
+import argparse
+import random
+import time
+
+import torch
+from backend.vllm_server.engine.logit_bias import get_logit_bias_processor
+
+
+def closure_processor(logit_bias: dict):
+    """Build the per-step Python loop processor."""
+
+    def logit_bias_logits_processor(token_ids, logits):
+        for token_id, bias in logit_bias.items():
+            # Clamp the bias between -100 and 100 per OpenAI API spec
+            bias = min(100, max(-100, bias))
+            logits[int(token_id)] += bias
+        return logits
+
+    return logit_bias_logits_processor
+
+
+def bench(processor, logits, steps: int) -> float:
+    """Return the mean time of applying the processor to the logits per step."""
+    processor([], logits)
+    if logits.is_cuda:
+        torch.cuda.synchronize()
+    start = time.perf_counter()
+    for _ in range(steps):
+        processor([], logits)
+    if logits.is_cuda:
+        torch.cuda.synchronize()
+    return (time.perf_counter() - start) / steps
+
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--vocab-size", type=int, default=32000)
+    parser.add_argument("--biases", type=int, default=500)
+    parser.add_argument("--steps", type=int, default=1000)
+    parser.add_argument(
+        "--device", default="cuda" if torch.cuda.is_available() else "cpu"
+    )
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    logit_bias = {
+        str(token_id): -100.0
+        for token_id in rng.sample(range(args.vocab_size), args.biases)
+    }
+    logits = torch.zeros(args.vocab_size, device=args.device)
+
+    start = time.perf_counter()
+    processor = get_logit_bias_processor(logit_bias)
+    compile_time = time.perf_counter() - start
+    start = time.perf_counter()
+    assert get_logit_bias_processor(logit_bias) is processor
+    cached_time = time.perf_counter() - start
+
+    closure_time = bench(closure_processor(logit_bias), logits, args.steps)
+    compiled_time = bench(processor, logits, args.steps)
+    print(f"{args.biases} biases over a vocabulary of {args.vocab_size}")
+    print(
+        f"  compile {compile_time * 1e3:.3f}ms, cached lookup {cached_time * 1e3:.3f}ms"
+    )
+    print(f"  closure:  {closure_time * 1e6:10.1f}us per step")
+    print(f"  compiled: {compiled_time * 1e6:10.1f}us per step")
+    print(f"  speedup:  {closure_time / compiled_time:10.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""Benchmark building OpenAI logprobs for long generations.
+
+Compares building logprobs one token at a time, as the vLLM OpenAI server does,
+with the batched builder used by the engines. Both builders receive the same
+synthetic `top_logprobs` steps, as produced when every generated token requests
+`top_logprobs` candidates.
+
+Usage:
+    python benchmarks/bench_logprobs.py --tokens 2048 --top-logprobs 20
+"""
+
+import argparse
+import random
+import time
+from typing import Optional, Sequence
+
+from backend.vllm_server.config import BASE_MODEL
+from backend.vllm_server.engine.logprobs import TopLogprobs, create_logprobs
+from backend.vllm_server.schema.common import LogProbs
+from transformers import AutoTokenizer
+
+
+def create_logprobs_reference(
+    tokenizer,
+    token_ids: Sequence[int],
+    top_logprobs: Optional[TopLogprobs] = None,
+    num_output_top_logprobs: Optional[int] = None,
+    initial_text_offset: int = 0,
+) -> LogProbs:
+    """Create logprobs one token at a time, as the vLLM OpenAI server does."""
+    logprobs = LogProbs()
+    last_token_len = 0
+    if num_output_top_logprobs:
+        logprobs.top_logprobs = []
+    for i, token_id in enumerate(token_ids):
+        step_top_logprobs = top_logprobs[i] if top_logprobs is not None else None
+        if step_top_logprobs is not None:
+            token_logprob = step_top_logprobs[token_id]
+        else:
+            token_logprob = None
+        token = tokenizer.convert_ids_to_tokens(token_id)
+        logprobs.tokens.append(token)
+        logprobs.token_logprobs.append(token_logprob)
+        if len(logprobs.text_offset) == 0:
+            logprobs.text_offset.append(initial_text_offset)
+        else:
+            logprobs.text_offset.append(logprobs.text_offset[-1] + last_token_len)
+        last_token_len = len(token)
+
+        if num_output_top_logprobs:
+            logprobs.top_logprobs.append(
+                {
+                    tokenizer.convert_ids_to_tokens(i): p
+                    for i, p in step_top_logprobs.items()
+                }
+                if step_top_logprobs
+                else None
+            )
+    return logprobs
+
+
+def make_steps(vocab_size: int, num_tokens: int, top_logprobs: int, seed: int = 0):
+    """Create generated token IDs and their top logprob candidates."""
+    rng = random.Random(seed)
+    token_ids = []
+    steps = []
+    for _ in range(num_tokens):
+        candidates = rng.sample(range(vocab_size), top_logprobs)
+        token_ids.append(candidates[0])
+        steps.append({c: -rng.random() * 10 for c in candidates})
+    return token_ids, steps
+
+
+def bench(fn, repeat: int) -> float:
+    """Return the best wall time of `repeat` runs of `fn`."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--tokenizer", default=BASE_MODEL)
+    parser.add_argument("--tokens", type=int, default=2048)
+    parser.add_argument("--top-logprobs", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    tokenizer = AutoTokenizer.from_pretrained(args.tokenizer)
+    token_ids, steps = make_steps(len(tokenizer), args.tokens, args.top_logprobs)
+
+    def run(builder):
+        return builder(
+            tokenizer,
+            token_ids,
+            top_logprobs=steps,
+            num_output_top_logprobs=args.top_logprobs,
+        )
+
+    reference, batched = run(create_logprobs_reference), run(create_logprobs)
+    assert reference.model_dump() == batched.model_dump()
+
+    reference_time = bench(lambda: run(create_logprobs_reference), args.repeat)
+    batched_time = bench(lambda: run(create_logprobs), args.repeat)
+    print(f"{args.tokens} tokens with top_logprobs={args.top_logprobs}")
+    print(f"  per token: {reference_time * 1e3:8.2f}ms")
+    print(f"  batched:   {batched_time * 1e3:8.2f}ms")
+    print(f"  speedup:   {reference_time / batched_time:8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""Simulate game-schedule-aware pre-warming of GPU containers.
+
+Replays request arrivals against the autoscaling of the model containers, once
+without pre-warming and once with the `PrewarmPlanner` planning warm containers
+from the game schedule and the requests seen so far.
+The cold starts, the containers started ahead of requests and the GPU minutes of
+both are reported, with the GPU minutes spent per cold start avoided.
+
+The arrivals are the `timestamp` of each line of a JSONL trace, like the traces
+of `bench_replay.py`, or synthetic traffic following the schedule: a low
+baseline rate with spikes from shortly before tip-off until the end of each game.
+
+Usage:
+    python benchmarks/bench_prewarm.py --schedule benchmarks/traces/example_games.csv
+    python benchmarks/bench_prewarm.py --trace trace.jsonl --schedule games.csv
+"""
+
+import argparse
+import json
+import math
+import random
+from typing import List, Sequence
+
+from backend.prewarm.scheduler import (
+    Game,
+    PrewarmPlanner,
+    PrewarmPolicy,
+    SimulationResult,
+    load_schedule,
+    simulate,
+)
+
+
+def load_arrivals(path: str) -> List[float]:
+    """Load the arrival times of the requests of a trace."""
+    arrivals = []
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if isinstance(record, dict) and record.get("timestamp") is not None:
+                arrivals.append(float(record["timestamp"]))
+    return sorted(arrivals)
+
+
+def synthetic_arrivals(
+    schedule: Sequence[Game], args: argparse.Namespace
+) -> List[float]:
+    """Generate Poisson arrivals with a spike around every game of the schedule."""
+    rng = random.Random(args.seed)
+    start = schedule[0].tip_off - 6 * 60 * 60
+    end = schedule[-1].tip_off + 6 * 60 * 60
+
+    def rate(at: float) -> float:
+        spike = 0.0
+        for game in schedule:
+            # Ramps up over the ten minutes before tip-off, then decays over the game
+            since = at - game.tip_off
+            if -600 <= since < 0:
+                spike = max(spike, args.game_rate * (1 + since / 600))
+            elif 0 <= since < args.game_minutes * 60:
+                spike = max(
+                    spike, args.game_rate * (1 - since / (args.game_minutes * 60))
+                )
+        return args.base_rate + spike
+
+    # Thinning of a Poisson process at the peak rate
+    peak = args.base_rate + args.game_rate
+    arrivals = []
+    at = start
+    while True:
+        at += rng.expovariate(peak)
+        if at >= end:
+            return arrivals
+        if rng.random() < rate(at) / peak:
+            arrivals.append(at)
+
+
+def report(name: str, result: SimulationResult):
+    """Print the result of a simulation."""
+    print(
+        f"{name:12} {result.cold_starts:5d} cold starts  {result.prewarmed:5d} "
+        f"prewarmed  {result.gpu_minutes:9.0f} GPU minutes"
+    )
+
+
+def main():
+    """Run the simulation."""
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--schedule", default="benchmarks/traces/example_games.csv")
+    parser.add_argument("--trace")
+    parser.add_argument("--base-rate", type=float, default=0.002)
+    parser.add_argument("--game-rate", type=float, default=3.0)
+    parser.add_argument("--game-minutes", type=float, default=150.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--requests-per-container", type=float, default=2.0)
+    parser.add_argument("--lead-minutes", type=float, default=15.0)
+    parser.add_argument("--max-containers", type=int, default=8)
+    parser.add_argument("--cold-start", type=float, default=120.0)
+    parser.add_argument("--idle-timeout", type=float, default=300.0)
+    parser.add_argument("--plan-interval", type=float, default=300.0)
+    args = parser.parse_args()
+
+    schedule = load_schedule(args.schedule)
+    if args.trace:
+        arrivals = load_arrivals(args.trace)
+    else:
+        arrivals = synthetic_arrivals(schedule, args)
+    policy = PrewarmPolicy(
+        requests_per_container=args.requests_per_container,
+        lead=args.lead_minutes * 60,
+        max_containers=args.max_containers,
+    )
+    simulation = {
+        "requests_per_container": args.requests_per_container,
+        "cold_start": args.cold_start,
+        "idle_timeout": args.idle_timeout,
+        "plan_interval": args.plan_interval,
+    }
+
+    baseline = simulate(arrivals, None, **simulation)
+    prewarmed = simulate(arrivals, PrewarmPlanner(schedule, policy), **simulation)
+
+    print(f"requests     {len(arrivals)} over {len(schedule)} games")
+    report("no prewarm", baseline)
+    report("prewarm", prewarmed)
+    avoided = baseline.cold_starts - prewarmed.cold_starts
+    spent = prewarmed.gpu_minutes - baseline.gpu_minutes
+    per_avoided = spent / avoided if avoided > 0 else math.inf
+    print(
+        f"avoided      {avoided} cold starts for {spent:.0f} more GPU minutes, "
+        f"{per_avoided:.1f} GPU minutes per cold start avoided"
+    )
+
+
+if __name__ == "__main__":
+    main()
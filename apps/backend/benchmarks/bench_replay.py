@@ -0,0 +1,188 @@
+"""Replay a trace of recorded chat completion requests open-loop.
+
+Each line of the trace is a JSON chat completion request with its `messages`,
+sampling parameters such as `max_tokens` and `temperature`, and the `timestamp`
+in seconds it arrived at. Lines without messages are skipped. Requests are sent
+at their original arrival times divided by `--speedup`, or at `--rate` requests
+per second when the trace has no timestamps, whether or not earlier requests
+finished, so queueing shows up in the latency like it would in production.
+
+The target is either the vLLM gateway served in-process with the fake engine
+(`fake`, see `bench_serving.py`), or the URL of a deployed OpenAI compatible
+server such as the vLLM `app` or the TGI `fastapi_app`. The latency percentiles,
+the error rate by status, the goodput of requests meeting the latency SLO, and
+the peak number of requests in flight are reported, to size
+`allow_concurrent_inputs` and the GPU count from real traffic shapes.
+
+Usage:
+    python benchmarks/bench_replay.py benchmarks/traces/example.jsonl --speedup 4
+    python benchmarks/bench_replay.py trace.jsonl --target https://example.modal.run
+"""
+
+import argparse
+import asyncio
+import json
+import time
+from collections import Counter
+from typing import List, NamedTuple, Optional
+
+import httpx
+from backend.vllm_server.config import BASE_MODEL
+from bench_serving import Result, percentiles, send, serve
+
+PATH = "/v1/chat/completions"
+
+
+class TraceRequest(NamedTuple):
+    """A recorded request and its arrival time relative to the first request."""
+
+    arrival: float
+    body: dict
+
+
+def load_trace(path: str, args: argparse.Namespace) -> List[TraceRequest]:
+    """Load the replayable requests of a trace, in arrival order."""
+    records = []
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if not isinstance(record, dict) or not record.get("messages"):
+                continue
+            records.append(record)
+
+    requests = []
+    timestamps = [record.get("timestamp") for record in records]
+    has_timestamps = bool(records) and all(t is not None for t in timestamps)
+    start = min(timestamps) if has_timestamps else 0.0
+    for i, record in enumerate(records):
+        body = {key: value for key, value in record.items() if key != "timestamp"}
+        body["model"] = args.model
+        if args.stream is not None:
+            body["stream"] = args.stream
+        if has_timestamps:
+            arrival = (record["timestamp"] - start) / args.speedup
+        else:
+            arrival = i / args.rate
+        requests.append(TraceRequest(arrival, body))
+    requests.sort(key=lambda request: request.arrival)
+    return requests
+
+
+async def send_http(client: httpx.AsyncClient, body: dict) -> Result:
+    """Send a request to a deployed server, timing the chunks of its response."""
+    start = time.perf_counter()
+    chunk_times = []
+    async with client.stream("POST", PATH, json=body) as response:
+        async for chunk in response.aiter_bytes():
+            if chunk:
+                chunk_times.append(time.perf_counter())
+    end = time.perf_counter()
+    return Result(
+        response.status_code,
+        (chunk_times[0] if chunk_times else end) - start,
+        [b - a for a, b in zip(chunk_times, chunk_times[1:])],
+        end - start,
+    )
+
+
+async def replay(trace: List[TraceRequest], args: argparse.Namespace):
+    """Send every request at its arrival time, returning the results and peak."""
+    client: Optional[httpx.AsyncClient] = None
+    if args.target != "fake":
+        headers = {"Cache-Control": "no-store"}
+        if args.api_key:
+            headers["Authorization"] = f"Bearer {args.api_key}"
+        client = httpx.AsyncClient(
+            base_url=args.target,
+            headers=headers,
+            timeout=args.timeout,
+            limits=httpx.Limits(max_connections=None),
+        )
+
+    in_flight = 0
+    peak = 0
+
+    async def one(request: TraceRequest) -> Optional[Result]:
+        nonlocal in_flight, peak
+        await asyncio.sleep(max(0.0, request.arrival - (time.perf_counter() - start)))
+        in_flight += 1
+        peak = max(peak, in_flight)
+        try:
+            if client is None:
+                return await send(PATH, json.dumps(request.body).encode())
+            return await send_http(client, request.body)
+        except (httpx.HTTPError, OSError):
+            # Counted as an error without a status
+            return None
+        finally:
+            in_flight -= 1
+
+    start = time.perf_counter()
+    try:
+        results = await asyncio.gather(*(one(request) for request in trace))
+    finally:
+        if client is not None:
+            await client.aclose()
+    return results, peak
+
+
+def main():
+    """Replay the trace."""
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("trace")
+    parser.add_argument("--target", default="fake")
+    parser.add_argument("--api-key", default=None)
+    parser.add_argument("--speedup", type=float, default=1.0)
+    parser.add_argument("--rate", type=float, default=1.0)
+    parser.add_argument("--stream", action=argparse.BooleanOptionalAction)
+    parser.add_argument("--slo-ttft-ms", type=float, default=1000.0)
+    parser.add_argument("--slo-latency-ms", type=float, default=30_000.0)
+    parser.add_argument("--timeout", type=float, default=600.0)
+    parser.add_argument("--model", default=BASE_MODEL)
+    # Fake engine options, see bench_serving.py
+    parser.add_argument("--tokens-per-second", type=float, default=50.0)
+    parser.add_argument("--prefill-tokens-per-second", type=float, default=10_000.0)
+    parser.add_argument("--budget-tokens", type=int, default=None)
+    parser.add_argument("--tokenizer", default=BASE_MODEL)
+    args = parser.parse_args()
+
+    trace = load_trace(args.trace, args)
+    if not trace:
+        parser.error(f"{args.trace} has no requests with messages to replay")
+    if args.target == "fake":
+        serve(args)
+
+    started = time.perf_counter()
+    results, peak = asyncio.run(replay(trace, args))
+    elapsed = time.perf_counter() - started
+
+    statuses = Counter("error" if r is None else r.status for r in results)
+    ok = [r for r in results if r is not None and r.status == 200]
+    good = [
+        r
+        for r in ok
+        if r.ttft * 1e3 <= args.slo_ttft_ms and r.latency * 1e3 <= args.slo_latency_ms
+    ]
+    errors = ", ".join(
+        f"{status}: {count}" for status, count in statuses.items() if status != 200
+    )
+    print(
+        f"replayed {len(results)} requests in {elapsed:.2f}s "
+        f"({len(results) / elapsed:.2f} req/s), peak {peak} in flight"
+    )
+    print(f"TTFT         {percentiles([r.ttft for r in ok])}")
+    print(f"latency      {percentiles([r.latency for r in ok])}")
+    print(
+        f"goodput      {len(good) / elapsed:.2f} req/s, {len(good)}/{len(results)} "
+        f"within TTFT {args.slo_ttft_ms:.0f}ms and latency "
+        f"{args.slo_latency_ms:.0f}ms"
+    )
+    print(f"errors       {1 - len(ok) / len(results):.1%} {errors}".rstrip())
+
+
+if __name__ == "__main__":
+    main()
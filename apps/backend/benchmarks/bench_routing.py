@@ -0,0 +1,157 @@
+"""Compare prefix-affinity routing against random routing across model replicas.
+
+Serves the gateway in-process with several model replicas, each with its own fake
+engine and chat engine, like `bench_serving.py` does with one. Conversations
+are opened by a few agents with their long instructions. Each conversation
+sends its turns one after another, resending its history like chat clients do,
+and many conversations run concurrently. With prefix routing the turns of a
+conversation reach the replica whose prompt cache already holds its history.
+With random routing they are spread over every replica.
+
+The prompt tokens reused from the prompt caches, the prefix hit ratio and the
+requests of each replica, and the time to first token are reported.
+
+Usage:
+    python benchmarks/bench_routing.py --replicas 4 --conversations 64 --turns 6
+    python benchmarks/bench_routing.py --policy random
+"""
+
+import argparse
+import asyncio
+import json
+import os
+from typing import Container, List
+
+from backend.vllm_server.api_server import app
+from backend.vllm_server.config import BASE_MODEL
+from backend.vllm_server.engine.chat import ChatEngine
+from backend.vllm_server.engine.completion import CompletionEngine
+from backend.vllm_server.engine.fake import FakeAsyncLLMEngine, SamplingParams
+from backend.vllm_server.metrics import ROUTING_REQUESTS
+from backend.vllm_server.router import PrefixRouter
+from backend.vllm_server.service import LocalModel, ModelService
+from backend.vllm_server.utils import create_chat_template
+from bench_serving import Result, percentiles, send
+from transformers import AutoTokenizer
+
+PATH = "/v1/chat/completions"
+
+
+class RandomRouter(PrefixRouter):
+    """Router ignoring the prefix of requests, as a baseline."""
+
+    def route(self, key: bytes, exclude: Container[int] = ()) -> int:
+        """Route the request by a random key."""
+        return super().route(os.urandom(16), exclude)
+
+
+def serve(args: argparse.Namespace) -> List[ChatEngine]:
+    """Serve the gateway with in-process replicas, returning their chat engines."""
+    chat_engines = []
+    replicas = []
+    template = create_chat_template()
+    fake = {
+        "tokenizer": AutoTokenizer.from_pretrained(args.tokenizer),
+        "sampling_params_class": SamplingParams,
+    }
+    for _ in range(args.replicas):
+        engine = FakeAsyncLLMEngine(
+            args.tokenizer,
+            tokens_per_second=args.tokens_per_second,
+            prefill_tokens_per_second=args.prefill_tokens_per_second,
+        )
+        chat_engine = ChatEngine(engine, args.model, "assistant", template, **fake)
+        completion_engine = CompletionEngine(engine, args.model, **fake)
+        replicas.append(
+            LocalModel(ModelService(engine, chat_engine, completion_engine))
+        )
+        chat_engines.append(chat_engine)
+    router_class = PrefixRouter if args.policy == "prefix" else RandomRouter
+    app.state.model = replicas
+    app.state.router = router_class(args.replicas, args.load_factor)
+    return chat_engines
+
+
+async def conversation(args: argparse.Namespace, i: int) -> List[Result]:
+    """Send the turns of a conversation one after another."""
+    # The served chat template drops system messages, so the instructions of the
+    # agent open the first user message instead
+    agent = i % args.agents
+    instructions = f"You are agent {agent}. " + "Follow the rules. " * args.words
+    messages = []
+    results = []
+    for turn in range(args.turns):
+        question = f"Conversation {i}, question {turn}?"
+        if not turn:
+            question = f"{instructions}\n{question}"
+        messages.append({"role": "user", "content": question})
+        body = {
+            "model": args.model,
+            "messages": messages,
+            "max_tokens": args.max_tokens,
+            "stream": True,
+        }
+        results.append(await send(PATH, json.dumps(body).encode()))
+        messages.append({"role": "assistant", "content": " token" * args.max_tokens})
+    return results
+
+
+async def run(args: argparse.Namespace) -> List[Result]:
+    """Run the conversations, at most `--concurrency` at once."""
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def one(i: int) -> List[Result]:
+        async with semaphore:
+            return await conversation(args, i)
+
+    results = await asyncio.gather(*(one(i) for i in range(args.conversations)))
+    return [
+        result for conversation_results in results for result in conversation_results
+    ]
+
+
+def main():
+    """Run the comparison."""
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--policy", choices=("prefix", "random"), default="prefix")
+    parser.add_argument("--replicas", type=int, default=4)
+    parser.add_argument("--load-factor", type=float, default=1.25)
+    parser.add_argument("--agents", type=int, default=4)
+    parser.add_argument("--conversations", type=int, default=64)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--turns", type=int, default=6)
+    parser.add_argument("--words", type=int, default=200)
+    parser.add_argument("--max-tokens", type=int, default=16)
+    parser.add_argument("--tokens-per-second", type=float, default=200.0)
+    parser.add_argument("--prefill-tokens-per-second", type=float, default=10_000.0)
+    parser.add_argument("--model", default=BASE_MODEL)
+    parser.add_argument("--tokenizer", default=BASE_MODEL)
+    args = parser.parse_args()
+
+    chat_engines = serve(args)
+    results = asyncio.run(run(args))
+
+    ok = [result for result in results if result.status == 200]
+    stats = [chat_engine.prompt_cache.stats() for chat_engine in chat_engines]
+    reused = sum(s["reused_tokens"] for s in stats)
+    encoded = sum(s["encoded_tokens"] for s in stats)
+    print(f"policy       {args.policy}, {len(ok)}/{len(results)} requests succeeded")
+    print(
+        f"prompt cache {reused / max(1, reused + encoded):.1%} of prompt tokens "
+        f"reused, {encoded} encoded"
+    )
+
+    for replica in range(args.replicas):
+        hits = ROUTING_REQUESTS.labels(str(replica), "hit").value
+        total = hits + ROUTING_REQUESTS.labels(str(replica), "miss").value
+        print(
+            f"replica {replica}    {total:5.0f} requests, prefix hits "
+            f"{hits / max(1, total):.1%}"
+        )
+    print(f"TTFT         {percentiles([result.ttft for result in ok])}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,225 @@
+"""Load test the serving stack in-process with a fake engine.
+
+Serves the FastAPI gateway, the model service and the chat and completion engines
+in a single process, with the `FakeAsyncLLMEngine` generating tokens at a fixed
+rate instead of a GPU. Concurrent clients send streamed requests straight to the
+ASGI app, and the throughput, time to first token, inter-chunk latency and end to
+end latency are reported. Since the engine timing is fixed, the latency on top of
+the configured prefill and decode rates is the overhead of our own code, which
+can be profiled with `--profile`.
+
+The tokenizer is loaded from a local path or the Hugging Face hub, and given to
+the engines with the sampling params of the fake engine in place of the vLLM ones.
+
+Usage:
+    python benchmarks/bench_serving.py --concurrency 32 --requests 256
+    python benchmarks/bench_serving.py --endpoint completions --profile serve.prof
+"""
+
+import argparse
+import asyncio
+import cProfile
+import json
+import logging
+import statistics
+import time
+from typing import List, NamedTuple, Optional
+
+from backend.vllm_server.admission import AdmissionController
+from backend.vllm_server.api_server import app
+from backend.vllm_server.config import BASE_MODEL
+from backend.vllm_server.engine.chat import ChatEngine
+from backend.vllm_server.engine.completion import CompletionEngine
+from backend.vllm_server.engine.fake import FakeAsyncLLMEngine, SamplingParams
+from backend.vllm_server.service import LocalModel, ModelService
+from backend.vllm_server.utils import create_chat_template
+from transformers import AutoTokenizer
+
+PATHS = {"chat": "/v1/chat/completions", "completions": "/v1/completions"}
+
+
+class Result(NamedTuple):
+    """The timings of a streamed request."""
+
+    status: int
+    ttft: float
+    chunk_gaps: List[float]
+    latency: float
+
+
+def serve(args: argparse.Namespace) -> FakeAsyncLLMEngine:
+    """Serve the gateway with the fake engine, returning the engine."""
+    # Logging every request would dominate the profile
+    for name in list(logging.root.manager.loggerDict):
+        if name.startswith("backend."):
+            logging.getLogger(name).setLevel(logging.WARNING)
+    engine = FakeAsyncLLMEngine(
+        args.tokenizer,
+        tokens_per_second=args.tokens_per_second,
+        prefill_tokens_per_second=args.prefill_tokens_per_second,
+    )
+    admission = None
+    if args.budget_tokens is not None:
+        admission = AdmissionController(args.budget_tokens)
+    fake = {
+        "tokenizer": AutoTokenizer.from_pretrained(args.tokenizer),
+        "sampling_params_class": SamplingParams,
+        "admission": admission,
+    }
+    chat_engine = ChatEngine(
+        engine, args.model, "assistant", create_chat_template(), **fake
+    )
+    completion_engine = CompletionEngine(engine, args.model, **fake)
+    app.state.model = LocalModel(ModelService(engine, chat_engine, completion_engine))
+    return engine
+
+
+def request_body(args: argparse.Namespace, i: int) -> bytes:
+    """Build the body of the i-th request."""
+    # Varies the prompts so no prefix is shared between users
+    text = f"user {i}: " + " ".join(["the best player scored 30 points"] * args.words)
+    body = {
+        "model": args.model,
+        "max_tokens": args.max_tokens,
+        "stream": True,
+        "user": f"user-{i % args.users}",
+    }
+    if args.endpoint == "chat":
+        body["messages"] = [{"role": "user", "content": text}]
+    else:
+        body["prompt"] = text
+    if args.flush_tokens is not None:
+        body["stream_flush_tokens"] = args.flush_tokens
+    return json.dumps(body).encode()
+
+
+async def send(path: str, body: bytes) -> Result:
+    """Send a request to the ASGI app, timing the chunks of its response."""
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "POST",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": b"",
+        "root_path": "",
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"cache-control", b"no-store"),
+        ],
+        "client": ("127.0.0.1", 0),
+        "server": ("127.0.0.1", 80),
+    }
+    done = asyncio.Event()
+    messages = [{"type": "http.request", "body": body, "more_body": False}]
+
+    async def receive():
+        if messages:
+            return messages.pop()
+        await done.wait()
+        return {"type": "http.disconnect"}
+
+    status = 0
+    chunk_times = []
+
+    async def send_message(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+        elif message.get("body"):
+            chunk_times.append(time.perf_counter())
+        if message["type"] == "http.response.body" and not message.get("more_body"):
+            done.set()
+
+    start = time.perf_counter()
+    await app(scope, receive, send_message)
+    done.set()
+    end = time.perf_counter()
+    # The last chunk is the done frame
+    chunk_times = chunk_times[:-1] or chunk_times
+    return Result(
+        status,
+        (chunk_times[0] if chunk_times else end) - start,
+        [b - a for a, b in zip(chunk_times, chunk_times[1:])],
+        end - start,
+    )
+
+
+async def run(args: argparse.Namespace) -> List[Result]:
+    """Send the requests from the concurrent clients."""
+    path = PATHS[args.endpoint]
+    bodies = iter(range(args.requests))
+    results = []
+
+    async def client():
+        for i in bodies:
+            results.append(await send(path, request_body(args, i)))
+
+    await asyncio.gather(*(client() for _ in range(args.concurrency)))
+    return results
+
+
+def percentiles(values: List[float]) -> str:
+    """Format the p50, p90 and p99 of values in milliseconds."""
+    if not values:
+        return "n/a"
+    values = sorted(values)
+    p90 = values[max(0, int(len(values) * 0.9) - 1)]
+    p99 = values[max(0, int(len(values) * 0.99) - 1)]
+    return (
+        f"p50 {statistics.median(values) * 1e3:8.2f}ms  "
+        f"p90 {p90 * 1e3:8.2f}ms  p99 {p99 * 1e3:8.2f}ms"
+    )
+
+
+def main():
+    """Run the load test."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--endpoint", choices=sorted(PATHS), default="chat")
+    parser.add_argument("--requests", type=int, default=256)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--users", type=int, default=8)
+    parser.add_argument("--words", type=int, default=64)
+    parser.add_argument("--max-tokens", type=int, default=128)
+    parser.add_argument("--flush-tokens", type=int, default=None)
+    parser.add_argument("--tokens-per-second", type=float, default=50.0)
+    parser.add_argument("--prefill-tokens-per-second", type=float, default=10_000.0)
+    parser.add_argument("--budget-tokens", type=int, default=None)
+    parser.add_argument("--model", default=BASE_MODEL)
+    parser.add_argument("--tokenizer", default=BASE_MODEL)
+    parser.add_argument("--profile", default=None, help="Write a cProfile to a file")
+    args = parser.parse_args()
+
+    engine = serve(args)
+    profiler: Optional[cProfile.Profile] = cProfile.Profile() if args.profile else None
+    if profiler is not None:
+        profiler.enable()
+    start = time.perf_counter()
+    results = asyncio.run(run(args))
+    elapsed = time.perf_counter() - start
+    if profiler is not None:
+        profiler.disable()
+        profiler.dump_stats(args.profile)
+
+    ok = [result for result in results if result.status == 200]
+    print(
+        f"{len(ok)}/{len(results)} requests succeeded in {elapsed:.2f}s, "
+        f"{len(results) / elapsed:.1f} req/s, "
+        f"{engine.generated_tokens / elapsed:.0f} generated tok/s"
+    )
+    print(f"TTFT         {percentiles([result.ttft for result in ok])}")
+    print(
+        "chunk gap    "
+        + percentiles([gap for result in ok for gap in result.chunk_gaps])
+    )
+    print(f"latency      {percentiles([result.latency for result in ok])}")
+    print(
+        f"engine       prefill {args.prefill_tokens_per_second:.0f} tok/s, "
+        f"decode step {1e3 / args.tokens_per_second:.2f}ms"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""Compare the gateway and co-located serving modes of deployed vLLM apps.
+
+Sends the same streamed chat completion requests, one at a time, to an app
+deployed in each mode (see `scripts/deploy_vllm.sh`), alternating between them so
+both see the same load on Modal. Every token is flushed as its own chunk, so the
+gap between chunks includes the overhead each mode adds per streamed frame. The
+time to first token and chunk gap percentiles of both modes are reported side by
+side. Warm the containers first, or raise `--warmup`, since cold starts dominate
+the first requests.
+
+Usage:
+    python benchmarks/bench_serving_modes.py --gateway-url $A --colocated-url $B
+"""
+
+import argparse
+import asyncio
+import statistics
+from typing import Dict, List
+
+import httpx
+from backend.vllm_server.config import BASE_MODEL
+from bench_replay import send_http
+from bench_serving import Result
+
+MODES = ("gateway", "colocated")
+
+
+def quantile(values: List[float], q: float) -> float:
+    """Return the q-quantile of values in milliseconds."""
+    values = sorted(values)
+    return values[max(0, int(len(values) * q) - 1)] * 1e3
+
+
+async def run(args: argparse.Namespace) -> Dict[str, List[Result]]:
+    """Send the requests to both deployments, alternating between modes."""
+    body = {
+        "model": BASE_MODEL,
+        "messages": [{"role": "user", "content": "Who is the best player ever?"}],
+        "max_tokens": args.max_tokens,
+        "temperature": 0.7,
+        "stream": True,
+        "stream_flush_tokens": 1,
+    }
+    headers = {"Cache-Control": "no-store"}
+    if args.api_key:
+        headers["Authorization"] = f"Bearer {args.api_key}"
+    urls = {"gateway": args.gateway_url, "colocated": args.colocated_url}
+    clients = {
+        mode: httpx.AsyncClient(base_url=url, headers=headers, timeout=600)
+        for mode, url in urls.items()
+    }
+    results = {mode: [] for mode in MODES}
+    try:
+        for i in range(args.warmup + args.requests):
+            for mode in MODES:
+                result = await send_http(clients[mode], body)
+                if i >= args.warmup and result.status == 200:
+                    results[mode].append(result)
+    finally:
+        for client in clients.values():
+            await client.aclose()
+    return results
+
+
+def main():
+    """Run the comparison."""
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--gateway-url", required=True)
+    parser.add_argument("--colocated-url", required=True)
+    parser.add_argument("--api-key", default=None)
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--max-tokens", type=int, default=64)
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+
+    print(
+        f"{'mode':<12}{'TTFT p50':>12}{'TTFT p90':>12}"
+        f"{'chunk gap p50':>16}{'chunk gap p90':>16}"
+    )
+    for mode in MODES:
+        ttfts = [result.ttft for result in results[mode]]
+        gaps = [gap for result in results[mode] for gap in result.chunk_gaps]
+        if not ttfts or not gaps:
+            print(f"{mode:<12}{'no successful streams':>32}")
+            continue
+        print(
+            f"{mode:<12}{statistics.median(ttfts) * 1e3:>10.1f}ms"
+            f"{quantile(ttfts, 0.9):>10.1f}ms"
+            f"{statistics.median(gaps) * 1e3:>14.2f}ms{quantile(gaps, 0.9):>14.2f}ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""Microbenchmark for encoding chat completion stream chunks.
+
+Compares the pydantic `model_dump_json` path against the precompiled
+`ChatChunkEncoder` for the per-token content frames of a streamed response.
+
+Usage:
+    python benchmarks/bench_stream_encoder.py --tokens 2000 --repeat 5
+"""
+
+import argparse
+import time
+
+from backend.vllm_server.encoder import ChatChunkEncoder
+from backend.vllm_server.schema.chat import (
+    ChatCompletionResponseStreamChoice,
+    ChatCompletionStreamResponse,
+)
+from backend.vllm_server.schema.common import DeltaMessage
+
+REQUEST_ID = "cmpl-0123456789abcdef0123456789abcdef"
+MODEL_NAME = "mistralai/Mistral-7B-Instruct-v0.1"
+DELTAS = [" the", ' "quick"', " brown\n", " fox", " jumps", " über", " 🏀", "\t"]
+
+
+def encode_pydantic(created: int, deltas: list) -> list:
+    """Encode content frames the way the stream generator used to."""
+    frames = []
+    for i, delta_text in enumerate(deltas):
+        choice_data = ChatCompletionResponseStreamChoice(
+            index=i % 2,
+            delta=DeltaMessage(content=delta_text),
+            logprobs=None,
+            finish_reason=None,
+        )
+        chunk = ChatCompletionStreamResponse(
+            id=REQUEST_ID,
+            object="chat.completion.chunk",
+            created=created,
+            choices=[choice_data],
+            model=MODEL_NAME,
+        )
+        data = chunk.model_dump_json(exclude_unset=True)
+        frames.append(f"data: {data}\n\n")
+    return frames
+
+
+def encode_precompiled(created: int, deltas: list) -> list:
+    """Encode content frames with the precompiled chunk encoder."""
+    encoder = ChatChunkEncoder(REQUEST_ID, created, MODEL_NAME)
+    return [encoder.content(i % 2, delta_text) for i, delta_text in enumerate(deltas)]
+
+
+def best_of(fn, repeat: int, *args) -> float:
+    """Return the fastest wall time of `repeat` runs of `fn`."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(*args)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--tokens", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    created = int(time.time())
+    deltas = [DELTAS[i % len(DELTAS)] for i in range(args.tokens)]
+
+    if encode_pydantic(created, deltas) != encode_precompiled(created, deltas):
+        raise AssertionError("Encoded frames differ between implementations")
+
+    baseline = best_of(encode_pydantic, args.repeat, created, deltas)
+    precompiled = best_of(encode_precompiled, args.repeat, created, deltas)
+
+    print(f"frames:      {args.tokens}")
+    print(f"pydantic:    {baseline / args.tokens * 1e6:8.2f} us/frame")
+    print(f"precompiled: {precompiled / args.tokens * 1e6:8.2f} us/frame")
+    print(f"speedup:     {baseline / precompiled:8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
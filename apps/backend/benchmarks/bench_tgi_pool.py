@@ -0,0 +1,132 @@
+"""Compare the clients of the TGI server under concurrent short requests.
+
+Sends short chat requests arriving as a Poisson process, at most
+`--concurrency` at a time like the concurrent inputs of a model container, to
+the fake TGI server of `backend.tgi_server.fake` started in-process. Each
+prefill of the fake server costs `--prefill-time` and stalls the generation of
+the running requests, and the prompts waiting for a prefill are batched.
+
+The clients compared:
+- `session`: the `AsyncClient` of `text_generation`, a new connection per request
+- `pooled`: the `TGIClient` keeping a pool of keep-alive connections
+- `batched`: the `TGIClient` holding short requests in a `MicroBatcher`
+
+The latency percentiles, the throughput, and the connections opened and prefills
+run by the server are reported for each.
+
+The `session` client requires `text_generation`.
+
+Usage:
+    python benchmarks/bench_tgi_pool.py --requests 500 --rate 25
+    python benchmarks/bench_tgi_pool.py --prefill-time 0.03 --batch-window 0.05
+"""
+
+import argparse
+import asyncio
+import random
+import statistics
+import time
+from typing import List, NamedTuple
+
+from backend.tgi_server.fake import FakeTGIServer
+from backend.tgi_server.pool import MicroBatcher, TGIClient
+
+CLIENTS = ("session", "pooled", "batched")
+
+
+class Result(NamedTuple):
+    """Results of the requests sent with a client."""
+
+    latencies: List[float]
+    duration: float
+    connections: int
+    prefills: int
+
+
+def quantile(values: List[float], q: float) -> float:
+    """Return the q-quantile of values in milliseconds."""
+    values = sorted(values)
+    return values[max(0, int(len(values) * q) - 1)] * 1e3
+
+
+def make_client(name: str, url: str, args: argparse.Namespace):
+    """Create a client of the TGI server."""
+    if name == "session":
+        from text_generation import AsyncClient
+
+        return AsyncClient(url, timeout=60)
+    batcher = None
+    if name == "batched":
+        batcher = MicroBatcher(
+            args.batch_window, max_batch=args.concurrency, max_tokens=args.max_tokens
+        )
+    return TGIClient(url, max_connections=args.concurrency, batcher=batcher)
+
+
+async def run(name: str, args: argparse.Namespace) -> Result:
+    """Send the requests with a client to a fresh fake TGI server."""
+    rng = random.Random(args.seed)
+    server = FakeTGIServer(
+        time_to_first_token=0.0,
+        tokens_per_second=args.tokens_per_second,
+        prefill_time=args.prefill_time,
+    )
+    semaphore = asyncio.Semaphore(args.concurrency)
+    messages = [{"role": "user", "content": "Who won the game last night?"}]
+    latencies = []
+
+    async with server:
+        client = make_client(name, server.url, args)
+
+        async def send(arrival: float):
+            await asyncio.sleep(max(0.0, arrival - time.perf_counter()))
+            async with semaphore:
+                await client.chat(messages=messages, max_tokens=args.max_tokens)
+                latencies.append(time.perf_counter() - arrival)
+
+        started_at = time.perf_counter()
+        arrival = started_at
+        arrivals = []
+        for _ in range(args.requests):
+            arrival += rng.expovariate(args.rate)
+            arrivals.append(arrival)
+        await asyncio.gather(*(send(at) for at in arrivals))
+        duration = time.perf_counter() - started_at
+        if isinstance(client, TGIClient):
+            await client.aclose()
+        return Result(latencies, duration, server.connections, server.prefills)
+
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--rate", type=float, default=25.0)
+    parser.add_argument("--concurrency", type=int, default=15)
+    parser.add_argument("--max-tokens", type=int, default=16)
+    parser.add_argument("--tokens-per-second", type=float, default=40.0)
+    parser.add_argument("--prefill-time", type=float, default=0.02)
+    parser.add_argument("--batch-window", type=float, default=0.02)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--clients", nargs="+", choices=CLIENTS, default=CLIENTS)
+    args = parser.parse_args()
+
+    print(
+        f"{'client':8}{'p50':>10}{'p90':>10}{'p99':>10}{'req/s':>8}"
+        f"{'conns':>7}{'prefills':>10}"
+    )
+    for name in args.clients:
+        result = asyncio.run(run(name, args))
+        latencies = result.latencies
+        print(
+            f"{name:8}{statistics.median(latencies) * 1e3:>8.1f}ms"
+            f"{quantile(latencies, 0.9):>8.1f}ms{quantile(latencies, 0.99):>8.1f}ms"
+            f"{len(latencies) / result.duration:>8.1f}"
+            f"{result.connections:>7}{result.prefills:>10}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""Compare the time to first token of streamed and full TGI chat completions.
+
+Serves chat completions through the `ChatService` of the TGI `Model` class,
+against the fake TGI server of `backend.tgi_server.fake` started in-process, or
+a real TGI server with `--url`. The same requests are sent streamed and not
+streamed. A streamed request has its first token at the first frame with
+content, a full request only once the whole answer is generated.
+
+Requires `text_generation` for its chat requests.
+
+Usage:
+    python benchmarks/bench_tgi_streaming.py --requests 64 --concurrency 15
+    python benchmarks/bench_tgi_streaming.py --url http://127.0.0.1:8000
+"""
+
+import argparse
+import asyncio
+import json
+import statistics
+import time
+from typing import Dict, List
+
+from backend.tgi_server.fake import FakeTGIServer
+from backend.tgi_server.pool import TGIClient
+from backend.tgi_server.service import ChatService
+from backend.tgi_server.stream import DONE_FRAME
+
+MODES = ("full", "stream")
+
+
+def quantile(values: List[float], q: float) -> float:
+    """Return the q-quantile of values in milliseconds."""
+    values = sorted(values)
+    return values[max(0, int(len(values) * q) - 1)] * 1e3
+
+
+async def first_token(service: ChatService, chat_request, *, stream: bool) -> float:
+    """Send a request and return the seconds until its first token."""
+    started_at = time.perf_counter()
+    if not stream:
+        await service.generate(chat_request)
+        return time.perf_counter() - started_at
+
+    ttft = None
+    async for frame in service.generate_stream(chat_request):
+        if frame == DONE_FRAME:
+            continue
+        event = json.loads(frame[len("data: ") :])
+        if "error" in event:
+            raise RuntimeError(event["error"]["message"])
+        delta = event["choices"][0]["delta"]
+        if ttft is None and (delta.get("content") or delta.get("tool_calls")):
+            ttft = time.perf_counter() - started_at
+    return ttft
+
+
+async def run(args: argparse.Namespace, url: str) -> Dict[str, List[float]]:
+    """Send the requests in both modes, one mode after the other."""
+    from text_generation.types import ChatRequest
+
+    client = TGIClient(url, max_connections=args.concurrency)
+    service = ChatService(client)
+    chat_request = ChatRequest(
+        model="tgi",
+        messages=[{"role": "user", "content": "Who won the game last night?"}],
+        max_tokens=args.max_tokens,
+    )
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def send(*, stream: bool) -> float:
+        async with semaphore:
+            return await first_token(service, chat_request, stream=stream)
+
+    results = {}
+    try:
+        for mode in MODES:
+            await send(stream=mode == "stream")
+            results[mode] = await asyncio.gather(
+                *(send(stream=mode == "stream") for _ in range(args.requests))
+            )
+    finally:
+        await client.aclose()
+    return results
+
+
+async def bench(args: argparse.Namespace) -> Dict[str, List[float]]:
+    """Run the benchmark against the fake TGI server unless a URL is set."""
+    if args.url:
+        return await run(args, args.url)
+    server = FakeTGIServer(
+        time_to_first_token=args.time_to_first_token,
+        tokens_per_second=args.tokens_per_second,
+        max_new_tokens=args.max_tokens,
+    )
+    async with server:
+        return await run(args, server.url)
+
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--url", help="A running TGI server, rather than the fake")
+    parser.add_argument("--requests", type=int, default=64)
+    parser.add_argument("--concurrency", type=int, default=15)
+    parser.add_argument("--max-tokens", type=int, default=128)
+    parser.add_argument("--time-to-first-token", type=float, default=0.1)
+    parser.add_argument("--tokens-per-second", type=float, default=40.0)
+    args = parser.parse_args()
+
+    results = asyncio.run(bench(args))
+    print(f"{'mode':8}{'p50 TTFT':>12}{'p90 TTFT':>12}")
+    for mode in MODES:
+        ttfts = results[mode]
+        print(
+            f"{mode:8}{statistics.median(ttfts) * 1e3:>10.1f}ms"
+            f"{quantile(ttfts, 0.9):>10.1f}ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""Benchmark inter-token latency of running streams while large prompts are admitted.
+
+Simulates streams emitting a token every few milliseconds on the event loop and
+measures the gaps between their tokens while a burst of large chat prompts is
+rendered and tokenized, first inline on the event loop and then on the
+`TokenizerPool`.
+
+Usage:
+    python benchmarks/bench_tokenizer_pool.py --prompts 64 --words 20000
+"""
+
+import argparse
+import asyncio
+import random
+import statistics
+import time
+
+from backend.vllm_server.config import BASE_MODEL
+from backend.vllm_server.engine.prompt_cache import PromptCache
+from backend.vllm_server.engine.tokenizer_pool import TokenizerPool
+from backend.vllm_server.utils import create_chat_template
+from transformers import AutoTokenizer
+
+WORDS = ["who", "led", "the", "league", "in", "scoring", "this", "season", "?"]
+
+
+def make_conversations(num: int, num_words: int) -> list:
+    """Create unique conversations with a large user message."""
+    rng = random.Random(0)
+    return [
+        [
+            {"role": "system", "content": "You are an NBA expert."},
+            {"role": "user", "content": " ".join(rng.choices(WORDS, k=num_words))},
+        ]
+        for _ in range(num)
+    ]
+
+
+async def stream(interval: float, stop: asyncio.Event, gaps: list):
+    """Emit a token every `interval` seconds and record the gaps between tokens."""
+    last = time.perf_counter()
+    while not stop.is_set():
+        await asyncio.sleep(interval)
+        now = time.perf_counter()
+        gaps.append(now - last)
+        last = now
+
+
+async def admit_inline(cache: PromptCache, messages: list):
+    """Render and tokenize a prompt on the event loop."""
+    prompt = cache.render(messages)
+    return cache.tokenizer(prompt).input_ids
+
+
+async def admit_pooled(cache: PromptCache, pool: TokenizerPool, messages: list):
+    """Render and tokenize a prompt on the tokenizer pool."""
+    prompt = await pool.run(cache.render, messages)
+    return (await pool.encode(prompt)).input_ids
+
+
+async def measure(admit, conversations: list, args) -> list:
+    """Measure stream token gaps while admitting all conversations."""
+    stop = asyncio.Event()
+    gaps = []
+    streams = [
+        asyncio.create_task(stream(args.interval, stop, gaps))
+        for _ in range(args.streams)
+    ]
+    await asyncio.sleep(0.1)
+    gaps.clear()
+
+    start = time.perf_counter()
+    for i in range(0, len(conversations), args.burst):
+        burst = conversations[i : i + args.burst]
+        await asyncio.gather(*(admit(messages) for messages in burst))
+    elapsed = time.perf_counter() - start
+
+    stop.set()
+    await asyncio.gather(*streams)
+    print(f"  admitted {len(conversations)} prompts in {elapsed:.2f}s")
+    return gaps
+
+
+def report(name: str, gaps: list, interval: float):
+    """Print inter-token latency percentiles."""
+    gaps = sorted(gap - interval for gap in gaps)
+    p50 = statistics.median(gaps)
+    p99 = gaps[int(len(gaps) * 0.99)]
+    print(f"  {name}: extra inter-token latency p50={p50 * 1e3:.2f}ms ", end="")
+    print(f"p99={p99 * 1e3:.2f}ms max={gaps[-1] * 1e3:.2f}ms")
+
+
+async def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--tokenizer", default=BASE_MODEL)
+    parser.add_argument("--prompts", type=int, default=64)
+    parser.add_argument("--words", type=int, default=20000)
+    parser.add_argument("--burst", type=int, default=8)
+    parser.add_argument("--streams", type=int, default=12)
+    parser.add_argument("--interval", type=float, default=0.01)
+    args = parser.parse_args()
+
+    tokenizer = AutoTokenizer.from_pretrained(args.tokenizer)
+    if tokenizer.chat_template is None:
+        tokenizer.chat_template = create_chat_template()
+    cache = PromptCache(tokenizer)
+    pool = TokenizerPool(tokenizer)
+    conversations = make_conversations(args.prompts, args.words)
+
+    print("inline on the event loop")
+    gaps = await measure(
+        lambda messages: admit_inline(cache, messages), conversations, args
+    )
+    report("inline", gaps, args.interval)
+
+    print("tokenizer pool")
+    gaps = await measure(
+        lambda messages: admit_pooled(cache, pool, messages), conversations, args
+    )
+    report("pooled", gaps, args.interval)
+    print(f"  {pool.encoded_texts} texts encoded in {pool.batches} batches")
+    pool.shutdown()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
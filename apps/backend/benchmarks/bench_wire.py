@@ -0,0 +1,129 @@
+"""Microbenchmark for the transport of streamed chunks to the gateway.
+
+Compares sending every chunk of a streamed chat completion as a formatted
+server-sent event string against the packed records of `wire`. Modal pickles
+each value yielded by a generator method, so each message is pickled in the model
+container and unpickled in the gateway. For packed records the gateway also
+renders the frames with `StreamDecoder`. The bytes sent and the CPU time of both
+sides are reported per streamed token, and the rendered frames are checked to be
+identical.
+
+Usage:
+    python benchmarks/bench_wire.py --tokens 2000 --n 2 --logprobs
+"""
+
+import argparse
+import pickle
+import time
+
+from backend.vllm_server.encoder import ChatChunkEncoder
+from backend.vllm_server.schema.common import LogProbs
+from backend.vllm_server.wire import PackedChatEncoder, StreamDecoder
+
+REQUEST_ID = "cmpl-0123456789abcdef0123456789abcdef"
+MODEL_NAME = "mistralai/Mistral-7B-Instruct-v0.1"
+DELTAS = [" the", ' "quick"', " brown\n", " fox", " jumps", " über", " 🏀", "\t"]
+
+
+def stream(encoder, created: int, args: argparse.Namespace) -> list:
+    """Encode the messages of a stream, one per engine output."""
+    messages = [[encoder.role(i, "assistant") for i in range(args.n)]]
+    for step in range(args.tokens // args.n):
+        delta_text = DELTAS[step % len(DELTAS)]
+        logprobs = None
+        if args.logprobs:
+            logprobs = LogProbs(
+                tokens=[delta_text],
+                token_logprobs=[-0.5],
+                top_logprobs=[{delta_text: -0.5}],
+            )
+        messages.append(
+            [encoder.content(i, delta_text, logprobs) for i in range(args.n)]
+        )
+    messages.append(
+        [encoder.finish(i, "", "length", 12, args.tokens) for i in range(args.n)]
+    )
+    messages.append(encoder.done())
+    return messages
+
+
+def send_frames(created: int, args: argparse.Namespace) -> list:
+    """Pickle every server-sent event frame, as the model container used to."""
+    encoder = ChatChunkEncoder(REQUEST_ID, created, MODEL_NAME)
+    frames = []
+    for message in stream(encoder, created, args):
+        if isinstance(message, list):
+            frames.extend(message)
+        else:
+            frames.append(message)
+    return [pickle.dumps(frame) for frame in frames]
+
+
+def send_packed(created: int, args: argparse.Namespace) -> list:
+    """Pickle the packed records of every engine output as one message."""
+    encoder = PackedChatEncoder(REQUEST_ID, created, MODEL_NAME)
+    messages = []
+    for message in stream(encoder, created, args):
+        if isinstance(message, list):
+            message = b"".join(message)
+        messages.append(pickle.dumps(message))
+    return messages
+
+
+def receive_frames(payloads: list) -> str:
+    """Unpickle the frames in the gateway."""
+    return "".join(pickle.loads(payload) for payload in payloads)
+
+
+def receive_packed(payloads: list) -> str:
+    """Unpickle and render the packed records in the gateway."""
+    decoder = StreamDecoder()
+    return "".join(decoder.render(pickle.loads(payload)) for payload in payloads)
+
+
+def best_of(fn, repeat: int, *args) -> float:
+    """Return the fastest CPU time of `repeat` runs of `fn`."""
+    timings = []
+    for _ in range(repeat):
+        start = time.process_time()
+        fn(*args)
+        timings.append(time.process_time() - start)
+    return min(timings)
+
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--tokens", type=int, default=2000)
+    parser.add_argument("--n", type=int, default=1)
+    parser.add_argument("--logprobs", action="store_true")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    created = int(time.time())
+    frames = send_frames(created, args)
+    packed = send_packed(created, args)
+    if receive_frames(frames) != receive_packed(packed):
+        raise AssertionError("Rendered frames differ between transports")
+
+    tokens = args.tokens // args.n * args.n
+    print(f"tokens:  {tokens}, {args.n} choices, logprobs {args.logprobs}")
+    print(
+        f"{'':<9}{'messages':>10}{'bytes/token':>14}{'send us/token':>16}"
+        f"{'receive us/token':>19}"
+    )
+    for name, send, receive, payloads in (
+        ("frames", send_frames, receive_frames, frames),
+        ("packed", send_packed, receive_packed, packed),
+    ):
+        sent = best_of(send, args.repeat, created, args)
+        received = best_of(receive, args.repeat, payloads)
+        print(
+            f"{name:<9}{len(payloads):>10}"
+            f"{sum(map(len, payloads)) / tokens:>14.1f}"
+            f"{sent / tokens * 1e6:>16.2f}{received / tokens * 1e6:>19.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -10,7 +10,7 @@ from openai import OpenAI
 from backend.functions import TakeAction
 from backend.schema import DescribeDatasetArgs
 from backend.utils import VLLM_API_URL, logger
-from backend.vllm_server.infra import BASE_MODEL
+from backend.vllm_server.config import BASE_MODEL
 
 GPU_TYPE = gpu.A10G()
 
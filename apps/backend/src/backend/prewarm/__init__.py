@@ -0,0 +1 @@
+"""Pre-warming of GPU containers ahead of NBA games."""
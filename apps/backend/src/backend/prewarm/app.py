@@ -0,0 +1,99 @@
+"""Modal app pre-warming the model containers of the vLLM and TGI servers.
+
+Every few minutes the number of warm containers of each `Model` is set from the
+schedule file of the games and the requests counted by the gateways, see
+`PrewarmPlanner`. The schedule file is mounted when deploying:
+
+    scripts/deploy_prewarm.sh path/to/games.csv
+"""
+
+import logging
+import math
+import os
+import time
+from typing import NamedTuple
+
+import modal
+
+from backend.prewarm.scheduler import (
+    PREWARM_DICT_NAME,
+    HistoryStore,
+    PrewarmPlanner,
+    PrewarmPolicy,
+    load_schedule,
+)
+from backend.tgi_server.infra import APP_NAME as TGI_APP_NAME
+from backend.vllm_server.config import APP_NAME as VLLM_APP_NAME
+from backend.vllm_server.config import MODEL_REPLICAS
+
+APP_NAME = "hooper-prewarm"
+PREWARM_INTERVAL = 5 * 60
+
+# The schedule file is read from the machine deploying the app
+SCHEDULE_PATH = os.environ.get("HOOPER_PREWARM_SCHEDULE", "games.csv")
+REMOTE_SCHEDULE_PATH = "/root/games.csv"
+
+logger = logging.getLogger(__name__)
+
+
+class Target(NamedTuple):
+    """A deployed `Model` class whose containers are pre-warmed."""
+
+    app_name: str
+    # The method whose containers are kept warm
+    method: str
+    replicas: int
+    policy: PrewarmPolicy
+
+
+TARGETS = [
+    Target(
+        VLLM_APP_NAME,
+        "generate_chat_completion_stream",
+        MODEL_REPLICAS,
+        PrewarmPolicy(),
+    ),
+    # TGI containers serve 15 concurrent inputs rather than 64
+    Target(TGI_APP_NAME, "generate", 1, PrewarmPolicy(requests_per_container=0.5)),
+]
+
+app = modal.App(name=APP_NAME, image=modal.Image.debian_slim())
+
+history_store = modal.Dict.from_name(PREWARM_DICT_NAME, create_if_missing=True)
+
+
+@app.function(
+    schedule=modal.Period(seconds=PREWARM_INTERVAL),
+    mounts=[
+        modal.Mount.from_local_file(SCHEDULE_PATH, remote_path=REMOTE_SCHEDULE_PATH)
+    ],
+)
+async def prewarm():
+    """Set the number of warm containers of every model."""
+    schedule = load_schedule(REMOTE_SCHEDULE_PATH)
+    now = time.time()
+    for target in TARGETS:
+        history = await HistoryStore(history_store, target.app_name).read()
+        planner = PrewarmPlanner(schedule, target.policy)
+        warm = planner.warm_containers(history, now)
+        try:
+            await keep_warm(target, warm)
+        except Exception as e:
+            logger.warning(f"Failed to pre-warm {target.app_name}: {e}")
+            continue
+        logger.info(f"Keeping {warm} containers of {target.app_name} warm")
+
+
+async def keep_warm(target: Target, warm: int):
+    """Set the number of warm containers of a model, split between its replicas.
+
+    Args:
+        target: The model.
+        warm: The number of warm containers.
+    """
+    cls = await modal.Cls.lookup.aio(target.app_name, "Model")
+    per_replica = math.ceil(warm / target.replicas)
+    for replica in range(target.replicas):
+        # Single replica deployments are not parametrized, see `_replica`
+        model = cls(replica=replica) if target.replicas > 1 else cls()
+        await getattr(model, target.method).keep_warm.aio(per_replica)
@@ -0,0 +1,424 @@
+"""Pre-warm GPU containers ahead of the traffic peaks around NBA games.
+
+Traffic spikes around tip-off, and every spike waits for GPU containers to cold
+start. The gateways count their requests per minute into a shared history, and a
+scheduler raises the number of warm model containers from shortly before each
+game of a schedule file until the game ends, and lets the autoscaler follow the
+traffic afterwards. `simulate` replays past traffic against the scheduler to
+weigh the cold starts avoided against the GPU minutes spent.
+
+Kept free of Modal so the gateways and the simulation import it quickly.
+"""
+
+import asyncio
+import csv
+import logging
+import math
+import time
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, NamedTuple, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+# Requests counted by the gateways, keyed by the name of their app
+PREWARM_DICT_NAME = "hooper-prewarm-history"
+
+# Requests are counted per minute, and gateways flush their counts every minute
+BUCKET_SECONDS = 60
+FLUSH_INTERVAL = 60.0
+
+# Past game windows are kept to learn the request rate of games
+HISTORY_RETENTION = 14 * 24 * 60 * 60.0
+
+
+class Game(NamedTuple):
+    """A game of the schedule."""
+
+    tip_off: float
+    name: str
+
+
+def parse_time(value: str) -> float:
+    """Parse an ISO 8601 time, in UTC unless it has an offset.
+
+    Args:
+        value: The time, e.g. `2024-04-20T19:30:00-04:00`.
+
+    Returns:
+        The time in seconds since the epoch.
+    """
+    parsed = datetime.fromisoformat(value.strip().replace("Z", "+00:00"))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+def load_schedule(path: str) -> List[Game]:
+    """Load the games of a schedule file.
+
+    The file is a CSV with the `tip_off` time of each game in ISO 8601 and
+    optionally its `away` and `home` teams.
+
+    Args:
+        path: The path of the schedule file.
+
+    Returns:
+        The games, by tip-off time.
+    """
+    games = []
+    with open(path, newline="") as f:
+        for row in csv.DictReader(f):
+            if not (row.get("tip_off") or "").strip():
+                continue
+            name = " @ ".join(
+                team for team in (row.get("away"), row.get("home")) if team
+            )
+            games.append(Game(parse_time(row["tip_off"]), name))
+    games.sort()
+    return games
+
+
+class RequestHistory:
+    """Requests counted per minute."""
+
+    def __init__(self, counts: Optional[Dict[int, int]] = None):
+        """Initialize the history.
+
+        Args:
+            counts: The number of requests by the start of their minute.
+        """
+        self.counts: Dict[int, int] = dict(counts or {})
+
+    def record(self, at: float, count: int = 1):
+        """Count requests.
+
+        Args:
+            at: The time the requests arrived.
+            count: The number of requests.
+        """
+        bucket = int(at // BUCKET_SECONDS * BUCKET_SECONDS)
+        self.counts[bucket] = self.counts.get(bucket, 0) + count
+
+    def merge(self, counts: Dict[int, int]):
+        """Add the counts of another history.
+
+        Args:
+            counts: The number of requests by the start of their minute.
+        """
+        for bucket, count in counts.items():
+            self.counts[bucket] = self.counts.get(bucket, 0) + count
+
+    def prune(self, before: float):
+        """Drop the counts of the minutes starting before a time."""
+        self.counts = {
+            bucket: count for bucket, count in self.counts.items() if bucket >= before
+        }
+
+    def has_counts(self, start: float, end: float) -> bool:
+        """Check whether requests were counted in a time range.
+
+        Args:
+            start: The start of the range.
+            end: The end of the range, exclusive.
+        """
+        return any(start <= bucket < end for bucket in self.counts)
+
+    def peak_rate(self, start: float, end: float) -> float:
+        """Get the highest request rate of the minutes in a time range.
+
+        Args:
+            start: The start of the range.
+            end: The end of the range, exclusive.
+
+        Returns:
+            The request rate in requests per second.
+        """
+        peak = max(
+            (count for bucket, count in self.counts.items() if start <= bucket < end),
+            default=0,
+        )
+        return peak / BUCKET_SECONDS
+
+
+class PrewarmPolicy(NamedTuple):
+    """How many containers the scheduler keeps warm for a request rate."""
+
+    # The request rate a single container serves without queueing
+    requests_per_container: float = 2.0
+    # Containers are warmed this many seconds before tip-off, more than a cold
+    # start takes
+    lead: float = 15 * 60.0
+    # Games are expected to keep traffic high this long after tip-off
+    game_duration: float = 3 * 60 * 60.0
+    # The recent request rate is the peak rate of this many past seconds, and past
+    # games are looked at this many seconds ahead
+    lookback: float = 15 * 60.0
+    # The expected request rate is multiplied by this margin
+    headroom: float = 1.2
+    # The request rate expected of games before any game is in the history
+    default_game_rate: float = 1.0
+    min_containers: int = 0
+    max_containers: int = 8
+
+
+class PrewarmPlanner:
+    """Plan the number of warm containers from a game schedule and past traffic.
+
+    Within the window of a game, from `lead` seconds before tip-off until the game
+    ends, the request rate expected is the peak rate the past games of the history
+    saw over the next `lookback` seconds at the same time from their tip-off, or
+    the recent peak rate if higher. Outside of games no container is kept warm
+    beyond `min_containers`, leaving the autoscaler to follow the traffic.
+    """
+
+    def __init__(self, schedule: Sequence[Game], policy: PrewarmPolicy):
+        """Initialize the planner.
+
+        Args:
+            schedule: The games, by tip-off time.
+            policy: The policy of the planner.
+        """
+        self.schedule = list(schedule)
+        self.policy = policy
+
+    def games_at(self, at: float) -> List[Game]:
+        """Get the games whose window contains a time."""
+        return [
+            game
+            for game in self.schedule
+            if game.tip_off - self.policy.lead
+            <= at
+            < game.tip_off + self.policy.game_duration
+        ]
+
+    def game_rate(self, history: RequestHistory, game: Game, now: float) -> float:
+        """Get the request rate expected of a game from the past games.
+
+        Args:
+            history: The requests counted until now.
+            game: The game.
+            now: The current time, within the window of the game.
+
+        Returns:
+            The peak rate of the past games at the same time from their tip-off,
+            or `default_game_rate` without past games in the history.
+        """
+        policy = self.policy
+        since_tip_off = now - game.tip_off
+        rates = [
+            history.peak_rate(
+                past.tip_off + since_tip_off,
+                past.tip_off + since_tip_off + policy.lookback,
+            )
+            for past in self.schedule
+            if past.tip_off + policy.game_duration <= now
+            and self._in_history(history, past, now)
+        ]
+        if not rates:
+            return policy.default_game_rate
+        return max(rates)
+
+    def _in_history(self, history: RequestHistory, past: Game, now: float) -> bool:
+        # Games before the retained history or before the gateways counted
+        # requests would expect no traffic at all
+        start = past.tip_off - self.policy.lead
+        end = past.tip_off + self.policy.game_duration
+        return start >= now - HISTORY_RETENTION and history.has_counts(start, end)
+
+    def warm_containers(self, history: RequestHistory, now: float) -> int:
+        """Get the number of containers to keep warm.
+
+        Args:
+            history: The requests counted until now.
+            now: The current time.
+
+        Returns:
+            The number of warm containers.
+        """
+        policy = self.policy
+        games = self.games_at(now)
+        if not games:
+            return policy.min_containers
+        rate = max(
+            history.peak_rate(now - policy.lookback, now),
+            *(self.game_rate(history, game, now) for game in games),
+        )
+        containers = math.ceil(rate * policy.headroom / policy.requests_per_container)
+        return min(policy.max_containers, max(policy.min_containers, containers))
+
+
+class HistoryStore:
+    """Request histories of the gateways, shared with the scheduler.
+
+    Concurrent flushes from other gateway containers may overwrite each other's
+    counts, which only lowers the rates the scheduler sees.
+    """
+
+    def __init__(self, store, key: str):
+        """Initialize the history store.
+
+        Args:
+            store: The modal dict holding the histories.
+            key: The key of the history, the name of the app of the gateway.
+        """
+        self.store = store
+        self.key = key
+
+    async def add(self, counts: Dict[int, int], now: float):
+        """Add the requests counted by a gateway, dropping expired minutes.
+
+        Args:
+            counts: The number of requests by the start of their minute.
+            now: The current time.
+        """
+        history = await self.read()
+        history.merge(counts)
+        history.prune(now - HISTORY_RETENTION)
+        await self.store.put.aio(self.key, history.counts)
+
+    async def read(self) -> RequestHistory:
+        """Read the history of the gateways."""
+        return RequestHistory(await self.store.get.aio(self.key, {}))
+
+
+class RequestRecorder:
+    """Count the requests of a gateway, flushing them to the shared history.
+
+    Counts are flushed in the background at most every `flush_interval` seconds,
+    so requests never wait for the store.
+    """
+
+    def __init__(
+        self,
+        store: HistoryStore,
+        flush_interval: float = FLUSH_INTERVAL,
+        clock: Callable[[], float] = time.time,
+    ):
+        """Initialize the recorder.
+
+        Args:
+            store: The history store.
+            flush_interval: The number of seconds between flushes.
+            clock: The clock of the history, shared with the scheduler.
+        """
+        self.store = store
+        self.flush_interval = flush_interval
+        self.clock = clock
+        self.pending = RequestHistory()
+        self._flushed_at = clock()
+        self._flush_task: Optional[asyncio.Task] = None
+
+    def record(self):
+        """Count a request, flushing the counts when due."""
+        now = self.clock()
+        self.pending.record(now)
+        if now - self._flushed_at >= self.flush_interval and (
+            self._flush_task is None or self._flush_task.done()
+        ):
+            self._flushed_at = now
+            self._flush_task = asyncio.create_task(self.flush())
+
+    async def flush(self):
+        """Flush the pending counts, keeping them for the next flush on failure."""
+        counts, self.pending = self.pending.counts, RequestHistory()
+        if not counts:
+            return
+        try:
+            await self.store.add(counts, self.clock())
+        except Exception as e:
+            logger.warning(f"Failed to flush request counts: {e}")
+            self.pending.merge(counts)
+
+
+class SimulationResult(NamedTuple):
+    """The containers started while replaying traffic."""
+
+    requests: int
+    # Containers started because requests arrived without enough containers
+    cold_starts: int
+    # Containers started ahead of requests by the scheduler
+    prewarmed: int
+    gpu_minutes: float
+
+
+def simulate(
+    arrivals: Sequence[float],
+    planner: Optional[PrewarmPlanner],
+    *,
+    requests_per_container: float = 2.0,
+    cold_start: float = 120.0,
+    idle_timeout: float = 300.0,
+    plan_interval: float = 300.0,
+    step: float = 60.0,
+    history: Optional[RequestHistory] = None,
+) -> SimulationResult:
+    """Replay request arrivals against the autoscaling of model containers.
+
+    Containers are started when the requests of a step need more containers than
+    are running, which is a cold start, or when the planner asks for more warm
+    containers. Containers stop once idle for `idle_timeout` seconds unless they
+    are kept warm. The planner only sees the requests that arrived before each
+    plan, like the scheduler.
+
+    Args:
+        arrivals: The arrival times of the requests.
+        planner: The planner of warm containers, or None to never pre-warm.
+        requests_per_container: The request rate a single container serves.
+        cold_start: The number of seconds a container takes to start.
+        idle_timeout: The number of seconds a container stays up while idle.
+        plan_interval: The number of seconds between plans.
+        step: The number of seconds of a step of the simulation.
+        history: The requests counted before the replay, e.g. past games.
+
+    Returns:
+        The containers started and the GPU minutes spent.
+    """
+    arrivals = sorted(arrivals)
+    if not arrivals:
+        return SimulationResult(0, 0, 0, 0.0)
+    history = RequestHistory(history.counts if history is not None else None)
+    lead = planner.policy.lead if planner is not None else 0.0
+
+    # The idle-since time of every running container
+    containers: List[float] = []
+    cold_starts = prewarmed = 0
+    gpu_seconds = 0.0
+    warm = 0
+    planned_at = -math.inf
+    index = 0
+    now = arrivals[0] - lead
+    end = arrivals[-1] + idle_timeout
+    while now < end:
+        if planner is not None and now - planned_at >= plan_interval:
+            warm = planner.warm_containers(history, now)
+            planned_at = now
+
+        arrived = 0
+        while index < len(arrivals) and arrivals[index] < now + step:
+            history.record(arrivals[index])
+            arrived += 1
+            index += 1
+        needed = math.ceil(arrived / step / requests_per_container)
+
+        if needed > len(containers):
+            cold_starts += needed - len(containers)
+            containers.extend([now + cold_start] * (needed - len(containers)))
+        if warm > len(containers):
+            prewarmed += warm - len(containers)
+            containers.extend([now + cold_start] * (warm - len(containers)))
+
+        # The most recently used containers serve the requests of the step
+        containers.sort(reverse=True)
+        for i in range(needed):
+            containers[i] = max(containers[i], now + step)
+        keep = max(warm, needed)
+        containers = containers[:keep] + [
+            idle_since
+            for idle_since in containers[keep:]
+            if now + step - idle_since < idle_timeout
+        ]
+
+        gpu_seconds += len(containers) * step
+        now += step
+
+    return SimulationResult(len(arrivals), cold_starts, prewarmed, gpu_seconds / 60)
@@ -4,19 +4,32 @@ import logging
 
 import modal
 
-from backend.tgi_server.infra import APP_NAME, GPU_CONFIG, LAUNCH_FLAGS, tgi_image
+from backend.prewarm.scheduler import PREWARM_DICT_NAME, HistoryStore, RequestRecorder
+from backend.tgi_server.infra import (
+    APP_NAME,
+    CONCURRENT_INPUTS,
+    GPU_CONFIG,
+    LAUNCH_FLAGS,
+    MICRO_BATCH_WINDOW,
+    tgi_image,
+)
+from backend.tgi_server.launcher import LauncherSupervisor
+from backend.tgi_server.pool import MicroBatcher, TGIClient
+from backend.tgi_server.service import ChatService
 
 app = modal.App(name=APP_NAME)
 
 logger = logging.getLogger(__name__)
 
+TGI_URL = "http://127.0.0.1:8000"
+
 
 @app.cls(
     secrets=[
         modal.Secret.from_name("huggingface-secret"),
     ],
     gpu=GPU_CONFIG,
-    allow_concurrent_inputs=15,
+    allow_concurrent_inputs=CONCURRENT_INPUTS,
     container_idle_timeout=60 * 10,
     timeout=60 * 60,
     image=tgi_image,
@@ -37,45 +50,31 @@ class Model:
     def start_server(self):
         """Start the TGI server and load the model."""
         import os
-        import socket
-        import subprocess
-        import time
-
-        from text_generation import AsyncClient
 
-        self.launcher = subprocess.Popen(
+        # Restarts the launcher if it exits, holding the requests meanwhile
+        self.launcher = LauncherSupervisor(
             ["text-generation-launcher", *LAUNCH_FLAGS],
+            health_url=f"{TGI_URL}/health",
             env={
                 **os.environ,
                 "HUGGING_FACE_HUB_TOKEN": os.environ["HF_TOKEN"],
             },
         )
-        self.client = AsyncClient("http://127.0.0.1:8000", timeout=60)
-
-        # Poll until webserver at 127.0.0.1:8000 accepts connections before running.
-        def webserver_ready():
-            try:
-                socket.create_connection(("127.0.0.1", 8000), timeout=1).close()
-                return True
-            except (socket.timeout, ConnectionRefusedError):
-                # Check if launcher webserving process has exited.
-                # If so, a connection can never be made.
-                retcode = self.launcher.poll()
-                if retcode is not None:
-                    raise RuntimeError(
-                        f"launcher exited unexpectedly with code {retcode}"
-                    ) from None
-                return False
-
-        while not webserver_ready():
-            time.sleep(1.0)
-
+        self.launcher.start()
         logger.info("Webserver ready!")
 
+        batcher = None
+        if MICRO_BATCH_WINDOW > 0:
+            batcher = MicroBatcher(MICRO_BATCH_WINDOW, max_batch=CONCURRENT_INPUTS)
+        self.client = TGIClient(
+            TGI_URL, max_connections=CONCURRENT_INPUTS, batcher=batcher
+        )
+        self.service = ChatService(self.client, self.launcher)
+
     @modal.exit()
     def close_server(self):
         """Shut down the TGI server on exit."""
-        self.launcher.terminate()
+        self.launcher.stop()
 
     @modal.method()
     async def generate(self, chat_request: ChatRequest):
@@ -87,66 +86,24 @@ class Model:
         Returns:
             The generated response.
         """
-        result = await self.client.chat(
-            messages=chat_request.messages,
-            repetition_penalty=chat_request.repetition_penalty,
-            frequency_penalty=chat_request.frequency_penalty,
-            logit_bias=chat_request.logit_bias,
-            logprobs=chat_request.logprobs,
-            top_logprobs=chat_request.top_logprobs,
-            max_tokens=chat_request.max_tokens,
-            presence_penalty=chat_request.presence_penalty,
-            # Returns a coroutine rather than a generator
-            stream=False,
-            seed=chat_request.seed,
-            temperature=chat_request.temperature,
-            top_p=chat_request.top_p,
-            tools=chat_request.tools,
-            tool_choice=chat_request.tool_choice,
-        )
-        return result
-
-    # @modal.method()
-    # async def generate_stream(self, chat_request: ChatRequest):
-    #     """Generate a response to a chat request as a stream.
-
-    #     Args:
-    #         chat_request: The chat request.
-
-    #     Returns:
-    #         The generated response stream.
-    #     """
-    #     from text_generation.types import ChatCompletionChunk
-
-    #     result_generator = await self.client.chat(
-    #         messages=chat_request.messages,
-    #         repetition_penalty=chat_request.repetition_penalty,
-    #         frequency_penalty=chat_request.frequency_penalty,
-    #         logit_bias=chat_request.logit_bias,
-    #         logprobs=chat_request.logprobs,
-    #         top_logprobs=chat_request.top_logprobs,
-    #         max_tokens=chat_request.max_tokens,
-    #         presence_penalty=chat_request.presence_penalty,
-    #         # Returns a generator rather than a coroutine
-    #         stream=True,
-    #         seed=chat_request.seed,
-    #         temperature=chat_request.temperature,
-    #         top_p=chat_request.top_p,
-    #         tools=chat_request.tools,
-    #         tool_choice=chat_request.tool_choice,
-    #     )
-    #     async for chunk in result_generator:
-    #         chunk: ChatCompletionChunk = chunk
-    #         print(f"Generated response: {chunk}")
-
-    #         # TODO: streaming breaks tool_call generation
-    #         # Need to figure out how that works but might not even
-    #         # be a good design choice for this use case
-    #         yield chunk
+        return await self.service.generate(chat_request)
+
+    @modal.method()
+    async def generate_stream(self, chat_request: ChatRequest):
+        """Generate a response to a chat request as a stream.
+
+        Args:
+            chat_request: The chat request.
+
+        Yields:
+            The server-sent event frames of the OpenAI chat completion chunks.
+        """
+        async for chunk in self.service.generate_stream(chat_request):
+            yield chunk
 
 
 @app.function(
-    allow_concurrent_inputs=15,
+    allow_concurrent_inputs=CONCURRENT_INPUTS,
     timeout=60 * 10,
     image=tgi_image,
     secrets=[
@@ -161,12 +118,20 @@ def fastapi_app():
     from fastapi import FastAPI
     from fastapi.exceptions import HTTPException
     from fastapi.requests import Request
+    from fastapi.responses import StreamingResponse
     from text_generation.client import ChatRequest
 
     web_app = FastAPI()
 
     model = Model()
 
+    # Requests are counted for the scheduler pre-warming the model containers
+    request_recorder = RequestRecorder(
+        HistoryStore(
+            modal.Dict.from_name(PREWARM_DICT_NAME, create_if_missing=True), APP_NAME
+        )
+    )
+
     @web_app.get("/")
     def index():
         return {"message": "Hello World"}
@@ -197,10 +162,13 @@ def fastapi_app():
         if authorization_header != f"Bearer {secret_key}":
             raise HTTPException(status_code=403, detail="Invalid API key")
 
+        request_recorder.record()
         if not request.stream:
             response = await model.generate.remote.aio(request)
             return response
-        else:
-            raise NotImplementedError("Streaming not implemented yet")
+        return StreamingResponse(
+            model.generate_stream.remote_gen.aio(request),
+            media_type="text/event-stream",
+        )
 
     return web_app
@@ -0,0 +1,375 @@
+"""Stand-in for the TGI server, for benchmarks and tests without a GPU.
+
+Serves the routes of TGI used by the `Model` class over HTTP/1.1 with
+keep-alive, generating tokens at a fixed rate after a fixed time to first token.
+Prefills can be given a cost, batching the prompts waiting for them like TGI.
+Chat completions follow the format of TGI 1.4, see `backend.tgi_server.stream`,
+and stream the arguments of a tool call when the request has tools.
+
+Usage:
+    python -m backend.tgi_server.fake --port 8000 --time-to-first-token 0.2
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import logging
+import time
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+WORDS = ["The", " Nuggets", " won", " the", " game", " by", " twelve", " points", "."]
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found"}
+
+
+class FakeTGIServer:
+    """HTTP server answering like TGI, without a model."""
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        time_to_first_token: float = 0.05,
+        tokens_per_second: float = 50.0,
+        max_new_tokens: int = 32,
+        prefill_time: float = 0.0,
+        model_id: str = "fake/model",
+    ):
+        """Initialize the server.
+
+        Args:
+            host: The host to listen on.
+            port: The port to listen on, any free port if 0.
+            time_to_first_token: The seconds before the first token.
+            tokens_per_second: The tokens generated per second after the first.
+            max_new_tokens: The length of the answers, unless cut short by the
+                `max_tokens` of a request.
+            prefill_time: The seconds of a prefill. Prompts arriving during a
+                prefill are prefilled together in the next one, and every
+                prefill stalls the generation of the running requests.
+            model_id: The model reported by the server.
+        """
+        self.host = host
+        self.port = port
+        self.time_to_first_token = time_to_first_token
+        self.tokens_per_second = tokens_per_second
+        self.max_new_tokens = max_new_tokens
+        self.prefill_time = prefill_time
+        self.model_id = model_id
+        self._server: Optional[asyncio.base_events.Server] = None
+        self._connections: Dict[asyncio.Task, asyncio.StreamWriter] = {}
+        self._engine = asyncio.Lock()
+        self._next_prefill: Optional[asyncio.Future] = None
+        # Counters for the benchmarks and tests
+        self.connections = 0
+        self.requests = 0
+        self.active = 0
+        self.peak_active = 0
+        self.disconnects = 0
+        self.prefills = 0
+        self.stalled = 0.0
+
+    @property
+    def url(self) -> str:
+        """The base URL of the server."""
+        return f"http://{self.host}:{self.port}"
+
+    async def start(self):
+        """Start listening, on a free port if none was set."""
+        self._server = await asyncio.start_server(self._serve, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def close(self):
+        """Stop listening and close the open connections."""
+        if self._server is not None:
+            self._server.close()
+            for writer in self._connections.values():
+                writer.close()
+            await asyncio.gather(*self._connections, return_exceptions=True)
+            await self._server.wait_closed()
+            self._server = None
+
+    async def __aenter__(self) -> "FakeTGIServer":
+        """Start the server."""
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        """Stop the server."""
+        await self.close()
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connections += 1
+        task = asyncio.current_task()
+        self._connections[task] = writer
+        try:
+            while True:
+                request = await _read_request(reader)
+                if request is None:
+                    break
+                method, path, headers, body = request
+                self.requests += 1
+                self.active += 1
+                self.peak_active = max(self.peak_active, self.active)
+                try:
+                    await self._handle(method, path, body, writer)
+                finally:
+                    self.active -= 1
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            self.disconnects += 1
+        finally:
+            self._connections.pop(task, None)
+            writer.close()
+
+    async def _handle(
+        self, method: str, path: str, body: bytes, writer: asyncio.StreamWriter
+    ):
+        if method == "GET" and path == "/health":
+            await _send_json(writer, 200, {})
+        elif method == "GET" and path == "/info":
+            await _send_json(writer, 200, self.info())
+        elif method == "POST" and path == "/v1/chat/completions":
+            try:
+                request = json.loads(body)
+            except ValueError:
+                await _send_json(writer, 400, {"error": "Invalid JSON"})
+                return
+            if request.get("stream"):
+                await _send_stream(writer, self._chat_stream(request))
+            else:
+                await _send_json(writer, 200, await self._chat(request))
+        else:
+            await _send_json(writer, 404, {"error": f"{method} {path} not found"})
+
+    def info(self) -> dict:
+        """The `/info` of the server."""
+        return {
+            "model_id": self.model_id,
+            "model_sha": None,
+            "model_dtype": "torch.float16",
+            "model_device_type": "cuda",
+            "model_pipeline_tag": "text-generation",
+            "max_concurrent_requests": 128,
+            "max_best_of": 2,
+            "max_stop_sequences": 4,
+            "max_input_length": 1024,
+            "max_total_tokens": 2048,
+            "waiting_served_ratio": 1.2,
+            "max_batch_total_tokens": 16000,
+            "max_waiting_tokens": 20,
+            "validation_workers": 2,
+            "version": "1.4.0",
+            "sha": None,
+            "docker_label": None,
+        }
+
+    def _tokens(self, request: dict) -> Tuple[List[str], Optional[str], str]:
+        """Get the tokens of a request, the tool called and the finish reason."""
+        max_tokens = request.get("max_tokens") or self.max_new_tokens
+        tool = None
+        tools = request.get("tools")
+        if tools and request.get("tool_choice") != "none":
+            tool = tools[0]["function"]["name"]
+            arguments = json.dumps({"function": {"_name": tool, "team": "DEN"}})
+            words = [arguments[i : i + 4] for i in range(0, len(arguments), 4)]
+            # Tool calls are not cut short, so their arguments stay valid JSON
+            return words, tool, "eos_token"
+        # The answer ends after `max_new_tokens` unless `max_tokens` cuts it short
+        length = min(max_tokens, self.max_new_tokens)
+        words = [WORDS[i % len(WORDS)] for i in range(length)]
+        finish_reason = "length" if max_tokens < self.max_new_tokens else "eos_token"
+        return words, None, finish_reason
+
+    async def _generate(self, tokens: List[str]) -> AsyncIterator[str]:
+        """Generate tokens at the rate of the server once the prompt is prefilled."""
+        await asyncio.sleep(self.time_to_first_token)
+        await self._prefill()
+        started_at = time.monotonic()
+        stalled_at = self.stalled
+        for index, token in enumerate(tokens):
+            # The prefills of other requests push back the tokens
+            at = started_at + index / self.tokens_per_second
+            at += self.stalled - stalled_at
+            await asyncio.sleep(max(0.0, at - time.monotonic()))
+            if self._engine.locked():
+                async with self._engine:
+                    pass
+            yield token
+
+    async def _prefill(self):
+        """Wait for the prefill of a prompt, batched with the other waiting ones."""
+        if self.prefill_time <= 0:
+            return
+        if self._next_prefill is None:
+            self._next_prefill = asyncio.ensure_future(self._run_prefill())
+        await asyncio.shield(self._next_prefill)
+
+    async def _run_prefill(self):
+        async with self._engine:
+            # Prompts arriving from now on wait for the next prefill
+            self._next_prefill = None
+            self.prefills += 1
+            await asyncio.sleep(self.prefill_time)
+            self.stalled += self.prefill_time
+
+    async def _chat(self, request: dict) -> dict:
+        tokens, tool, finish_reason = self._tokens(request)
+        tokens = [token async for token in self._generate(tokens)]
+        message = {"role": "assistant", "content": "".join(tokens)}
+        if tool is not None:
+            message = {
+                "role": "assistant",
+                "content": None,
+                "tool_calls": [
+                    {
+                        "id": 0,
+                        "type": "function",
+                        "function": {
+                            "name": "tools",
+                            "description": None,
+                            "arguments": json.loads("".join(tokens)),
+                        },
+                    }
+                ],
+            }
+        prompt_tokens = sum(
+            len(str(m.get("content") or "").split()) for m in request["messages"]
+        )
+        return {
+            "id": "",
+            "object": "text_completion",
+            "created": int(time.time()),
+            "model": self.model_id,
+            "system_fingerprint": "1.4.0-native",
+            "choices": [
+                {
+                    "index": 0,
+                    "message": message,
+                    "logprobs": None,
+                    "finish_reason": finish_reason,
+                }
+            ],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": len(tokens),
+                "total_tokens": prompt_tokens + len(tokens),
+            },
+        }
+
+    async def _chat_stream(self, request: dict) -> AsyncIterator[bytes]:
+        tokens, tool, finish_reason = self._tokens(request)
+        created = int(time.time())
+        index = 0
+        async for token in self._generate(tokens):
+            delta = {"role": "assistant", "content": token, "tool_calls": None}
+            if tool is not None:
+                # TGI 1.4 streams a single tool call object without its name
+                delta["content"] = None
+                delta["tool_calls"] = {
+                    "index": 0,
+                    "id": "",
+                    "type": "function",
+                    "function": {"name": None, "arguments": token},
+                }
+            chunk = {
+                "id": "",
+                "object": "text_completion",
+                "created": created,
+                "model": self.model_id,
+                "system_fingerprint": "1.4.0-native",
+                "choices": [
+                    {
+                        "index": 0,
+                        "delta": delta,
+                        "logprobs": None,
+                        "finish_reason": (
+                            finish_reason if index == len(tokens) - 1 else None
+                        ),
+                    }
+                ],
+            }
+            # TGI 1.4 does not end the stream with [DONE]
+            yield f"data:{json.dumps(chunk)}\n\n".encode()
+            index += 1
+
+
+async def _read_request(
+    reader: asyncio.StreamReader,
+) -> Optional[Tuple[str, str, Dict[str, str], bytes]]:
+    """Read an HTTP request, or None once the client closed the connection."""
+    line = await reader.readline()
+    if not line.strip():
+        return None
+    method, path, _ = line.decode("latin-1").split(" ", 2)
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    body = await reader.readexactly(int(headers.get("content-length", 0)))
+    return method, path.split("?", 1)[0], headers, body
+
+
+def _head(status: int, headers: Dict[str, str]) -> bytes:
+    lines = [f"HTTP/1.1 {status} {REASONS.get(status, '')}"]
+    lines += [f"{name}: {value}" for name, value in headers.items()]
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+
+async def _send_json(writer: asyncio.StreamWriter, status: int, payload: dict):
+    body = json.dumps(payload).encode()
+    headers = {"Content-Type": "application/json", "Content-Length": str(len(body))}
+    writer.write(_head(status, headers) + body)
+    await writer.drain()
+
+
+async def _send_stream(writer: asyncio.StreamWriter, events):
+    headers = {"Content-Type": "text/event-stream", "Transfer-Encoding": "chunked"}
+    writer.write(_head(200, headers))
+    await writer.drain()
+    async for event in events:
+        writer.write(f"{len(event):x}\r\n".encode() + event + b"\r\n")
+        await writer.drain()
+    writer.write(b"0\r\n\r\n")
+    await writer.drain()
+
+
+async def _run(args: argparse.Namespace):
+    server = FakeTGIServer(
+        host=args.host,
+        port=args.port,
+        time_to_first_token=args.time_to_first_token,
+        tokens_per_second=args.tokens_per_second,
+        max_new_tokens=args.max_new_tokens,
+        prefill_time=args.prefill_time,
+    )
+    async with server:
+        logger.info(f"Fake TGI server listening on {server.url}")
+        await asyncio.Event().wait()
+
+
+def main():
+    """Run the fake TGI server."""
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--time-to-first-token", type=float, default=0.05)
+    parser.add_argument("--tokens-per-second", type=float, default=50.0)
+    parser.add_argument("--max-new-tokens", type=int, default=32)
+    parser.add_argument("--prefill-time", type=float, default=0.0)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    with contextlib.suppress(KeyboardInterrupt):
+        asyncio.run(_run(args))
+
+
+if __name__ == "__main__":
+    main()
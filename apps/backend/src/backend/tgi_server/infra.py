@@ -16,6 +16,12 @@ LAUNCH_FLAGS = [
 
 APP_NAME = "hooper-tgi-server"
 
+# The concurrent inputs of a model container, and the connections to its TGI server
+CONCURRENT_INPUTS = 15
+# Seconds short requests are held so concurrent ones reach TGI together, 0 to
+# send them right away, see `MicroBatcher`
+MICRO_BATCH_WINDOW = 0.0
+
 
 def download_model():
     """Download the model weights from the huggingface hub.
@@ -42,7 +48,7 @@ tgi_image = (
         timeout=3600,
     )
     .pip_install("text-generation")
-    .pip_install("pydantic>=2.6.4", "fastapi>=0.110.0")
+    .pip_install("pydantic>=2.6.4", "fastapi>=0.110.0", "httpx>=0.27.0")
 )
 
 client_image = Image.debian_slim().pip_install("openai")
@@ -0,0 +1,307 @@
+"""Supervisor of the TGI launcher of a model container.
+
+`LauncherSupervisor` starts `text-generation-launcher`, probes the `/health` of
+TGI with backoff until it answers, and records how long each phase of the
+startup took from the logs of the launcher. A watcher thread restarts the
+launcher when it exits, without recycling the container, and requests wait for
+the restarted launcher rather than failing, see `wait_ready`. When every restart
+failed the container exits, so Modal replaces it rather than routing requests to
+a container without TGI.
+"""
+
+import asyncio
+import logging
+import os
+import subprocess
+import sys
+import threading
+import time
+from typing import Callable, Dict, List, NamedTuple, Optional, Sequence
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# The logs of the launcher starting each phase after the weights download
+PHASE_MARKERS = {
+    "shard_load": "Starting shard",
+    "warmup": "Warming up model",
+}
+STARTUP_TIMEOUT = 30 * 60.0
+PROBE_TIMEOUT = 2.0
+# Seconds the launcher takes to exit once the TGI router or a shard died
+EXIT_GRACE = 10.0
+
+
+class StartupTimings(NamedTuple):
+    """Seconds spent in each phase of a startup of the launcher.
+
+    A phase is None when the launcher logged no start for it.
+    """
+
+    download: Optional[float]
+    shard_load: Optional[float]
+    warmup: Optional[float]
+    total: float
+
+
+class StartupLog:
+    """Times of the phases started in the logs of a launcher."""
+
+    def __init__(self, started_at: float, clock: Callable[[], float] = time.monotonic):
+        """Initialize the log.
+
+        Args:
+            started_at: The time the launcher was started, starting the download.
+            clock: The clock of the phase times.
+        """
+        self.clock = clock
+        self.started_at = started_at
+        self.phases: Dict[str, float] = {"download": started_at}
+
+    def feed(self, line: str):
+        """Record the phase started by a line of the logs, if any.
+
+        Args:
+            line: The line logged by the launcher.
+        """
+        for phase, marker in PHASE_MARKERS.items():
+            if phase not in self.phases and marker in line:
+                self.phases[phase] = self.clock()
+
+    def timings(self, ready_at: float) -> StartupTimings:
+        """Get the timings of the phases, each ending when the next one starts.
+
+        Args:
+            ready_at: The time TGI first answered its health checks.
+
+        Returns:
+            The timings.
+        """
+        starts = sorted(self.phases.items(), key=lambda item: item[1])
+        ends = [at for _, at in starts[1:]] + [ready_at]
+        durations = {phase: end - at for (phase, at), end in zip(starts, ends)}
+        return StartupTimings(
+            download=durations.get("download"),
+            shard_load=durations.get("shard_load"),
+            warmup=durations.get("warmup"),
+            total=ready_at - self.started_at,
+        )
+
+
+class LauncherSupervisor:
+    """Start the TGI launcher and restart it when it exits."""
+
+    def __init__(
+        self,
+        command: Sequence[str],
+        health_url: str,
+        env: Optional[Dict[str, str]] = None,
+        startup_timeout: float = STARTUP_TIMEOUT,
+        initial_backoff: float = 0.1,
+        max_backoff: float = 5.0,
+        watch_interval: float = 1.0,
+        max_restarts: int = 3,
+        on_failure: Optional[Callable[[], None]] = None,
+    ):
+        """Initialize the supervisor.
+
+        Args:
+            command: The command starting the launcher.
+            health_url: The URL of the health checks of TGI.
+            env: The environment of the launcher.
+            startup_timeout: The seconds a start of the launcher may take.
+            initial_backoff: The seconds between the first health checks,
+                doubled after each failed one.
+            max_backoff: The most seconds between health checks.
+            watch_interval: The seconds between checks that the launcher runs.
+            max_restarts: The attempts to restart an exited launcher before
+                failing the requests.
+            on_failure: Called once every restart failed, exits the container if
+                not set.
+        """
+        self.command = list(command)
+        self.health_url = health_url
+        self.env = env
+        self.startup_timeout = startup_timeout
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.watch_interval = watch_interval
+        self.max_restarts = max_restarts
+        self.on_failure = on_failure or _exit_container
+        self.process: Optional[subprocess.Popen] = None
+        self.launches: List[StartupTimings] = []
+        self.restarts = 0
+        self.error: Optional[Exception] = None
+        self._ready = threading.Event()
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._watcher: Optional[threading.Thread] = None
+
+    def start(self):
+        """Start the launcher, blocking until TGI is healthy, and watch it.
+
+        Raises:
+            RuntimeError: If the launcher exited while starting.
+            TimeoutError: If TGI was not healthy within the startup timeout.
+        """
+        self._launch()
+        self._ready.set()
+        self._watcher = threading.Thread(target=self._watch, daemon=True)
+        self._watcher.start()
+
+    def stop(self):
+        """Stop watching and terminate the launcher."""
+        self._stopped.set()
+        self._wake.set()
+        if self._watcher is not None:
+            self._watcher.join()
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+
+    async def recovered(self, grace: float = EXIT_GRACE) -> bool:
+        """Wait for the launcher to restart after a request failed to reach TGI.
+
+        Args:
+            grace: The seconds the launcher may take to exit, while TGI is down.
+
+        Returns:
+            True if the launcher exited and restarted, False if it kept running.
+        """
+        deadline = time.monotonic() + grace
+        while self.process.poll() is None and self._ready.is_set():
+            if time.monotonic() > deadline or await asyncio.to_thread(self._healthy):
+                return False
+            await asyncio.sleep(self.initial_backoff)
+        await self.wait_ready()
+        return True
+
+    async def wait_ready(self, timeout: Optional[float] = None):
+        """Wait until TGI is healthy, holding requests while it restarts.
+
+        Args:
+            timeout: The most seconds to wait, the startup timeout if None.
+
+        Raises:
+            RuntimeError: If the launcher could not be restarted.
+            TimeoutError: If TGI did not restart in time.
+        """
+        if self.process.poll() is not None and not self._stopped.is_set():
+            # Restart now rather than after the watch interval
+            self._wake.set()
+            while (
+                self._ready.is_set()
+                and self.process.poll() is not None
+                and not self._stopped.is_set()
+            ):
+                await asyncio.sleep(0.01)
+        if not self._ready.is_set():
+            logger.info("Holding a request until the TGI launcher restarted")
+            timeout = self.startup_timeout if timeout is None else timeout
+            if not await asyncio.to_thread(self._ready.wait, timeout):
+                raise TimeoutError(f"TGI did not restart within {timeout:.0f}s")
+        if self.error is not None:
+            raise RuntimeError("The TGI launcher could not be restarted") from (
+                self.error
+            )
+
+    def _launch(self):
+        """Start the launcher and wait until TGI is healthy."""
+        started_at = time.monotonic()
+        log = StartupLog(started_at)
+        self.process = subprocess.Popen(
+            self.command,
+            env=self.env,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+            bufsize=1,
+        )
+        threading.Thread(
+            target=_forward_output, args=(self.process, log), daemon=True
+        ).start()
+        self._wait_healthy(self.process, started_at + self.startup_timeout)
+        timings = log.timings(time.monotonic())
+        self.launches.append(timings)
+        logger.info(f"TGI ready: {_format(timings)}")
+
+    def _wait_healthy(self, process: subprocess.Popen, deadline: float):
+        backoff = self.initial_backoff
+        while True:
+            retcode = process.poll()
+            if retcode is not None:
+                raise RuntimeError(f"TGI launcher exited with code {retcode}")
+            if self._healthy():
+                return
+            if time.monotonic() > deadline or self._stopped.is_set():
+                process.kill()
+                raise TimeoutError("TGI did not start within the startup timeout")
+            self._stopped.wait(backoff)
+            backoff = min(2 * backoff, self.max_backoff)
+
+    def _healthy(self) -> bool:
+        try:
+            response = httpx.get(self.health_url, timeout=PROBE_TIMEOUT)
+        except httpx.HTTPError:
+            return False
+        return response.status_code == 200
+
+    def _watch(self):
+        while not self._stopped.is_set():
+            self._wake.wait(self.watch_interval)
+            self._wake.clear()
+            if self._stopped.is_set():
+                return
+            retcode = self.process.poll()
+            if retcode is None:
+                continue
+            logger.warning(f"TGI launcher exited with code {retcode}, restarting")
+            self._ready.clear()
+            self._restart()
+            self._ready.set()
+
+    def _restart(self):
+        """Restart the launcher, failing the container if every attempt failed."""
+        backoff = self.initial_backoff
+        for attempt in range(1, self.max_restarts + 1):
+            self.restarts += 1
+            try:
+                self._launch()
+                self.error = None
+                return
+            except (RuntimeError, TimeoutError) as e:
+                logger.warning(f"TGI launcher restart {attempt} failed: {e}")
+                self.error = e
+            if self._stopped.wait(backoff):
+                return
+            backoff = min(2 * backoff, self.max_backoff)
+        logger.error(f"TGI launcher failed {self.max_restarts} restarts")
+        self._stopped.set()
+        self.on_failure()
+
+
+def _exit_container():
+    """Exit the container from the watcher thread so Modal replaces it."""
+    logging.shutdown()
+    os._exit(1)
+
+
+def _forward_output(process: subprocess.Popen, log: StartupLog):
+    """Forward the logs of the launcher, recording the phases of its startup."""
+    for line in process.stdout:
+        log.feed(line)
+        sys.stdout.write(line)
+    process.stdout.close()
+
+
+def _format(timings: StartupTimings) -> str:
+    phases = [
+        f"{phase} {seconds:.1f}s"
+        for phase, seconds in timings._asdict().items()
+        if seconds is not None
+    ]
+    return ", ".join(phases)
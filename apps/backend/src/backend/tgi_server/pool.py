@@ -0,0 +1,229 @@
+"""Pooled HTTP client of the TGI server of a model container.
+
+The `AsyncClient` of `text_generation` opens a new session, and so a new
+connection, for every request. `TGIClient` keeps a pool of keep-alive
+connections as large as the concurrent inputs of the container, and sets the
+timeout of every request from its `max_tokens` rather than a flat timeout
+that cuts long generations short.
+
+Short requests can optionally go through a `MicroBatcher`, which holds them for
+a few milliseconds so concurrent ones reach TGI together and are prefilled in
+the same batch, rather than each stalling the decoding of the running batch.
+"""
+
+import asyncio
+import json
+import time
+from typing import AsyncIterator, Optional, Union
+
+import httpx
+from pydantic_core import to_jsonable_python
+
+CHAT_PATH = "/v1/chat/completions"
+
+# The max tokens of TGI 1.4 when a chat request sets none
+DEFAULT_MAX_TOKENS = 100
+# Seconds for the queueing and prefill of a request, and the slowest decoding
+# expected after it
+BASE_TIMEOUT = 30.0
+MIN_TOKENS_PER_SECOND = 10.0
+MAX_TIMEOUT = 60 * 60.0
+CONNECT_TIMEOUT = 5.0
+# Seconds an idle connection is kept open
+KEEPALIVE_EXPIRY = 60.0
+
+
+class TGIError(Exception):
+    """Error answered by the TGI server."""
+
+    def __init__(self, status_code: int, message: str):
+        """Initialize the error.
+
+        Args:
+            status_code: The HTTP status of the response.
+            message: The error message of TGI.
+        """
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def request_timeout(max_tokens: Optional[int]) -> float:
+    """Get the seconds a request may take to generate its tokens.
+
+    Args:
+        max_tokens: The max tokens of the request, the default of TGI if None.
+
+    Returns:
+        The timeout in seconds.
+    """
+    tokens = max_tokens or DEFAULT_MAX_TOKENS
+    return min(MAX_TIMEOUT, BASE_TIMEOUT + tokens / MIN_TOKENS_PER_SECOND)
+
+
+class _Batch:
+    """Requests released together by a `MicroBatcher`."""
+
+    def __init__(self, handle: asyncio.TimerHandle):
+        self.released = asyncio.Event()
+        self.handle = handle
+        self.size = 0
+
+
+class MicroBatcher:
+    """Hold concurrent short requests so they are sent to TGI together."""
+
+    def __init__(
+        self, window: float = 0.005, max_batch: int = 15, max_tokens: int = 64
+    ):
+        """Initialize the batcher.
+
+        Args:
+            window: The seconds the first request of a batch is held.
+            max_batch: The requests releasing a batch before the window ends.
+            max_tokens: The max tokens of the requests held, longer requests
+                are sent right away.
+        """
+        self.window = window
+        self.max_batch = max_batch
+        self.max_tokens = max_tokens
+        self._pending: Optional[_Batch] = None
+        # Counters for the benchmarks
+        self.batches = 0
+        self.requests = 0
+
+    def accepts(self, max_tokens: Optional[int]) -> bool:
+        """Whether a request is short enough to be held.
+
+        Args:
+            max_tokens: The max tokens of the request.
+
+        Returns:
+            True if the request is held.
+        """
+        return (max_tokens or DEFAULT_MAX_TOKENS) <= self.max_tokens
+
+    async def join(self):
+        """Wait until the batch of the request is released."""
+        if self._pending is None:
+            handle = asyncio.get_running_loop().call_later(self.window, self._release)
+            self._pending = _Batch(handle)
+            self.batches += 1
+        batch = self._pending
+        batch.size += 1
+        self.requests += 1
+        if batch.size >= self.max_batch:
+            self._release()
+        await batch.released.wait()
+
+    def _release(self):
+        batch, self._pending = self._pending, None
+        if batch is not None:
+            batch.handle.cancel()
+            batch.released.set()
+
+
+class TGIClient:
+    """Client of a TGI server sharing a pool of keep-alive connections.
+
+    `chat` takes the arguments of `text_generation.AsyncClient.chat` and
+    returns the JSON of the responses of TGI.
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        max_connections: int = 15,
+        batcher: Optional[MicroBatcher] = None,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+    ):
+        """Initialize the client.
+
+        Args:
+            base_url: The URL of the TGI server.
+            max_connections: The connections of the pool, the concurrent
+                inputs of the container.
+            batcher: The batcher of short requests, if any.
+            transport: The transport of the HTTP client, for tests.
+        """
+        self.base_url = base_url
+        self.batcher = batcher
+        self._client = httpx.AsyncClient(
+            base_url=base_url,
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections,
+                keepalive_expiry=KEEPALIVE_EXPIRY,
+            ),
+            timeout=httpx.Timeout(BASE_TIMEOUT, connect=CONNECT_TIMEOUT),
+            transport=transport,
+        )
+
+    async def chat(
+        self, *, stream: bool = False, **arguments
+    ) -> Union[dict, AsyncIterator[dict]]:
+        """Send a chat request.
+
+        Args:
+            stream: Whether to stream the response.
+            **arguments: The arguments of `text_generation.AsyncClient.chat`.
+
+        Returns:
+            The chat completion, or an iterator of its chunks when streaming.
+        """
+        payload = {"model": "tgi", **to_jsonable_python(arguments), "stream": stream}
+        payload = {key: value for key, value in payload.items() if value is not None}
+        max_tokens = payload.get("max_tokens")
+        timeout = request_timeout(max_tokens)
+        if self.batcher is not None and self.batcher.accepts(max_tokens):
+            await self.batcher.join()
+        if not stream:
+            return await self._chat_single_response(payload, timeout)
+        return self._chat_stream_response(payload, timeout)
+
+    async def _chat_single_response(self, payload: dict, timeout: float) -> dict:
+        response = await self._client.post(
+            CHAT_PATH, json=payload, timeout=self._timeout(timeout)
+        )
+        if response.status_code != 200:
+            raise _error(response.status_code, response.content)
+        return response.json()
+
+    async def _chat_stream_response(
+        self, payload: dict, timeout: float
+    ) -> AsyncIterator[dict]:
+        deadline = time.monotonic() + timeout
+        async with self._client.stream(
+            "POST", CHAT_PATH, json=payload, timeout=self._timeout(timeout)
+        ) as response:
+            if response.status_code != 200:
+                raise _error(response.status_code, await response.aread())
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = line[len("data:") :].strip()
+                if data == "[DONE]":
+                    break
+                chunk = json.loads(data)
+                if "error" in chunk:
+                    raise TGIError(response.status_code, str(chunk["error"]))
+                yield chunk
+                if time.monotonic() > deadline:
+                    raise TimeoutError(f"Chat stream took over {timeout:.0f}s")
+
+    @staticmethod
+    def _timeout(timeout: float) -> httpx.Timeout:
+        # Waiting for a connection of the pool counts toward the request
+        return httpx.Timeout(timeout, connect=CONNECT_TIMEOUT, pool=timeout)
+
+    async def aclose(self):
+        """Close the connections of the pool."""
+        await self._client.aclose()
+
+
+def _error(status_code: int, content: bytes) -> TGIError:
+    """Get the error of a response of TGI."""
+    try:
+        message = json.loads(content).get("error", "")
+    except (ValueError, AttributeError):
+        message = content.decode(errors="replace")
+    return TGIError(status_code, message or f"TGI answered {status_code}")
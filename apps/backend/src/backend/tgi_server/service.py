@@ -0,0 +1,117 @@
+"""Chat completions served by the TGI server of a model container.
+
+Kept apart from the Modal `Model` class so the benchmarks can serve completions
+against a local TGI server, or the fake one of `backend.tgi_server.fake`.
+"""
+
+import logging
+from typing import TYPE_CHECKING, AsyncGenerator, Optional
+
+import httpx
+
+from backend.tgi_server.launcher import LauncherSupervisor
+from backend.tgi_server.pool import TGIClient
+from backend.tgi_server.stream import DONE_FRAME, ChunkNormalizer, error_frame, frame
+
+if TYPE_CHECKING:
+    from text_generation.types import ChatRequest
+
+logger = logging.getLogger(__name__)
+
+
+def chat_arguments(chat_request: "ChatRequest") -> dict:
+    """Get the arguments of `TGIClient.chat` for a chat request.
+
+    Args:
+        chat_request: The chat request.
+
+    Returns:
+        The keyword arguments, without `stream`.
+    """
+    return {
+        "messages": chat_request.messages,
+        "repetition_penalty": chat_request.repetition_penalty,
+        "frequency_penalty": chat_request.frequency_penalty,
+        "logit_bias": chat_request.logit_bias,
+        "logprobs": chat_request.logprobs,
+        "top_logprobs": chat_request.top_logprobs,
+        "max_tokens": chat_request.max_tokens,
+        "presence_penalty": chat_request.presence_penalty,
+        "seed": chat_request.seed,
+        "temperature": chat_request.temperature,
+        "top_p": chat_request.top_p,
+        "tools": chat_request.tools,
+        "tool_choice": chat_request.tool_choice,
+    }
+
+
+class ChatService:
+    """Forward chat requests to a TGI server."""
+
+    def __init__(
+        self, client: TGIClient, launcher: Optional[LauncherSupervisor] = None
+    ):
+        """Initialize the chat service.
+
+        Args:
+            client: The client of the TGI server.
+            launcher: The supervisor of the launcher of the TGI server, whose
+                restarts hold the requests.
+        """
+        self.client = client
+        self.launcher = launcher
+
+    async def generate(self, chat_request: "ChatRequest") -> dict:
+        """Generate the full response to a chat request.
+
+        Args:
+            chat_request: The chat request.
+
+        Returns:
+            The generated chat completion of TGI.
+        """
+        arguments = chat_arguments(chat_request)
+        if self.launcher is not None:
+            await self.launcher.wait_ready()
+        try:
+            # Returns a coroutine rather than a generator
+            return await self.client.chat(**arguments, stream=False)
+        except httpx.TransportError:
+            # Sent again when the launcher exited during the request
+            if self.launcher is None or not await self.launcher.recovered():
+                raise
+            return await self.client.chat(**arguments, stream=False)
+
+    async def generate_stream(
+        self, chat_request: "ChatRequest", request_id: Optional[str] = None
+    ) -> AsyncGenerator[str, None]:
+        """Stream the response to a chat request as server-sent events.
+
+        The chunks of TGI are rewritten in the OpenAI format, including the
+        deltas of tool calls. Errors are sent as an error event, and the stream
+        always ends with `[DONE]`. Closing the stream closes the connection to
+        TGI, which stops the generation.
+
+        Args:
+            chat_request: The chat request.
+            request_id: The ID of the completion, generated if not set.
+
+        Yields:
+            The server-sent event frames.
+        """
+        normalizer = ChunkNormalizer(request_id)
+        chunks = None
+        try:
+            if self.launcher is not None:
+                await self.launcher.wait_ready()
+            # Returns a generator rather than a coroutine
+            chunks = await self.client.chat(**chat_arguments(chat_request), stream=True)
+            async for chunk in chunks:
+                yield frame(normalizer.normalize(chunk))
+        except Exception as e:
+            logger.warning(f"Chat stream {normalizer.request_id} failed: {e}")
+            yield error_frame(str(e))
+        finally:
+            if chunks is not None:
+                await chunks.aclose()
+        yield DONE_FRAME
@@ -0,0 +1,131 @@
+"""OpenAI compatible server-sent events from the chat stream of TGI.
+
+TGI 1.4 streams chat completion chunks close to the OpenAI format, but with an
+empty ID, an `object` of `text_completion`, the role on every chunk, a single
+tool call object rather than a list of tool call deltas, and its own finish
+reasons. `ChunkNormalizer` rewrites the chunks of a stream into the OpenAI
+format, and the chunks are sent as server-sent event frames.
+"""
+
+import json
+import time
+import uuid
+from typing import Optional, Set, Tuple
+
+DONE_FRAME = "data: [DONE]\n\n"
+
+# The OpenAI finish reasons by the finish reason of TGI
+FINISH_REASONS = {"eos_token": "stop", "stop_sequence": "stop", "length": "length"}
+
+
+def frame(data: dict) -> str:
+    """Encode a server-sent event frame.
+
+    Args:
+        data: The JSON payload of the event.
+
+    Returns:
+        The frame.
+    """
+    return f"data: {json.dumps(data, ensure_ascii=False, separators=(',', ':'))}\n\n"
+
+
+def error_frame(message: str, err_type: str = "BadRequestError") -> str:
+    """Encode an error raised while streaming, in the format of OpenAI.
+
+    Args:
+        message: The error message.
+        err_type: The type of the error.
+
+    Returns:
+        The frame.
+    """
+    return frame({"error": {"message": message, "type": err_type, "code": None}})
+
+
+class ChunkNormalizer:
+    """Rewrite the chat completion chunks of a TGI stream in the OpenAI format.
+
+    Holds the state of a single stream: the role is only sent with the first
+    delta of each choice, and the ID, type and name of a tool call only with its
+    first delta.
+    """
+
+    def __init__(self, request_id: Optional[str] = None):
+        """Initialize the normalizer.
+
+        Args:
+            request_id: The ID of the completion, used when TGI sends none.
+        """
+        self.request_id = request_id or f"chatcmpl-{uuid.uuid4().hex}"
+        # The choices that sent their role, and the tool calls that sent their ID
+        self._started: Set[int] = set()
+        self._tool_calls: Set[Tuple[int, int]] = set()
+
+    def normalize(self, chunk: dict) -> dict:
+        """Rewrite a chunk.
+
+        Args:
+            chunk: The chunk of TGI, as a dict.
+
+        Returns:
+            The OpenAI `chat.completion.chunk`.
+        """
+        return {
+            "id": chunk.get("id") or self.request_id,
+            "object": "chat.completion.chunk",
+            "created": chunk.get("created") or int(time.time()),
+            "model": chunk.get("model", ""),
+            "system_fingerprint": chunk.get("system_fingerprint"),
+            "choices": [self._choice(choice) for choice in chunk.get("choices") or []],
+        }
+
+    def _choice(self, choice: dict) -> dict:
+        index = choice.get("index", 0)
+        source = choice.get("delta") or {}
+        delta = {}
+        if index not in self._started:
+            self._started.add(index)
+            delta["role"] = source.get("role") or "assistant"
+        if source.get("content") is not None:
+            delta["content"] = source["content"]
+
+        tool_calls = source.get("tool_calls")
+        if isinstance(tool_calls, dict):
+            tool_calls = [tool_calls]
+        if tool_calls:
+            delta["tool_calls"] = [
+                self._tool_call(index, position, tool_call)
+                for position, tool_call in enumerate(tool_calls)
+            ]
+
+        finish_reason = choice.get("finish_reason")
+        if finish_reason is not None:
+            finish_reason = FINISH_REASONS.get(finish_reason, finish_reason)
+            if finish_reason == "stop" and any(
+                choice_index == index for choice_index, _ in self._tool_calls
+            ):
+                finish_reason = "tool_calls"
+        return {
+            "index": index,
+            "delta": delta,
+            "logprobs": choice.get("logprobs"),
+            "finish_reason": finish_reason,
+        }
+
+    def _tool_call(self, choice_index: int, position: int, tool_call: dict) -> dict:
+        function = tool_call.get("function") or {}
+        arguments = function.get("arguments")
+        if arguments is not None and not isinstance(arguments, str):
+            arguments = json.dumps(arguments)
+        delta = {
+            "index": tool_call.get("index", position),
+            "function": {"arguments": arguments or ""},
+        }
+        key = (choice_index, delta["index"])
+        if key not in self._tool_calls:
+            self._tool_calls.add(key)
+            delta["id"] = tool_call.get("id") or f"call_{uuid.uuid4().hex[:24]}"
+            delta["type"] = tool_call.get("type") or "function"
+            delta["function"]["name"] = function.get("name") or ""
+        return delta
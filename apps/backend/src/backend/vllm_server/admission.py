@@ -0,0 +1,200 @@
+"""Admission control of requests against a budget of KV cache tokens."""
+
+import asyncio
+import time
+from typing import Dict, List, Optional, Sequence
+
+from backend.vllm_server.fair_queue import DEFAULT_SCHEDULING, FairQueue, Scheduling
+from backend.vllm_server.metrics import (
+    ADMISSION_COMMITTED_TOKENS,
+    ADMISSION_QUEUE_DEPTH,
+    ADMISSION_QUEUE_WAIT,
+    ADMISSION_REJECTED,
+)
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request is shed instead of queued."""
+
+    def __init__(self, message: str, retry_after: float):
+        """Initialize the rejection.
+
+        Args:
+            message: The reason the request was rejected.
+            retry_after: The number of seconds the client should wait before
+                retrying.
+        """
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class Admission:
+    """The tokens committed to an admitted request."""
+
+    def __init__(self, controller: "AdmissionController", tokens: int):
+        """Initialize the admission.
+
+        Args:
+            controller: The controller that admitted the request.
+            tokens: The number of committed tokens.
+        """
+        self.controller = controller
+        self.tokens = tokens
+        self.released = False
+
+    def release(self):
+        """Return the committed tokens to the budget, at most once."""
+        if not self.released:
+            self.released = True
+            self.controller._release(self.tokens)
+
+    def split(self, tokens: Sequence[int]) -> List["Admission"]:
+        """Split the committed tokens into admissions released independently.
+
+        Args:
+            tokens: The number of tokens of each part, summing to the tokens of
+                the admission.
+
+        Returns:
+            The admission of each part, the admission itself no longer releases
+            any tokens.
+        """
+        if sum(tokens) != self.tokens:
+            raise ValueError(f"The parts {tokens} do not sum to {self.tokens} tokens")
+        if self.released:
+            raise ValueError("A released admission cannot be split")
+        self.released = True
+        return [Admission(self.controller, part) for part in tokens]
+
+
+class _Waiter:
+    def __init__(self, tokens: int, scheduling: Scheduling):
+        self.tokens = tokens
+        self.scheduling = scheduling
+        self.future = asyncio.get_running_loop().create_future()
+
+
+class AdmissionController:
+    """Admit requests while their worst case KV cache usage fits a budget.
+
+    Each request commits its prompt tokens plus the maximum number of tokens it may
+    generate. Requests that do not fit wait in a queue until enough committed
+    tokens are released, and are admitted by priority class and fairly between
+    tenants, see `FairQueue`. Requests are shed when the queue is full or when they
+    wait longer than the maximum queue wait, so clients back off instead of latency
+    growing without bound. A request larger than the whole budget is admitted once
+    nothing else is committed.
+    """
+
+    def __init__(
+        self,
+        budget_tokens: int,
+        max_queue_wait: float = 30.0,
+        max_queue_size: Optional[int] = None,
+        retry_after: Optional[float] = None,
+        quantum: int = 2048,
+        tenant_weights: Optional[Dict[str, float]] = None,
+    ):
+        """Initialize the admission controller.
+
+        Args:
+            budget_tokens: The number of tokens that can be committed at once.
+            max_queue_wait: The maximum number of seconds a request waits in the
+                queue before it is rejected.
+            max_queue_size: The maximum number of queued requests, unbounded if not
+                set.
+            retry_after: The number of seconds rejected clients are asked to wait
+                before retrying, the maximum queue wait if not set.
+            quantum: The number of tokens each tenant is credited per round of the
+                fair queue.
+            tenant_weights: The weight of the quantum of each tenant, 1 if not set.
+        """
+        self.budget_tokens = budget_tokens
+        self.max_queue_wait = max_queue_wait
+        self.max_queue_size = max_queue_size
+        self.retry_after = max_queue_wait if retry_after is None else retry_after
+
+        self.committed = 0
+        self._queue: FairQueue[_Waiter] = FairQueue(quantum, tenant_weights)
+
+    @property
+    def queue_depth(self) -> int:
+        """Return the number of queued requests."""
+        return len(self._queue)
+
+    async def acquire(
+        self, tokens: int, scheduling: Scheduling = DEFAULT_SCHEDULING
+    ) -> Admission:
+        """Commit tokens to a request, waiting for them to fit the budget.
+
+        Args:
+            tokens: The number of prompt and generated tokens the request may use.
+            scheduling: The tenant and priority class of the request.
+
+        Returns:
+            The admission, whose tokens must be released once the request finishes.
+
+        Raises:
+            AdmissionRejected: If the queue is full or the request waited longer
+                than the maximum queue wait.
+        """
+        if not self._queue and self._fits(tokens):
+            ADMISSION_QUEUE_WAIT.observe(0.0)
+            return self._commit(tokens)
+
+        if self.max_queue_size is not None and len(self._queue) >= self.max_queue_size:
+            ADMISSION_REJECTED.labels("queue_full").inc()
+            raise AdmissionRejected(
+                "The server is overloaded, please retry later.", self.retry_after
+            )
+
+        waiter = _Waiter(tokens, scheduling)
+        self._queue.push(waiter)
+        ADMISSION_QUEUE_DEPTH.set(len(self._queue))
+        enqueued_at = time.perf_counter()
+        try:
+            await asyncio.wait_for(
+                asyncio.shield(waiter.future), timeout=self.max_queue_wait
+            )
+        except asyncio.TimeoutError:
+            # The tokens may have been committed right as the wait timed out
+            if not waiter.future.done():
+                self._remove(waiter)
+                ADMISSION_REJECTED.labels("timeout").inc()
+                raise AdmissionRejected(
+                    "The server is overloaded, please retry later.", self.retry_after
+                ) from None
+        except asyncio.CancelledError:
+            if waiter.future.done():
+                waiter.future.result().release()
+            else:
+                self._remove(waiter)
+            raise
+        finally:
+            ADMISSION_QUEUE_WAIT.observe(time.perf_counter() - enqueued_at)
+        return waiter.future.result()
+
+    def _fits(self, tokens: int) -> bool:
+        return self.committed + tokens <= self.budget_tokens or self.committed == 0
+
+    def _commit(self, tokens: int) -> Admission:
+        self.committed += tokens
+        ADMISSION_COMMITTED_TOKENS.set(self.committed)
+        return Admission(self, tokens)
+
+    def _release(self, tokens: int):
+        self.committed -= tokens
+        ADMISSION_COMMITTED_TOKENS.set(self.committed)
+        self._admit_queued()
+
+    def _remove(self, waiter: _Waiter):
+        self._queue.remove(waiter)
+        ADMISSION_QUEUE_DEPTH.set(len(self._queue))
+        # The removed request may have been blocking smaller requests
+        self._admit_queued()
+
+    def _admit_queued(self):
+        while self._queue and self._fits(self._queue.peek().tokens):
+            waiter = self._queue.pop()
+            waiter.future.set_result(self._commit(waiter.tokens))
+        ADMISSION_QUEUE_DEPTH.set(len(self._queue))
@@ -1,25 +1,143 @@
 """OpenAI compatible API server running vLLM inference engine."""
 
+import asyncio
+import hashlib
+import math
+import time
 from http import HTTPStatus
+from typing import AsyncIterator, Awaitable, Callable, List, Optional, Set, Union
 
 from fastapi import FastAPI
 from fastapi.exceptions import RequestValidationError
 from fastapi.requests import Request
-from fastapi.responses import JSONResponse, Response
-from modal import asgi_app
+from fastapi.responses import (
+    JSONResponse,
+    PlainTextResponse,
+    Response,
+    StreamingResponse,
+)
+from modal import Dict, asgi_app
+
+from backend.prewarm.scheduler import (
+    PREWARM_DICT_NAME,
+    HistoryStore,
+    RequestRecorder,
+)
+from backend.vllm_server.config import (
+    APP_NAME,
+    GATEWAY,
+    HEALTH_CACHE_TTL,
+    HEALTH_HEARTBEAT_STALENESS,
+    MAX_CONCURRENT_INPUTS,
+    METRICS_SNAPSHOT_TTL,
+    MODEL_REPLICAS,
+    RESPONSE_CACHE_MAX_ENTRIES,
+    RESPONSE_CACHE_TTL,
+    ROUTING_LOAD_FACTOR,
+    ROUTING_MAX_ATTEMPTS,
+    ROUTING_PREFIX_TURNS,
+    ROUTING_PROMPT_PREFIX,
+    SERVING_MODE,
+)
+from backend.vllm_server.fair_queue import INTERACTIVE, PRIORITIES, Scheduling
+from backend.vllm_server.health import (
+    UNHEALTHY,
+    WARM,
+    HealthMonitor,
+    ReplicaHealth,
+)
+from backend.vllm_server.logger import init_logger
+from backend.vllm_server.metrics import (
+    GATEWAY_DISCONNECTS,
+    GATEWAY_RECEIVE,
+    GATEWAY_REQUEST,
+    GATEWAY_TIME_TO_FIRST_CHUNK,
+    REGISTRY,
+    RESPONSE_CACHE_ENTRIES,
+    RESPONSE_CACHE_REQUESTS,
+)
+from backend.vllm_server.model import (
+    METRICS_SNAPSHOTS_KEY,
+    Model,
+    cancellations,
+    heartbeats,
+    metrics_store,
+    stub,
+)
+from backend.vllm_server.response_cache import (
+    CachedResponse,
+    ResponseCache,
+    StreamRecorder,
+    cache_directives,
+    replay_stream,
+    request_cache_key,
+)
+from backend.vllm_server.router import (
+    PrefixRouter,
+    chat_routing_key,
+    completion_routing_key,
+)
+from backend.vllm_server.schema.chat import (
+    ChatCompletionRequest,
+)
+from backend.vllm_server.schema.common import ErrorResponse
+from backend.vllm_server.schema.completion import CompletionRequest
+from backend.vllm_server.service import LocalModel
+from backend.vllm_server.utils import create_error_response, random_uuid
+from backend.vllm_server.wire import StreamDecoder
+
+logger = init_logger(__name__)
+
+
+class ReceiveTimeMiddleware:
+    """Stamp each request with the time the gateway received it.
+
+    A pure ASGI middleware so streamed responses are not buffered. The timestamp is
+    available as `request.state.received_at`.
+    """
+
+    def __init__(self, app):
+        """Wrap an ASGI app."""
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        """Stamp the request and forward it to the wrapped app."""
+        if scope["type"] == "http":
+            scope.setdefault("state", {})["received_at"] = time.perf_counter()
+        await self.app(scope, receive, send)
 
-from backend.vllm_server.model import Model, stub
-from backend.vllm_server.schema.chat import ChatCompletionRequest
-from backend.vllm_server.utils import create_error_response
 
 app = FastAPI()
+app.add_middleware(ReceiveTimeMiddleware)
 
+response_cache = ResponseCache(
+    max_entries=RESPONSE_CACHE_MAX_ENTRIES, ttl=RESPONSE_CACHE_TTL
+)
+REGISTRY.add_collector(lambda: RESPONSE_CACHE_ENTRIES.set(len(response_cache)))
 
-@stub.function(timeout=60 * 10, allow_concurrent_inputs=12)
-@asgi_app()
-def fastapi_app():
-    """FastAPI app for the vLLM server."""
-    return app
+router = PrefixRouter(MODEL_REPLICAS, ROUTING_LOAD_FACTOR)
+
+# Requests are counted for the scheduler pre-warming the model containers
+request_recorder = RequestRecorder(
+    HistoryStore(Dict.from_name(PREWARM_DICT_NAME, create_if_missing=True), APP_NAME)
+)
+
+health_monitor = HealthMonitor(
+    heartbeats,
+    MODEL_REPLICAS,
+    staleness=HEALTH_HEARTBEAT_STALENESS,
+    cache_ttl=HEALTH_CACHE_TTL,
+)
+
+
+if SERVING_MODE == GATEWAY:
+    # Co-located deployments serve the app from `Model.colocated_app` instead
+
+    @stub.function(timeout=60 * 10, allow_concurrent_inputs=MAX_CONCURRENT_INPUTS)
+    @asgi_app()
+    def fastapi_app():
+        """FastAPI app for the vLLM server."""
+        return app
 
 
 @app.exception_handler(RequestValidationError)
@@ -30,58 +148,492 @@ async def validation_exception_handler(_, exc):
 
 
 @app.get("/health")
-async def health() -> Response:
+async def health(raw_request: Request, *, deep: bool = False) -> Response:
     """Health check.
 
-    Check the health of the vLLM model server to ensure the engine is running correctly.
+    Answered from the heartbeats of the model containers, so probes never wake a
+    GPU container. The server is unhealthy when every container of a replica that
+    sent a fresh heartbeat reports a stopped engine. Replicas without containers
+    are scaled to zero, which is healthy.
+
+    Args:
+        raw_request: The raw HTTP request.
+        deep: Probe a container of every replica instead, starting one if needed.
+
+    Returns:
+        The health of every replica, with a 503 status code when unhealthy.
+    """
+    monitor = _health_monitor(raw_request)
+    if deep:
+        healthy = await _probe_replicas(raw_request, monitor)
+        replicas = await monitor.replica_health()
+    else:
+        replicas = await monitor.replica_health()
+        healthy = all(replica.state != UNHEALTHY for replica in replicas)
+    return _health_response(replicas, ok=healthy)
+
+
+@app.get("/ready")
+async def ready(raw_request: Request) -> Response:
+    """Readiness check.
+
+    Answered from the heartbeats of the model containers like the health check.
+    The server is ready when every replica has a healthy container, so requests
+    do not wait for a cold start.
+
+    Args:
+        raw_request: The raw HTTP request.
+
+    Returns:
+        The health of every replica, with a 503 status code when not ready.
+    """
+    replicas = await _health_monitor(raw_request).replica_health()
+    return _health_response(
+        replicas, ok=all(replica.state == WARM for replica in replicas)
+    )
+
+
+def _health_monitor(raw_request: Request) -> HealthMonitor:
+    """Get the health monitor of the model replicas, `app.state.health` if set."""
+    return getattr(raw_request.app.state, "health", None) or health_monitor
+
+
+async def _probe_replicas(raw_request: Request, monitor: HealthMonitor) -> bool:
+    """Call the health check of a container of every replica.
+
+    The heartbeats returned by the containers are recorded by the monitor.
+
+    Returns:
+        True if every replica reported a healthy engine.
+    """
+    responses = await asyncio.gather(
+        *(
+            _replica(raw_request, replica).check_health.remote.aio()
+            for replica in range(_router(raw_request).replicas)
+        ),
+        return_exceptions=True,
+    )
+    healthy = True
+    for replica, response in enumerate(responses):
+        if isinstance(response, BaseException):
+            logger.warning(f"Health check of replica {replica} failed: {response}")
+            healthy = False
+            continue
+        if response.get("heartbeat") is not None:
+            monitor.record(response["heartbeat"])
+        healthy = healthy and response["status"] == "ok"
+    return healthy
+
+
+def _health_response(replicas: List[ReplicaHealth], *, ok: bool) -> JSONResponse:
+    return JSONResponse(
+        {
+            "status": "ok" if ok else "error",
+            "replicas": [replica._asdict() for replica in replicas],
+        },
+        status_code=HTTPStatus.OK if ok else HTTPStatus.SERVICE_UNAVAILABLE,
+    )
+
+
+@app.get("/metrics")
+async def metrics(raw_request: Request) -> Response:
+    """Metrics in the Prometheus text format.
+
+    Merges the metrics of the gateway with the latest snapshots published by the
+    model containers, so scraping never wakes a GPU container. A co-located model
+    container serves its own metrics rather than its snapshot.
+
+    Args:
+        raw_request: The raw HTTP request.
+
+    Returns:
+        The metrics of the server.
+    """
+    try:
+        snapshots = await metrics_store.get.aio(METRICS_SNAPSHOTS_KEY, {})
+    except Exception as e:
+        logger.warning(f"Failed to read model container metrics: {e}")
+        snapshots = {}
+
+    container_id = getattr(raw_request.app.state, "container_id", None)
+    cutoff = time.time() - METRICS_SNAPSHOT_TTL
+    fresh = [
+        snapshot
+        for snapshot_container_id, (published_at, snapshot) in snapshots.items()
+        if published_at >= cutoff and snapshot_container_id != container_id
+    ]
+    return PlainTextResponse(
+        REGISTRY.render(fresh), media_type="text/plain; version=0.0.4"
+    )
+
+
+def _replica(raw_request: Request, replica: int):
+    """Get the handle of the containers of a model replica.
+
+    Setting `app.state.model`, e.g. to a `LocalModel`, serves the gateway with an
+    in-process model instead, or with in-process replicas when set to a list of
+    models routed by `app.state.router`.
+    """
+    model = getattr(raw_request.app.state, "model", None)
+    if isinstance(model, list):
+        return model[replica]
+    if model is not None:
+        return model
+    return Model(replica=replica) if MODEL_REPLICAS > 1 else Model()
+
+
+def _router(raw_request: Request) -> PrefixRouter:
+    """Get the router of the model replicas, `app.state.router` if set."""
+    return getattr(raw_request.app.state, "router", None) or router
+
+
+async def _dispatch(
+    raw_request: Request,
+    key: bytes,
+    call: Callable[..., Awaitable],
+    *,
+    stream: bool,
+):
+    """Call the model replica a request is routed to.
+
+    Requests rejected as overloaded are retried on the next replica along the
+    ring, up to `ROUTING_MAX_ATTEMPTS` replicas. The request counts against its
+    replica until its response is returned, or until its stream finishes.
+
+    Args:
+        raw_request: The raw HTTP request.
+        key: The routing key of the request.
+        call: Sends the request to a model handle, returning the response or the
+            opened stream.
+        stream: Whether `call` returns a stream.
+
+    Returns:
+        The response or the stream, or the error response of the last replica.
+    """
+    replica_router = _router(raw_request)
+    max_attempts = min(ROUTING_MAX_ATTEMPTS, replica_router.replicas)
+    rejected: Set[int] = set()
+    while True:
+        replica = replica_router.route(key, exclude=rejected)
+        try:
+            result = await call(_replica(raw_request, replica))
+        except BaseException:
+            replica_router.release(replica)
+            raise
+
+        if not isinstance(result, ErrorResponse) and stream:
+            return _release_after(result, replica_router, replica)
+        replica_router.release(replica)
+        if (
+            isinstance(result, ErrorResponse)
+            and result.code == HTTPStatus.TOO_MANY_REQUESTS
+            and len(rejected) + 1 < max_attempts
+        ):
+            rejected.add(replica)
+            continue
+        return result
+
+
+async def _release_after(
+    stream: AsyncIterator[str], replica_router: PrefixRouter, replica: int
+):
+    try:
+        async for partial_result in stream:
+            yield partial_result
+    finally:
+        replica_router.release(replica)
+
+
+# Keeps the cancellations of disconnected streams alive until they complete
+_background_tasks: Set[asyncio.Task] = set()
+
+
+async def _cancel_remote(remote_gen, request_id: str, *, local: bool):
+    """Cancel the remote stream of a disconnected client.
+
+    Streams served in-process abort their request once closed, remote streams are
+    also cancelled through the store checked by the model containers.
+    """
+    if not local:
+        try:
+            await cancellations.cancel(request_id)
+        except Exception as e:
+            logger.warning(f"Failed to cancel request {request_id}: {e}")
+    await remote_gen.aclose()
+
+
+def _scheduling(raw_request: Request, user: Optional[str]) -> Scheduling:
+    """Get the tenant and priority class of a request.
+
+    Requests are shared fairly between the `user` of the request, falling back to
+    a hash of the API key. The priority class is set by the `X-Priority` header.
+    """
+    tenant = user
+    if not tenant:
+        api_key = raw_request.headers.get("authorization", "")
+        tenant = hashlib.blake2b(api_key.encode(), digest_size=8).hexdigest()
+    priority = raw_request.headers.get("x-priority", INTERACTIVE).lower()
+    if priority not in PRIORITIES:
+        raise ValueError(
+            f"Invalid X-Priority header {priority!r}, expected one of {PRIORITIES}."
+        )
+    return Scheduling(tenant, priority)
+
+
+def _error_response(error: ErrorResponse) -> JSONResponse:
+    """Respond with an error, asking the client to back off if needed."""
+    headers = None
+    if error.retry_after is not None:
+        headers = {"Retry-After": str(math.ceil(error.retry_after))}
+    return JSONResponse(error.model_dump(), status_code=error.code, headers=headers)
+
+
+async def _stream_remote(
+    remote_gen, received_at: float, request_id: str, *, local: bool
+):
+    """Forward a remote stream, recording the gateway timings.
+
+    Packed messages of the model container are rendered as server-sent event
+    frames, see `wire`.
+
+    When the client disconnects before the stream finishes, the request is
+    cancelled so the model container stops generating it.
+    """
+    decoder = StreamDecoder()
+    first_chunk = True
+    finished = False
+    try:
+        async for partial_result in remote_gen:
+            if isinstance(partial_result, ErrorResponse):
+                # The request failed before it reached the engine
+                finished = True
+            elif isinstance(partial_result, bytes):
+                partial_result = decoder.render(partial_result)
+            if first_chunk:
+                first_chunk = False
+                GATEWAY_TIME_TO_FIRST_CHUNK.observe(time.perf_counter() - received_at)
+            yield partial_result
+        finished = True
+    finally:
+        GATEWAY_REQUEST.observe(time.perf_counter() - received_at)
+        if not finished:
+            GATEWAY_DISCONNECTS.inc()
+            # The stream is being cancelled so the cancellation runs in its own task
+            task = asyncio.create_task(
+                _cancel_remote(remote_gen, request_id, local=local)
+            )
+            _background_tasks.add(task)
+            task.add_done_callback(_background_tasks.discard)
+
+
+async def _open_stream(
+    remote_gen, received_at: float, request_id: str, *, local: bool
+) -> Union[ErrorResponse, AsyncIterator[str]]:
+    """Wait for the first chunk of a remote stream.
+
+    Errors are sent by the model container before any chunk, so they can be
+    returned with their status code rather than inside a successful stream.
 
     Returns:
-        A JSON response indicating the health of the server and a HTTP status code.
+        The error of the request, or the stream of chunks.
     """
-    model = Model()
-    response = await model.check_health.remote.aio()
-    print(response)
-    if response["status"] != "ok":
-        return create_error_response("Model health check failed", err_type="")
-    return Response(status_code=HTTPStatus.OK)
+    stream = _stream_remote(remote_gen, received_at, request_id, local=local)
+    try:
+        first = await stream.__anext__()
+    except StopAsyncIteration:
+        return stream
+    if isinstance(first, ErrorResponse):
+        await stream.aclose()
+        return first
+    return _prepend(first, stream)
+
+
+async def _prepend(first: str, stream: AsyncIterator[str]):
+    yield first
+    async for partial_result in stream:
+        yield partial_result
+
+
+async def _record_stream(stream, cache_key: str):
+    """Forward a chat completion stream, caching its response once complete."""
+    recorder = StreamRecorder()
+    async for partial_result in stream:
+        recorder.feed(partial_result)
+        yield partial_result
+
+    recorded = recorder.response()
+    if recorded is not None:
+        response, completion_tokens = recorded
+        response_cache.put(cache_key, response, completion_tokens)
+
+
+async def _replay_stream(cached: CachedResponse):
+    for frame in replay_stream(cached):
+        yield frame
 
 
 @app.post("/v1/chat/completions")
-async def create_chat_completion(request: ChatCompletionRequest, raw_request: Request):
+async def create_chat_completion(
+    request: ChatCompletionRequest, raw_request: Request, response: Response
+):
     """Generate chat completions.
 
     Generate chat completions based on the given chat message history and chat settings.
 
+    Responses to deterministic requests are served from the response cache when
+    possible, reported by the `X-Cache` response header. Requests can skip the
+    cache lookup with `Cache-Control: no-cache`, or skip the cache entirely with
+    `Cache-Control: no-store`.
+
+    Requests queued in the model container are admitted fairly between users, and
+    requests sent with `X-Priority: batch` only once no interactive request waits.
+
+    Conversations are routed to the model replica that served their system prompt
+    and first turn before, see `PrefixRouter`.
+
     Args:
         request: The chat completion request.
         raw_request: The raw HTTP request.
+        response: The response whose headers are set for non-streamed completions.
 
     Returns:
         The chat completion response.
     """
-    from fastapi.responses import StreamingResponse
+    received_at = getattr(raw_request.state, "received_at", time.perf_counter())
+    request_recorder.record()
+    try:
+        scheduling = _scheduling(raw_request, request.user)
+    except ValueError as e:
+        return _error_response(create_error_response(str(e)))
 
-    print("inside endpoint")
-    print("request", request)
-    print("typeof request", type(request))
-    print("raw_request", raw_request)
-
-    model = Model()
+    directives = cache_directives(raw_request.headers.get("cache-control"))
+    cache_key = None if "no-store" in directives else request_cache_key(request)
+    if cache_key is None:
+        cache_status = "BYPASS"
+    else:
+        cached = (
+            None
+            if "no-cache" in directives
+            else response_cache.get(cache_key, stream=request.stream)
+        )
+        if cached is not None:
+            RESPONSE_CACHE_REQUESTS.labels("hit").inc()
+            GATEWAY_REQUEST.observe(time.perf_counter() - received_at)
+            if request.stream:
+                return StreamingResponse(
+                    _replay_stream(cached),
+                    media_type="text/event-stream",
+                    headers={"X-Cache": "HIT"},
+                )
+            response.headers["X-Cache"] = "HIT"
+            return cached.response
+        cache_status = "MISS"
+    RESPONSE_CACHE_REQUESTS.labels(cache_status.lower()).inc()
 
+    key = chat_routing_key(request.messages, ROUTING_PREFIX_TURNS)
+    GATEWAY_RECEIVE.observe(time.perf_counter() - received_at)
     if request.stream:
+        request_id = f"cmpl-{random_uuid()}"
 
-        async def streamer():
-            async for (
-                partial_result
-            ) in model.generate_chat_completion_stream.remote_gen.aio(request):
-                print("Partial:\n", partial_result)
-                yield partial_result
+        def open_stream(model):
+            remote_gen = model.generate_chat_completion_stream.remote_gen.aio(
+                request,
+                dispatched_at=time.time(),
+                request_id=request_id,
+                scheduling=scheduling,
+            )
+            return _open_stream(
+                remote_gen, received_at, request_id, local=isinstance(model, LocalModel)
+            )
 
-        return StreamingResponse(streamer(), media_type="text/event-stream")
+        stream = await _dispatch(raw_request, key, open_stream, stream=True)
+        if isinstance(stream, ErrorResponse):
+            return _error_response(stream)
+        if cache_key is not None:
+            stream = _record_stream(stream, cache_key)
+        return StreamingResponse(
+            stream, media_type="text/event-stream", headers={"X-Cache": cache_status}
+        )
 
     else:
-        full = await model.generate_chat_completion_full.remote.aio(request)
-        print("Got full response in API")
-        print(full)
-        # return full
-        return full
+        try:
+            res = await _dispatch(
+                raw_request,
+                key,
+                lambda model: model.generate_chat_completion_full.remote.aio(
+                    request, dispatched_at=time.time(), scheduling=scheduling
+                ),
+                stream=False,
+            )
+        finally:
+            GATEWAY_REQUEST.observe(time.perf_counter() - received_at)
+
+        if isinstance(res, ErrorResponse):
+            return _error_response(res)
+        if cache_key is not None:
+            response_cache.put(cache_key, res)
+        response.headers["X-Cache"] = cache_status
+        return res
+
+
+@app.post("/v1/completions")
+async def create_completion(request: CompletionRequest, raw_request: Request):
+    """Generate completions.
+
+    Generate completions for one or more prompts. All prompts of a request are
+    generated concurrently and their choices are indexed by prompt, so prompt `p`
+    owns choices `p * n` to `(p + 1) * n - 1`.
+
+    Requests are scheduled like chat completions, fairly between users and by the
+    `X-Priority` header, and routed to a model replica by their first prompt.
+
+    Args:
+        request: The completion request.
+        raw_request: The raw HTTP request.
+
+    Returns:
+        The completion response.
+    """
+    received_at = getattr(raw_request.state, "received_at", time.perf_counter())
+    request_recorder.record()
+    try:
+        scheduling = _scheduling(raw_request, request.user)
+    except ValueError as e:
+        return _error_response(create_error_response(str(e)))
+    key = completion_routing_key(request.prompt, ROUTING_PROMPT_PREFIX)
+
+    GATEWAY_RECEIVE.observe(time.perf_counter() - received_at)
+    if request.stream:
+        request_id = f"cmpl-{random_uuid()}"
+
+        def open_stream(model):
+            remote_gen = model.generate_completion_stream.remote_gen.aio(
+                request,
+                dispatched_at=time.time(),
+                request_id=request_id,
+                scheduling=scheduling,
+            )
+            return _open_stream(
+                remote_gen, received_at, request_id, local=isinstance(model, LocalModel)
+            )
+
+        stream = await _dispatch(raw_request, key, open_stream, stream=True)
+        if isinstance(stream, ErrorResponse):
+            return _error_response(stream)
+        return StreamingResponse(stream, media_type="text/event-stream")
+
+    try:
+        res = await _dispatch(
+            raw_request,
+            key,
+            lambda model: model.generate_completion_full.remote.aio(
+                request, dispatched_at=time.time(), scheduling=scheduling
+            ),
+            stream=False,
+        )
+    finally:
+        GATEWAY_REQUEST.observe(time.perf_counter() - received_at)
+
+    if isinstance(res, ErrorResponse):
+        return _error_response(res)
+    return res
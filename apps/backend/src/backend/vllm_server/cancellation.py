@@ -0,0 +1,196 @@
+"""Abort engine requests whose streaming client disconnected."""
+
+import asyncio
+import time
+from typing import (
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    Optional,
+    Sequence,
+    Set,
+)
+
+from backend.vllm_server.logger import init_logger
+from backend.vllm_server.metrics import CANCELLED_REQUESTS, CANCELLED_TOKENS_SAVED
+
+logger = init_logger(__name__)
+
+# The marks of every cancelled request, under a single key so containers read them
+# in one call
+CANCELLED_KEY = "cancelled"
+CANCELLATION_TTL = 60.0
+
+
+class CancellationStore:
+    """Requests cancelled by the gateway, shared with the model containers.
+
+    Closing the remote stream of a disconnected client aborts its request in the
+    model container, see `ModelService`. Modal does not cancel individual inputs of
+    containers serving concurrent inputs on every version, so the gateway also
+    marks the request as cancelled in a shared dict. The marks of every request are
+    kept under a single key, so a container checks all the streams it serves with
+    one read per poll, and marks older than the TTL are pruned on every cancel.
+    Concurrent cancels from other gateway containers may drop a mark, leaving the
+    request to the close of its stream.
+    """
+
+    def __init__(
+        self,
+        store,
+        ttl: float = CANCELLATION_TTL,
+        clock: Callable[[], float] = time.time,
+    ):
+        """Initialize the cancellation store.
+
+        Args:
+            store: The modal dict holding the cancelled request IDs.
+            ttl: The number of seconds a mark is kept.
+            clock: The clock of the marks.
+        """
+        self.store = store
+        self.ttl = ttl
+        self.clock = clock
+
+    async def cancel(self, request_id: str):
+        """Mark a request as cancelled.
+
+        Args:
+            request_id: The ID of the request.
+        """
+        now = self.clock()
+        marks = await self.store.get.aio(CANCELLED_KEY, {})
+        marks = {key: at for key, at in marks.items() if now - at < self.ttl}
+        marks[request_id] = now
+        await self.store.put.aio(CANCELLED_KEY, marks)
+
+    async def cancelled(self) -> Set[str]:
+        """Return the IDs of the requests marked as cancelled."""
+        return set(await self.store.get.aio(CANCELLED_KEY, {}))
+
+
+class StreamAbort:
+    """Abort the unfinished engine requests of a stream.
+
+    Tracks the latest output of each engine request so aborting a stream only
+    aborts requests that are still generating, and records the number of tokens
+    that no longer have to be generated.
+    """
+
+    def __init__(
+        self,
+        abort: Callable[[str], Awaitable[None]],
+        request_ids: Sequence[str],
+        max_tokens: int,
+        n: int = 1,
+    ):
+        """Initialize the stream abort.
+
+        Args:
+            abort: The function aborting an engine request, `AsyncLLMEngine.abort`.
+            request_ids: The IDs of the engine requests of the stream.
+            max_tokens: The maximum number of tokens generated per sequence.
+            n: The number of sequences generated per engine request.
+        """
+        self._abort = abort
+        self.request_ids = list(request_ids)
+        self.max_tokens = max_tokens
+        self.n = n
+        self.aborted = False
+        self._outputs: Dict[str, Optional[object]] = dict.fromkeys(self.request_ids)
+
+    async def track(self, results_generator: AsyncIterator) -> AsyncIterator:
+        """Record the outputs of an engine request while forwarding them.
+
+        Args:
+            results_generator: The generator of request outputs.
+
+        Yields:
+            The request outputs.
+        """
+        async for res in results_generator:
+            self._outputs[res.request_id] = res
+            yield res
+
+    def tokens_saved(self) -> int:
+        """Return the number of tokens the unfinished requests may still generate."""
+        saved = 0
+        for res in self._outputs.values():
+            if res is None:
+                saved += self.n * self.max_tokens
+            elif not res.finished:
+                saved += sum(
+                    max(0, self.max_tokens - len(output.token_ids))
+                    for output in res.outputs
+                )
+        return saved
+
+    async def abort(self):
+        """Abort the unfinished engine requests, at most once."""
+        unfinished = [
+            request_id
+            for request_id, res in self._outputs.items()
+            if res is None or not res.finished
+        ]
+        if self.aborted or not unfinished:
+            return
+        self.aborted = True
+
+        CANCELLED_REQUESTS.inc()
+        CANCELLED_TOKENS_SAVED.inc(self.tokens_saved())
+        for request_id in unfinished:
+            await self._abort(request_id)
+
+
+class CancellationWatcher:
+    """Abort the streams of a model container once the gateway cancels them.
+
+    A single task polls the cancellation store while the container serves
+    streams, however many it serves.
+    """
+
+    def __init__(self, cancellations: CancellationStore, poll_interval: float):
+        """Initialize the watcher.
+
+        Args:
+            cancellations: The cancellation store.
+            poll_interval: The number of seconds between checks.
+        """
+        self.cancellations = cancellations
+        self.poll_interval = poll_interval
+        self._streams: Dict[str, StreamAbort] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def watch(self, request_id: str, stream_abort: StreamAbort):
+        """Abort a stream once its request is marked as cancelled.
+
+        Args:
+            request_id: The ID of the request marked by the gateway.
+            stream_abort: The abort of the engine requests of the stream.
+        """
+        self._streams[request_id] = stream_abort
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._poll())
+
+    def unwatch(self, request_id: str):
+        """Stop watching a stream once it is closed.
+
+        Args:
+            request_id: The ID of the request.
+        """
+        self._streams.pop(request_id, None)
+
+    async def _poll(self):
+        while self._streams:
+            await asyncio.sleep(self.poll_interval)
+            if not self._streams:
+                return
+            try:
+                cancelled = await self.cancellations.cancelled()
+            except Exception as e:
+                logger.warning(f"Failed to check cancelled requests: {e}")
+                continue
+            for request_id in cancelled.intersection(self._streams):
+                logger.info(f"Aborting request {request_id}, the client disconnected")
+                await self._streams.pop(request_id).abort()
@@ -2,7 +2,7 @@
 
 from openai import OpenAI
 
-from backend.vllm_server.infra import BASE_MODEL
+from backend.vllm_server.config import BASE_MODEL
 
 client = OpenAI(
     base_url="https://walln-walln--vllm-openai-server-fastapi-app-dev.modal.run/v1",
@@ -0,0 +1,89 @@
+"""Configuration of the vLLM server.
+
+Kept free of Modal, vLLM and torch so CPU-only components such as the gateway,
+the clients and the protocol schemas import it quickly.
+"""
+
+import os
+
+APP_NAME = "vLLM-OpenAI-server"
+MODEL_DIR = "/model"
+BASE_MODEL = "mistralai/Mistral-7B-Instruct-v0.1"
+
+# Streamed chat completions are flushed every N tokens or every T milliseconds,
+# whichever comes first. Requests can override either with `stream_flush_tokens`
+# and `stream_flush_interval_ms`.
+STREAM_FLUSH_TOKENS = 8
+STREAM_FLUSH_INTERVAL_MS = 50.0
+
+# Model containers publish their metrics to a shared dict at most every N seconds
+# so the gateway can serve /metrics without waking a GPU. Containers remove their
+# snapshot when they stop, and snapshots of containers that stopped publishing are
+# ignored and pruned after the TTL.
+METRICS_DICT_NAME = "hooper-vllm-metrics"
+METRICS_PUBLISH_INTERVAL = 15.0
+METRICS_SNAPSHOT_TTL = 600.0
+
+# Model containers publish a heartbeat with the stats of their engine to a shared
+# dict every N seconds, and the gateway answers /health and /ready from the
+# heartbeats it read within the cache TTL, ignoring those older than the staleness
+# bound. Probing the model containers themselves is left to `/health?deep=true`.
+HEALTH_DICT_NAME = "hooper-vllm-health"
+HEALTH_HEARTBEAT_INTERVAL = 10.0
+HEALTH_HEARTBEAT_STALENESS = 30.0
+HEALTH_CACHE_TTL = 2.0
+
+# Responses to deterministic chat completion requests (temperature 0, beam search
+# or a fixed seed) are cached by each gateway container
+RESPONSE_CACHE_MAX_ENTRIES = 1024
+RESPONSE_CACHE_TTL = 300.0
+
+# Maximum number of inputs a container serves concurrently. Model containers
+# further limit the requests in the engine with admission control.
+MAX_CONCURRENT_INPUTS = 64
+
+# Model containers admit requests while their prompt plus maximum generated tokens
+# fit a budget of KV cache tokens, the KV cache capacity of the engine when not
+# set. Requests past the budget are queued and rejected with a 429 once the queue
+# is full or after waiting for the maximum queue wait.
+ADMISSION_KV_BUDGET_TOKENS = None
+ADMISSION_MAX_QUEUE_SIZE = 128
+ADMISSION_MAX_QUEUE_WAIT = 30.0
+
+# Requests without max_tokens may generate up to this many tokens instead of the
+# whole remaining context, which would commit the full context on admission
+DEFAULT_MAX_TOKENS = 2048
+
+# Streams whose client disconnects are closed by the gateway, which aborts them in
+# the model container, and also marked as cancelled in a shared dict. Model
+# containers serving streams read the marks every N seconds and abort the
+# cancelled ones in the engine.
+CANCELLATIONS_DICT_NAME = "hooper-vllm-cancellations"
+CANCELLATION_POLL_INTERVAL = 0.5
+
+# The gateway routes requests across MODEL_REPLICAS independently scaled pools of
+# model containers by the hash of their stable prefix: the system prompt and the
+# first ROUTING_PREFIX_TURNS messages after it for chat completions, or the first
+# ROUTING_PROMPT_PREFIX characters or token IDs for completions. A replica takes a
+# request while it has fewer than ROUTING_LOAD_FACTOR times the average number of
+# requests in flight, and requests rejected as overloaded are retried on up to
+# ROUTING_MAX_ATTEMPTS replicas.
+MODEL_REPLICAS = 1
+ROUTING_PREFIX_TURNS = 1
+ROUTING_PROMPT_PREFIX = 1024
+ROUTING_LOAD_FACTOR = 1.25
+ROUTING_MAX_ATTEMPTS = 2
+
+# The API is either served by a CPU gateway calling the model containers remotely,
+# or co-located in the model containers against their in-process engines, which
+# saves a remote call per request and per streamed chunk. Selected when deploying
+# with HOOPER_SERVING_MODE and baked into the image, so the containers define the
+# same functions as the deployment.
+GATEWAY = "gateway"
+COLOCATED = "colocated"
+SERVING_MODE = os.environ.get("HOOPER_SERVING_MODE", GATEWAY)
+if SERVING_MODE not in (GATEWAY, COLOCATED):
+    raise ValueError(
+        f"Invalid HOOPER_SERVING_MODE {SERVING_MODE!r}, "
+        f"expected {GATEWAY!r} or {COLOCATED!r}."
+    )
@@ -0,0 +1,239 @@
+"""Precompiled server-sent event encoders for completion stream chunks."""
+
+from json.encoder import encode_basestring
+from typing import Optional
+
+from backend.vllm_server.schema.common import LogProbs
+from backend.vllm_server.utils import create_streaming_error_response
+
+DONE_FRAME = "data: [DONE]\n\n"
+
+
+class ChatChunkEncoder:
+    """Server-sent event encoder for chat completion stream chunks.
+
+    Building a `ChatCompletionStreamResponse` and calling `model_dump_json` for every
+    streamed token is dominated by pydantic overhead. The invariant parts of a chunk
+    (id, object, created and model) are serialized once per request so that only the
+    delta text has to be JSON escaped per token. Frames are byte-identical to the
+    pydantic serialization of the equivalent chunk with `exclude_unset=True`.
+    """
+
+    __slots__ = ("_head",)
+
+    def __init__(self, request_id: str, created: int, model_name: str):
+        """Initialize the encoder.
+
+        Args:
+            request_id: The request ID.
+            created: The creation timestamp of the completion.
+            model_name: The name of the model being served.
+        """
+        self._head = (
+            f'data: {{"id":{encode_basestring(request_id)},'
+            f'"object":"chat.completion.chunk","created":{int(created)},'
+            f'"model":{encode_basestring(model_name)},"choices":[{{"index":'
+        )
+
+    def role(self, index: int, role: str) -> str:
+        """Encode the first chunk of a choice announcing the response role.
+
+        Args:
+            index: The choice index.
+            role: The role of the response.
+
+        Returns:
+            The server-sent event frame.
+        """
+        return (
+            f'{self._head}{index},"delta":{{"role":{encode_basestring(role)}}},'
+            '"logprobs":null,"finish_reason":null}]}\n\n'
+        )
+
+    def echo(self, index: int, content: str) -> str:
+        """Encode a chunk echoing the last message of the conversation.
+
+        Args:
+            index: The choice index.
+            content: The echoed message content.
+
+        Returns:
+            The server-sent event frame.
+        """
+        return (
+            f'{self._head}{index},"delta":{{"content":{encode_basestring(content)}}},'
+            '"finish_reason":null}]}\n\n'
+        )
+
+    def content(
+        self, index: int, content: str, logprobs: Optional[LogProbs] = None
+    ) -> str:
+        """Encode a chunk carrying generated text for a choice.
+
+        Args:
+            index: The choice index.
+            content: The generated delta text.
+            logprobs: The log probabilities of the delta tokens.
+
+        Returns:
+            The server-sent event frame.
+        """
+        encoded_logprobs = (
+            "null" if logprobs is None else logprobs.model_dump_json(exclude_unset=True)
+        )
+        return (
+            f'{self._head}{index},"delta":{{"content":{encode_basestring(content)}}},'
+            f'"logprobs":{encoded_logprobs},"finish_reason":null}}]}}\n\n'
+        )
+
+    def finish(
+        self,
+        index: int,
+        content: str,
+        finish_reason: str,
+        prompt_tokens: int,
+        completion_tokens: int,
+        logprobs: Optional[LogProbs] = None,
+    ) -> str:
+        """Encode the final chunk of a choice including the usage information.
+
+        Args:
+            index: The choice index.
+            content: The generated delta text.
+            finish_reason: The reason the choice finished generating.
+            prompt_tokens: The number of tokens in the prompt.
+            completion_tokens: The number of tokens generated for the choice.
+            logprobs: The log probabilities of the delta tokens.
+
+        Returns:
+            The server-sent event frame.
+        """
+        encoded_logprobs = (
+            ""
+            if logprobs is None
+            else '"logprobs":'
+            f"{logprobs.model_dump_json(exclude_unset=True, exclude_none=True)},"
+        )
+        return (
+            f'{self._head}{index},"delta":{{"content":{encode_basestring(content)}}},'
+            f'{encoded_logprobs}"finish_reason":{encode_basestring(finish_reason)}}}],'
+            f'"usage":{{"prompt_tokens":{prompt_tokens},'
+            f'"total_tokens":{prompt_tokens + completion_tokens},'
+            f'"completion_tokens":{completion_tokens}}}}}\n\n'
+        )
+
+    def error(self, message: str) -> str:
+        """Encode an error raised while streaming.
+
+        Args:
+            message: The error message.
+
+        Returns:
+            The server-sent event frame.
+        """
+        return f"data: {create_streaming_error_response(message)}\n\n"
+
+    def done(self) -> str:
+        """Encode the end of the stream.
+
+        Returns:
+            The server-sent event frame.
+        """
+        return DONE_FRAME
+
+
+class CompletionChunkEncoder:
+    """Server-sent event encoder for completion stream chunks.
+
+    The completion counterpart of `ChatChunkEncoder`. Frames are byte-identical to
+    the pydantic serialization of the equivalent `CompletionStreamResponse` with
+    `exclude_unset=True`.
+    """
+
+    __slots__ = ("_head",)
+
+    def __init__(self, request_id: str, created: int, model_name: str):
+        """Initialize the encoder.
+
+        Args:
+            request_id: The request ID.
+            created: The creation timestamp of the completion.
+            model_name: The name of the model being served.
+        """
+        self._head = (
+            f'data: {{"id":{encode_basestring(request_id)},'
+            f'"object":"text_completion","created":{int(created)},'
+            f'"model":{encode_basestring(model_name)},"choices":[{{"index":'
+        )
+
+    def text(self, index: int, text: str, logprobs: Optional[LogProbs] = None) -> str:
+        """Encode a chunk carrying generated text for a choice.
+
+        Args:
+            index: The choice index.
+            text: The generated delta text.
+            logprobs: The log probabilities of the delta tokens.
+
+        Returns:
+            The server-sent event frame.
+        """
+        encoded_logprobs = (
+            "null" if logprobs is None else logprobs.model_dump_json(exclude_unset=True)
+        )
+        return (
+            f'{self._head}{index},"text":{encode_basestring(text)},'
+            f'"logprobs":{encoded_logprobs},"finish_reason":null}}]}}\n\n'
+        )
+
+    def finish(
+        self,
+        index: int,
+        text: str,
+        finish_reason: str,
+        prompt_tokens: int,
+        completion_tokens: int,
+        logprobs: Optional[LogProbs] = None,
+    ) -> str:
+        """Encode the final chunk of a choice including the usage information.
+
+        Args:
+            index: The choice index.
+            text: The generated delta text.
+            finish_reason: The reason the choice finished generating.
+            prompt_tokens: The number of tokens in the prompt.
+            completion_tokens: The number of tokens generated for the choice.
+            logprobs: The log probabilities of the delta tokens.
+
+        Returns:
+            The server-sent event frame.
+        """
+        encoded_logprobs = (
+            "null" if logprobs is None else logprobs.model_dump_json(exclude_unset=True)
+        )
+        return (
+            f'{self._head}{index},"text":{encode_basestring(text)},'
+            f'"logprobs":{encoded_logprobs},'
+            f'"finish_reason":{encode_basestring(finish_reason)}}}],'
+            f'"usage":{{"prompt_tokens":{prompt_tokens},'
+            f'"total_tokens":{prompt_tokens + completion_tokens},'
+            f'"completion_tokens":{completion_tokens}}}}}\n\n'
+        )
+
+    def error(self, message: str) -> str:
+        """Encode an error raised while streaming.
+
+        Args:
+            message: The error message.
+
+        Returns:
+            The server-sent event frame.
+        """
+        return f"data: {create_streaming_error_response(message)}\n\n"
+
+    def done(self) -> str:
+        """Encode the end of the stream.
+
+        Returns:
+            The server-sent event frame.
+        """
+        return DONE_FRAME
@@ -1,15 +1,36 @@
 """Base vLLM engine implementing OpenAI api functionality."""
 
 import asyncio
-from typing import List, Optional, Union
+from http import HTTPStatus
+from typing import (
+    TYPE_CHECKING,
+    AsyncIterator,
+    Callable,
+    List,
+    Optional,
+    Sequence,
+    Union,
+)
 
-from backend.vllm_server.schema.chat import ChatCompletionRequest
-from backend.vllm_server.schema.common import ErrorResponse
-from vllm.engine.async_llm_engine import AsyncLLMEngine
-from vllm.entrypoints.openai.protocol import (
-    CompletionRequest,
+from backend.vllm_server.admission import (
+    Admission,
+    AdmissionController,
+    AdmissionRejected,
 )
-from vllm.transformers_utils.tokenizer import get_tokenizer
+from backend.vllm_server.engine.guided_decoding import GuidedDecodingCache
+from backend.vllm_server.engine.logit_bias import validate_logit_bias
+from backend.vllm_server.engine.logprobs import TopLogprobs, create_logprobs
+from backend.vllm_server.engine.tokenizer_pool import TokenizerPool
+from backend.vllm_server.fair_queue import Scheduling
+from backend.vllm_server.schema.chat import ChatCompletionRequest
+from backend.vllm_server.schema.common import ErrorResponse, LogProbs
+from backend.vllm_server.schema.completion import CompletionRequest
+from backend.vllm_server.utils import create_error_response
+
+if TYPE_CHECKING:
+    from transformers import PreTrainedTokenizerBase
+    from vllm.engine.async_llm_engine import AsyncLLMEngine
+    from vllm.sampling_params import SamplingParams
 
 
 class BaseEngine:
@@ -19,7 +40,15 @@ class BaseEngine:
     both chat and completion engines.
     """
 
-    def __init__(self, engine: AsyncLLMEngine, model_name: str):
+    def __init__(
+        self,
+        engine: "AsyncLLMEngine",
+        model_name: str,
+        admission: Optional[AdmissionController] = None,
+        default_max_tokens: Optional[int] = None,
+        tokenizer: Optional["PreTrainedTokenizerBase"] = None,
+        sampling_params_class: Optional[Callable[..., "SamplingParams"]] = None,
+    ):
         """Initialize the base engine.
 
         Ensures the engine has a valid event loop depending on the runtime context
@@ -28,12 +57,25 @@ class BaseEngine:
         Args:
             engine: The vLLM engine to use.
             model_name: The name of the model being served.
+            admission: The admission controller requests must pass before they are
+                submitted to the engine. Requests are submitted directly if not set.
+            default_max_tokens: The maximum number of tokens generated for requests
+                that do not set `max_tokens`, the remaining context if not set.
+            tokenizer: The tokenizer of the model, loaded with vLLM from the model
+                config of the engine if not set.
+            sampling_params_class: The class the sampling params are built with,
+                the `SamplingParams` of vLLM if not set.
         """
         self.engine = engine
         self.model_name = model_name
+        self.admission = admission
+        self.default_max_tokens = default_max_tokens
 
         self.max_model_len = 0
-        self.tokenizer = None
+        self.tokenizer = tokenizer
+        self.sampling_params_class = sampling_params_class
+        self.tokenizer_pool = None
+        self.guided_decoding = None
 
         try:
             event_loop = asyncio.get_event_loop()
@@ -53,11 +95,17 @@ class BaseEngine:
         self.max_model_len = engine_model_config.max_model_len
 
         # A separate tokenizer to map token IDs to strings.
-        self.tokenizer = get_tokenizer(
-            engine_model_config.tokenizer,
-            tokenizer_mode=engine_model_config.tokenizer_mode,
-            trust_remote_code=engine_model_config.trust_remote_code,
-        )
+        if self.tokenizer is None:
+            from vllm.transformers_utils.tokenizer import get_tokenizer
+
+            self.tokenizer = get_tokenizer(
+                engine_model_config.tokenizer,
+                tokenizer_mode=engine_model_config.tokenizer_mode,
+                trust_remote_code=engine_model_config.trust_remote_code,
+            )
+        # Keeps tokenization and template rendering off the event loop
+        self.tokenizer_pool = TokenizerPool(self.tokenizer)
+        self.guided_decoding = GuidedDecodingCache(self.tokenizer)
 
     def check_model(self, request) -> Optional[ErrorResponse]:
         """Verify the requested model is being served.
@@ -69,9 +117,10 @@ class BaseEngine:
             An error response if the model is not being served.
         """
         if request.model is not None and request.model != self.model_name:
-            return ErrorResponse(
-                message=f"Model {request.model_name} is not being served.",
-                err_type="model_not_served",
+            return create_error_response(
+                f"Model {request.model} is not being served.",
+                err_type="NotFoundError",
+                status_code=HTTPStatus.NOT_FOUND,
             )
         return None
 
@@ -101,6 +150,8 @@ class BaseEngine:
 
         if request.max_tokens is None:
             request.max_tokens = self.max_model_len - token_num
+            if self.default_max_tokens is not None:
+                request.max_tokens = min(request.max_tokens, self.default_max_tokens)
 
         if token_num + request.max_tokens > self.max_model_len:
             raise ValueError(
@@ -113,3 +164,120 @@ class BaseEngine:
             )
 
         return input_ids
+
+    async def _admit(
+        self,
+        request: Union[ChatCompletionRequest, CompletionRequest],
+        prompt_ids: List[List[int]],
+        scheduling: Scheduling,
+    ) -> Union[ErrorResponse, List[Optional[Admission]]]:
+        """Wait for the admission of the validated prompts of a request.
+
+        A prompt commits its tokens plus the maximum number of tokens of every
+        sequence generated for it. The prompts of a request are admitted
+        together, as prompts admitted one at a time could wait on the tokens
+        committed to their siblings, and the admission is then split so each
+        prompt releases its tokens once it finishes.
+
+        Args:
+            request: The chat completion or completion request.
+            prompt_ids: The token IDs of each prompt.
+            scheduling: The tenant and priority class of the request.
+
+        Returns:
+            The admission of each prompt, None without admission control, or a
+            rate limit error if the request was rejected.
+        """
+        if self.admission is None:
+            return [None] * len(prompt_ids)
+
+        num_sequences = request.best_of or request.n
+        tokens = [len(ids) + request.max_tokens * num_sequences for ids in prompt_ids]
+        try:
+            admission = await self.admission.acquire(sum(tokens), scheduling)
+        except AdmissionRejected as e:
+            return create_error_response(
+                str(e),
+                err_type="RateLimitError",
+                status_code=HTTPStatus.TOO_MANY_REQUESTS,
+                retry_after=e.retry_after,
+            )
+        return admission.split(tokens)
+
+    async def _create_sampling_params(
+        self, request: Union[ChatCompletionRequest, CompletionRequest]
+    ) -> "SamplingParams":
+        """Create the sampling params of a request, including guided decoding.
+
+        Every call creates its own guided decoding processor, so the params of each
+        engine request must be created separately.
+
+        Args:
+            request: The chat completion or completion request.
+
+        Returns:
+            The sampling params of the request.
+
+        Raises:
+            ValueError: If the logit bias of the request is out of the vocabulary.
+        """
+        if request.logit_bias:
+            validate_logit_bias(request.logit_bias, len(self.tokenizer))
+        if self.sampling_params_class is None:
+            sampling_params = request.to_sampling_params()
+        else:
+            sampling_params = self.sampling_params_class(
+                **request.sampling_params_kwargs()
+            )
+        logits_processor = await self.guided_decoding.get_logits_processor(request)
+        if logits_processor is not None:
+            if sampling_params.logits_processors is None:
+                sampling_params.logits_processors = []
+            sampling_params.logits_processors.append(logits_processor)
+        return sampling_params
+
+    def _create_logprobs(
+        self,
+        token_ids: Sequence[int],
+        top_logprobs: Optional[TopLogprobs] = None,
+        num_output_top_logprobs: Optional[int] = None,
+        initial_text_offset: int = 0,
+    ) -> LogProbs:
+        """Create OpenAI style logprobs for a sequence of tokens.
+
+        Args:
+            token_ids: The token IDs.
+            top_logprobs: The logprobs of the candidates of each step.
+            num_output_top_logprobs: The number of top logprobs requested.
+            initial_text_offset: The text offset of the first token.
+
+        Returns:
+            The logprobs of the tokens.
+        """
+        return create_logprobs(
+            self.tokenizer,
+            token_ids,
+            top_logprobs=top_logprobs,
+            num_output_top_logprobs=num_output_top_logprobs,
+            initial_text_offset=initial_text_offset,
+        )
+
+
+async def release_when_done(
+    results_generator: AsyncIterator, admission: Optional[Admission]
+) -> AsyncIterator:
+    """Release the admission of a request once its outputs are consumed.
+
+    Args:
+        results_generator: The generator of request outputs.
+        admission: The admission of the request.
+
+    Yields:
+        The request outputs.
+    """
+    try:
+        async for res in results_generator:
+            yield res
+    finally:
+        if admission is not None:
+            admission.release()
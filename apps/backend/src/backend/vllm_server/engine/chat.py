@@ -2,44 +2,53 @@
 
 import codecs
 import time
-from typing import AsyncGenerator, AsyncIterator, Union
+from typing import TYPE_CHECKING, AsyncGenerator, AsyncIterator, Dict, List, Type, Union
 
-from backend.vllm_server.engine.base import BaseEngine
+from backend.vllm_server.encoder import ChatChunkEncoder
+from backend.vllm_server.engine.base import BaseEngine, release_when_done
+from backend.vllm_server.engine.delta import DeltaTracker
+from backend.vllm_server.engine.prompt_cache import PromptCache
+from backend.vllm_server.fair_queue import DEFAULT_SCHEDULING, Scheduling
 from backend.vllm_server.logger import init_logger
+from backend.vllm_server.metrics import (
+    PROMPT_CACHE_LOOKUPS,
+    PROMPT_CACHE_TOKENS,
+    REGISTRY,
+    TEMPLATE_RENDER,
+    TOKENIZE,
+)
 from backend.vllm_server.schema.chat import (
     ChatCompletionRequest,
     ChatCompletionResponse,
     ChatCompletionResponseChoice,
-    ChatCompletionResponseStreamChoice,
-    ChatCompletionStreamResponse,
     ChatMessage,
 )
 from backend.vllm_server.schema.common import (
-    DeltaMessage,
     ErrorResponse,
     UsageInfo,
 )
-from backend.vllm_server.utils import (
-    create_error_response,
-    create_streaming_error_response,
-)
-from vllm.engine.async_llm_engine import AsyncLLMEngine
+from backend.vllm_server.utils import create_error_response
+from backend.vllm_server.wire import PackedChatEncoder
 
-# from vllm.model_executor.guided_decoding import get_guided_decoding_logits_processor
-from vllm.outputs import RequestOutput
+if TYPE_CHECKING:
+    from vllm.engine.async_llm_engine import AsyncLLMEngine
+    from vllm.outputs import RequestOutput
 
 logger = init_logger(__name__)
 
+ChatEncoder = Union[ChatChunkEncoder, PackedChatEncoder]
+
 
 class ChatEngine(BaseEngine):
     """Chat completion vLLM engine implementing OpenAI api functionality."""
 
     def __init__(
         self,
-        engine: AsyncLLMEngine,
+        engine: "AsyncLLMEngine",
         model_name: str,
         response_role: str,
         chat_template=None,
+        **kwargs,
     ):
         """Initialize the chat engine.
 
@@ -52,14 +61,20 @@ class ChatEngine(BaseEngine):
             model_name: The name of the model being served.
             response_role: The role of the response in the chat.
             chat_template: The chat template to use for the tokenizer.
+            **kwargs: The keyword arguments of `BaseEngine`.
         """
-        super().__init__(engine=engine, model_name=model_name)
+        super().__init__(engine=engine, model_name=model_name, **kwargs)
         self.response_role = response_role
         self._load_chat_template(chat_template)
+        self.prompt_cache = PromptCache(self.tokenizer)
+        REGISTRY.add_collector(self._collect_prompt_cache_stats)
 
     async def create_chat_completion_generator(
-        self, request: ChatCompletionRequest, request_id: str
-    ) -> Union[ErrorResponse, AsyncIterator[RequestOutput]]:
+        self,
+        request: ChatCompletionRequest,
+        request_id: str,
+        scheduling: Scheduling = DEFAULT_SCHEDULING,
+    ) -> Union[ErrorResponse, AsyncIterator["RequestOutput"]]:
         """Completion API compliant with OpenAI API.
 
         Mimics the OpenAI API for generating chat completions based on the given
@@ -70,6 +85,7 @@ class ChatEngine(BaseEngine):
         Args:
             request: The chat completion request.
             request_id: The request ID.
+            scheduling: The tenant and priority class the request is admitted for.
 
         Returns:
             The chat completion generator and the request_id.
@@ -79,42 +95,61 @@ class ChatEngine(BaseEngine):
             return model_validation_err
 
         try:
-            prompt = self.tokenizer.apply_chat_template(
-                conversation=request.messages,
-                tokenize=False,
-                add_generation_prompt=request.add_generation_prompt,
-            )
+            with TEMPLATE_RENDER.time():
+                prompt = await self.tokenizer_pool.run(
+                    self.prompt_cache.render,
+                    messages=request.messages,
+                    add_generation_prompt=request.add_generation_prompt,
+                )
         except Exception as e:
             logger.error(f"Failed to apply chat template: {e!s}")
             logger.error(f"conversation: {request.messages}")
             return create_error_response(str(e))
 
         try:
-            token_ids = self._validate_prompt_and_tokenize(request, prompt=prompt)
-            print("In chat engine. Typeof request", type(request))
-            sampling_params = request.to_sampling_params()
-            # sampling_params = request.to_sampling_params()
-
-            # guided_decoding_logits_processor = (
-            #     await get_guided_decoding_logits_processor(
-            #         request, await self.engine.get_tokenizer()
-            #     )
-            # )
-            # if guided_decoding_logits_processor:
-            #     if sampling_params.logits_processors is None:
-            #         sampling_params.logits_processors = []
-            #     sampling_params.logits_processors.append(
-            #         guided_decoding_logits_processor
-            #     )
-
+            with TOKENIZE.time():
+                prompt_ids = await self._tokenize_chat_prompt(request.messages, prompt)
+            token_ids = self._validate_prompt_and_tokenize(
+                request, prompt_ids=prompt_ids
+            )
+            sampling_params = await self._create_sampling_params(request)
         except ValueError as e:
             return create_error_response(str(e))
 
+        admissions = await self._admit(request, [token_ids], scheduling)
+        if isinstance(admissions, ErrorResponse):
+            return admissions
+
         results_generator = self.engine.generate(
             prompt, sampling_params, request_id, token_ids
         )
-        print("created results_generator")
-        return results_generator
+        return release_when_done(results_generator, admissions[0])
+
+    async def _tokenize_chat_prompt(
+        self, messages: List[Dict[str, str]], prompt: str
+    ) -> List[int]:
+        """Tokenize a rendered chat prompt on the tokenizer pool.
+
+        Only the part of the prompt that is not covered by a cached conversation
+        prefix is encoded.
+
+        Args:
+            messages: The chat messages the prompt was rendered from.
+            prompt: The rendered prompt.
+
+        Returns:
+            The token IDs of the prompt.
+        """
+        plan = self.prompt_cache.plan(messages, prompt)
+        encoding = await self.tokenizer_pool.encode(
+            plan.text, add_special_tokens=plan.add_special_tokens
+        )
+        token_ids = self.prompt_cache.complete(plan, encoding)
+        if token_ids is None:
+            plan = self.prompt_cache.full_plan(plan)
+            encoding = await self.tokenizer_pool.encode(plan.text)
+            token_ids = self.prompt_cache.complete(plan, encoding)
+        return token_ids
 
     def get_chat_request_role(self, request: ChatCompletionRequest) -> str:
         """Get the role of the chat request.
@@ -133,9 +168,10 @@ class ChatEngine(BaseEngine):
     async def chat_completion_stream_generator(
         self,
         request: ChatCompletionRequest,
-        results_generator: AsyncIterator[RequestOutput],
+        results_generator: AsyncIterator["RequestOutput"],
         request_id: str,
-    ) -> Union[ErrorResponse, AsyncGenerator[str, None]]:
+        encoder_class: Type[ChatEncoder] = ChatChunkEncoder,
+    ) -> Union[ErrorResponse, AsyncGenerator[Union[str, bytes], None]]:
         """Generate the chat completion stream.
 
         Generate a stream of tokens for the chat completion based on the given chat
@@ -145,19 +181,17 @@ class ChatEngine(BaseEngine):
             request: The chat completion request.
             results_generator: The generator of request outputs.
             request_id: The request ID.
+            encoder_class: The encoder of the chunks, server-sent event frames by
+                default or packed records sent to the gateway.
 
         Returns:
             The chat completion stream or an error.
         """
-        model_name = self.model_name
-        created_time = int(time.time())
-        chunk_object_type = "chat.completion.chunk"
+        encoder = encoder_class(request_id, int(time.time()), self.model_name)
         first_iteration = True
 
         # Send response for each token for each request.n (index)
-        previous_texts = [""] * request.n
-        previous_num_tokens = [0] * request.n
-        finish_reason_sent = [False] * request.n
+        tracker = DeltaTracker(request.n)
 
         try:
             async for res in results_generator:
@@ -170,21 +204,7 @@ class ChatEngine(BaseEngine):
                     # the role
                     role = self.get_chat_request_role(request)
                     for i in range(request.n):
-                        choice_data = ChatCompletionResponseStreamChoice(
-                            index=i,
-                            delta=DeltaMessage(role=role),
-                            logprobs=None,
-                            finish_reason=None,
-                        )
-                        chunk = ChatCompletionStreamResponse(
-                            id=request_id,
-                            object=chunk_object_type,
-                            created=created_time,
-                            choices=[choice_data],
-                            model=model_name,
-                        )
-                        data = chunk.model_dump_json(exclude_unset=True)
-                        yield f"data: {data}\n\n"
+                        yield encoder.role(i, role)
 
                     # Send response to echo the input portion of the
                     # last message
@@ -200,104 +220,50 @@ class ChatEngine(BaseEngine):
 
                         if last_msg_content:
                             for i in range(request.n):
-                                choice_data = ChatCompletionResponseStreamChoice(
-                                    index=i,
-                                    delta=DeltaMessage(content=last_msg_content),
-                                    finish_reason=None,
-                                )
-                                chunk = ChatCompletionStreamResponse(
-                                    id=request_id,
-                                    object=chunk_object_type,
-                                    created=created_time,
-                                    choices=[choice_data],
-                                    logprobs=None,
-                                    model=model_name,
-                                )
-                                data = chunk.model_dump_json(exclude_unset=True)
-                                yield f"data: {data}\n\n"
+                                yield encoder.echo(i, last_msg_content)
                     first_iteration = False
 
                 for output in res.outputs:
                     i = output.index
 
-                    if finish_reason_sent[i]:
+                    if tracker.is_finished(i):
                         continue
 
-                    delta_token_ids = output.token_ids[previous_num_tokens[i] :]
-                    top_logprobs = (
-                        output.logprobs[previous_num_tokens[i] :]
-                        if output.logprobs
-                        else None
-                    )
+                    delta = tracker.advance(output)
 
                     if request.logprobs:
                         logprobs = self._create_logprobs(
-                            token_ids=delta_token_ids,
-                            top_logprobs=top_logprobs,
-                            num_output_top_logprobs=request.logprobs,
-                            initial_text_offset=len(previous_texts[i]),
+                            token_ids=delta.token_ids,
+                            top_logprobs=delta.top_logprobs,
+                            num_output_top_logprobs=request.top_logprobs,
+                            initial_text_offset=delta.text_offset,
                         )
                     else:
                         logprobs = None
 
-                    delta_text = output.text[len(previous_texts[i]) :]
-                    previous_texts[i] = output.text
-                    previous_num_tokens[i] = len(output.token_ids)
                     if output.finish_reason is None:
                         # Send token-by-token response for each request.n
-                        choice_data = ChatCompletionResponseStreamChoice(
-                            index=i,
-                            delta=DeltaMessage(content=delta_text),
-                            logprobs=logprobs,
-                            finish_reason=None,
-                        )
-                        chunk = ChatCompletionStreamResponse(
-                            id=request_id,
-                            object=chunk_object_type,
-                            created=created_time,
-                            choices=[choice_data],
-                            model=model_name,
-                        )
-                        data = chunk.model_dump_json(exclude_unset=True)
-                        yield f"data: {data}\n\n"
+                        yield encoder.content(i, delta.text, logprobs)
                     else:
                         # Send the finish response for each request.n only once
-                        prompt_tokens = len(res.prompt_token_ids)
-                        final_usage = UsageInfo(
-                            prompt_tokens=prompt_tokens,
-                            completion_tokens=previous_num_tokens[i],
-                            total_tokens=prompt_tokens + previous_num_tokens[i],
-                        )
-                        choice_data = ChatCompletionResponseStreamChoice(
-                            index=i,
-                            delta=DeltaMessage(content=delta_text),
+                        yield encoder.finish(
+                            i,
+                            delta.text,
+                            output.finish_reason,
+                            prompt_tokens=len(res.prompt_token_ids),
+                            completion_tokens=delta.num_tokens,
                             logprobs=logprobs,
-                            finish_reason=output.finish_reason,
-                        )
-                        chunk = ChatCompletionStreamResponse(
-                            id=request_id,
-                            object=chunk_object_type,
-                            created=created_time,
-                            choices=[choice_data],
-                            model=model_name,
                         )
-                        if final_usage is not None:
-                            chunk.usage = final_usage
-                        data = chunk.model_dump_json(
-                            exclude_unset=True, exclude_none=True
-                        )
-                        yield f"data: {data}\n\n"
-                        finish_reason_sent[i] = True
+                        tracker.finish(i)
         except ValueError as e:
-            data = create_streaming_error_response(str(e))
-            yield f"data: {data}\n\n"
+            yield encoder.error(str(e))
         # Send the final done message after all response.n are finished
-        yield "data: [DONE]\n\n"
+        yield encoder.done()
 
     async def chat_completion_full_generator(
         self,
         request: ChatCompletionRequest,
-        results_generator: AsyncIterator[RequestOutput],
+        results_generator: AsyncIterator["RequestOutput"],
         request_id: str,
     ) -> Union[ErrorResponse, ChatCompletionResponse]:
         """Generate the full chat completion response.
@@ -333,7 +299,7 @@ class ChatEngine(BaseEngine):
                 logprobs = self._create_logprobs(
                     token_ids=token_ids,
                     top_logprobs=top_logprobs,
-                    num_output_top_logprobs=request.logprobs,
+                    num_output_top_logprobs=request.top_logprobs,
                 )
             else:
                 logprobs = None
@@ -370,7 +336,6 @@ class ChatEngine(BaseEngine):
             completion_tokens=num_generated_tokens,
             total_tokens=num_prompt_tokens + num_generated_tokens,
         )
-        print("Created usage info", usage)
         response = ChatCompletionResponse(
             id=request_id,
             created=created_time,
@@ -378,11 +343,15 @@ class ChatEngine(BaseEngine):
             choices=choices,
             usage=usage,
         )
-
-        print("chat completion response", response.model_dump())
-
         return response
 
+    def _collect_prompt_cache_stats(self):
+        stats = self.prompt_cache.stats()
+        PROMPT_CACHE_LOOKUPS.labels("hit").set(stats["hits"])
+        PROMPT_CACHE_LOOKUPS.labels("miss").set(stats["misses"])
+        PROMPT_CACHE_TOKENS.labels("reused").set(stats["reused_tokens"])
+        PROMPT_CACHE_TOKENS.labels("encoded").set(stats["encoded_tokens"])
+
     def _load_chat_template(self, chat_template: str):
         if chat_template is not None:
             try:
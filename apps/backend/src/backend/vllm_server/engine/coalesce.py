@@ -0,0 +1,100 @@
+"""Token coalescing for streamed engine outputs."""
+
+import asyncio
+from typing import TYPE_CHECKING, AsyncGenerator, AsyncIterator, Optional
+
+if TYPE_CHECKING:
+    from vllm.outputs import RequestOutput
+
+
+def _num_generated_tokens(res: "RequestOutput") -> int:
+    return sum(len(output.token_ids) for output in res.outputs)
+
+
+async def coalesce_request_outputs(
+    results_generator: AsyncIterator["RequestOutput"],
+    flush_tokens: Optional[int] = None,
+    flush_interval: Optional[float] = None,
+) -> AsyncGenerator["RequestOutput", None]:
+    """Coalesce engine outputs so fewer stream chunks are produced.
+
+    The engine yields a cumulative `RequestOutput` on every decoding step. Skipping
+    intermediate outputs merges the deltas of several steps into a single stream
+    chunk, which cuts the number of frames crossing the network. The first output
+    and the finished output are always forwarded immediately so time to first
+    token and completion latency are unchanged.
+
+    Args:
+        results_generator: The generator of request outputs.
+        flush_tokens: Flush once this many tokens are buffered across all choices.
+        flush_interval: Flush once the oldest buffered output is this many seconds
+            old.
+
+    Yields:
+        The coalesced request outputs.
+    """
+    by_tokens = flush_tokens is not None
+    by_time = flush_interval is not None
+    if (
+        not (by_tokens or by_time)
+        or (by_tokens and flush_tokens <= 1)
+        or (by_time and flush_interval <= 0)
+    ):
+        # Every engine step is flushed so there is nothing to coalesce
+        async for res in results_generator:
+            yield res
+        return
+
+    loop = asyncio.get_running_loop()
+    iterator = results_generator.__aiter__()
+    next_output: Optional[asyncio.Future] = None
+    pending: Optional[RequestOutput] = None
+    deadline: Optional[float] = None
+    flushed_tokens = 0
+    first_output = True
+
+    try:
+        while True:
+            if next_output is None:
+                next_output = asyncio.ensure_future(iterator.__anext__())
+
+            timeout = None
+            if pending is not None and deadline is not None:
+                timeout = max(0.0, deadline - loop.time())
+            done, _ = await asyncio.wait({next_output}, timeout=timeout)
+
+            if not done:
+                # The flush interval elapsed before the engine produced more tokens
+                flushed_tokens = _num_generated_tokens(pending)
+                yield pending
+                pending = deadline = None
+                continue
+
+            try:
+                res = next_output.result()
+            except StopAsyncIteration:
+                break
+            finally:
+                next_output = None
+
+            num_tokens = _num_generated_tokens(res)
+            if (
+                first_output
+                or res.finished
+                or (by_tokens and num_tokens - flushed_tokens >= flush_tokens)
+            ):
+                first_output = False
+                flushed_tokens = num_tokens
+                pending = deadline = None
+                yield res
+                continue
+
+            if pending is None and by_time:
+                deadline = loop.time() + flush_interval
+            pending = res
+
+        if pending is not None:
+            yield pending
+    finally:
+        if next_output is not None:
+            next_output.cancel()
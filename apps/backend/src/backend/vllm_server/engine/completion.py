@@ -0,0 +1,386 @@
+"""Completion vLLM engine implementing OpenAI api functionality."""
+
+import asyncio
+import time
+from typing import (
+    TYPE_CHECKING,
+    AsyncGenerator,
+    AsyncIterator,
+    Dict,
+    List,
+    Sequence,
+    Set,
+    Tuple,
+    Type,
+    Union,
+)
+
+from backend.vllm_server.encoder import CompletionChunkEncoder
+from backend.vllm_server.engine.base import BaseEngine, release_when_done
+from backend.vllm_server.engine.delta import DeltaTracker
+from backend.vllm_server.fair_queue import DEFAULT_SCHEDULING, Scheduling
+from backend.vllm_server.logger import init_logger
+from backend.vllm_server.metrics import TOKENIZE
+from backend.vllm_server.schema.common import ErrorResponse, UsageInfo
+from backend.vllm_server.schema.completion import (
+    CompletionRequest,
+    CompletionResponse,
+    CompletionResponseChoice,
+)
+from backend.vllm_server.utils import create_error_response
+from backend.vllm_server.wire import PackedCompletionEncoder
+
+if TYPE_CHECKING:
+    from vllm.outputs import RequestOutput
+
+logger = init_logger(__name__)
+
+CompletionEncoder = Union[CompletionChunkEncoder, PackedCompletionEncoder]
+
+
+def parse_prompt_format(prompt) -> Tuple[bool, list]:
+    """Normalize the prompt of a completion request to a list of prompts.
+
+    The OpenAI API accepts a string, an array of strings, an array of tokens or an
+    array of token arrays.
+
+    Args:
+        prompt: The prompt of the request.
+
+    Returns:
+        Whether the prompts are token IDs, and the list of prompts.
+    """
+    if not isinstance(prompt, list):
+        return False, [prompt]
+    if not prompt:
+        raise ValueError("Please provide at least one prompt.")
+    if isinstance(prompt[0], str):
+        return False, prompt
+    if isinstance(prompt[0], int):
+        return True, [prompt]
+    if isinstance(prompt[0], list) and prompt[0] and isinstance(prompt[0][0], int):
+        return True, prompt
+    raise ValueError(
+        "Prompt must be a string, array of strings, array of tokens, or array of "
+        "token arrays."
+    )
+
+
+async def merge_request_outputs(
+    generators: Sequence[AsyncIterator["RequestOutput"]],
+) -> AsyncGenerator[Tuple[int, "RequestOutput"], None]:
+    """Merge the outputs of concurrently generated prompts.
+
+    Every generator is consumed by its own task so all prompts are in the engine at
+    once and continuous batching can pack them. Outputs are yielded as soon as any
+    prompt produces one, tagged with the index of its prompt. The queue is bounded
+    so a slow consumer applies backpressure rather than buffering every step.
+
+    Args:
+        generators: The generators of request outputs, one per prompt.
+
+    Yields:
+        The index of the prompt and its request output.
+    """
+    queue: asyncio.Queue = asyncio.Queue(maxsize=len(generators))
+    done = object()
+
+    async def forward(index: int, generator: AsyncIterator["RequestOutput"]):
+        try:
+            async for res in generator:
+                await queue.put((index, res))
+        except Exception as e:
+            await queue.put((index, e))
+        else:
+            await queue.put((index, done))
+
+    tasks = [
+        asyncio.create_task(forward(i, generator))
+        for i, generator in enumerate(generators)
+    ]
+    try:
+        remaining = len(tasks)
+        while remaining:
+            index, res = await queue.get()
+            if res is done:
+                remaining -= 1
+            elif isinstance(res, Exception):
+                raise res
+            else:
+                yield index, res
+    finally:
+        # Cancelling the generators aborts their requests in the engine
+        for task in tasks:
+            task.cancel()
+
+
+class CompletionEngine(BaseEngine):
+    """Completion vLLM engine implementing OpenAI api functionality."""
+
+    @staticmethod
+    def can_stream(request: CompletionRequest) -> bool:
+        """Check whether the completion can be streamed.
+
+        Similar to the OpenAI API, completions are not streamed when `n` differs
+        from `best_of` or when beam search is used since the returned choices are
+        only known once generation finishes.
+
+        Args:
+            request: The completion request.
+
+        Returns:
+            True if the completion can be streamed.
+        """
+        return (
+            request.best_of is None or request.best_of == request.n
+        ) and not request.use_beam_search
+
+    async def create_completion_generators(
+        self,
+        request: CompletionRequest,
+        request_id: str,
+        scheduling: Scheduling = DEFAULT_SCHEDULING,
+    ) -> Union[ErrorResponse, List[AsyncIterator["RequestOutput"]]]:
+        """Completion API compliant with OpenAI API.
+
+        Every prompt of the request is submitted to the engine as its own request
+        so the prompts are batched with each other and with other requests.
+
+        Args:
+            request: The completion request.
+            request_id: The request ID.
+            scheduling: The tenant and priority class the request is admitted for.
+
+        Returns:
+            The generator of request outputs of each prompt, or an error.
+        """
+        model_validation_err = self.check_model(request)
+        if model_validation_err is not None:
+            return model_validation_err
+
+        if request.suffix is not None:
+            return create_error_response("Suffix is not currently supported.")
+
+        try:
+            prompt_is_tokens, prompts = parse_prompt_format(request.prompt)
+
+            if prompt_is_tokens:
+                prompt_ids = prompts
+            else:
+                # Prompts submitted together are encoded in batched tokenizer calls
+                with TOKENIZE.time():
+                    encodings = await asyncio.gather(
+                        *(self.tokenizer_pool.encode(prompt) for prompt in prompts)
+                    )
+                prompt_ids = [encoding.input_ids for encoding in encodings]
+
+            token_ids = [
+                self._validate_prompt_and_tokenize(request, prompt_ids=ids)
+                for ids in prompt_ids
+            ]
+            # Guided decoding processors track the state of a single prompt
+            sampling_params = await asyncio.gather(
+                *(self._create_sampling_params(request) for _ in prompts)
+            )
+        except ValueError as e:
+            return create_error_response(str(e))
+
+        admissions = await self._admit(request, token_ids, scheduling)
+        if isinstance(admissions, ErrorResponse):
+            return admissions
+
+        return [
+            release_when_done(
+                self.engine.generate(
+                    None if prompt_is_tokens else prompt,
+                    params,
+                    f"{request_id}-{i}",
+                    ids,
+                ),
+                admission,
+            )
+            for i, (prompt, ids, params, admission) in enumerate(
+                zip(prompts, token_ids, sampling_params, admissions)
+            )
+        ]
+
+    async def completion_stream_generator(
+        self,
+        request: CompletionRequest,
+        results_generator: AsyncIterator[Tuple[int, "RequestOutput"]],
+        request_id: str,
+        encoder_class: Type[CompletionEncoder] = CompletionChunkEncoder,
+    ) -> AsyncGenerator[Union[str, bytes], None]:
+        """Generate the completion stream.
+
+        Args:
+            request: The completion request.
+            results_generator: The merged generator of request outputs tagged with
+                the index of their prompt.
+            request_id: The request ID.
+            encoder_class: The encoder of the chunks, server-sent event frames by
+                default or packed records sent to the gateway.
+
+        Returns:
+            The completion stream.
+        """
+        encoder = encoder_class(request_id, int(time.time()), self.model_name)
+        echo_only = request.echo and request.max_tokens == 0
+
+        # The choices of prompt p are indexed p * n to (p + 1) * n - 1
+        trackers: Dict[int, DeltaTracker] = {}
+        prompt_texts: Dict[int, str] = {}
+        echoed: Set[int] = set()
+
+        try:
+            async for prompt_index, res in results_generator:
+                tracker = trackers.get(prompt_index)
+                if tracker is None:
+                    tracker = trackers[prompt_index] = DeltaTracker(request.n)
+                    if request.echo:
+                        prompt_texts[prompt_index] = self._prompt_text(res)
+
+                for output in res.outputs:
+                    if tracker.is_finished(output.index):
+                        continue
+
+                    index = prompt_index * request.n + output.index
+                    delta = tracker.advance(output)
+                    text = delta.text
+                    token_ids = delta.token_ids
+                    top_logprobs = delta.top_logprobs
+                    text_offset = delta.text_offset
+
+                    if request.echo:
+                        prompt_text = prompt_texts[prompt_index]
+                        text_offset += len(prompt_text)
+                        if echo_only:
+                            text = prompt_text
+                            token_ids = res.prompt_token_ids
+                            top_logprobs = res.prompt_logprobs
+                            text_offset = 0
+                        elif index not in echoed:
+                            text = prompt_text + text
+                            token_ids = res.prompt_token_ids + list(token_ids)
+                            top_logprobs = (res.prompt_logprobs or []) + (
+                                top_logprobs or []
+                            )
+                            text_offset = 0
+                        echoed.add(index)
+
+                    if request.logprobs is not None:
+                        logprobs = self._create_logprobs(
+                            token_ids=token_ids,
+                            top_logprobs=top_logprobs,
+                            num_output_top_logprobs=request.logprobs,
+                            initial_text_offset=text_offset,
+                        )
+                    else:
+                        logprobs = None
+
+                    if output.finish_reason is None:
+                        yield encoder.text(index, text, logprobs)
+                    else:
+                        yield encoder.finish(
+                            index,
+                            text,
+                            output.finish_reason,
+                            prompt_tokens=len(res.prompt_token_ids),
+                            completion_tokens=delta.num_tokens,
+                            logprobs=logprobs,
+                        )
+                        tracker.finish(output.index)
+        except ValueError as e:
+            yield encoder.error(str(e))
+        yield encoder.done()
+
+    async def completion_full_generator(
+        self,
+        request: CompletionRequest,
+        results_generator: AsyncIterator[Tuple[int, "RequestOutput"]],
+        request_id: str,
+    ) -> CompletionResponse:
+        """Generate the full completion response.
+
+        Waits for every prompt to finish and merges their choices by prompt index.
+
+        Args:
+            request: The completion request.
+            results_generator: The merged generator of request outputs tagged with
+                the index of their prompt.
+            request_id: The request ID.
+
+        Returns:
+            The completion response.
+        """
+        created_time = int(time.time())
+        final_outputs: Dict[int, RequestOutput] = {}
+        async for prompt_index, res in results_generator:
+            final_outputs[prompt_index] = res
+
+        echo_only = request.echo and request.max_tokens == 0
+        choices = []
+        num_prompt_tokens = 0
+        num_generated_tokens = 0
+
+        for prompt_index in sorted(final_outputs):
+            final_res = final_outputs[prompt_index]
+            prompt_text = self._prompt_text(final_res) if request.echo else ""
+
+            for output in sorted(final_res.outputs, key=lambda output: output.index):
+                if echo_only:
+                    token_ids = final_res.prompt_token_ids
+                    top_logprobs = final_res.prompt_logprobs
+                    text = prompt_text
+                elif request.echo:
+                    token_ids = final_res.prompt_token_ids + list(output.token_ids)
+                    top_logprobs = (final_res.prompt_logprobs or []) + (
+                        output.logprobs or []
+                    )
+                    text = prompt_text + output.text
+                else:
+                    token_ids = output.token_ids
+                    top_logprobs = output.logprobs
+                    text = output.text
+
+                if request.logprobs is not None:
+                    logprobs = self._create_logprobs(
+                        token_ids=token_ids,
+                        top_logprobs=top_logprobs,
+                        num_output_top_logprobs=request.logprobs,
+                    )
+                else:
+                    logprobs = None
+
+                choices.append(
+                    CompletionResponseChoice(
+                        index=prompt_index * request.n + output.index,
+                        text=text,
+                        logprobs=logprobs,
+                        finish_reason=output.finish_reason,
+                    )
+                )
+
+            num_prompt_tokens += len(final_res.prompt_token_ids)
+            num_generated_tokens += sum(
+                len(output.token_ids) for output in final_res.outputs
+            )
+
+        usage = UsageInfo(
+            prompt_tokens=num_prompt_tokens,
+            completion_tokens=num_generated_tokens,
+            total_tokens=num_prompt_tokens + num_generated_tokens,
+        )
+        return CompletionResponse(
+            id=request_id,
+            created=created_time,
+            model=self.model_name,
+            choices=choices,
+            usage=usage,
+        )
+
+    def _prompt_text(self, res: "RequestOutput") -> str:
+        # Prompts submitted as token IDs have no text
+        if res.prompt is not None:
+            return res.prompt
+        return self.tokenizer.decode(res.prompt_token_ids)
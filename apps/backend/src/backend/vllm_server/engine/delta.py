@@ -0,0 +1,83 @@
+"""Incremental delta extraction for streamed engine outputs."""
+
+from typing import TYPE_CHECKING, List, NamedTuple, Optional, Sequence
+
+if TYPE_CHECKING:
+    from vllm.outputs import CompletionOutput
+
+
+class Delta(NamedTuple):
+    """The newly generated portion of a choice since the previous engine step."""
+
+    text: str
+    token_ids: Sequence[int]
+    top_logprobs: Optional[List]
+    text_offset: int
+    num_tokens: int
+
+
+class DeltaTracker:
+    """Track how much of each choice has already been streamed.
+
+    The engine yields cumulative outputs on every step. Rather than holding on to
+    the previously streamed text of every choice, only the text and token offsets
+    are kept so each delta and logprob window is sliced straight out of the latest
+    output. Memory per choice stays constant and the work per step is proportional
+    to the size of the delta rather than the length of the generation.
+    """
+
+    __slots__ = ("_finished", "_text_offsets", "_token_offsets")
+
+    def __init__(self, n: int):
+        """Initialize the tracker.
+
+        Args:
+            n: The number of choices generated for the request.
+        """
+        self._text_offsets = [0] * n
+        self._token_offsets = [0] * n
+        self._finished = [False] * n
+
+    def is_finished(self, index: int) -> bool:
+        """Check whether the finish chunk has been sent for a choice.
+
+        Args:
+            index: The choice index.
+
+        Returns:
+            True if the choice has finished streaming.
+        """
+        return self._finished[index]
+
+    def finish(self, index: int):
+        """Mark a choice as finished so later outputs for it are skipped.
+
+        Args:
+            index: The choice index.
+        """
+        self._finished[index] = True
+
+    def advance(self, output: "CompletionOutput") -> Delta:
+        """Extract the delta of a choice and advance its offsets.
+
+        Args:
+            output: The latest cumulative output of the choice.
+
+        Returns:
+            The delta generated since the previous call for the same choice.
+        """
+        i = output.index
+        text_offset = self._text_offsets[i]
+        token_offset = self._token_offsets[i]
+
+        num_tokens = len(output.token_ids)
+        self._text_offsets[i] = len(output.text)
+        self._token_offsets[i] = num_tokens
+
+        return Delta(
+            output.text[text_offset:],
+            output.token_ids[token_offset:],
+            output.logprobs[token_offset:] if output.logprobs else None,
+            text_offset,
+            num_tokens,
+        )
@@ -0,0 +1,218 @@
+"""Deterministic CPU-only stand-in for the vLLM async engine.
+
+The sampling params and outputs are local classes shaped like those of vLLM, so
+the fake engine, and the engines and service running on it, work without vLLM
+or torch installed. The engines serving it are given the tokenizer and the
+`SamplingParams` of this module, see `BaseEngine`.
+"""
+
+import asyncio
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Dict, List, NamedTuple, Optional, Set
+
+
+@dataclass
+class SamplingParams:
+    """The sampling params of vLLM built by the request schemas.
+
+    Only `n`, `max_tokens` and `logprobs` change the fake generation.
+    """
+
+    n: int = 1
+    best_of: Optional[int] = None
+    presence_penalty: float = 0.0
+    frequency_penalty: float = 0.0
+    repetition_penalty: float = 1.0
+    temperature: float = 1.0
+    top_p: float = 1.0
+    top_k: int = -1
+    min_p: float = 0.0
+    seed: Optional[int] = None
+    use_beam_search: bool = False
+    length_penalty: float = 1.0
+    early_stopping: Any = False
+    stop: Any = None
+    stop_token_ids: Optional[List[int]] = None
+    include_stop_str_in_output: bool = False
+    ignore_eos: bool = False
+    max_tokens: Optional[int] = 16
+    logprobs: Optional[int] = None
+    prompt_logprobs: Optional[int] = None
+    skip_special_tokens: bool = True
+    spaces_between_special_tokens: bool = True
+    logits_processors: Optional[list] = None
+
+
+@dataclass
+class CompletionOutput:
+    """The output of a sequence, like the `CompletionOutput` of vLLM."""
+
+    index: int
+    text: str = ""
+    token_ids: List[int] = field(default_factory=list)
+    cumulative_logprob: float = 0.0
+    logprobs: Optional[List[Dict[int, float]]] = None
+    finish_reason: Optional[str] = None
+
+    def finished(self) -> bool:
+        """Return whether the sequence finished."""
+        return self.finish_reason is not None
+
+
+@dataclass
+class RequestOutput:
+    """The output of a request, like the `RequestOutput` of vLLM."""
+
+    request_id: str
+    prompt: Optional[str]
+    prompt_token_ids: List[int]
+    prompt_logprobs: Optional[list]
+    outputs: List[CompletionOutput]
+    finished: bool
+
+
+class FakeModelConfig(NamedTuple):
+    """The part of the vLLM model config read by the engines."""
+
+    tokenizer: str
+    max_model_len: int = 4096
+    tokenizer_mode: str = "auto"
+    trust_remote_code: bool = False
+
+
+class FakeAsyncLLMEngine:
+    """Fake of the `AsyncLLMEngine` surface used by the engines.
+
+    Implements `generate`, `abort` and `get_model_config` without a GPU or model
+    weights, so the serving stack can be profiled on any machine. Requests are not
+    batched against each other: each request waits for its prompt to be prefilled,
+    then generates one token per sequence every decode step, so the outputs and
+    their timing depend only on the configured rates and the request.
+
+    Generated tokens repeat the prompt token IDs so they are valid IDs of the
+    tokenizer, and every token is decoded as the same text.
+    """
+
+    def __init__(
+        self,
+        tokenizer: str,
+        max_model_len: int = 4096,
+        tokens_per_second: float = 50.0,
+        prefill_tokens_per_second: float = 10_000.0,
+        output_tokens: Optional[int] = None,
+        token_text: str = " token",
+    ):
+        """Initialize the fake engine.
+
+        Args:
+            tokenizer: The name or path of the tokenizer the engines load.
+            max_model_len: The context length of the model.
+            tokens_per_second: The number of tokens each sequence generates per
+                second.
+            prefill_tokens_per_second: The number of prompt tokens processed per
+                second before the first token.
+            output_tokens: The number of tokens generated before a sequence stops,
+                only limited by `max_tokens` if not set.
+            token_text: The text of every generated token.
+        """
+        self.model_config = FakeModelConfig(tokenizer, max_model_len)
+        self.decode_interval = 1 / tokens_per_second
+        self.prefill_tokens_per_second = prefill_tokens_per_second
+        self.output_tokens = output_tokens
+        self.token_text = token_text
+
+        self.generated_tokens = 0
+        self.aborted: List[str] = []
+        self._running: Set[str] = set()
+
+    @property
+    def num_running(self) -> int:
+        """Return the number of requests being generated."""
+        return len(self._running)
+
+    async def get_model_config(self) -> FakeModelConfig:
+        """Get the model configuration of the engine."""
+        return self.model_config
+
+    async def abort(self, request_id: str):
+        """Abort a request, ending its stream before the next output.
+
+        Args:
+            request_id: The ID of the request.
+        """
+        self._abort(request_id)
+
+    def _abort(self, request_id: str):
+        if request_id in self._running:
+            self._running.discard(request_id)
+            self.aborted.append(request_id)
+
+    async def generate(
+        self,
+        prompt: Optional[str],
+        sampling_params: SamplingParams,
+        request_id: str,
+        prompt_token_ids: Optional[List[int]] = None,
+    ) -> AsyncIterator[RequestOutput]:
+        """Generate the outputs of a request.
+
+        Like vLLM, every output holds the cumulative text and token IDs of each
+        sequence.
+
+        Args:
+            prompt: The prompt.
+            sampling_params: The sampling parameters of the request.
+            request_id: The ID of the request.
+            prompt_token_ids: The token IDs of the prompt.
+
+        Yields:
+            The outputs of the request after every decode step.
+        """
+        if not prompt_token_ids:
+            prompt_token_ids = [0]
+        max_tokens = sampling_params.max_tokens or 16
+        if self.output_tokens is not None:
+            max_tokens = min(max_tokens, self.output_tokens)
+        finish_reason = "length" if max_tokens == sampling_params.max_tokens else "stop"
+        want_logprobs = sampling_params.logprobs is not None
+
+        outputs = [
+            CompletionOutput(index, logprobs=[] if want_logprobs else None)
+            for index in range(sampling_params.n)
+        ]
+        self._running.add(request_id)
+        try:
+            await asyncio.sleep(len(prompt_token_ids) / self.prefill_tokens_per_second)
+            for step in range(max_tokens):
+                if step:
+                    await asyncio.sleep(self.decode_interval)
+                if request_id not in self._running:
+                    return
+
+                token_id = prompt_token_ids[step % len(prompt_token_ids)]
+                finished = step == max_tokens - 1
+                for output in outputs:
+                    # The token list is extended in place as vLLM does
+                    output.token_ids.append(token_id)
+                    output.text += self.token_text
+                    output.cumulative_logprob -= 0.5
+                    if want_logprobs:
+                        output.logprobs.append({token_id: -0.5})
+                    if finished:
+                        output.finish_reason = finish_reason
+                self.generated_tokens += len(outputs)
+
+                yield RequestOutput(
+                    request_id,
+                    prompt,
+                    prompt_token_ids,
+                    None,
+                    list(outputs),
+                    finished,
+                )
+        except asyncio.CancelledError:
+            # Like vLLM, cancelling the stream aborts the request
+            self._abort(request_id)
+            raise
+        finally:
+            self._running.discard(request_id)
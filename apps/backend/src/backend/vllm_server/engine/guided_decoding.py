@@ -0,0 +1,184 @@
+"""Cache of compiled guided decoding logits processors."""
+
+import asyncio
+import copy
+import hashlib
+import json
+import re
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, NamedTuple, Optional, Union
+
+from backend.vllm_server.metrics import GUIDED_DECODING_COMPILE, GUIDED_DECODING_LOOKUPS
+from backend.vllm_server.schema.chat import ChatCompletionRequest
+from backend.vllm_server.schema.completion import CompletionRequest
+from pydantic import BaseModel
+
+
+class Guide(NamedTuple):
+    """The canonical constraint of a guided decoding request."""
+
+    # "json" for a JSON schema, "regex" for regexes and choices
+    mode: str
+    guide: str
+
+    @property
+    def key(self) -> str:
+        """Return the hash identifying the compiled processor of the constraint."""
+        canonical = f"{self.mode}:{self.guide}".encode()
+        return hashlib.blake2b(canonical, digest_size=16).hexdigest()
+
+
+def _canonical_json(schema: Union[str, dict, BaseModel]) -> str:
+    if isinstance(schema, BaseModel):
+        schema = type(schema).model_json_schema()
+    elif isinstance(schema, str):
+        try:
+            schema = json.loads(schema)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"guided_json is not a valid JSON schema: {e}") from e
+    return json.dumps(schema, sort_keys=True, separators=(",", ":"))
+
+
+def request_guide(
+    request: Union[ChatCompletionRequest, CompletionRequest],
+) -> Optional[Guide]:
+    """Get the canonical guided decoding constraint of a request.
+
+    Constraints that only differ in formatting, such as the key order or spacing of
+    a JSON schema, share the same canonical form.
+
+    Args:
+        request: The chat completion or completion request.
+
+    Returns:
+        The constraint of the request, or None if it does not use guided decoding.
+    """
+    if request.guided_grammar is not None:
+        raise ValueError("guided_grammar is not currently supported.")
+    if request.guided_json is not None:
+        return Guide("json", _canonical_json(request.guided_json))
+    if request.guided_regex is not None:
+        return Guide("regex", request.guided_regex)
+    if request.guided_choice is not None:
+        choices = "|".join(re.escape(str(choice)) for choice in request.guided_choice)
+        return Guide("regex", f"({choices})")
+    return None
+
+
+def compile_logits_processor(guide: Guide, tokenizer):
+    """Compile the finite state machine of a constraint into a logits processor.
+
+    Args:
+        guide: The constraint.
+        tokenizer: The tokenizer of the model being served.
+
+    Returns:
+        The logits processor, shared by every request using the constraint.
+    """
+    from vllm.model_executor.guided_logits_processors import (
+        JSONLogitsProcessor,
+        RegexLogitsProcessor,
+    )
+
+    if guide.mode == "json":
+        return JSONLogitsProcessor(guide.guide, tokenizer)
+    return RegexLogitsProcessor(guide.guide, tokenizer)
+
+
+class GuidedDecodingCache:
+    """LRU cache of compiled guided decoding logits processors.
+
+    Compiling the finite state machine of a JSON schema or regex over the vocabulary
+    takes from hundreds of milliseconds to seconds, while agents send the same
+    schema on every call. Processors are compiled once per constraint on a
+    dedicated thread, so compiles never stall the event loop or queue behind
+    tokenization, and concurrent requests for a constraint that is still compiling
+    wait for the same compile. Each request gets a shallow copy of the cached
+    processor that shares its state machine but tracks its own decoding state.
+    """
+
+    def __init__(
+        self,
+        tokenizer,
+        max_entries: int = 32,
+        compile_fn: Callable[[Guide, Any], Any] = compile_logits_processor,
+    ):
+        """Initialize the guided decoding cache.
+
+        Args:
+            tokenizer: The tokenizer of the model being served.
+            max_entries: The maximum number of compiled processors kept.
+            compile_fn: The function compiling the processor of a constraint.
+        """
+        self.tokenizer = tokenizer
+        self.max_entries = max_entries
+        self.compile_fn = compile_fn
+
+        self.hits = 0
+        self.misses = 0
+
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="guided-decoding"
+        )
+        self._entries: OrderedDict[str, asyncio.Future] = OrderedDict()
+
+    def __len__(self) -> int:
+        """Return the number of compiled or compiling processors."""
+        return len(self._entries)
+
+    async def get_logits_processor(
+        self, request: Union[ChatCompletionRequest, CompletionRequest]
+    ):
+        """Get a logits processor enforcing the guided decoding of a request.
+
+        Args:
+            request: The chat completion or completion request.
+
+        Returns:
+            A fresh logits processor for the request, or None if the request does
+            not use guided decoding.
+
+        Raises:
+            ValueError: If the constraint is not supported or fails to compile.
+        """
+        guide = request_guide(request)
+        if guide is None:
+            return None
+
+        key = guide.key
+        future = self._entries.get(key)
+        if future is None:
+            self.misses += 1
+            GUIDED_DECODING_LOOKUPS.labels("miss").inc()
+            future = self._entries[key] = asyncio.ensure_future(self._compile(guide))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        else:
+            self.hits += 1
+            GUIDED_DECODING_LOOKUPS.labels("hit").inc()
+            self._entries.move_to_end(key)
+
+        try:
+            # A cancelled request does not cancel a compile others may wait for
+            processor = await asyncio.shield(future)
+        except Exception as e:
+            # Failed compiles are retried by the next request
+            if self._entries.get(key) is future:
+                del self._entries[key]
+            raise ValueError(f"Invalid guided decoding constraint: {e}") from e
+
+        processor = copy.copy(processor)
+        processor.init_state()
+        return processor
+
+    def shutdown(self):
+        """Shut down the compile thread."""
+        self._executor.shutdown(wait=False)
+
+    async def _compile(self, guide: Guide):
+        loop = asyncio.get_running_loop()
+        with GUIDED_DECODING_COMPILE.time():
+            return await loop.run_in_executor(
+                self._executor, self.compile_fn, guide, self.tokenizer
+            )
@@ -0,0 +1,121 @@
+"""Logits processor applying an OpenAI logit bias map."""
+
+from functools import lru_cache
+from typing import Dict, List, Tuple
+
+# The OpenAI API clamps every bias between -100 and 100
+MAX_BIAS = 100.0
+
+BiasItems = Tuple[Tuple[int, float], ...]
+
+
+def canonical_logit_bias(logit_bias: Dict[str, float]) -> BiasItems:
+    """Normalize a logit bias map to sorted token ID and clamped bias pairs.
+
+    Args:
+        logit_bias: The logit bias map of a request, keyed by token ID strings.
+
+    Returns:
+        The canonical form of the map, identical for maps biasing the same tokens
+        by the same amounts.
+    """
+    return tuple(
+        sorted(
+            (int(token_id), min(MAX_BIAS, max(-MAX_BIAS, float(bias))))
+            for token_id, bias in logit_bias.items()
+        )
+    )
+
+
+def validate_logit_bias(logit_bias: Dict[str, float], vocab_size: int):
+    """Check that a logit bias map only biases tokens of the vocabulary.
+
+    Runs while validating the request, as an invalid token ID raised in the
+    sampler would fail every request of the batch.
+
+    Args:
+        logit_bias: The logit bias map of a request, keyed by token ID strings.
+        vocab_size: The size of the vocabulary of the tokenizer.
+
+    Raises:
+        ValueError: If a key is not a token ID of the vocabulary.
+    """
+    for token_id in logit_bias:
+        try:
+            valid = 0 <= int(token_id) < vocab_size
+        except ValueError:
+            valid = False
+        if not valid:
+            raise ValueError(
+                f"Token ID {token_id!r} in logit_bias is out of the vocabulary of "
+                f"size {vocab_size}."
+            )
+
+
+class LogitBiasProcessor:
+    """Add a fixed bias to the logits of a set of tokens.
+
+    The bias map is compiled once into an index tensor and a value tensor so each
+    decoding step costs a single `index_add_` instead of a Python loop over the
+    map. Copies of the tensors are kept per device and dtype of the logits.
+
+    The processor runs inside the sampler, where raising would stop the engine,
+    so the map must be checked beforehand with `validate_logit_bias`. Token IDs
+    past the logits are skipped rather than raised.
+    """
+
+    def __init__(self, items: BiasItems):
+        """Compile the bias map.
+
+        Args:
+            items: The canonical bias map, see `canonical_logit_bias`.
+        """
+        import torch
+
+        self.max_token_id = max(token_id for token_id, _ in items)
+        self.token_ids = torch.tensor([token_id for token_id, _ in items])
+        self.biases = torch.tensor([bias for _, bias in items], dtype=torch.float32)
+        self._tensors: Dict[tuple, tuple] = {}
+
+    def __call__(self, token_ids: List[int], logits):
+        """Bias the logits of the next token.
+
+        Args:
+            token_ids: The tokens generated so far.
+            logits: The logits of the next token.
+
+        Returns:
+            The biased logits.
+        """
+        key = (logits.device, logits.dtype)
+        tensors = self._tensors.get(key)
+        if tensors is None:
+            token_ids, biases = self.token_ids, self.biases
+            if self.max_token_id >= logits.shape[-1]:
+                in_vocabulary = token_ids < logits.shape[-1]
+                token_ids, biases = token_ids[in_vocabulary], biases[in_vocabulary]
+            tensors = self._tensors[key] = (
+                token_ids.to(logits.device),
+                biases.to(logits.device, logits.dtype),
+            )
+        return logits.index_add_(-1, *tensors)
+
+
+@lru_cache(maxsize=256)
+def _compile(items: BiasItems) -> LogitBiasProcessor:
+    return LogitBiasProcessor(items)
+
+
+def get_logit_bias_processor(logit_bias: Dict[str, float]) -> LogitBiasProcessor:
+    """Get the compiled processor of a logit bias map.
+
+    Processors are cached by the canonical form of the map so requests sharing a
+    bias map share its compiled tensors.
+
+    Args:
+        logit_bias: The logit bias map of a request, keyed by token ID strings.
+
+    Returns:
+        The logits processor applying the bias.
+    """
+    return _compile(canonical_logit_bias(logit_bias))
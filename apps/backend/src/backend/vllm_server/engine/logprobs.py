@@ -0,0 +1,103 @@
+"""Batched construction of OpenAI style logprobs."""
+
+from functools import lru_cache
+from itertools import accumulate, chain
+from typing import Dict, List, Optional, Sequence
+
+from backend.vllm_server.schema.common import LogProbs
+
+# vLLM < 0.4 reports the logprobs of a step as floats, later versions as `Logprob`
+# objects exposing a `logprob` attribute
+TopLogprobs = Sequence[Optional[Dict[int, object]]]
+
+
+@lru_cache(maxsize=4)
+def _token_table(tokenizer) -> List[Optional[str]]:
+    # The token string of every ID, indexed by ID
+    return tokenizer.convert_ids_to_tokens(list(range(len(tokenizer))))
+
+
+def _convert_ids_to_tokens(tokenizer, token_ids: List[int]) -> List[str]:
+    table = _token_table(tokenizer)
+    if token_ids and max(token_ids) >= len(table):
+        # The model may pad its vocabulary beyond the tokenizer
+        return tokenizer.convert_ids_to_tokens(token_ids)
+    return [table[token_id] for token_id in token_ids]
+
+
+def _logprob_values(values: List) -> List[float]:
+    if values and hasattr(values[0], "logprob"):
+        return [value.logprob for value in values]
+    return values
+
+
+def create_logprobs(
+    tokenizer,
+    token_ids: Sequence[int],
+    top_logprobs: Optional[TopLogprobs] = None,
+    num_output_top_logprobs: Optional[int] = None,
+    initial_text_offset: int = 0,
+) -> LogProbs:
+    """Create OpenAI style logprobs for a sequence of generated tokens.
+
+    Rather than converting every token and every top logprob candidate through the
+    tokenizer one at a time, token strings are looked up in a table of the whole
+    vocabulary built once per tokenizer. The candidates of all steps are flattened
+    into arrays that are converted at once, text offsets are a running sum of the
+    token lengths, and the top logprob dicts are assembled by slicing the arrays.
+
+    Args:
+        tokenizer: The tokenizer of the model being served.
+        token_ids: The generated token IDs.
+        top_logprobs: The logprobs of the candidates of each step, or None for steps
+            without logprobs.
+        num_output_top_logprobs: The number of top logprobs requested. The top
+            logprob dicts are omitted when not set.
+        initial_text_offset: The text offset of the first token.
+
+    Returns:
+        The logprobs of the tokens.
+    """
+    token_ids = list(token_ids)
+    if not token_ids:
+        return LogProbs(top_logprobs=[] if num_output_top_logprobs else None)
+
+    tokens = _convert_ids_to_tokens(tokenizer, token_ids)
+    text_offset = list(accumulate(map(len, tokens[:-1]), initial=initial_text_offset))
+
+    if top_logprobs is None:
+        top_logprobs = [None] * len(token_ids)
+
+    token_logprobs = [
+        getattr(step[token_id], "logprob", step[token_id]) if step else None
+        for token_id, step in zip(token_ids, top_logprobs)
+    ]
+
+    step_top_logprobs = None
+    if num_output_top_logprobs:
+        steps = [step for step in top_logprobs if step]
+        candidate_tokens = _convert_ids_to_tokens(
+            tokenizer, list(chain.from_iterable(steps))
+        )
+        candidate_values = _logprob_values(
+            list(chain.from_iterable(step.values() for step in steps))
+        )
+
+        step_top_logprobs = []
+        end = 0
+        for step in top_logprobs:
+            if not step:
+                step_top_logprobs.append(None)
+                continue
+            start, end = end, end + len(step)
+            step_top_logprobs.append(
+                dict(zip(candidate_tokens[start:end], candidate_values[start:end]))
+            )
+
+    # The arrays are built from engine outputs so validating them is redundant
+    return LogProbs.model_construct(
+        text_offset=text_offset,
+        token_logprobs=token_logprobs,
+        tokens=tokens,
+        top_logprobs=step_top_logprobs,
+    )
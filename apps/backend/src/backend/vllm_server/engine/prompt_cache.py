@@ -0,0 +1,324 @@
+"""Chat template and prompt prefix tokenization cache."""
+
+import hashlib
+import json
+from bisect import bisect_left
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Dict, List, NamedTuple, Optional
+
+from jinja2.exceptions import TemplateError
+from jinja2.sandbox import ImmutableSandboxedEnvironment
+
+
+def hash_message_prefixes(messages: List[Dict[str, str]]) -> List[bytes]:
+    """Hash every prefix of a conversation.
+
+    The hashes are chained so hashing all prefixes costs the same as hashing the
+    full conversation once. The k-th hash identifies `messages[: k + 1]`.
+
+    Args:
+        messages: The chat messages.
+
+    Returns:
+        The digest of each message prefix.
+    """
+    digests = []
+    digest = b""
+    for message in messages:
+        canonical = json.dumps(message, sort_keys=True, separators=(",", ":"))
+        digest = hashlib.blake2b(digest + canonical.encode(), digest_size=16).digest()
+        digests.append(digest)
+    return digests
+
+
+def _raise_exception(message: str):
+    raise TemplateError(message)
+
+
+@lru_cache(maxsize=8)
+def _compile_template(source: str):
+    # Mirrors the environment transformers uses to render chat templates
+    env = ImmutableSandboxedEnvironment(trim_blocks=True, lstrip_blocks=True)
+    env.globals["raise_exception"] = _raise_exception
+    return env.from_string(source)
+
+
+class _PrefixEntry(NamedTuple):
+    text: str
+    token_ids: List[int]
+    token_starts: List[int]
+
+
+class TokenizePlan(NamedTuple):
+    """The text of a prompt that has to be encoded to complete its tokenization."""
+
+    messages: List[Dict[str, str]]
+    prompt: str
+    prefix_hashes: List[bytes]
+    entry: Optional[_PrefixEntry]
+    overlap_start: int
+    text: str
+    add_special_tokens: bool
+
+
+class PromptCache:
+    """Cache for rendering and tokenizing chat prompts.
+
+    Multi-turn conversations resend the same long system prompt and history on every
+    turn. The chat template is compiled once, and the rendered and tokenized prompts
+    of recent conversations are kept in a bounded LRU keyed by the hash of their
+    messages. A new prompt that extends a cached conversation only tokenizes the
+    new suffix, re-encoding a few overlapping tokens to verify the token boundary is
+    stable before splicing the cached token IDs in front of it.
+    """
+
+    def __init__(self, tokenizer, max_entries: int = 256, overlap_tokens: int = 8):
+        """Initialize the prompt cache.
+
+        Args:
+            tokenizer: The tokenizer of the model being served.
+            max_entries: The maximum number of cached prompt prefixes.
+            overlap_tokens: The number of cached tokens re-encoded with the suffix to
+                verify the token boundary.
+        """
+        self.tokenizer = tokenizer
+        self.max_entries = max_entries
+        self.overlap_tokens = max(2, overlap_tokens)
+
+        self.hits = 0
+        self.misses = 0
+        self.reused_tokens = 0
+        self.encoded_tokens = 0
+
+        self._entries: OrderedDict[bytes, _PrefixEntry] = OrderedDict()
+        self._num_leading_special_tokens: Optional[int] = None
+
+    def stats(self) -> Dict[str, int]:
+        """Return the cache counters.
+
+        Returns:
+            The hit, miss and token reuse counters of the cache.
+        """
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "reused_tokens": self.reused_tokens,
+            "encoded_tokens": self.encoded_tokens,
+            "entries": len(self._entries),
+        }
+
+    def render(
+        self,
+        messages: List[Dict[str, str]],
+        *,
+        add_generation_prompt: bool = True,
+    ) -> str:
+        """Render the chat template with the compiled template.
+
+        Args:
+            messages: The chat messages.
+            add_generation_prompt: Whether to append the generation prompt.
+
+        Returns:
+            The rendered prompt.
+        """
+        source = self.tokenizer.chat_template or getattr(
+            self.tokenizer, "default_chat_template", None
+        )
+        if source is None:
+            raise ValueError("No chat template provided or set in tokenizer")
+
+        return _compile_template(source).render(
+            messages=messages,
+            add_generation_prompt=add_generation_prompt,
+            **self.tokenizer.special_tokens_map,
+        )
+
+    def tokenize(self, messages: List[Dict[str, str]], prompt: str) -> List[int]:
+        """Tokenize a rendered prompt, reusing the longest cached prefix.
+
+        Args:
+            messages: The chat messages the prompt was rendered from.
+            prompt: The rendered prompt.
+
+        Returns:
+            The token IDs of the prompt, identical to tokenizing it from scratch.
+        """
+        plan = self.plan(messages, prompt)
+        token_ids = self.complete(plan, self._encode(plan))
+        if token_ids is None:
+            plan = self.full_plan(plan)
+            token_ids = self.complete(plan, self._encode(plan))
+        return token_ids
+
+    def plan(self, messages: List[Dict[str, str]], prompt: str) -> TokenizePlan:
+        """Plan the tokenization of a rendered prompt.
+
+        Looks up the longest cached prefix of the conversation so only the new
+        suffix of the prompt has to be encoded. The caller encodes `plan.text` and
+        passes the encoding to `complete`, which allows the encoding itself to be
+        batched or run off the event loop.
+
+        Args:
+            messages: The chat messages the prompt was rendered from.
+            prompt: The rendered prompt.
+
+        Returns:
+            The plan describing which text has to be encoded.
+        """
+        if not messages or not self._supports_incremental():
+            return TokenizePlan(messages, prompt, [], None, 0, prompt, True)
+
+        prefix_hashes = hash_message_prefixes(messages)
+        for prefix_hash in reversed(prefix_hashes):
+            entry = self._lookup(prefix_hash, prompt)
+            if entry is None:
+                continue
+
+            num_cached = len(entry.token_ids)
+            overlap_start = max(
+                self._num_leading_special_tokens, num_cached - self.overlap_tokens
+            )
+            if num_cached - overlap_start < 2:
+                break
+
+            char_start = entry.token_starts[overlap_start]
+            return TokenizePlan(
+                messages,
+                prompt,
+                prefix_hashes,
+                entry,
+                overlap_start,
+                prompt[char_start:],
+                False,
+            )
+
+        return TokenizePlan(messages, prompt, prefix_hashes, None, 0, prompt, True)
+
+    def full_plan(self, plan: TokenizePlan) -> TokenizePlan:
+        """Plan encoding the whole prompt after a cached prefix failed to splice.
+
+        Args:
+            plan: The plan whose spliced encoding was rejected.
+
+        Returns:
+            The plan encoding the whole prompt.
+        """
+        return plan._replace(
+            entry=None, overlap_start=0, text=plan.prompt, add_special_tokens=True
+        )
+
+    def complete(self, plan: TokenizePlan, encoding) -> Optional[List[int]]:
+        """Complete the tokenization of a prompt from the encoding of its plan.
+
+        Args:
+            plan: The tokenization plan.
+            encoding: The encoding of `plan.text` exposing `input_ids` and, for fast
+                tokenizers, `offset_mapping`.
+
+        Returns:
+            The token IDs of the prompt, or None if the cached prefix could not be
+            spliced and the whole prompt has to be encoded with `full_plan`.
+        """
+        if plan.entry is not None:
+            spliced = self._splice(plan, encoding)
+            if spliced is None:
+                return None
+            self.hits += 1
+            token_ids, token_starts = spliced
+        else:
+            self.misses += 1
+            self.encoded_tokens += len(encoding.input_ids)
+            token_ids = encoding.input_ids
+            if not plan.prefix_hashes:
+                return token_ids
+            token_starts = [start for start, _ in encoding.offset_mapping]
+
+        messages, prompt = plan.messages, plan.prompt
+        self._store(
+            plan.prefix_hashes[-1], _PrefixEntry(prompt, token_ids, token_starts)
+        )
+        if len(messages) > 1 and messages[0].get("role") == "system":
+            # Conversations share the system prompt even when their histories differ
+            self._store_system_prefix(
+                plan.prefix_hashes[0], messages[:1], prompt, token_ids, token_starts
+            )
+
+        return token_ids
+
+    def _encode(self, plan: TokenizePlan):
+        return self.tokenizer(
+            plan.text,
+            add_special_tokens=plan.add_special_tokens,
+            return_offsets_mapping=bool(plan.prefix_hashes),
+        )
+
+    def _supports_incremental(self) -> bool:
+        if self._num_leading_special_tokens is None:
+            # Splicing relies on special tokens only ever being prepended
+            self._num_leading_special_tokens = -1
+            if getattr(self.tokenizer, "is_fast", False):
+                with_special = self.tokenizer("a").input_ids
+                without_special = self.tokenizer(
+                    "a", add_special_tokens=False
+                ).input_ids
+                num_special = len(with_special) - len(without_special)
+                if with_special[num_special:] == without_special:
+                    self._num_leading_special_tokens = num_special
+        return self._num_leading_special_tokens >= 0
+
+    def _lookup(self, prefix_hash: bytes, prompt: str) -> Optional[_PrefixEntry]:
+        entry = self._entries.get(prefix_hash)
+        if entry is None or not prompt.startswith(entry.text):
+            return None
+        self._entries.move_to_end(prefix_hash)
+        return entry
+
+    def _splice(self, plan: TokenizePlan, encoding):
+        # The first overlapping token may encode differently when it starts the text
+        # (e.g. a sentencepiece dummy prefix) so only the rest of the overlap has to
+        # match for the boundary to be considered stable.
+        entry = plan.entry
+        overlap = len(entry.token_ids) - plan.overlap_start
+        if encoding.input_ids[1:overlap] != entry.token_ids[plan.overlap_start + 1 :]:
+            return None
+
+        char_start = entry.token_starts[plan.overlap_start]
+        self.reused_tokens += len(entry.token_ids)
+        self.encoded_tokens += len(encoding.input_ids)
+        token_ids = entry.token_ids + encoding.input_ids[overlap:]
+        token_starts = entry.token_starts + [
+            char_start + start for start, _ in encoding.offset_mapping[overlap:]
+        ]
+        return token_ids, token_starts
+
+    def _store_system_prefix(
+        self,
+        prefix_hash: bytes,
+        messages: List[Dict[str, str]],
+        prompt: str,
+        token_ids: List[int],
+        token_starts: List[int],
+    ):
+        if prefix_hash in self._entries:
+            self._entries.move_to_end(prefix_hash)
+            return
+
+        text = self.render(messages, add_generation_prompt=False)
+        if not prompt.startswith(text):
+            return
+
+        num_tokens = bisect_left(
+            token_starts, len(text), lo=self._num_leading_special_tokens
+        )
+        self._store(
+            prefix_hash,
+            _PrefixEntry(text, token_ids[:num_tokens], token_starts[:num_tokens]),
+        )
+
+    def _store(self, prefix_hash: bytes, entry: _PrefixEntry):
+        self._entries[prefix_hash] = entry
+        self._entries.move_to_end(prefix_hash)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
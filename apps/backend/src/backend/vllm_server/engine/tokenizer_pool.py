@@ -0,0 +1,148 @@
+"""Asynchronous tokenization service backed by worker threads."""
+
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, List, NamedTuple, Optional, Tuple
+
+
+class Encoding(NamedTuple):
+    """The encoding of a single text."""
+
+    input_ids: List[int]
+    offset_mapping: Optional[List[Tuple[int, int]]]
+
+
+class TokenizerPool:
+    """Run tokenization and template rendering off the event loop.
+
+    Rendering a chat template or tokenizing a large prompt on the event loop stalls
+    every other stream served by the container. Texts are encoded on a dedicated
+    tokenizer thread; the fast tokenizers release the GIL while encoding so the event
+    loop keeps streaming tokens in the meantime. Texts submitted while a batch is
+    being encoded are queued and encoded together in a single batched tokenizer call
+    once the thread frees up, so bursts of requests cost one call rather than one
+    per request. Other CPU bound work such as rendering templates runs on a separate
+    pool so it never queues behind tokenization.
+    """
+
+    def __init__(self, tokenizer, max_batch_size: int = 64, max_workers: int = 2):
+        """Initialize the tokenizer pool.
+
+        Args:
+            tokenizer: The tokenizer of the model being served.
+            max_batch_size: The maximum number of texts encoded in a single call.
+            max_workers: The number of threads running other offloaded work.
+        """
+        self.tokenizer = tokenizer
+        self.max_batch_size = max_batch_size
+
+        self.batches = 0
+        self.encoded_texts = 0
+
+        # Fast tokenizers are not safe to call concurrently so a single thread
+        # owns the tokenizer
+        self._tokenizer_executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="tokenizer"
+        )
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="tokenizer-pool"
+        )
+        self._queue: List[Tuple[str, bool, asyncio.Future]] = []
+        self._encoding = False
+
+    async def run(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """Run a CPU bound function on the worker pool.
+
+        Args:
+            fn: The function to run.
+            *args: The positional arguments of the function.
+            **kwargs: The keyword arguments of the function.
+
+        Returns:
+            The return value of the function.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor, functools.partial(fn, *args, **kwargs)
+        )
+
+    async def encode(self, text: str, *, add_special_tokens: bool = True) -> Encoding:
+        """Encode a text on the tokenizer thread.
+
+        Args:
+            text: The text to encode.
+            add_special_tokens: Whether to add the special tokens of the tokenizer.
+
+        Returns:
+            The encoding of the text, including the offset mapping for fast
+            tokenizers.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._queue.append((text, add_special_tokens, future))
+        if len(self._queue) == 1 and not self._encoding:
+            # Defer to the next loop iteration so texts submitted in the same
+            # iteration share a batch
+            loop.call_soon(self._dispatch)
+        return await future
+
+    def shutdown(self):
+        """Shut down the worker threads."""
+        self._tokenizer_executor.shutdown(wait=False)
+        self._executor.shutdown(wait=False)
+
+    def _dispatch(self):
+        if self._encoding or not self._queue:
+            return
+
+        batch = self._queue[: self.max_batch_size]
+        self._queue = self._queue[self.max_batch_size :]
+        self._encoding = True
+
+        loop = asyncio.get_running_loop()
+        encoded = loop.run_in_executor(
+            self._tokenizer_executor,
+            self._encode_batch,
+            [(text, add_special_tokens) for text, add_special_tokens, _ in batch],
+        )
+        encoded.add_done_callback(functools.partial(self._resolve, batch))
+
+    def _resolve(self, batch: List[Tuple[str, bool, asyncio.Future]], encoded):
+        self._encoding = False
+        error = encoded.exception()
+        for i, (_, _, future) in enumerate(batch):
+            if future.done():
+                continue
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(encoded.result()[i])
+        self._dispatch()
+
+    def _encode_batch(self, items: List[Tuple[str, bool]]) -> List[Encoding]:
+        self.batches += 1
+        self.encoded_texts += len(items)
+
+        return_offsets_mapping = getattr(self.tokenizer, "is_fast", False)
+        encodings: List[Optional[Encoding]] = [None] * len(items)
+        for add_special_tokens in (True, False):
+            indices = [
+                i for i, item in enumerate(items) if item[1] == add_special_tokens
+            ]
+            if not indices:
+                continue
+
+            batch_encoding = self.tokenizer(
+                [items[i][0] for i in indices],
+                add_special_tokens=add_special_tokens,
+                return_offsets_mapping=return_offsets_mapping,
+            )
+            for j, i in enumerate(indices):
+                encodings[i] = Encoding(
+                    batch_encoding.input_ids[j],
+                    batch_encoding.offset_mapping[j]
+                    if return_offsets_mapping
+                    else None,
+                )
+        return encodings
@@ -0,0 +1,151 @@
+"""Deficit round robin queue sharing admission fairly between tenants."""
+
+from collections import OrderedDict, deque
+from typing import (
+    Deque,
+    Dict,
+    Generic,
+    NamedTuple,
+    Optional,
+    Protocol,
+    Tuple,
+    TypeVar,
+)
+
+# Priority classes from the most to the least urgent
+INTERACTIVE = "interactive"
+BATCH = "batch"
+PRIORITIES = (INTERACTIVE, BATCH)
+
+
+class Scheduling(NamedTuple):
+    """Who a request is scheduled for."""
+
+    # The user or API key requests are shared fairly between
+    tenant: str = ""
+    priority: str = INTERACTIVE
+
+
+DEFAULT_SCHEDULING = Scheduling()
+
+
+class Queued(Protocol):
+    """An item of the fair queue."""
+
+    tokens: int
+    scheduling: Scheduling
+
+
+T = TypeVar("T", bound=Queued)
+
+
+class FairQueue(Generic[T]):
+    """Queue of requests served by priority class, then fairly between tenants.
+
+    Requests of a higher priority class are always served before requests of a
+    lower one. Within a class, tenants are served with deficit round robin: each
+    visit credits a tenant with a quantum of tokens weighted by the tenant, and the
+    tenant's queued requests are served while their cost is covered by its credit.
+    A tenant submitting many or large requests therefore receives the same share
+    of tokens as any other tenant with queued requests, instead of being served in
+    arrival order ahead of them.
+    """
+
+    def __init__(self, quantum: int = 2048, weights: Optional[Dict[str, float]] = None):
+        """Initialize the fair queue.
+
+        Args:
+            quantum: The number of tokens a tenant is credited per round.
+            weights: The weight of the quantum of each tenant, 1 if not set.
+
+        Raises:
+            ValueError: If the quantum or a weight is not positive, as a tenant
+                would never be credited enough to be served.
+        """
+        if quantum <= 0:
+            raise ValueError(f"The quantum must be positive, got {quantum}.")
+        for tenant, weight in (weights or {}).items():
+            if weight <= 0:
+                raise ValueError(
+                    f"The weight of tenant {tenant!r} must be positive, got {weight}."
+                )
+        self.quantum = quantum
+        self.weights = weights or {}
+        self._length = 0
+        # The queues of the tenants of each class with queued requests, in
+        # round robin order
+        self._classes: Dict[str, OrderedDict[str, Deque[T]]] = {
+            priority: OrderedDict() for priority in PRIORITIES
+        }
+        self._deficits: Dict[Tuple[str, str], float] = {}
+
+    def __len__(self) -> int:
+        """Return the number of queued requests."""
+        return self._length
+
+    def push(self, item: T):
+        """Queue a request.
+
+        Args:
+            item: The request.
+        """
+        tenant, priority = item.scheduling
+        if priority not in self._classes:
+            raise ValueError(
+                f"Unknown priority {priority!r}, expected one of {PRIORITIES}."
+            )
+        tenants = self._classes[priority]
+        if tenant not in tenants:
+            tenants[tenant] = deque()
+            self._deficits[(priority, tenant)] = 0.0
+        tenants[tenant].append(item)
+        self._length += 1
+
+    def peek(self) -> Optional[T]:
+        """Return the request to serve next without removing it.
+
+        Returns:
+            The next request, or None if the queue is empty.
+        """
+        for priority, tenants in self._classes.items():
+            while tenants:
+                tenant, queue = next(iter(tenants.items()))
+                key = (priority, tenant)
+                if self._deficits[key] >= queue[0].tokens:
+                    return queue[0]
+                # The tenant spent its credit, credit it and move on to the next
+                self._deficits[key] += self.quantum * self.weights.get(tenant, 1.0)
+                tenants.move_to_end(tenant)
+        return None
+
+    def pop(self) -> T:
+        """Remove and return the request to serve next.
+
+        Returns:
+            The next request.
+        """
+        item = self.peek()
+        if item is None:
+            raise IndexError("pop from an empty fair queue")
+        tenant, priority = item.scheduling
+        self._deficits[(priority, tenant)] -= item.tokens
+        self._discard(item)
+        return item
+
+    def remove(self, item: T):
+        """Remove a queued request, e.g. once it timed out.
+
+        Args:
+            item: The request.
+        """
+        self._discard(item)
+
+    def _discard(self, item: T):
+        tenant, priority = item.scheduling
+        tenants = self._classes[priority]
+        tenants[tenant].remove(item)
+        self._length -= 1
+        if not tenants[tenant]:
+            # Idle tenants do not accumulate credit
+            del tenants[tenant]
+            del self._deficits[(priority, tenant)]
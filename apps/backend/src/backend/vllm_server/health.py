@@ -0,0 +1,236 @@
+"""Health of the model containers from the heartbeats they publish.
+
+Probing a model container wakes it, which cold starts a GPU when none is running.
+Model containers instead publish heartbeats with the stats of their engine to a
+shared dict, and the gateway answers health and readiness probes from the latest
+heartbeats it read.
+"""
+
+import asyncio
+import threading
+import time
+from typing import Callable, Dict, List, NamedTuple, Optional, Sequence
+
+from backend.vllm_server.logger import init_logger
+
+logger = init_logger(__name__)
+
+# Heartbeats of every model container, keyed by container ID under a single key
+# since modal dicts cannot list their keys
+HEARTBEATS_KEY = "heartbeats"
+
+WARM = "warm"
+COLD = "cold"
+UNHEALTHY = "unhealthy"
+
+
+class Heartbeat(NamedTuple):
+    """The state of a model container when it sent a heartbeat."""
+
+    container_id: str
+    replica: int
+    sent_at: float
+    # Whether the engine loop of the container is running
+    healthy: bool
+    running: int
+    waiting: int
+    # The fraction of the KV cache blocks in use
+    kv_cache_usage: float
+
+
+class ReplicaHealth(NamedTuple):
+    """The health of a model replica from the fresh heartbeats of its containers."""
+
+    replica: int
+    # `warm` with a healthy container, `unhealthy` when every container reporting
+    # is unhealthy, or `cold` when no container reported within the staleness bound
+    state: str
+    containers: int
+    running: int
+    waiting: int
+    kv_cache_usage: Optional[float]
+    # The number of seconds since the latest heartbeat of the replica
+    age: Optional[float]
+
+
+class HeartbeatStore:
+    """Heartbeats of the model containers, shared with the gateway.
+
+    Containers publish from their heartbeat thread with the blocking calls of the
+    modal dict, the gateway reads with the async ones. Concurrent publishes from
+    other containers may overwrite a heartbeat with its previous version until the
+    next one, so the staleness bound should span a few heartbeat intervals.
+    Heartbeats older than the staleness bound are pruned on every publish, so
+    containers that stopped without removing theirs do not pile up.
+    """
+
+    def __init__(self, store, staleness: float = 30.0):
+        """Initialize the heartbeat store.
+
+        Args:
+            store: The modal dict holding the heartbeats.
+            staleness: The number of seconds a heartbeat is kept.
+        """
+        self.store = store
+        self.staleness = staleness
+
+    def publish(self, heartbeat: Heartbeat):
+        """Publish the heartbeat of a container, pruning the stale ones.
+
+        Args:
+            heartbeat: The heartbeat.
+        """
+        heartbeats = {
+            container_id: known
+            for container_id, known in self.store.get(HEARTBEATS_KEY, {}).items()
+            if heartbeat.sent_at - known.sent_at <= self.staleness
+        }
+        heartbeats[heartbeat.container_id] = heartbeat
+        self.store.put(HEARTBEATS_KEY, heartbeats)
+
+    def remove(self, container_id: str):
+        """Remove the heartbeat of a stopped container.
+
+        Args:
+            container_id: The ID of the container.
+        """
+        heartbeats = self.store.get(HEARTBEATS_KEY, {})
+        if heartbeats.pop(container_id, None) is not None:
+            self.store.put(HEARTBEATS_KEY, heartbeats)
+
+    async def read(self) -> List[Heartbeat]:
+        """Read the heartbeats of every container."""
+        heartbeats = await self.store.get.aio(HEARTBEATS_KEY, {})
+        return list(heartbeats.values())
+
+
+def send_heartbeats(
+    store: HeartbeatStore,
+    heartbeat: Callable[[], Heartbeat],
+    interval: float,
+    stopped: threading.Event,
+):
+    """Publish heartbeats until stopped.
+
+    Runs in a thread of the model container so heartbeats are sent while the
+    event loop is busy, and while the container is idle.
+
+    Args:
+        store: The heartbeat store.
+        heartbeat: Returns the current heartbeat of the container.
+        interval: The number of seconds between heartbeats.
+        stopped: Set to stop sending heartbeats.
+    """
+    while True:
+        try:
+            store.publish(heartbeat())
+        except Exception as e:
+            logger.warning(f"Failed to publish heartbeat: {e}")
+        if stopped.wait(interval):
+            return
+
+
+class HealthMonitor:
+    """Health of the model replicas as seen by the gateway.
+
+    The heartbeats are read at most every `cache_ttl` seconds however often the
+    gateway is probed, and heartbeats older than `staleness` seconds are ignored.
+    When the store cannot be read the previous heartbeats are kept, so they turn
+    stale rather than failing the probes.
+    """
+
+    def __init__(
+        self,
+        store: HeartbeatStore,
+        replicas: int = 1,
+        staleness: float = 30.0,
+        cache_ttl: float = 2.0,
+        clock: Callable[[], float] = time.time,
+    ):
+        """Initialize the health monitor.
+
+        Args:
+            store: The heartbeat store.
+            replicas: The number of model replicas.
+            staleness: The number of seconds a heartbeat counts for.
+            cache_ttl: The number of seconds the heartbeats read are reused.
+            clock: The clock of the heartbeats, shared with the model containers.
+        """
+        self.store = store
+        self.replicas = replicas
+        self.staleness = staleness
+        self.cache_ttl = cache_ttl
+        self.clock = clock
+        self._heartbeats: List[Heartbeat] = []
+        self._read_at = -float("inf")
+        self._lock = asyncio.Lock()
+
+    async def heartbeats(self) -> List[Heartbeat]:
+        """Get the fresh heartbeats of the model containers."""
+        if self.clock() - self._read_at >= self.cache_ttl:
+            # Concurrent probes share a single read of the store
+            async with self._lock:
+                if self.clock() - self._read_at >= self.cache_ttl:
+                    try:
+                        self._heartbeats = await self.store.read()
+                    except Exception as e:
+                        logger.warning(f"Failed to read heartbeats: {e}")
+                    self._read_at = self.clock()
+
+        cutoff = self.clock() - self.staleness
+        return [
+            heartbeat for heartbeat in self._heartbeats if heartbeat.sent_at >= cutoff
+        ]
+
+    def record(self, heartbeat: Heartbeat):
+        """Record a heartbeat received from a container, e.g. by a deep probe.
+
+        Args:
+            heartbeat: The heartbeat.
+        """
+        self._heartbeats = [
+            known
+            for known in self._heartbeats
+            if known.container_id != heartbeat.container_id
+        ]
+        self._heartbeats.append(heartbeat)
+
+    async def replica_health(self) -> List[ReplicaHealth]:
+        """Get the health of every model replica."""
+        by_replica: Dict[int, List[Heartbeat]] = {}
+        for heartbeat in await self.heartbeats():
+            by_replica.setdefault(heartbeat.replica, []).append(heartbeat)
+        now = self.clock()
+        return [
+            _replica_health(replica, by_replica.get(replica, ()), now)
+            for replica in range(self.replicas)
+        ]
+
+
+def _replica_health(
+    replica: int, heartbeats: Sequence[Heartbeat], now: float
+) -> ReplicaHealth:
+    healthy = [heartbeat for heartbeat in heartbeats if heartbeat.healthy]
+    if healthy:
+        state = WARM
+    elif heartbeats:
+        state = UNHEALTHY
+    else:
+        state = COLD
+    return ReplicaHealth(
+        replica=replica,
+        state=state,
+        containers=len(healthy),
+        running=sum(heartbeat.running for heartbeat in healthy),
+        waiting=sum(heartbeat.waiting for heartbeat in healthy),
+        kv_cache_usage=(
+            sum(heartbeat.kv_cache_usage for heartbeat in healthy) / len(healthy)
+            if healthy
+            else None
+        ),
+        age=(
+            now - max(heartbeat.sent_at for heartbeat in heartbeats)
+            if heartbeats
+            else None
+        ),
+    )
@@ -4,8 +4,8 @@ import os
 
 from modal import Image, gpu
 
-MODEL_DIR = "/model"
-BASE_MODEL = "mistralai/Mistral-7B-Instruct-v0.1"
+from backend.vllm_server.config import BASE_MODEL, MODEL_DIR, SERVING_MODE
+
 GPU_CONFIG = gpu.A100(count=1, memory=40)
 
 
@@ -31,7 +31,7 @@ def download_model_to_folder():
 
 image = (
     Image.from_registry("nvidia/cuda:12.1.0-base-ubuntu22.04", add_python="3.10")
-    .pip_install("vllm==0.2.6")
+    .pip_install("vllm==0.3.3")
     .pip_install(
         "pydantic>=2.6.4",
         "fastapi>=0.110.0",
@@ -40,4 +40,5 @@ image = (
         download_model_to_folder,
         timeout=60 * 20,
     )
+    .env({"HOOPER_SERVING_MODE": SERVING_MODE})
 )
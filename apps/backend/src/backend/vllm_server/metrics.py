@@ -0,0 +1,476 @@
+"""Low overhead request metrics exposed in the Prometheus text format."""
+
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Sequence, Tuple
+
+DEFAULT_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+)
+TOKEN_BUCKETS = (0.005, 0.01, 0.015, 0.02, 0.03, 0.04, 0.05, 0.075, 0.1, 0.25, 0.5)
+
+Snapshot = Dict[str, Dict[str, Any]]
+
+
+class _Value:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+    def dec(self, amount: float = 1.0):
+        self.value -= amount
+
+    def set(self, value: float):
+        self.value = value
+
+
+class _Histogram:
+    __slots__ = ("bounds", "counts", "sum")
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+    @contextmanager
+    def time(self) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+
+class Metric:
+    """A family of metric values sharing a name, partitioned by label values."""
+
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        """Initialize the metric.
+
+        Args:
+            name: The name of the metric.
+            documentation: The help text of the metric.
+            labelnames: The names of the labels partitioning the metric.
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], Any] = {}
+        self._unlabeled = None if self.labelnames else self.labels()
+
+    def labels(self, *labelvalues: str):
+        """Return the value of the metric for the given label values.
+
+        Args:
+            *labelvalues: The values of the labels, in the order of `labelnames`.
+
+        Returns:
+            The metric value for the label values.
+        """
+        key = tuple(str(value) for value in labelvalues)
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}")
+            child = self._children[key] = self._new_child()
+        return child
+
+    def _new_child(self):
+        return _Value()
+
+    def _sample(self, child) -> Any:
+        return child.value
+
+    def _snapshot(self) -> Dict[str, Any]:
+        return {
+            "kind": self.kind,
+            "documentation": self.documentation,
+            "labelnames": self.labelnames,
+            "samples": {
+                key: self._sample(child) for key, child in self._children.items()
+            },
+        }
+
+
+class Counter(Metric):
+    """A monotonically increasing counter."""
+
+    kind = "counter"
+
+    def inc(self, amount: float = 1.0):
+        """Increment the unlabeled counter."""
+        self._unlabeled.inc(amount)
+
+
+class Gauge(Metric):
+    """A value that can go up and down."""
+
+    kind = "gauge"
+
+    def inc(self, amount: float = 1.0):
+        """Increment the unlabeled gauge."""
+        self._unlabeled.inc(amount)
+
+    def dec(self, amount: float = 1.0):
+        """Decrement the unlabeled gauge."""
+        self._unlabeled.dec(amount)
+
+    def set(self, value: float):
+        """Set the unlabeled gauge."""
+        self._unlabeled.set(value)
+
+
+class Histogram(Metric):
+    """A histogram of observations counted in fixed buckets."""
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        """Initialize the histogram.
+
+        Args:
+            name: The name of the metric.
+            documentation: The help text of the metric.
+            labelnames: The names of the labels partitioning the metric.
+            buckets: The upper bounds of the buckets.
+        """
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def observe(self, value: float):
+        """Record an observation in the unlabeled histogram."""
+        self._unlabeled.observe(value)
+
+    def time(self):
+        """Time a block of code and record its duration in seconds."""
+        return self._unlabeled.time()
+
+    def _new_child(self):
+        return _Histogram(self.buckets)
+
+    def _sample(self, child) -> Any:
+        return list(child.counts), child.sum
+
+    def _snapshot(self) -> Dict[str, Any]:
+        return {**super()._snapshot(), "buckets": self.buckets}
+
+
+class Registry:
+    """A collection of metrics rendered together."""
+
+    def __init__(self):
+        """Initialize an empty registry."""
+        self._metrics: Dict[str, Metric] = {}
+        self._collectors: List[Callable[[], None]] = []
+
+    def counter(self, name: str, documentation: str, labelnames=()) -> Counter:
+        """Register a counter."""
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames=()) -> Gauge:
+        """Register a gauge."""
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames=(),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        """Register a histogram."""
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def add_collector(self, collector: Callable[[], None]):
+        """Register a callback refreshing metrics right before they are read.
+
+        Args:
+            collector: The callback, typically setting gauges from external state.
+        """
+        self._collectors.append(collector)
+
+    def snapshot(self) -> Snapshot:
+        """Capture the current value of every metric.
+
+        Returns:
+            A picklable snapshot that can be merged into another registry's output.
+        """
+        for collector in self._collectors:
+            collector()
+        return {name: metric._snapshot() for name, metric in self._metrics.items()}
+
+    def render(self, snapshots: Sequence[Snapshot] = ()) -> str:
+        """Render the metrics in the Prometheus text exposition format.
+
+        Args:
+            snapshots: Snapshots of other registries, e.g. from other processes, to
+                merge into the output. Counters, gauges and histograms sharing a
+                name and label values are summed.
+
+        Returns:
+            The metrics in the Prometheus text format.
+        """
+        merged = merge_snapshots([self.snapshot(), *snapshots])
+        lines = []
+        for name, family in merged.items():
+            lines.append(f"# HELP {name} {family['documentation']}")
+            lines.append(f"# TYPE {name} {family['kind']}")
+            labelnames = family["labelnames"]
+            for key, sample in family["samples"].items():
+                labels = list(zip(labelnames, key))
+                if family["kind"] != "histogram":
+                    lines.append(f"{name}{_format_labels(labels)} {sample}")
+                    continue
+
+                counts, total = sample
+                cumulative = 0
+                for bound, count in zip([*family["buckets"], "+Inf"], counts):
+                    cumulative += count
+                    le = _format_labels([*labels, ("le", _format_bound(bound))])
+                    lines.append(f"{name}_bucket{le} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {total}")
+                lines.append(f"{name}_count{_format_labels(labels)} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+    def _register(self, metric: Metric) -> Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+
+def merge_snapshots(snapshots: Sequence[Snapshot]) -> Snapshot:
+    """Merge metric snapshots by summing samples with the same labels.
+
+    Args:
+        snapshots: The snapshots to merge.
+
+    Returns:
+        The merged snapshot.
+    """
+    merged: Snapshot = {}
+    for snapshot in snapshots:
+        for name, family in snapshot.items():
+            target = merged.get(name)
+            if target is None:
+                merged[name] = {**family, "samples": dict(family["samples"])}
+                continue
+
+            for key, sample in family["samples"].items():
+                existing = target["samples"].get(key)
+                if existing is None:
+                    target["samples"][key] = sample
+                elif family["kind"] == "histogram":
+                    counts = [a + b for a, b in zip(existing[0], sample[0])]
+                    target["samples"][key] = (counts, existing[1] + sample[1])
+                else:
+                    target["samples"][key] = existing + sample
+    return merged
+
+
+def _format_bound(bound) -> str:
+    return bound if isinstance(bound, str) else repr(float(bound))
+
+
+def _format_labels(labels: List[Tuple[str, str]]) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        (name, value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in labels
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+async def observe_request_outputs(results_generator, started: float):
+    """Record engine timings while forwarding the outputs of a request.
+
+    Args:
+        results_generator: The generator of request outputs.
+        started: The `time.perf_counter()` timestamp the model container received
+            the request at.
+
+    Yields:
+        The request outputs.
+    """
+    submitted = time.perf_counter()
+    last = None
+    num_tokens = 0
+    try:
+        async for res in results_generator:
+            now = time.perf_counter()
+            generated = sum(len(output.token_ids) for output in res.outputs)
+            if last is None:
+                TIME_TO_FIRST_TOKEN.observe(now - started)
+                request_metrics = getattr(res, "metrics", None)
+                if getattr(request_metrics, "first_scheduled_time", None):
+                    ENGINE_QUEUE.observe(
+                        request_metrics.first_scheduled_time
+                        - request_metrics.arrival_time
+                    )
+                else:
+                    ENGINE_QUEUE.observe(now - submitted)
+            elif generated > num_tokens:
+                # A step may produce several tokens, e.g. with n > 1
+                gap = (now - last) / (generated - num_tokens)
+                for _ in range(generated - num_tokens):
+                    INTER_TOKEN.observe(gap)
+            last = now
+            num_tokens = generated
+            yield res
+    finally:
+        REQUEST_TOTAL.observe(time.perf_counter() - started)
+        GENERATED_TOKENS.inc(num_tokens)
+
+
+REGISTRY = Registry()
+
+# Gateway, recorded by the FastAPI app
+GATEWAY_RECEIVE = REGISTRY.histogram(
+    "hooper_gateway_receive_seconds",
+    "Time from the gateway receiving a request to dispatching it to the model.",
+)
+GATEWAY_TIME_TO_FIRST_CHUNK = REGISTRY.histogram(
+    "hooper_gateway_time_to_first_chunk_seconds",
+    "Time from the gateway receiving a request to the first response chunk.",
+)
+GATEWAY_REQUEST = REGISTRY.histogram(
+    "hooper_gateway_request_seconds",
+    "Total time spent serving a request in the gateway.",
+)
+RESPONSE_CACHE_REQUESTS = REGISTRY.counter(
+    "hooper_response_cache_requests_total",
+    "Number of chat completion requests by response cache result.",
+    labelnames=("result",),
+)
+RESPONSE_CACHE_ENTRIES = REGISTRY.gauge(
+    "hooper_response_cache_entries", "Number of cached chat completion responses."
+)
+GATEWAY_DISCONNECTS = REGISTRY.counter(
+    "hooper_gateway_disconnects_total",
+    "Number of streams whose client disconnected before the stream finished.",
+)
+ROUTING_REQUESTS = REGISTRY.counter(
+    "hooper_routing_requests_total",
+    "Number of requests routed to each model replica, by whether the replica "
+    "served the last request with the same prefix.",
+    labelnames=("replica", "prefix"),
+)
+ROUTING_FALLBACKS = REGISTRY.counter(
+    "hooper_routing_fallbacks_total",
+    "Number of requests routed away from the replica owning their prefix, by reason.",
+    labelnames=("reason",),
+)
+ROUTING_IN_FLIGHT = REGISTRY.gauge(
+    "hooper_routing_in_flight",
+    "Number of requests in flight on each model replica.",
+    labelnames=("replica",),
+)
+
+# Model container, recorded next to the engine
+REMOTE_DISPATCH = REGISTRY.histogram(
+    "hooper_remote_dispatch_seconds",
+    "Time from the gateway dispatching a request to the model container running it.",
+)
+TEMPLATE_RENDER = REGISTRY.histogram(
+    "hooper_template_render_seconds", "Time spent rendering the chat template."
+)
+TOKENIZE = REGISTRY.histogram(
+    "hooper_tokenize_seconds", "Time spent tokenizing the prompt."
+)
+ENGINE_QUEUE = REGISTRY.histogram(
+    "hooper_engine_queue_seconds",
+    "Time a request waits in the engine before it is scheduled, including the "
+    "prefill when the engine does not report scheduling times.",
+)
+TIME_TO_FIRST_TOKEN = REGISTRY.histogram(
+    "hooper_time_to_first_token_seconds",
+    "Time from the model container receiving a request to its first token.",
+)
+INTER_TOKEN = REGISTRY.histogram(
+    "hooper_inter_token_seconds",
+    "Time between consecutive generated tokens.",
+    buckets=TOKEN_BUCKETS,
+)
+REQUEST_TOTAL = REGISTRY.histogram(
+    "hooper_request_seconds",
+    "Total time the model container spent serving a request.",
+)
+GENERATED_TOKENS = REGISTRY.counter(
+    "hooper_generated_tokens_total", "Number of tokens generated."
+)
+PROMPT_CACHE_LOOKUPS = REGISTRY.counter(
+    "hooper_prompt_cache_lookups_total",
+    "Number of prompt cache lookups by result.",
+    labelnames=("result",),
+)
+PROMPT_CACHE_TOKENS = REGISTRY.counter(
+    "hooper_prompt_cache_tokens_total",
+    "Number of prompt tokens by whether they were reused or encoded.",
+    labelnames=("source",),
+)
+GUIDED_DECODING_LOOKUPS = REGISTRY.counter(
+    "hooper_guided_decoding_lookups_total",
+    "Number of guided decoding processor cache lookups by result.",
+    labelnames=("result",),
+)
+GUIDED_DECODING_COMPILE = REGISTRY.histogram(
+    "hooper_guided_decoding_compile_seconds",
+    "Time spent compiling guided decoding state machines.",
+)
+CANCELLED_REQUESTS = REGISTRY.counter(
+    "hooper_cancelled_requests_total",
+    "Number of streams aborted in the engine before they finished.",
+)
+CANCELLED_TOKENS_SAVED = REGISTRY.counter(
+    "hooper_cancelled_tokens_saved_total",
+    "Number of tokens not generated because their stream was aborted, bounded by "
+    "max_tokens.",
+)
+ADMISSION_COMMITTED_TOKENS = REGISTRY.gauge(
+    "hooper_admission_committed_tokens",
+    "Number of prompt and maximum generated tokens committed to admitted requests.",
+)
+ADMISSION_QUEUE_DEPTH = REGISTRY.gauge(
+    "hooper_admission_queue_depth", "Number of requests waiting for admission."
+)
+ADMISSION_QUEUE_WAIT = REGISTRY.histogram(
+    "hooper_admission_queue_wait_seconds",
+    "Time requests waited for admission, including rejected requests.",
+)
+ADMISSION_REJECTED = REGISTRY.counter(
+    "hooper_admission_rejected_total",
+    "Number of requests shed by admission control by reason.",
+    labelnames=("reason",),
+)
@@ -1,29 +1,95 @@
 """vLLM model wrapper for the vLLM inference engine."""
 
-from typing import AsyncGenerator, Union
+import os
+import threading
+import time
+from typing import AsyncGenerator, Optional, Union
 
-from modal import Stub, enter, exit, method
-from vllm import AsyncEngineArgs, AsyncLLMEngine
-from vllm.utils import random_uuid
+from modal import Dict, Stub, asgi_app, enter, exit, method
 
+from backend.vllm_server.admission import AdmissionController
+from backend.vllm_server.cancellation import CancellationStore
+from backend.vllm_server.config import (
+    ADMISSION_KV_BUDGET_TOKENS,
+    ADMISSION_MAX_QUEUE_SIZE,
+    ADMISSION_MAX_QUEUE_WAIT,
+    APP_NAME,
+    BASE_MODEL,
+    CANCELLATIONS_DICT_NAME,
+    COLOCATED,
+    DEFAULT_MAX_TOKENS,
+    GATEWAY,
+    HEALTH_DICT_NAME,
+    HEALTH_HEARTBEAT_INTERVAL,
+    HEALTH_HEARTBEAT_STALENESS,
+    MAX_CONCURRENT_INPUTS,
+    METRICS_DICT_NAME,
+    METRICS_PUBLISH_INTERVAL,
+    METRICS_SNAPSHOT_TTL,
+    MODEL_DIR,
+    SERVING_MODE,
+)
 from backend.vllm_server.engine.chat import ChatEngine
-from backend.vllm_server.infra import BASE_MODEL, GPU_CONFIG, MODEL_DIR, image
+from backend.vllm_server.engine.completion import CompletionEngine
+from backend.vllm_server.fair_queue import DEFAULT_SCHEDULING, Scheduling
+from backend.vllm_server.health import Heartbeat, HeartbeatStore, send_heartbeats
+from backend.vllm_server.infra import GPU_CONFIG, image
 from backend.vllm_server.logger import init_logger
+from backend.vllm_server.metrics import REGISTRY
+from backend.vllm_server.router import PrefixRouter
 from backend.vllm_server.schema.chat import (
     ChatCompletionRequest,
     ChatCompletionResponse,
 )
 from backend.vllm_server.schema.common import ErrorResponse
-from backend.vllm_server.utils import create_chat_template, create_error_response
+from backend.vllm_server.schema.completion import (
+    CompletionRequest,
+    CompletionResponse,
+)
+from backend.vllm_server.service import LocalModel, ModelService
+from backend.vllm_server.utils import create_chat_template, random_uuid
 
 logger = init_logger(__name__)
 
-stub = Stub("vLLM-OpenAI-server", image=image)
+stub = Stub(APP_NAME, image=image)
+
+
+# Metric snapshots of every model container, keyed by container ID under a single
+# key since modal dicts cannot list their keys
+metrics_store = Dict.from_name(METRICS_DICT_NAME, create_if_missing=True)
+METRICS_SNAPSHOTS_KEY = "snapshots"
+
+# Streams cancelled by the gateway, keyed by request ID
+cancellations = CancellationStore(
+    Dict.from_name(CANCELLATIONS_DICT_NAME, create_if_missing=True)
+)
+
+# Heartbeats the gateway answers health probes from, keyed by container ID
+heartbeats = HeartbeatStore(
+    Dict.from_name(HEALTH_DICT_NAME, create_if_missing=True),
+    staleness=HEALTH_HEARTBEAT_STALENESS,
+)
 
 
-@stub.cls(gpu=GPU_CONFIG, allow_concurrent_inputs=12, container_idle_timeout=300)
+@stub.cls(
+    gpu=GPU_CONFIG,
+    allow_concurrent_inputs=MAX_CONCURRENT_INPUTS,
+    container_idle_timeout=300,
+)
 class Model:
-    """Wrapper for the vLLM inference engine."""
+    """Wrapper for the vLLM inference engine.
+
+    Each `replica` is its own pool of containers, which the gateway routes requests
+    to by their prompt prefix.
+    """
+
+    def __init__(self, replica: int = 0):
+        """Select the replica of the model.
+
+        Args:
+            replica: The index of the replica, below `MODEL_REPLICAS`.
+        """
+        self.replica = replica
 
     @enter()
     def load(self):
@@ -32,6 +98,9 @@ class Model:
         When the container image starts, this method is called to load the vLLM model
         into memory and initialize the engine.
         """
+        # Only imported by the GPU containers so the gateway starts quickly
+        from vllm import AsyncEngineArgs, AsyncLLMEngine
+
         if GPU_CONFIG.count > 1:
             # Patch issue from https://github.com/vllm-project/vllm/issues/1116
             import ray
@@ -53,56 +122,199 @@ class Model:
         chat_template = create_chat_template()
 
         self.engine = AsyncLLMEngine.from_engine_args(engine_args)
+        self.admission = AdmissionController(
+            ADMISSION_KV_BUDGET_TOKENS or self._kv_cache_tokens(),
+            max_queue_wait=ADMISSION_MAX_QUEUE_WAIT,
+            max_queue_size=ADMISSION_MAX_QUEUE_SIZE,
+        )
         self.chat_engine = ChatEngine(
-            self.engine, BASE_MODEL, "assistant", chat_template
+            self.engine,
+            BASE_MODEL,
+            "assistant",
+            chat_template,
+            admission=self.admission,
+            default_max_tokens=DEFAULT_MAX_TOKENS,
         )
+        self.completion_engine = CompletionEngine(
+            self.engine,
+            BASE_MODEL,
+            admission=self.admission,
+            default_max_tokens=DEFAULT_MAX_TOKENS,
+        )
+        self.service = ModelService(
+            self.engine,
+            self.chat_engine,
+            self.completion_engine,
+            # Co-located streams are closed in-process when their client disconnects
+            cancellations=cancellations if SERVING_MODE == GATEWAY else None,
+            on_request_done=self.publish_metrics,
+        )
+
+        self.container_id = os.environ.get("MODAL_TASK_ID") or random_uuid()
+        self.metrics_published_at = 0.0
+
+        self.heartbeats_stopped = threading.Event()
+        threading.Thread(
+            target=send_heartbeats,
+            args=(
+                heartbeats,
+                self.heartbeat,
+                HEALTH_HEARTBEAT_INTERVAL,
+                self.heartbeats_stopped,
+            ),
+            daemon=True,
+        ).start()
+
+    def _kv_cache_tokens(self) -> int:
+        # The number of tokens the KV cache of the engine holds
+        cache_config = self.engine.engine.cache_config
+        return cache_config.num_gpu_blocks * cache_config.block_size
 
     @exit()
-    def stop_engine():
+    def stop_engine(self):
         """Stop the vLLM engine.
 
-        When the container is stopped, this method is called to stop the vLLM engine.
+        When the container is stopped, this method is called to remove the heartbeat
+        and the metrics snapshot of the container and stop the vLLM engine.
         """
+        self.heartbeats_stopped.set()
+        try:
+            heartbeats.remove(self.container_id)
+        except Exception as e:
+            logger.warning(f"Failed to remove heartbeat: {e}")
+
+        try:
+            snapshots = metrics_store.get(METRICS_SNAPSHOTS_KEY, {})
+            if snapshots.pop(self.container_id, None) is not None:
+                metrics_store.put(METRICS_SNAPSHOTS_KEY, snapshots)
+        except Exception as e:
+            logger.warning(f"Failed to remove metrics: {e}")
+
         if GPU_CONFIG.count > 1:
             import ray
 
             ray.shutdown()
 
+    if SERVING_MODE == COLOCATED:
+
+        @asgi_app()
+        def colocated_app(self):
+            """Serve the API from the model container.
+
+            The routes of the gateway are served against the in-process engines, so
+            requests and streamed chunks skip the remote call to the model
+            container.
+            """
+            from backend.vllm_server.api_server import app
+
+            app.state.model = LocalModel(self.service)
+            # Every request is served by this container
+            app.state.router = PrefixRouter(1)
+            app.state.container_id = self.container_id
+            return app
+
+    def heartbeat(self) -> Heartbeat:
+        """Get the current heartbeat of the container.
+
+        Reads the scheduler of the engine from the heartbeat thread, which is safe
+        enough for the approximate stats of a health check.
+        """
+        scheduler = self.engine.engine.scheduler
+        num_gpu_blocks = self.engine.engine.cache_config.num_gpu_blocks
+        free_gpu_blocks = scheduler.block_manager.get_num_free_gpu_blocks()
+        return Heartbeat(
+            container_id=self.container_id,
+            replica=self.replica,
+            sent_at=time.time(),
+            # The engine loop starts with the first request and stops on errors
+            healthy=self.engine.background_loop is None or self.engine.is_running,
+            running=len(scheduler.running),
+            waiting=len(scheduler.waiting) + len(scheduler.swapped),
+            kv_cache_usage=1.0 - free_gpu_blocks / max(1, num_gpu_blocks),
+        )
+
     @method()
     async def check_health(self):
-        """Health check for the vLLM model."""
-        return {"status": "ok"}
+        """Health check for the vLLM model.
+
+        Only called by deep health checks, the gateway otherwise answers from the
+        heartbeats of the containers.
+        """
+        heartbeat = self.heartbeat()
+        return {
+            "status": "ok" if heartbeat.healthy else "error",
+            "heartbeat": heartbeat,
+        }
+
+    async def publish_metrics(self):
+        """Publish the metrics of the container for the gateway to serve.
+
+        Snapshots are published at most every `METRICS_PUBLISH_INTERVAL` seconds,
+        and the snapshots of other containers older than `METRICS_SNAPSHOT_TTL`
+        are pruned. Concurrent publishes from other containers may overwrite a
+        snapshot with its previous version until the next publish.
+        """
+        now = time.time()
+        if now - self.metrics_published_at < METRICS_PUBLISH_INTERVAL:
+            return
+        self.metrics_published_at = now
+
+        try:
+            snapshots = await metrics_store.get.aio(METRICS_SNAPSHOTS_KEY, {})
+            snapshots = {
+                container_id: (published_at, snapshot)
+                for container_id, (published_at, snapshot) in snapshots.items()
+                if now - published_at < METRICS_SNAPSHOT_TTL
+            }
+            snapshots[self.container_id] = (now, REGISTRY.snapshot())
+            await metrics_store.put.aio(METRICS_SNAPSHOTS_KEY, snapshots)
+        except Exception as e:
+            logger.warning(f"Failed to publish metrics: {e}")
 
     @method()
     async def generate_chat_completion_stream(
-        self, request: ChatCompletionRequest
-    ) -> Union[ErrorResponse, AsyncGenerator[str, None]]:
+        self,
+        request: ChatCompletionRequest,
+        dispatched_at: Optional[float] = None,
+        request_id: Optional[str] = None,
+        scheduling: Scheduling = DEFAULT_SCHEDULING,
+    ) -> AsyncGenerator[Union[ErrorResponse, bytes], None]:
         """Generate chat completions.
 
         Generate chat completions based on the given chat message history and chat
         settings. This is a streaming completion generator that returns the
-        response in chunks.
+        response in chunks. Tokens are coalesced into chunks according to the
+        request stream granularity, falling back to the server configuration.
+
+        The request is aborted in the engine when the gateway cancels it or the
+        stream is closed before it finishes.
 
         Args:
             request: The chat completion request.
+            dispatched_at: The wall clock time the gateway dispatched the request.
+            request_id: The request ID assigned by the gateway.
+            scheduling: The tenant and priority class the request is admitted for.
 
         Returns:
-            A stream of chat completions or an error response.
+            A stream of packed chat completion chunks, rendered by the gateway
+            with `wire.StreamDecoder`, or an error response sent before any chunk.
         """
-        request_id = f"cmpl-{random_uuid()}"
-        logger.info(f"Creating stream generator for request {request_id}")
-        results_generator = await self.chat_engine.create_chat_completion_generator(
-            request, request_id
+        stream = self.service.generate_chat_completion_stream(
+            request, dispatched_at, request_id, scheduling
         )
-        # TODO: handler error response of results_generator
-        async for res in self.chat_engine.chat_completion_stream_generator(
-            request, results_generator, request_id
-        ):
-            yield res
+        try:
+            async for res in stream:
+                yield res
+        finally:
+            # Aborts the request right away when the stream is closed early
+            await stream.aclose()
 
     @method()
     async def generate_chat_completion_full(
-        self, request: ChatCompletionRequest
+        self,
+        request: ChatCompletionRequest,
+        dispatched_at: Optional[float] = None,
+        scheduling: Scheduling = DEFAULT_SCHEDULING,
     ) -> Union[ErrorResponse, ChatCompletionResponse]:
         """Generate chat completions.
 
@@ -112,24 +324,74 @@ class Model:
 
         Args:
             request: The chat completion request.
+            dispatched_at: The wall clock time the gateway dispatched the request.
+            scheduling: The tenant and priority class the request is admitted for.
 
         Returns:
             The chat completion response or an error response.
         """
-        request_id = f"cmpl-{random_uuid()}"
-        logger.info(f"Creating completion generator for request {request_id}")
-
-        results_generator = await self.chat_engine.create_chat_completion_generator(
-            request, request_id
+        return await self.service.generate_chat_completion_full(
+            request, dispatched_at, scheduling
         )
-        # TODO: handler error response of results_generator
 
+    @method()
+    async def generate_completion_stream(
+        self,
+        request: CompletionRequest,
+        dispatched_at: Optional[float] = None,
+        request_id: Optional[str] = None,
+        scheduling: Scheduling = DEFAULT_SCHEDULING,
+    ) -> AsyncGenerator[Union[ErrorResponse, bytes], None]:
+        """Generate completions.
+
+        Generate completions for every prompt of the request. All prompts are
+        submitted to the engine at once and their chunks are streamed as soon as
+        they are generated, indexed by prompt. Completions that cannot be streamed
+        are sent as a single chunk once finished.
+
+        The prompts are aborted in the engine when the gateway cancels the request
+        or the stream is closed before it finishes.
+
+        Args:
+            request: The completion request.
+            dispatched_at: The wall clock time the gateway dispatched the request.
+            request_id: The request ID assigned by the gateway.
+            scheduling: The tenant and priority class the request is admitted for.
+
+        Returns:
+            A stream of packed completion chunks, rendered by the gateway with
+            `wire.StreamDecoder`, or an error response sent before any chunk.
+        """
+        stream = self.service.generate_completion_stream(
+            request, dispatched_at, request_id, scheduling
+        )
         try:
-            res = await self.chat_engine.chat_completion_full_generator(
-                request, results_generator, request_id
-            )
-            return res
-
-        except ValueError as e:
-            logger.error(f"Error generating chat completion: {e}")
-            return create_error_response(str(e))
+            async for res in stream:
+                yield res
+        finally:
+            # Aborts the request right away when the stream is closed early
+            await stream.aclose()
+
+    @method()
+    async def generate_completion_full(
+        self,
+        request: CompletionRequest,
+        dispatched_at: Optional[float] = None,
+        scheduling: Scheduling = DEFAULT_SCHEDULING,
+    ) -> Union[ErrorResponse, CompletionResponse]:
+        """Generate completions.
+
+        Generate completions for every prompt of the request, returning the choices
+        of all prompts merged by prompt index once every prompt finished.
+
+        Args:
+            request: The completion request.
+            dispatched_at: The wall clock time the gateway dispatched the request.
+            scheduling: The tenant and priority class the request is admitted for.
+
+        Returns:
+            The completion response or an error response.
+        """
+        return await self.service.generate_completion_full(
+            request, dispatched_at, scheduling
+        )
@@ -0,0 +1,284 @@
+"""Gateway cache for deterministic chat completion responses."""
+
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Iterator, List, NamedTuple, Optional, Set, Tuple
+
+from backend.vllm_server.encoder import DONE_FRAME, ChatChunkEncoder
+from backend.vllm_server.schema.chat import (
+    ChatCompletionRequest,
+    ChatCompletionResponse,
+    ChatCompletionResponseChoice,
+    ChatMessage,
+)
+from backend.vllm_server.schema.common import LogProbs, UsageInfo
+
+# Fields that change how a response is delivered but not what is generated
+DELIVERY_FIELDS = {"stream", "stream_flush_tokens", "stream_flush_interval_ms", "user"}
+
+
+def cache_directives(header: Optional[str]) -> Set[str]:
+    """Parse the directives of a `Cache-Control` header.
+
+    Args:
+        header: The value of the header.
+
+    Returns:
+        The lowercased directive names.
+    """
+    if not header:
+        return set()
+    return {
+        directive.split("=", 1)[0].strip().lower() for directive in header.split(",")
+    }
+
+
+def request_cache_key(request: ChatCompletionRequest) -> Optional[str]:
+    """Hash the fields of a request that determine its response.
+
+    Only deterministic requests are cacheable: greedy sampling, beam search or a
+    fixed seed.
+
+    Args:
+        request: The chat completion request.
+
+    Returns:
+        The cache key of the request, or None if the request is not cacheable.
+    """
+    if not (request.temperature == 0 or request.use_beam_search) and (
+        request.seed is None
+    ):
+        return None
+
+    fields = request.model_dump(mode="json", exclude=DELIVERY_FIELDS)
+    canonical = json.dumps(fields, sort_keys=True, separators=(",", ":"))
+    return hashlib.blake2b(canonical.encode(), digest_size=16).hexdigest()
+
+
+class CachedResponse(NamedTuple):
+    """A cached chat completion response."""
+
+    response: ChatCompletionResponse
+    # The number of tokens generated for each choice, needed to replay the usage
+    # of each choice when streaming. Unknown for n > 1 full responses.
+    completion_tokens: Optional[List[int]]
+    expires_at: float
+
+
+class ResponseCache:
+    """Bounded LRU cache of chat completion responses with a TTL.
+
+    Agents frequently resend identical deterministic requests. Serving them from
+    the gateway skips the round trip to the GPU container entirely. Streamed
+    requests are replayed as server-sent events from the cached response.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        ttl: float = 300.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        """Initialize the response cache.
+
+        Args:
+            max_entries: The maximum number of cached responses.
+            ttl: The number of seconds a response is served from the cache.
+            clock: The clock measuring the TTL.
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.clock = clock
+        self._entries: OrderedDict[str, CachedResponse] = OrderedDict()
+
+    def __len__(self) -> int:
+        """Return the number of cached responses."""
+        return len(self._entries)
+
+    def get(self, key: str, *, stream: bool = False) -> Optional[CachedResponse]:
+        """Look up a cached response.
+
+        Args:
+            key: The cache key of the request.
+            stream: Whether the response is replayed as a stream, which requires
+                the number of tokens generated for each choice.
+
+        Returns:
+            The cached response, or None if it is missing or expired.
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires_at <= self.clock():
+            del self._entries[key]
+            return None
+        if stream and entry.completion_tokens is None:
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def put(
+        self,
+        key: str,
+        response: ChatCompletionResponse,
+        completion_tokens: Optional[List[int]] = None,
+    ):
+        """Cache a response.
+
+        Args:
+            key: The cache key of the request.
+            response: The chat completion response.
+            completion_tokens: The number of tokens generated for each choice. Only
+                required when a response has more than one choice.
+        """
+        if completion_tokens is None and len(response.choices) == 1:
+            completion_tokens = [response.usage.completion_tokens]
+
+        self._entries[key] = CachedResponse(
+            response, completion_tokens, self.clock() + self.ttl
+        )
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+
+def replay_stream(cached: CachedResponse) -> Iterator[str]:
+    """Replay a cached response as a chat completion stream.
+
+    Each choice is sent as its role frame followed by a single finish frame
+    carrying the whole message.
+
+    Args:
+        cached: The cached response.
+
+    Yields:
+        The server-sent event frames.
+    """
+    response = cached.response
+    encoder = ChatChunkEncoder(response.id, response.created, response.model)
+    for choice in response.choices:
+        yield encoder.role(choice.index, choice.message.role)
+    for choice, completion_tokens in zip(response.choices, cached.completion_tokens):
+        yield encoder.finish(
+            choice.index,
+            choice.message.content,
+            choice.finish_reason,
+            prompt_tokens=response.usage.prompt_tokens,
+            completion_tokens=completion_tokens,
+            logprobs=choice.logprobs,
+        )
+    yield DONE_FRAME
+
+
+class StreamRecorder:
+    """Rebuild the full response of a chat completion stream from its frames."""
+
+    def __init__(self):
+        """Initialize an empty recorder."""
+        self.id: Optional[str] = None
+        self.created = 0
+        self.model = ""
+        self.prompt_tokens = 0
+        self.done = False
+        self.failed = False
+        self._roles: Dict[int, str] = {}
+        self._contents: Dict[int, List[str]] = {}
+        self._logprobs: Dict[int, LogProbs] = {}
+        self._finish_reasons: Dict[int, str] = {}
+        self._completion_tokens: Dict[int, int] = {}
+
+    def feed(self, data: str):
+        """Record the frames of a stream chunk.
+
+        Args:
+            data: One or more server-sent event frames.
+        """
+        for frame in data.split("\n\n"):
+            if not frame.startswith("data: "):
+                continue
+            payload = frame[len("data: ") :]
+            if payload == "[DONE]":
+                self.done = True
+                continue
+
+            chunk = json.loads(payload)
+            if "error" in chunk or not chunk.get("choices"):
+                self.failed = True
+                continue
+
+            self.id = chunk["id"]
+            self.created = chunk["created"]
+            self.model = chunk["model"]
+            for choice in chunk["choices"]:
+                self._record_choice(choice)
+            usage = chunk.get("usage")
+            if usage:
+                self.prompt_tokens = usage["prompt_tokens"]
+                index = chunk["choices"][0]["index"]
+                self._completion_tokens[index] = usage["completion_tokens"]
+
+    def response(self) -> Optional[Tuple[ChatCompletionResponse, List[int]]]:
+        """Build the response of a completed stream.
+
+        Returns:
+            The response and the number of tokens generated for each choice, or
+            None if the stream failed or did not finish every choice.
+        """
+        indices = sorted(self._roles)
+        if (
+            self.failed
+            or not self.done
+            or not indices
+            or any(i not in self._finish_reasons for i in indices)
+            or any(i not in self._completion_tokens for i in indices)
+        ):
+            return None
+
+        choices = [
+            ChatCompletionResponseChoice(
+                index=i,
+                message=ChatMessage(
+                    role=self._roles[i], content="".join(self._contents.get(i, []))
+                ),
+                logprobs=self._logprobs.get(i),
+                finish_reason=self._finish_reasons[i],
+            )
+            for i in indices
+        ]
+        completion_tokens = [self._completion_tokens[i] for i in indices]
+        usage = UsageInfo(
+            prompt_tokens=self.prompt_tokens,
+            completion_tokens=sum(completion_tokens),
+            total_tokens=self.prompt_tokens + sum(completion_tokens),
+        )
+        response = ChatCompletionResponse(
+            id=self.id,
+            created=self.created,
+            model=self.model,
+            choices=choices,
+            usage=usage,
+        )
+        return response, completion_tokens
+
+    def _record_choice(self, choice: dict):
+        index = choice["index"]
+        delta = choice.get("delta") or {}
+        if delta.get("role") is not None:
+            self._roles[index] = delta["role"]
+        if delta.get("content"):
+            self._contents.setdefault(index, []).append(delta["content"])
+        if choice.get("finish_reason") is not None:
+            self._finish_reasons[index] = choice["finish_reason"]
+
+        logprobs = choice.get("logprobs")
+        if logprobs:
+            merged = self._logprobs.setdefault(index, LogProbs())
+            merged.text_offset.extend(logprobs.get("text_offset", []))
+            merged.token_logprobs.extend(logprobs.get("token_logprobs", []))
+            merged.tokens.extend(logprobs.get("tokens", []))
+            if logprobs.get("top_logprobs") is not None:
+                if merged.top_logprobs is None:
+                    merged.top_logprobs = []
+                merged.top_logprobs.extend(logprobs["top_logprobs"])
@@ -0,0 +1,165 @@
+"""Prefix-affinity routing of requests across model replicas."""
+
+import hashlib
+import json
+import math
+from bisect import bisect_left
+from collections import OrderedDict
+from typing import Container, Dict, List, Union
+
+from backend.vllm_server.engine.prompt_cache import hash_message_prefixes
+from backend.vllm_server.metrics import (
+    ROUTING_FALLBACKS,
+    ROUTING_IN_FLIGHT,
+    ROUTING_REQUESTS,
+)
+
+
+def _point(data: bytes) -> int:
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), "big")
+
+
+def chat_routing_key(messages: List[Dict[str, str]], prefix_turns: int = 1) -> bytes:
+    """Hash the stable prefix of a conversation.
+
+    The stable prefix is made of the leading system messages and the first
+    `prefix_turns` messages after them, so every turn of a conversation, and every
+    conversation opening the same way, shares the key.
+
+    Args:
+        messages: The chat messages.
+        prefix_turns: The number of messages after the system prompt in the prefix.
+
+    Returns:
+        The routing key of the conversation.
+    """
+    if not messages:
+        return b""
+    system = 0
+    while system < len(messages) and messages[system].get("role") == "system":
+        system += 1
+    end = min(len(messages), system + prefix_turns)
+    return hash_message_prefixes(messages[: max(end, 1)])[-1]
+
+
+def completion_routing_key(
+    prompt: Union[List[int], List[List[int]], str, List[str]], prefix_length: int
+) -> bytes:
+    """Hash the leading characters or token IDs of the first prompt of a request.
+
+    Args:
+        prompt: The prompt of the completion request.
+        prefix_length: The number of characters or token IDs hashed.
+
+    Returns:
+        The routing key of the request.
+    """
+    if isinstance(prompt, list) and prompt and isinstance(prompt[0], (str, list)):
+        prompt = prompt[0]
+    canonical = json.dumps(prompt[:prefix_length], separators=(",", ":"))
+    return hashlib.blake2b(canonical.encode(), digest_size=16).digest()
+
+
+class PrefixRouter:
+    """Route requests sharing a prompt prefix to the same model replica.
+
+    A replica only reuses the prompts it tokenized and cached for earlier
+    requests, so requests are placed on a consistent hash ring by their routing
+    key. Loads are bounded: a replica takes a request while its requests in
+    flight stay below `load_factor` times the average, otherwise the request
+    falls back to the next replica along the ring. A hot prefix spills over to
+    the same few replicas rather than overloading its own.
+
+    The router only sees the requests of its gateway container, and a request
+    counts against its replica until `release` is called.
+    """
+
+    def __init__(
+        self,
+        replicas: int,
+        load_factor: float = 1.25,
+        virtual_nodes: int = 64,
+        max_prefixes: int = 4096,
+    ):
+        """Initialize the router.
+
+        Args:
+            replicas: The number of model replicas.
+            load_factor: The maximum in-flight requests of a replica relative to
+                the average, above 1.
+            virtual_nodes: The number of points of each replica on the ring.
+            max_prefixes: The number of routing keys whose last replica is kept
+                to report prefix hits.
+        """
+        if replicas < 1:
+            raise ValueError("There must be at least one replica.")
+        if load_factor <= 1:
+            raise ValueError("The load factor must be above 1.")
+        self.replicas = replicas
+        self.load_factor = load_factor
+        self.max_prefixes = max_prefixes
+        self.in_flight = [0] * replicas
+
+        ring = sorted(
+            (_point(f"{replica}:{node}".encode()), replica)
+            for replica in range(replicas)
+            for node in range(virtual_nodes)
+        )
+        self._points = [point for point, _ in ring]
+        self._owners = [replica for _, replica in ring]
+        # Replica that last served each routing key, in LRU order
+        self._last_replica: OrderedDict[bytes, int] = OrderedDict()
+
+    def candidates(self, key: bytes) -> List[int]:
+        """Return every replica in the order a request is offered to them."""
+        start = bisect_left(self._points, _point(key))
+        seen: Dict[int, None] = {}
+        for i in range(len(self._owners)):
+            seen.setdefault(self._owners[(start + i) % len(self._owners)])
+            if len(seen) == self.replicas:
+                break
+        return list(seen)
+
+    def capacity(self) -> int:
+        """Return the number of requests in flight a replica takes another one at."""
+        return math.ceil(self.load_factor * (sum(self.in_flight) + 1) / self.replicas)
+
+    def route(self, key: bytes, exclude: Container[int] = ()) -> int:
+        """Pick the replica of a request and count the request in flight.
+
+        Args:
+            key: The routing key of the request.
+            exclude: The replicas not to route to, e.g. since they rejected the
+                request as overloaded.
+
+        Returns:
+            The replica.
+        """
+        candidates = self.candidates(key)
+        home = candidates[0]
+        allowed = [replica for replica in candidates if replica not in exclude]
+        if not allowed:
+            allowed = candidates
+        capacity = self.capacity()
+        replica = next(
+            (replica for replica in allowed if self.in_flight[replica] < capacity),
+            allowed[0],
+        )
+
+        if replica != home:
+            ROUTING_FALLBACKS.labels("overloaded" if home in exclude else "load").inc()
+        hit = self._last_replica.get(key) == replica
+        ROUTING_REQUESTS.labels(str(replica), "hit" if hit else "miss").inc()
+        self._last_replica[key] = replica
+        self._last_replica.move_to_end(key)
+        if len(self._last_replica) > self.max_prefixes:
+            self._last_replica.popitem(last=False)
+
+        self.in_flight[replica] += 1
+        ROUTING_IN_FLIGHT.labels(str(replica)).set(self.in_flight[replica])
+        return replica
+
+    def release(self, replica: int):
+        """Stop counting a finished request against its replica."""
+        self.in_flight[replica] -= 1
+        ROUTING_IN_FLIGHT.labels(str(replica)).set(self.in_flight[replica])
@@ -1,18 +1,21 @@
 """Chat related schemas compatible with the OpenAI API."""
 
 import time
-from typing import Dict, List, Literal, Optional, Union
+from typing import TYPE_CHECKING, Dict, List, Literal, Optional, Union
 
 from pydantic import BaseModel, Field, model_validator
-from vllm.sampling_params import SamplingParams
-from vllm.utils import random_uuid
 
+from backend.vllm_server.engine.logit_bias import get_logit_bias_processor
 from backend.vllm_server.schema.common import (
     DeltaMessage,
     LogProbs,
     ResponseFormat,
     UsageInfo,
 )
+from backend.vllm_server.utils import random_uuid
+
+if TYPE_CHECKING:
+    from vllm.sampling_params import SamplingParams
 
 
 class ChatCompletionRequest(BaseModel):
@@ -91,49 +94,28 @@ class ChatCompletionRequest(BaseModel):
         default=None,
         description=("If specified, the output will follow the context free grammar."),
     )
+    stream_flush_tokens: Optional[int] = Field(
+        default=None,
+        ge=1,
+        description=(
+            "When streaming, flush a chunk once this many tokens are buffered. "
+            "Defaults to the server configuration, 1 streams every token."
+        ),
+    )
+    stream_flush_interval_ms: Optional[float] = Field(
+        default=None,
+        ge=0,
+        description=(
+            "When streaming, flush buffered tokens after this many milliseconds. "
+            "Defaults to the server configuration, 0 streams every token."
+        ),
+    )
 
-    def to_sampling_params(self) -> SamplingParams:
+    def to_sampling_params(self) -> "SamplingParams":
         """Construct the sampling parameters from the request."""
-        if self.logprobs and not self.top_logprobs:
-            raise ValueError("Top logprobs must be set when logprobs is.")
+        from vllm.sampling_params import SamplingParams
 
-        logits_processors = None
-        if self.logit_bias:
-
-            def logit_bias_logits_processor(token_ids: List[int], logits):
-                for token_id, bias in self.logit_bias.items():
-                    # Clamp the bias between -100 and 100 per OpenAI API spec
-                    bias = min(100, max(-100, bias))
-                    logits[int(token_id)] += bias
-                return logits
-
-            logits_processors = [logit_bias_logits_processor]
-
-        params = SamplingParams(
-            n=self.n,
-            best_of=self.best_of,
-            presence_penalty=self.presence_penalty,
-            frequency_penalty=self.frequency_penalty,
-            repetition_penalty=self.repetition_penalty,
-            temperature=self.temperature,
-            top_p=self.top_p,
-            top_k=self.top_k,
-            min_p=self.min_p,
-            # seed=self.seed,
-            use_beam_search=self.use_beam_search,
-            length_penalty=self.length_penalty,
-            early_stopping=self.early_stopping,
-            stop=self.stop,
-            stop_token_ids=self.stop_token_ids,
-            include_stop_str_in_output=self.include_stop_str_in_output,
-            ignore_eos=self.ignore_eos,
-            max_tokens=self.max_tokens,
-            logprobs=self.top_logprobs if self.logprobs else None,
-            prompt_logprobs=self.top_logprobs if self.echo else None,
-            skip_special_tokens=self.skip_special_tokens,
-            spaces_between_special_tokens=self.spaces_between_special_tokens,
-            logits_processors=logits_processors,
-        )
+        params = SamplingParams(**self.sampling_params_kwargs())
 
         # TODO: the vllm version that is on the modal registry has pytorch incompatible
         # with the current version of the vllm package. So the modal instance is
@@ -144,6 +126,41 @@ class ChatCompletionRequest(BaseModel):
 
         return params
 
+    def sampling_params_kwargs(self) -> dict:
+        """Get the keyword arguments of the sampling params of the request."""
+        if self.logprobs and not self.top_logprobs:
+            raise ValueError("Top logprobs must be set when logprobs is.")
+
+        logits_processors = None
+        if self.logit_bias:
+            logits_processors = [get_logit_bias_processor(self.logit_bias)]
+
+        return {
+            "n": self.n,
+            "best_of": self.best_of,
+            "presence_penalty": self.presence_penalty,
+            "frequency_penalty": self.frequency_penalty,
+            "repetition_penalty": self.repetition_penalty,
+            "temperature": self.temperature,
+            "top_p": self.top_p,
+            "top_k": self.top_k,
+            "min_p": self.min_p,
+            # "seed": self.seed,
+            "use_beam_search": self.use_beam_search,
+            "length_penalty": self.length_penalty,
+            "early_stopping": self.early_stopping,
+            "stop": self.stop,
+            "stop_token_ids": self.stop_token_ids,
+            "include_stop_str_in_output": self.include_stop_str_in_output,
+            "ignore_eos": self.ignore_eos,
+            "max_tokens": self.max_tokens,
+            "logprobs": self.top_logprobs if self.logprobs else None,
+            "prompt_logprobs": self.top_logprobs if self.echo else None,
+            "skip_special_tokens": self.skip_special_tokens,
+            "spaces_between_special_tokens": self.spaces_between_special_tokens,
+            "logits_processors": logits_processors,
+        }
+
     @model_validator(mode="before")
     @classmethod
     def check_guided_decoding_count(cls, data):
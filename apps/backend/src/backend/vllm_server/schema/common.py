@@ -13,6 +13,8 @@ class ErrorResponse(BaseModel):
     type: str
     param: Optional[str] = None
     code: int
+    # Sent as the Retry-After header rather than in the body
+    retry_after: Optional[float] = Field(default=None, exclude=True)
 
 
 class UsageInfo(BaseModel):
@@ -1,11 +1,16 @@
 """Completion related schemas compatible with the OpenAI API."""
 
-from typing import Dict, List, Optional, Union
+import time
+from typing import TYPE_CHECKING, Dict, List, Literal, Optional, Union
 
 from pydantic import BaseModel, Field, model_validator
-from vllm.sampling_params import SamplingParams
 
-from backend.vllm_server.schema.common import ResponseFormat
+from backend.vllm_server.engine.logit_bias import get_logit_bias_processor
+from backend.vllm_server.schema.common import LogProbs, ResponseFormat, UsageInfo
+from backend.vllm_server.utils import random_uuid
+
+if TYPE_CHECKING:
+    from vllm.sampling_params import SamplingParams
 
 
 class CompletionRequest(BaseModel):
@@ -77,49 +82,62 @@ class CompletionRequest(BaseModel):
         default=None,
         description=("If specified, the output will follow the context free grammar."),
     )
+    stream_flush_tokens: Optional[int] = Field(
+        default=None,
+        ge=1,
+        description=(
+            "When streaming, flush a chunk once this many tokens are buffered. "
+            "Defaults to the server configuration, 1 streams every token."
+        ),
+    )
+    stream_flush_interval_ms: Optional[float] = Field(
+        default=None,
+        ge=0,
+        description=(
+            "When streaming, flush buffered tokens after this many milliseconds. "
+            "Defaults to the server configuration, 0 streams every token."
+        ),
+    )
 
-    def to_sampling_params(self):
+    def to_sampling_params(self) -> "SamplingParams":
         """Construct the sampling parameters from the request."""
+        from vllm.sampling_params import SamplingParams
+
+        return SamplingParams(**self.sampling_params_kwargs())
+
+    def sampling_params_kwargs(self) -> dict:
+        """Get the keyword arguments of the sampling params of the request."""
         echo_without_generation = self.echo and self.max_tokens == 0
 
         logits_processors = None
         if self.logit_bias:
+            logits_processors = [get_logit_bias_processor(self.logit_bias)]
 
-            def logit_bias_logits_processor(token_ids: List[int], logits):
-                for token_id, bias in self.logit_bias.items():
-                    # Clamp the bias between -100 and 100 per OpenAI API spec
-                    bias = min(100, max(-100, bias))
-                    logits[int(token_id)] += bias
-                return logits
-
-            logits_processors = [logit_bias_logits_processor]
-
-        return SamplingParams(
-            n=self.n,
-            best_of=self.best_of,
-            presence_penalty=self.presence_penalty,
-            frequency_penalty=self.frequency_penalty,
-            repetition_penalty=self.repetition_penalty,
-            temperature=self.temperature,
-            top_p=self.top_p,
-            top_k=self.top_k,
-            min_p=self.min_p,
-            seed=self.seed,
-            stop=self.stop,
-            stop_token_ids=self.stop_token_ids,
-            ignore_eos=self.ignore_eos,
-            max_tokens=self.max_tokens if not echo_without_generation else 1,
-            min_tokens=self.min_tokens,
-            logprobs=self.logprobs,
-            use_beam_search=self.use_beam_search,
-            early_stopping=self.early_stopping,
-            prompt_logprobs=self.logprobs if self.echo else None,
-            skip_special_tokens=self.skip_special_tokens,
-            spaces_between_special_tokens=(self.spaces_between_special_tokens),
-            include_stop_str_in_output=self.include_stop_str_in_output,
-            length_penalty=self.length_penalty,
-            logits_processors=logits_processors,
-        )
+        return {
+            "n": self.n,
+            "best_of": self.best_of,
+            "presence_penalty": self.presence_penalty,
+            "frequency_penalty": self.frequency_penalty,
+            "repetition_penalty": self.repetition_penalty,
+            "temperature": self.temperature,
+            "top_p": self.top_p,
+            "top_k": self.top_k,
+            "min_p": self.min_p,
+            "seed": self.seed,
+            "stop": self.stop,
+            "stop_token_ids": self.stop_token_ids,
+            "ignore_eos": self.ignore_eos,
+            "max_tokens": self.max_tokens if not echo_without_generation else 1,
+            "logprobs": self.logprobs,
+            "use_beam_search": self.use_beam_search,
+            "early_stopping": self.early_stopping,
+            "prompt_logprobs": self.logprobs if self.echo else None,
+            "skip_special_tokens": self.skip_special_tokens,
+            "spaces_between_special_tokens": self.spaces_between_special_tokens,
+            "include_stop_str_in_output": self.include_stop_str_in_output,
+            "length_penalty": self.length_penalty,
+            "logits_processors": logits_processors,
+        }
 
     @model_validator(mode="before")
     @classmethod
@@ -138,3 +156,50 @@ class CompletionRequest(BaseModel):
                 "('guided_json', 'guided_regex' or 'guided_choice')."
             )
         return data
+
+    @model_validator(mode="after")
+    def check_min_tokens(self):
+        """Check that min_tokens is not set, the vLLM of the image ignores it."""
+        if self.min_tokens:
+            raise ValueError("min_tokens is not supported.")
+        return self
+
+
+class CompletionResponseChoice(BaseModel):
+    """Completion response choice schema."""
+
+    index: int
+    text: str
+    logprobs: Optional[LogProbs] = None
+    finish_reason: Optional[Literal["stop", "length"]] = None
+
+
+class CompletionResponse(BaseModel):
+    """Completion endpoint API response body compliant schema."""
+
+    id: str = Field(default_factory=lambda: f"cmpl-{random_uuid()}")
+    object: str = "text_completion"
+    created: int = Field(default_factory=lambda: int(time.time()))
+    model: str
+    choices: List[CompletionResponseChoice]
+    usage: UsageInfo
+
+
+class CompletionResponseStreamChoice(BaseModel):
+    """Completion response choice schema for streaming responses."""
+
+    index: int
+    text: str
+    logprobs: Optional[LogProbs] = None
+    finish_reason: Optional[Literal["stop", "length"]] = None
+
+
+class CompletionStreamResponse(BaseModel):
+    """Completion endpoint API response body compliant schema for streaming."""
+
+    id: str = Field(default_factory=lambda: f"cmpl-{random_uuid()}")
+    object: str = "text_completion"
+    created: int = Field(default_factory=lambda: int(time.time()))
+    model: str
+    choices: List[CompletionResponseStreamChoice]
+    usage: Optional[UsageInfo] = Field(default=None)
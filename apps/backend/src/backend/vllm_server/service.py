@@ -0,0 +1,360 @@
+"""Serving logic of the model container, independent of Modal."""
+
+import time
+from types import SimpleNamespace
+from typing import (
+    TYPE_CHECKING,
+    AsyncGenerator,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Optional,
+    Union,
+)
+
+from backend.vllm_server.cancellation import (
+    CancellationStore,
+    CancellationWatcher,
+    StreamAbort,
+)
+from backend.vllm_server.config import (
+    CANCELLATION_POLL_INTERVAL,
+    STREAM_FLUSH_INTERVAL_MS,
+    STREAM_FLUSH_TOKENS,
+)
+from backend.vllm_server.engine.chat import ChatEngine
+from backend.vllm_server.engine.coalesce import coalesce_request_outputs
+from backend.vllm_server.engine.completion import (
+    CompletionEngine,
+    merge_request_outputs,
+)
+from backend.vllm_server.fair_queue import DEFAULT_SCHEDULING, Scheduling
+from backend.vllm_server.logger import init_logger
+from backend.vllm_server.metrics import REMOTE_DISPATCH, observe_request_outputs
+from backend.vllm_server.schema.chat import (
+    ChatCompletionRequest,
+    ChatCompletionResponse,
+)
+from backend.vllm_server.schema.common import ErrorResponse
+from backend.vllm_server.schema.completion import (
+    CompletionRequest,
+    CompletionResponse,
+)
+from backend.vllm_server.utils import create_error_response, random_uuid
+from backend.vllm_server.wire import (
+    PackedChatEncoder,
+    PackedCompletionEncoder,
+    batch_records,
+)
+
+if TYPE_CHECKING:
+    from vllm.engine.async_llm_engine import AsyncLLMEngine
+    from vllm.outputs import RequestOutput
+
+logger = init_logger(__name__)
+
+
+def _coalesce(
+    request: Union[ChatCompletionRequest, CompletionRequest],
+    results_generator: AsyncIterator["RequestOutput"],
+) -> AsyncIterator["RequestOutput"]:
+    # Tokens are coalesced according to the request stream granularity, falling
+    # back to the server configuration
+    flush_tokens = request.stream_flush_tokens
+    if flush_tokens is None:
+        flush_tokens = STREAM_FLUSH_TOKENS
+    flush_interval_ms = request.stream_flush_interval_ms
+    if flush_interval_ms is None:
+        flush_interval_ms = STREAM_FLUSH_INTERVAL_MS
+    return coalesce_request_outputs(
+        results_generator,
+        flush_tokens=flush_tokens,
+        flush_interval=(
+            flush_interval_ms / 1000 if flush_interval_ms is not None else None
+        ),
+    )
+
+
+def _observe_dispatch(dispatched_at: Optional[float]):
+    if dispatched_at is not None:
+        REMOTE_DISPATCH.observe(max(0.0, time.time() - dispatched_at))
+
+
+class ModelService:
+    """Generate chat completions and completions with a vLLM engine.
+
+    Holds everything the model container does per request, so the same code is
+    served by the Modal `Model` class and in-process by `LocalModel`.
+    """
+
+    def __init__(
+        self,
+        engine: "AsyncLLMEngine",
+        chat_engine: ChatEngine,
+        completion_engine: CompletionEngine,
+        cancellations: Optional[CancellationStore] = None,
+        on_request_done: Optional[Callable[[], Awaitable[None]]] = None,
+    ):
+        """Initialize the model service.
+
+        Args:
+            engine: The vLLM engine requests are generated and aborted with.
+            chat_engine: The chat completion engine.
+            completion_engine: The completion engine.
+            cancellations: The store of streams cancelled by the gateway. Streams
+                are only aborted when they are closed if not set.
+            on_request_done: Awaited once every request finished, e.g. to publish
+                metrics.
+        """
+        self.engine = engine
+        self.chat_engine = chat_engine
+        self.completion_engine = completion_engine
+        self.cancellations = cancellations
+        self.watcher = None
+        if cancellations is not None:
+            self.watcher = CancellationWatcher(
+                cancellations, CANCELLATION_POLL_INTERVAL
+            )
+        self.on_request_done = on_request_done
+
+    async def _request_done(self):
+        if self.on_request_done is not None:
+            await self.on_request_done()
+
+    def _watch_cancellation(self, request_id: str, stream_abort: StreamAbort):
+        if self.watcher is not None:
+            self.watcher.watch(request_id, stream_abort)
+
+    def _unwatch_cancellation(self, request_id: str):
+        if self.watcher is not None:
+            self.watcher.unwatch(request_id)
+
+    async def generate_chat_completion_stream(
+        self,
+        request: ChatCompletionRequest,
+        dispatched_at: Optional[float] = None,
+        request_id: Optional[str] = None,
+        scheduling: Scheduling = DEFAULT_SCHEDULING,
+    ) -> AsyncGenerator[Union[ErrorResponse, bytes], None]:
+        """Generate a stream of chat completion chunks.
+
+        Chunks are sent as messages of packed records, see `wire`.
+
+        See `Model.generate_chat_completion_stream`.
+        """
+        started = time.perf_counter()
+        _observe_dispatch(dispatched_at)
+
+        request_id = request_id or f"cmpl-{random_uuid()}"
+        logger.info(f"Creating stream generator for request {request_id}")
+        results_generator = await self.chat_engine.create_chat_completion_generator(
+            request, request_id, scheduling
+        )
+        if isinstance(results_generator, ErrorResponse):
+            # Sent before any chunk so the gateway responds with the error status
+            yield results_generator
+            return
+
+        stream_abort = StreamAbort(
+            self.engine.abort, [request_id], request.max_tokens, request.n
+        )
+        results_generator = _coalesce(
+            request,
+            observe_request_outputs(stream_abort.track(results_generator), started),
+        )
+        self._watch_cancellation(request_id, stream_abort)
+        messages = batch_records(
+            self.chat_engine.chat_completion_stream_generator(
+                request, results_generator, request_id, PackedChatEncoder
+            )
+        )
+        try:
+            async for message in messages:
+                yield message
+        finally:
+            self._unwatch_cancellation(request_id)
+            await stream_abort.abort()
+            # Drops the record being produced once the engine request is aborted
+            await messages.aclose()
+            await self._request_done()
+
+    async def generate_chat_completion_full(
+        self,
+        request: ChatCompletionRequest,
+        dispatched_at: Optional[float] = None,
+        scheduling: Scheduling = DEFAULT_SCHEDULING,
+    ) -> Union[ErrorResponse, ChatCompletionResponse]:
+        """Generate a full chat completion.
+
+        See `Model.generate_chat_completion_full`.
+        """
+        started = time.perf_counter()
+        _observe_dispatch(dispatched_at)
+
+        request_id = f"cmpl-{random_uuid()}"
+        logger.info(f"Creating completion generator for request {request_id}")
+
+        results_generator = await self.chat_engine.create_chat_completion_generator(
+            request, request_id, scheduling
+        )
+        if isinstance(results_generator, ErrorResponse):
+            return results_generator
+        results_generator = observe_request_outputs(results_generator, started)
+
+        try:
+            return await self.chat_engine.chat_completion_full_generator(
+                request, results_generator, request_id
+            )
+
+        except ValueError as e:
+            logger.error(f"Error generating chat completion: {e}")
+            return create_error_response(str(e))
+
+        finally:
+            await self._request_done()
+
+    async def generate_completion_stream(
+        self,
+        request: CompletionRequest,
+        dispatched_at: Optional[float] = None,
+        request_id: Optional[str] = None,
+        scheduling: Scheduling = DEFAULT_SCHEDULING,
+    ) -> AsyncGenerator[Union[ErrorResponse, bytes], None]:
+        """Generate a stream of completion chunks for every prompt.
+
+        Chunks are sent as messages of packed records, see `wire`.
+
+        See `Model.generate_completion_stream`.
+        """
+        started = time.perf_counter()
+        _observe_dispatch(dispatched_at)
+
+        request_id = request_id or f"cmpl-{random_uuid()}"
+        logger.info(f"Creating completion stream generator for request {request_id}")
+
+        generators = await self.completion_engine.create_completion_generators(
+            request, request_id, scheduling
+        )
+        if isinstance(generators, ErrorResponse):
+            # Sent before any chunk so the gateway responds with the error status
+            yield generators
+            return
+
+        stream_abort = StreamAbort(
+            self.engine.abort,
+            [f"{request_id}-{i}" for i in range(len(generators))],
+            request.max_tokens,
+            request.n,
+        )
+        self._watch_cancellation(request_id, stream_abort)
+        messages = None
+        try:
+            generators = [
+                observe_request_outputs(stream_abort.track(generator), started)
+                for generator in generators
+            ]
+            if not self.completion_engine.can_stream(request):
+                res = await self.completion_engine.completion_full_generator(
+                    request, merge_request_outputs(generators), request_id
+                )
+                encoder = PackedCompletionEncoder(
+                    request_id, int(time.time()), self.completion_engine.model_name
+                )
+                yield encoder.frame(f"data: {res.model_dump_json()}\n\n") + (
+                    encoder.done()
+                )
+                return
+
+            results_generator = merge_request_outputs(
+                [_coalesce(request, generator) for generator in generators]
+            )
+            messages = batch_records(
+                self.completion_engine.completion_stream_generator(
+                    request, results_generator, request_id, PackedCompletionEncoder
+                )
+            )
+            async for message in messages:
+                yield message
+        finally:
+            self._unwatch_cancellation(request_id)
+            await stream_abort.abort()
+            if messages is not None:
+                # Drops the record being produced once the engine requests are
+                # aborted
+                await messages.aclose()
+            await self._request_done()
+
+    async def generate_completion_full(
+        self,
+        request: CompletionRequest,
+        dispatched_at: Optional[float] = None,
+        scheduling: Scheduling = DEFAULT_SCHEDULING,
+    ) -> Union[ErrorResponse, CompletionResponse]:
+        """Generate full completions for every prompt.
+
+        See `Model.generate_completion_full`.
+        """
+        started = time.perf_counter()
+        _observe_dispatch(dispatched_at)
+
+        request_id = f"cmpl-{random_uuid()}"
+        logger.info(f"Creating completion generator for request {request_id}")
+
+        generators = await self.completion_engine.create_completion_generators(
+            request, request_id, scheduling
+        )
+        if isinstance(generators, ErrorResponse):
+            return generators
+
+        results_generator = merge_request_outputs(
+            [observe_request_outputs(generator, started) for generator in generators]
+        )
+        try:
+            return await self.completion_engine.completion_full_generator(
+                request, results_generator, request_id
+            )
+
+        except ValueError as e:
+            logger.error(f"Error generating completion: {e}")
+            return create_error_response(str(e))
+
+        finally:
+            await self._request_done()
+
+
+class LocalModel:
+    """In-process stand-in for the Modal handle of the `Model` class.
+
+    Exposes the methods of a `ModelService` as `method.remote.aio` and
+    `method.remote_gen.aio` like Modal does, so the gateway can be served without
+    model containers by setting `app.state.model`.
+    """
+
+    def __init__(self, service: ModelService):
+        """Wrap a model service.
+
+        Args:
+            service: The model service requests are generated with.
+        """
+        self.service = service
+        for name in (
+            "generate_chat_completion_stream",
+            "generate_chat_completion_full",
+            "generate_completion_stream",
+            "generate_completion_full",
+        ):
+            method = getattr(service, name)
+            setattr(
+                self,
+                name,
+                SimpleNamespace(
+                    remote=SimpleNamespace(aio=method),
+                    remote_gen=SimpleNamespace(aio=method),
+                ),
+            )
+        self.check_health = SimpleNamespace(
+            remote=SimpleNamespace(aio=self._check_health)
+        )
+
+    async def _check_health(self):
+        return {"status": "ok"}
@@ -1,7 +1,9 @@
 """Common utility functions for the VLLM server."""
 
 import json
+import uuid
 from http import HTTPStatus
+from typing import Optional
 
 from backend.vllm_server.schema.common import ErrorResponse
 
@@ -10,6 +12,7 @@ def create_error_response(
     message: str,
     err_type: str = "BadRequestError",
     status_code: HTTPStatus = HTTPStatus.BAD_REQUEST,
+    retry_after: Optional[float] = None,
 ) -> ErrorResponse:
     """HTTP error response factory.
 
@@ -19,11 +22,17 @@ def create_error_response(
         message: The error message.
         err_type: The error type.
         status_code: The HTTP status code.
+        retry_after: The number of seconds the client should wait before retrying.
 
     Returns:
             An ErrorResponse object.
     """
-    return ErrorResponse(message=message, type=err_type, code=status_code.value)
+    return ErrorResponse(
+        message=message,
+        type=err_type,
+        code=status_code.value,
+        retry_after=retry_after,
+    )
 
 
 def create_streaming_error_response(
@@ -80,3 +89,14 @@ def create_chat_template() -> str:
     {% endif %}
 {% endfor %}
 """
+
+
+def random_uuid() -> str:
+    """Generate a random request ID.
+
+    Same format as `vllm.utils.random_uuid`, without importing vLLM.
+
+    Returns:
+        The hexadecimal UUID.
+    """
+    return uuid.uuid4().hex
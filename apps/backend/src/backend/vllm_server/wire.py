@@ -0,0 +1,279 @@
+"""Packed wire format of the streams sent by the model containers to the gateway.
+
+Rather than formatted server-sent event frames, model containers send messages of
+packed records carrying only what changes between chunks: the choice index, the
+delta text, the finish reason and the token usage. The invariant parts of the
+chunks (id, created and model) are sent once in the first record of the stream,
+and the gateway renders the OpenAI JSON frames with the chunk encoders.
+
+Every record starts with its type byte, integers are little endian and strings
+are UTF-8 prefixed with their byte length.
+"""
+
+import asyncio
+import struct
+from typing import AsyncGenerator, AsyncIterator, Optional, Union
+
+from backend.vllm_server.encoder import ChatChunkEncoder, CompletionChunkEncoder
+from backend.vllm_server.schema.common import LogProbs
+
+# Record types
+_START = 0
+_ROLE = 1
+_ECHO = 2
+_TEXT = 3
+_FINISH = 4
+_FRAME = 5
+_ERROR = 6
+_DONE = 7
+
+# Stream kinds
+_CHAT = 0
+_COMPLETION = 1
+
+_START_HEAD = struct.Struct("<BBq")  # type, kind, created
+_INDEX_HEAD = struct.Struct("<BI")  # type, index
+_FINISH_HEAD = struct.Struct("<BIII")  # type, index, prompt and completion tokens
+_LENGTH = struct.Struct("<I")
+
+_DONE_RECORD = bytes([_DONE])
+
+
+def _pack_str(value: str) -> bytes:
+    encoded = value.encode()
+    return _LENGTH.pack(len(encoded)) + encoded
+
+
+def _pack_logprobs(logprobs: Optional[LogProbs]) -> bytes:
+    # An empty string stands for no logprobs
+    if logprobs is None:
+        return _LENGTH.pack(0)
+    return _pack_str(logprobs.model_dump_json(exclude_unset=True))
+
+
+class _PackedEncoder:
+    __slots__ = ("_start",)
+
+    kind = _CHAT
+
+    def __init__(self, request_id: str, created: int, model_name: str):
+        self._start = (
+            _START_HEAD.pack(_START, self.kind, int(created))
+            + _pack_str(request_id)
+            + _pack_str(model_name)
+        )
+
+    def _record(self, record: bytes) -> bytes:
+        # The first record of the stream carries the invariant parts of the chunks
+        if self._start:
+            record = self._start + record
+            self._start = b""
+        return record
+
+    def finish(
+        self,
+        index: int,
+        content: str,
+        finish_reason: str,
+        prompt_tokens: int,
+        completion_tokens: int,
+        logprobs: Optional[LogProbs] = None,
+    ) -> bytes:
+        """Pack the final chunk of a choice including the usage information."""
+        return self._record(
+            _FINISH_HEAD.pack(_FINISH, index, prompt_tokens, completion_tokens)
+            + _pack_str(content)
+            + _pack_str(finish_reason)
+            + _pack_logprobs(logprobs)
+        )
+
+    def frame(self, frame: str) -> bytes:
+        """Pack a server-sent event frame rendered by the model container."""
+        return self._record(bytes([_FRAME]) + _pack_str(frame))
+
+    def error(self, message: str) -> bytes:
+        """Pack an error raised while streaming."""
+        return self._record(bytes([_ERROR]) + _pack_str(message))
+
+    def done(self) -> bytes:
+        """Pack the end of the stream."""
+        return self._record(_DONE_RECORD)
+
+
+class PackedChatEncoder(_PackedEncoder):
+    """Packed counterpart of `ChatChunkEncoder`, with the same methods."""
+
+    __slots__ = ()
+
+    kind = _CHAT
+
+    def role(self, index: int, role: str) -> bytes:
+        """Pack the first chunk of a choice announcing the response role."""
+        return self._record(_INDEX_HEAD.pack(_ROLE, index) + _pack_str(role))
+
+    def echo(self, index: int, content: str) -> bytes:
+        """Pack a chunk echoing the last message of the conversation."""
+        return self._record(_INDEX_HEAD.pack(_ECHO, index) + _pack_str(content))
+
+    def content(
+        self, index: int, content: str, logprobs: Optional[LogProbs] = None
+    ) -> bytes:
+        """Pack a chunk carrying generated text for a choice."""
+        return self._record(
+            _INDEX_HEAD.pack(_TEXT, index)
+            + _pack_str(content)
+            + _pack_logprobs(logprobs)
+        )
+
+
+class PackedCompletionEncoder(_PackedEncoder):
+    """Packed counterpart of `CompletionChunkEncoder`, with the same methods."""
+
+    __slots__ = ()
+
+    kind = _COMPLETION
+
+    def text(self, index: int, text: str, logprobs: Optional[LogProbs] = None) -> bytes:
+        """Pack a chunk carrying generated text for a choice."""
+        return self._record(
+            _INDEX_HEAD.pack(_TEXT, index) + _pack_str(text) + _pack_logprobs(logprobs)
+        )
+
+
+class StreamDecoder:
+    """Render the packed messages of a stream as server-sent event frames."""
+
+    def __init__(self):
+        """Initialize the decoder of a stream."""
+        self._encoder: Union[ChatChunkEncoder, CompletionChunkEncoder, None] = None
+
+    def render(self, message: bytes) -> str:
+        """Render the records of a message.
+
+        Args:
+            message: One or more packed records.
+
+        Returns:
+            The server-sent event frames of the records.
+        """
+        frames = []
+        offset = 0
+        while offset < len(message):
+            record_type = message[offset]
+
+            if record_type == _START:
+                _, kind, created = _START_HEAD.unpack_from(message, offset)
+                offset += _START_HEAD.size
+                request_id, offset = self._str(message, offset)
+                model_name, offset = self._str(message, offset)
+                encoder_class = (
+                    ChatChunkEncoder if kind == _CHAT else CompletionChunkEncoder
+                )
+                self._encoder = encoder_class(request_id, created, model_name)
+
+            elif record_type in (_ROLE, _ECHO, _TEXT):
+                _, index = _INDEX_HEAD.unpack_from(message, offset)
+                offset += _INDEX_HEAD.size
+                text, offset = self._str(message, offset)
+                if record_type == _ROLE:
+                    frames.append(self._encoder.role(index, text))
+                elif record_type == _ECHO:
+                    frames.append(self._encoder.echo(index, text))
+                else:
+                    logprobs, offset = self._logprobs(message, offset)
+                    if isinstance(self._encoder, ChatChunkEncoder):
+                        frames.append(self._encoder.content(index, text, logprobs))
+                    else:
+                        frames.append(self._encoder.text(index, text, logprobs))
+
+            elif record_type == _FINISH:
+                _, index, prompt_tokens, completion_tokens = _FINISH_HEAD.unpack_from(
+                    message, offset
+                )
+                offset += _FINISH_HEAD.size
+                text, offset = self._str(message, offset)
+                finish_reason, offset = self._str(message, offset)
+                logprobs, offset = self._logprobs(message, offset)
+                frames.append(
+                    self._encoder.finish(
+                        index,
+                        text,
+                        finish_reason,
+                        prompt_tokens,
+                        completion_tokens,
+                        logprobs,
+                    )
+                )
+
+            elif record_type in (_FRAME, _ERROR):
+                text, offset = self._str(message, offset + 1)
+                frames.append(
+                    text if record_type == _FRAME else self._encoder.error(text)
+                )
+
+            elif record_type == _DONE:
+                offset += 1
+                frames.append(self._encoder.done())
+
+            else:
+                raise ValueError(f"Unknown record type {record_type}")
+        return "".join(frames)
+
+    @staticmethod
+    def _str(message: bytes, offset: int):
+        (length,) = _LENGTH.unpack_from(message, offset)
+        start = offset + _LENGTH.size
+        return message[start : start + length].decode(), start + length
+
+    @staticmethod
+    def _logprobs(message: bytes, offset: int):
+        (length,) = _LENGTH.unpack_from(message, offset)
+        start = offset + _LENGTH.size
+        if not length:
+            return None, start
+        return LogProbs.model_validate_json(message[start : start + length]), (
+            start + length
+        )
+
+
+async def batch_records(
+    records: AsyncIterator[bytes], max_records: int = 64
+) -> AsyncGenerator[bytes, None]:
+    """Join the records a stream produces back to back into single messages.
+
+    Records produced without waiting, e.g. the chunks of every choice of an engine
+    output, are sent in the same message. A record is never held back waiting for
+    the next one, so batching adds no latency.
+
+    Args:
+        records: The packed records of a stream.
+        max_records: The maximum number of records per message.
+
+    Yields:
+        The messages of the stream.
+    """
+    iterator = records.__aiter__()
+    next_record: Optional[asyncio.Future] = None
+    try:
+        while True:
+            batch = []
+            while len(batch) < max_records:
+                if next_record is None:
+                    next_record = asyncio.ensure_future(iterator.__anext__())
+                if batch:
+                    # Lets the stream produce its next record unless it has to wait
+                    await asyncio.sleep(0)
+                    if not next_record.done():
+                        break
+                try:
+                    batch.append(await next_record)
+                except StopAsyncIteration:
+                    next_record = None
+                    if batch:
+                        yield b"".join(batch)
+                    return
+                next_record = None
+            yield b"".join(batch)
+    finally:
+        if next_record is not None:
+            next_record.cancel()
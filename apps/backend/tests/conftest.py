@@ -0,0 +1,33 @@
+"""Shared fixtures for the backend tests."""
+
+import random
+
+import pytest
+from backend.vllm_server.utils import create_chat_template
+from tokenizers import Tokenizer, decoders, models, pre_tokenizers, processors, trainers
+from transformers import PreTrainedTokenizerFast
+
+from tests.helpers import WORDS
+
+
+@pytest.fixture(scope="session")
+def tokenizer() -> PreTrainedTokenizerFast:
+    """Small sentencepiece style tokenizer prepending a BOS token."""
+    rng = random.Random(0)
+    vocabulary = [*WORDS, "[INST]", "[/INST]"]
+    corpus = [" ".join(rng.choices(vocabulary, k=30)) for _ in range(200)]
+    backend = Tokenizer(models.BPE(unk_token="<unk>"))
+    backend.pre_tokenizer = pre_tokenizers.Metaspace()
+    backend.decoder = decoders.Metaspace()
+    backend.train_from_iterator(
+        corpus,
+        trainers.BpeTrainer(vocab_size=200, special_tokens=["<unk>", "<s>", "</s>"]),
+    )
+    backend.post_processor = processors.TemplateProcessing(
+        single="<s> $A", special_tokens=[("<s>", 1)]
+    )
+    tokenizer = PreTrainedTokenizerFast(
+        tokenizer_object=backend, bos_token="<s>", eos_token="</s>", unk_token="<unk>"
+    )
+    tokenizer.chat_template = create_chat_template()
+    return tokenizer
@@ -0,0 +1,77 @@
+"""Helpers shared by the backend tests."""
+
+from types import SimpleNamespace
+
+WORDS = ["the", "best", "player", "LeBron", "James", "scored", "30", "points", "?"]
+
+
+def tgi_chat_request(**fields) -> SimpleNamespace:
+    """TGI chat request with the fields read by `ChatService`."""
+    request = dict.fromkeys(
+        [
+            "repetition_penalty",
+            "frequency_penalty",
+            "logit_bias",
+            "logprobs",
+            "top_logprobs",
+            "max_tokens",
+            "presence_penalty",
+            "seed",
+            "temperature",
+            "top_p",
+            "tools",
+            "tool_choice",
+        ]
+    )
+    request["messages"] = [{"role": "user", "content": "Who won?"}]
+    request.update(fields)
+    return SimpleNamespace(**request)
+
+
+class FakeMethod:
+    """Modal style method, blocking when called and async as `aio`."""
+
+    def __init__(self, fn):
+        """Wrap a function."""
+        self.fn = fn
+
+    def __call__(self, *args):
+        """Call the function."""
+        return self.fn(*args)
+
+    async def aio(self, *args):
+        """Call the function from the event loop."""
+        return self.fn(*args)
+
+
+class FakeDict:
+    """In memory stand in for a modal dict, counting reads and failing on demand."""
+
+    def __init__(self):
+        """Start empty."""
+        self.data = {}
+        self.reads = 0
+        self.fail = False
+        self.get = FakeMethod(self._get)
+        self.put = FakeMethod(self._put)
+
+    def _get(self, key, default=None):
+        self.reads += 1
+        if self.fail:
+            raise ConnectionError("unavailable")
+        return self.data.get(key, default)
+
+    def _put(self, key, value):
+        self.data[key] = value
+
+
+class FakeClock:
+    """Clock advanced by hand."""
+
+    def __init__(self, now: float = 0.0):
+        """Start the clock at a fixed time."""
+        self.now = now
+
+    def __call__(self) -> float:
+        """Return the current time."""
+        return self.now
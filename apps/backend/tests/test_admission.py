@@ -0,0 +1,86 @@
+"""Tests for admission control against a KV cache token budget."""
+
+import asyncio
+
+import pytest
+from backend.vllm_server.admission import AdmissionController, AdmissionRejected
+
+
+def test_requests_past_the_budget_wait_in_order():
+    """Queued requests are admitted in arrival order as tokens are released."""
+
+    async def run():
+        controller = AdmissionController(budget_tokens=100)
+        first = await controller.acquire(60)
+        admitted = []
+
+        async def acquire(name, tokens):
+            admission = await controller.acquire(tokens)
+            admitted.append(name)
+            return admission
+
+        # The small request does not overtake the large one queued before it
+        large = asyncio.create_task(acquire("large", 80))
+        small = asyncio.create_task(acquire("small", 10))
+        await asyncio.sleep(0)
+        assert controller.queue_depth == 2
+
+        first.release()
+        first.release()
+        await asyncio.gather(large, small)
+        return controller, admitted
+
+    controller, admitted = asyncio.run(run())
+    assert admitted == ["large", "small"]
+    assert controller.committed == 90
+    assert controller.queue_depth == 0
+
+
+def test_requests_larger_than_the_budget_run_alone():
+    """A request larger than the budget is admitted once nothing is committed."""
+
+    async def run():
+        controller = AdmissionController(budget_tokens=100)
+        admission = await controller.acquire(500)
+        assert controller.committed == 500
+        admission.release()
+        return controller
+
+    assert asyncio.run(run()).committed == 0
+
+
+def test_load_is_shed_after_the_max_queue_wait():
+    """Requests waiting longer than the maximum queue wait are rejected."""
+
+    async def run():
+        controller = AdmissionController(
+            budget_tokens=100, max_queue_wait=0.01, retry_after=2.0
+        )
+        await controller.acquire(100)
+        with pytest.raises(AdmissionRejected) as rejected:
+            await controller.acquire(1)
+        return controller, rejected.value
+
+    controller, rejected = asyncio.run(run())
+    assert rejected.retry_after == 2.0
+    assert controller.queue_depth == 0
+    assert controller.committed == 100
+
+
+def test_load_is_shed_when_the_queue_is_full():
+    """Requests are rejected immediately once the queue is full."""
+
+    async def run():
+        controller = AdmissionController(budget_tokens=100, max_queue_size=1)
+        await controller.acquire(100)
+        queued = asyncio.create_task(controller.acquire(1))
+        await asyncio.sleep(0)
+        with pytest.raises(AdmissionRejected, match="overloaded"):
+            await controller.acquire(1)
+        queued.cancel()
+        await asyncio.gather(queued, return_exceptions=True)
+        return controller
+
+    controller = asyncio.run(run())
+    assert controller.queue_depth == 0
+    assert controller.committed == 100
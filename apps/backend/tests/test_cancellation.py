@@ -0,0 +1,124 @@
+"""Tests for aborting the engine requests of disconnected streams."""
+
+import asyncio
+from types import SimpleNamespace
+
+from backend.vllm_server.cancellation import (
+    CancellationStore,
+    CancellationWatcher,
+    StreamAbort,
+)
+
+from tests.helpers import FakeDict
+
+
+class FakeEngine:
+    """Engine streaming a token every few milliseconds until aborted."""
+
+    def __init__(self):
+        """Start without requests."""
+        self.aborted = []
+        self._events = {}
+
+    async def generate(self, request_id: str, num_tokens: int):
+        """Stream the outputs of a request."""
+        aborted = self._events[request_id] = asyncio.Event()
+        for i in range(1, num_tokens + 1):
+            if aborted.is_set():
+                return
+            await asyncio.sleep(0.001)
+            output = SimpleNamespace(token_ids=list(range(i)))
+            yield SimpleNamespace(
+                request_id=request_id, outputs=[output], finished=i == num_tokens
+            )
+
+    async def abort(self, request_id: str):
+        """Abort a request."""
+        self.aborted.append(request_id)
+        self._events[request_id].set()
+
+
+def test_cancelled_streams_are_aborted():
+    """A stream marked as cancelled is aborted and its remaining tokens counted."""
+    engine = FakeEngine()
+    cancellations = CancellationStore(FakeDict())
+    watcher = CancellationWatcher(cancellations, 0.001)
+    streams = {
+        request_id: StreamAbort(engine.abort, [request_id], max_tokens=100)
+        for request_id in ("cmpl-1", "cmpl-2")
+    }
+
+    async def consume(request_id):
+        stream_abort = streams[request_id]
+        watcher.watch(request_id, stream_abort)
+        received = 0
+        async for res in stream_abort.track(engine.generate(request_id, 100)):
+            received = len(res.outputs[0].token_ids)
+            if received == 10 and request_id == "cmpl-1":
+                await cancellations.cancel(request_id)
+        watcher.unwatch(request_id)
+        return received
+
+    async def run():
+        received = await asyncio.gather(consume("cmpl-1"), consume("cmpl-2"))
+        await asyncio.sleep(0.01)
+        reads = cancellations.store.reads
+        await asyncio.sleep(0.01)
+        # The store is no longer read once every stream is closed
+        assert cancellations.store.reads == reads
+        return received
+
+    cancelled, finished = asyncio.run(run())
+    assert engine.aborted == ["cmpl-1"]
+    assert cancelled < 100
+    assert finished == 100
+    assert streams["cmpl-1"].tokens_saved() == 100 - cancelled
+    assert watcher._task.done()
+
+
+def test_cancel_prunes_old_marks():
+    """Marks older than the TTL are dropped when a request is cancelled."""
+    now = [0.0]
+    cancellations = CancellationStore(FakeDict(), ttl=60.0, clock=lambda: now[0])
+
+    async def run():
+        await cancellations.cancel("cmpl-1")
+        now[0] = 30.0
+        await cancellations.cancel("cmpl-2")
+        now[0] = 70.0
+        await cancellations.cancel("cmpl-3")
+        return await cancellations.cancelled()
+
+    assert asyncio.run(run()) == {"cmpl-2", "cmpl-3"}
+
+
+def test_only_unfinished_requests_are_aborted():
+    """Finished requests are left alone and a stream is aborted at most once."""
+    engine = FakeEngine()
+    stream_abort = StreamAbort(engine.abort, ["cmpl-1-0", "cmpl-1-1"], max_tokens=5)
+
+    async def run():
+        async for _ in stream_abort.track(engine.generate("cmpl-1-0", 5)):
+            pass
+        engine._events["cmpl-1-1"] = asyncio.Event()
+        await stream_abort.abort()
+        await stream_abort.abort()
+
+    asyncio.run(run())
+    assert engine.aborted == ["cmpl-1-1"]
+    assert stream_abort.tokens_saved() == 5
+
+
+def test_finished_streams_are_not_aborted():
+    """Closing a finished stream does not abort anything."""
+    engine = FakeEngine()
+    stream_abort = StreamAbort(engine.abort, ["cmpl-1"], max_tokens=3)
+
+    async def run():
+        async for _ in stream_abort.track(engine.generate("cmpl-1", 3)):
+            pass
+        await stream_abort.abort()
+
+    asyncio.run(run())
+    assert engine.aborted == []
+    assert not stream_abort.aborted
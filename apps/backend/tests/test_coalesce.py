@@ -0,0 +1,48 @@
+"""Tests for coalescing streamed engine outputs."""
+
+import asyncio
+from types import SimpleNamespace
+
+from backend.vllm_server.engine.coalesce import coalesce_request_outputs
+
+
+def _output(num_tokens: int, *, finished: bool = False) -> SimpleNamespace:
+    completion = SimpleNamespace(index=0, token_ids=list(range(num_tokens)))
+    return SimpleNamespace(outputs=[completion], finished=finished)
+
+
+async def _engine(num_steps: int, step_delay: float = 0.0):
+    for step in range(1, num_steps + 1):
+        await asyncio.sleep(step_delay)
+        yield _output(step, finished=step == num_steps)
+
+
+async def _collect(generator) -> list:
+    return [len(res.outputs[0].token_ids) async for res in generator]
+
+
+def test_passthrough_when_disabled():
+    """Every engine step is forwarded when coalescing is disabled."""
+    outputs = asyncio.run(
+        _collect(coalesce_request_outputs(_engine(5), flush_tokens=1))
+    )
+    assert outputs == [1, 2, 3, 4, 5]
+
+
+def test_flush_by_token_count():
+    """Outputs are flushed every N tokens, always keeping the first and last."""
+    outputs = asyncio.run(
+        _collect(coalesce_request_outputs(_engine(10), flush_tokens=4))
+    )
+    assert outputs == [1, 5, 9, 10]
+
+
+def test_flush_by_interval():
+    """Buffered outputs are flushed once the interval elapses."""
+    generator = coalesce_request_outputs(
+        _engine(6, step_delay=0.02), flush_tokens=100, flush_interval=0.03
+    )
+    outputs = asyncio.run(_collect(generator))
+    assert outputs[0] == 1
+    assert outputs[-1] == 6
+    assert 2 < len(outputs) < 6
@@ -0,0 +1,186 @@
+"""Tests for the multi-prompt completion engine."""
+
+import asyncio
+import json
+from types import SimpleNamespace
+
+import pytest
+from backend.vllm_server.admission import AdmissionController
+from backend.vllm_server.engine.completion import (
+    CompletionEngine,
+    merge_request_outputs,
+    parse_prompt_format,
+)
+from backend.vllm_server.fair_queue import DEFAULT_SCHEDULING
+from backend.vllm_server.schema.completion import CompletionRequest
+
+MODEL_NAME = "mistralai/Mistral-7B-Instruct-v0.1"
+
+
+def _output(text: str, *, finished: bool) -> SimpleNamespace:
+    completion = SimpleNamespace(
+        index=0,
+        text=text,
+        token_ids=list(range(len(text))),
+        logprobs=None,
+        finish_reason="stop" if finished else None,
+    )
+    return SimpleNamespace(
+        prompt="p", prompt_token_ids=[1, 2], outputs=[completion], finished=finished
+    )
+
+
+async def _engine(text: str, step_delay: float):
+    for end in range(1, len(text) + 1):
+        await asyncio.sleep(step_delay)
+        yield _output(text[:end], finished=end == len(text))
+
+
+def _completion_engine() -> CompletionEngine:
+    # Skips loading the tokenizer from a running engine
+    engine = CompletionEngine.__new__(CompletionEngine)
+    engine.model_name = MODEL_NAME
+    return engine
+
+
+@pytest.mark.parametrize(
+    ("prompt", "expected"),
+    [
+        ("a", (False, ["a"])),
+        (["a", "b"], (False, ["a", "b"])),
+        ([1, 2], (True, [[1, 2]])),
+        ([[1], [2, 3]], (True, [[1], [2, 3]])),
+    ],
+)
+def test_parse_prompt_format(prompt, expected):
+    """Every OpenAI prompt format is normalized to a list of prompts."""
+    assert parse_prompt_format(prompt) == expected
+
+
+def test_parse_empty_prompt():
+    """An empty list of prompts is rejected."""
+    with pytest.raises(ValueError, match="at least one prompt"):
+        parse_prompt_format([])
+
+
+def test_min_tokens_is_rejected():
+    """Requests setting min_tokens, which is not supported, are rejected."""
+    CompletionRequest(model=MODEL_NAME, prompt="p", min_tokens=0)
+    with pytest.raises(ValueError, match="min_tokens is not supported"):
+        CompletionRequest(model=MODEL_NAME, prompt="p", min_tokens=4)
+
+
+def test_unknown_model_is_not_found():
+    """Requests for a model that is not served get an OpenAI style 404."""
+    engine = _completion_engine()
+    assert engine.check_model(CompletionRequest(model=MODEL_NAME, prompt="p")) is None
+    error = engine.check_model(CompletionRequest(model="other", prompt="p"))
+    assert error.code == 404
+    assert error.type == "NotFoundError"
+    assert error.message == "Model other is not being served."
+
+
+def test_merge_interleaves_prompts():
+    """Outputs of all prompts are yielded as soon as they are generated."""
+
+    async def run():
+        generators = [_engine("abcd", 0.01), _engine("xy", 0.015)]
+        return [
+            (i, res.outputs[0].text)
+            async for i, res in merge_request_outputs(generators)
+        ]
+
+    merged = asyncio.run(run())
+    assert [text for i, text in merged if i == 0] == ["a", "ab", "abc", "abcd"]
+    assert [text for i, text in merged if i == 1] == ["x", "xy"]
+    # The shorter prompt finishes before the longer one
+    assert merged.index((1, "xy")) < merged.index((0, "abcd"))
+
+
+def test_merge_propagates_errors_and_cancels():
+    """An error in one prompt is raised and the other prompts are cancelled."""
+    cancelled = asyncio.Event()
+
+    async def failing():
+        await asyncio.sleep(0.01)
+        raise ValueError("boom")
+        yield
+
+    async def slow():
+        try:
+            await asyncio.sleep(10)
+            yield _output("a", finished=True)
+        finally:
+            cancelled.set()
+
+    async def run():
+        with pytest.raises(ValueError, match="boom"):
+            async for _ in merge_request_outputs([failing(), slow()]):
+                pass
+        await asyncio.wait_for(cancelled.wait(), timeout=1)
+
+    asyncio.run(run())
+
+
+def test_stream_indexes_choices_by_prompt():
+    """Streamed chunks carry the choice index of their prompt."""
+    request = CompletionRequest(model=MODEL_NAME, prompt=["p", "q"], stream=True)
+
+    async def run():
+        generators = [_engine("ab", 0.01), _engine("xyz", 0.003)]
+        return [
+            frame
+            async for frame in _completion_engine().completion_stream_generator(
+                request, merge_request_outputs(generators), "cmpl-1"
+            )
+        ]
+
+    frames = asyncio.run(run())
+    assert frames[-1] == "data: [DONE]\n\n"
+    texts = {0: "", 1: ""}
+    for frame in frames[:-1]:
+        choice = json.loads(frame[len("data: ") :])["choices"][0]
+        texts[choice["index"]] += choice["text"]
+    assert texts == {0: "ab", 1: "xyz"}
+
+
+def test_full_response_merges_by_prompt_index():
+    """Choices of the full response are ordered by prompt regardless of timing."""
+    request = CompletionRequest(model=MODEL_NAME, prompt=["p", "q", "r"])
+
+    async def run():
+        generators = [
+            _engine("slow", 0.01),
+            _engine("f", 0.001),
+            _engine("mid", 0.003),
+        ]
+        return await _completion_engine().completion_full_generator(
+            request, merge_request_outputs(generators), "cmpl-1"
+        )
+
+    response = asyncio.run(run())
+    assert [(c.index, c.text) for c in response.choices] == [
+        (0, "slow"),
+        (1, "f"),
+        (2, "mid"),
+    ]
+    assert response.usage.prompt_tokens == 6
+    assert response.usage.completion_tokens == 8
+
+
+def test_prompts_past_the_budget_are_admitted_together():
+    """The prompts of a request larger than the budget do not wait on each other."""
+    request = CompletionRequest(model=MODEL_NAME, prompt=["p", "q", "r"], max_tokens=40)
+    engine = _completion_engine()
+    engine.admission = AdmissionController(budget_tokens=100, max_queue_wait=0.1)
+
+    async def run():
+        admissions = await engine._admit(request, [[1, 2]] * 3, DEFAULT_SCHEDULING)
+        assert engine.admission.committed == 126
+        for admission in admissions:
+            admission.release()
+        return admissions
+
+    admissions = asyncio.run(run())
+    assert [admission.tokens for admission in admissions] == [42, 42, 42]
+    assert engine.admission.committed == 0
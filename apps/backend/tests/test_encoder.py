@@ -0,0 +1,127 @@
+"""Tests for the precompiled chat completion chunk encoder."""
+
+import pytest
+from backend.vllm_server.encoder import ChatChunkEncoder, CompletionChunkEncoder
+from backend.vllm_server.schema.chat import (
+    ChatCompletionResponseStreamChoice,
+    ChatCompletionStreamResponse,
+)
+from backend.vllm_server.schema.common import DeltaMessage, LogProbs, UsageInfo
+from backend.vllm_server.schema.completion import (
+    CompletionResponseStreamChoice,
+    CompletionStreamResponse,
+)
+
+REQUEST_ID = 'cmpl-"quoted"'
+CREATED = 1712345678
+MODEL_NAME = "mistralai/Mistral-7B-Instruct-v0.1"
+TEXTS = ["", "hello", ' "quoted" \\ slash', "line\nbreak\t\x01\x7f", "über 🏀 </s>"]
+
+
+def _frame(choice: ChatCompletionResponseStreamChoice, *, final: bool = False) -> str:
+    chunk = ChatCompletionStreamResponse(
+        id=REQUEST_ID,
+        object="chat.completion.chunk",
+        created=CREATED,
+        choices=[choice],
+        model=MODEL_NAME,
+    )
+    if final:
+        chunk.usage = UsageInfo(prompt_tokens=7, completion_tokens=3, total_tokens=10)
+    data = chunk.model_dump_json(exclude_unset=True, exclude_none=final)
+    return f"data: {data}\n\n"
+
+
+@pytest.fixture
+def encoder() -> ChatChunkEncoder:
+    """Chunk encoder for a fixed request."""
+    return ChatChunkEncoder(REQUEST_ID, CREATED, MODEL_NAME)
+
+
+def test_role_frame(encoder):
+    """Role frames match the pydantic serialization."""
+    choice = ChatCompletionResponseStreamChoice(
+        index=1, delta=DeltaMessage(role="assistant"), logprobs=None, finish_reason=None
+    )
+    assert encoder.role(1, "assistant") == _frame(choice)
+
+
+@pytest.mark.parametrize("text", TEXTS)
+def test_echo_frame(encoder, text):
+    """Echo frames match the pydantic serialization."""
+    choice = ChatCompletionResponseStreamChoice(
+        index=0, delta=DeltaMessage(content=text), finish_reason=None
+    )
+    assert encoder.echo(0, text) == _frame(choice)
+
+
+@pytest.mark.parametrize("text", TEXTS)
+def test_content_frame(encoder, text):
+    """Content frames match the pydantic serialization."""
+    choice = ChatCompletionResponseStreamChoice(
+        index=2, delta=DeltaMessage(content=text), logprobs=None, finish_reason=None
+    )
+    assert encoder.content(2, text) == _frame(choice)
+
+
+@pytest.mark.parametrize("text", TEXTS)
+def test_finish_frame(encoder, text):
+    """Finish frames match the pydantic serialization including usage."""
+    choice = ChatCompletionResponseStreamChoice(
+        index=0, delta=DeltaMessage(content=text), logprobs=None, finish_reason="stop"
+    )
+    expected = _frame(choice, final=True)
+    assert encoder.finish(0, text, "stop", 7, 3) == expected
+
+
+def test_frames_with_logprobs(encoder):
+    """Frames carrying logprobs match the pydantic serialization."""
+    logprobs = LogProbs(
+        text_offset=[0, 3],
+        token_logprobs=[-0.5, None],
+        tokens=["foo", "bar"],
+        top_logprobs=[{"foo": -0.5}, None],
+    )
+    content = ChatCompletionResponseStreamChoice(
+        index=0,
+        delta=DeltaMessage(content="foo"),
+        logprobs=logprobs,
+        finish_reason=None,
+    )
+    finish = ChatCompletionResponseStreamChoice(
+        index=0,
+        delta=DeltaMessage(content="bar"),
+        logprobs=logprobs,
+        finish_reason="length",
+    )
+    assert encoder.content(0, "foo", logprobs) == _frame(content)
+    assert encoder.finish(0, "bar", "length", 7, 3, logprobs) == _frame(
+        finish, final=True
+    )
+
+
+@pytest.mark.parametrize("text", TEXTS)
+def test_completion_frames(text):
+    """Completion frames match the pydantic serialization."""
+    encoder = CompletionChunkEncoder(REQUEST_ID, CREATED, MODEL_NAME)
+    finish_logprobs = LogProbs(tokens=["foo"], token_logprobs=[-0.5], text_offset=[0])
+    for finish_reason, logprobs in ((None, None), ("length", finish_logprobs)):
+        chunk = CompletionStreamResponse(
+            id=REQUEST_ID,
+            object="text_completion",
+            created=CREATED,
+            model=MODEL_NAME,
+            choices=[
+                CompletionResponseStreamChoice(
+                    index=3, text=text, logprobs=logprobs, finish_reason=finish_reason
+                )
+            ],
+        )
+        if finish_reason is None:
+            frame = encoder.text(3, text, logprobs)
+        else:
+            chunk.usage = UsageInfo(
+                prompt_tokens=7, completion_tokens=3, total_tokens=10
+            )
+            frame = encoder.finish(3, text, finish_reason, 7, 3, logprobs)
+        assert frame == f"data: {chunk.model_dump_json(exclude_unset=True)}\n\n"
@@ -0,0 +1,79 @@
+"""Tests for the deficit round robin fair queue."""
+
+from typing import NamedTuple
+
+import pytest
+from backend.vllm_server.fair_queue import BATCH, FairQueue, Scheduling
+
+
+class Item(NamedTuple):
+    """Queued request."""
+
+    name: str
+    tokens: int
+    scheduling: Scheduling
+
+
+def _drain(queue: FairQueue) -> list:
+    order = []
+    while queue:
+        order.append(queue.pop().name)
+    return order
+
+
+def test_tenants_are_served_round_robin():
+    """A tenant with a backlog does not delay the requests of other tenants."""
+    queue = FairQueue(quantum=100)
+    for i in range(4):
+        queue.push(Item(f"a{i}", 100, Scheduling("a")))
+    queue.push(Item("b0", 100, Scheduling("b")))
+    queue.push(Item("b1", 100, Scheduling("b")))
+    assert _drain(queue) == ["a0", "b0", "a1", "b1", "a2", "a3"]
+
+
+def test_tenants_receive_equal_token_shares():
+    """Tenants sending larger requests are served proportionally less often."""
+    queue = FairQueue(quantum=100)
+    for i in range(3):
+        queue.push(Item(f"large{i}", 200, Scheduling("large")))
+    for i in range(6):
+        queue.push(Item(f"small{i}", 100, Scheduling("small")))
+    order = _drain(queue)
+    assert order[:6] == ["small0", "large0", "small1", "small2", "large1", "small3"]
+
+
+def test_weights():
+    """A tenant with twice the weight is served twice as often."""
+    queue = FairQueue(quantum=100, weights={"a": 2.0})
+    for i in range(4):
+        queue.push(Item(f"a{i}", 100, Scheduling("a")))
+        queue.push(Item(f"b{i}", 100, Scheduling("b")))
+    assert _drain(queue)[:6] == ["a0", "a1", "b0", "a2", "a3", "b1"]
+
+
+@pytest.mark.parametrize("weight", [0, -1.0])
+def test_weights_must_be_positive(weight):
+    """A tenant whose weight credits no tokens is rejected."""
+    with pytest.raises(ValueError, match="must be positive"):
+        FairQueue(quantum=10, weights={"a": weight})
+
+
+def test_interactive_requests_are_served_before_batch():
+    """Batch requests are only served once no interactive request waits."""
+    queue = FairQueue(quantum=100)
+    queue.push(Item("batch", 100, Scheduling("a", BATCH)))
+    queue.push(Item("interactive", 100, Scheduling("b")))
+    assert _drain(queue) == ["interactive", "batch"]
+    with pytest.raises(ValueError, match="Unknown priority"):
+        queue.push(Item("urgent", 100, Scheduling("a", "urgent")))
+
+
+def test_removed_requests_are_skipped():
+    """Requests that timed out are removed along with their idle tenant."""
+    queue = FairQueue(quantum=100)
+    expired = Item("a0", 100, Scheduling("a"))
+    queue.push(expired)
+    queue.push(Item("b0", 100, Scheduling("b")))
+    queue.remove(expired)
+    assert len(queue) == 1
+    assert _drain(queue) == ["b0"]
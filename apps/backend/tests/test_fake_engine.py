@@ -0,0 +1,87 @@
+"""Tests for the fake engine and the model service running on it."""
+
+import asyncio
+import json
+
+from backend.vllm_server.engine.chat import ChatEngine
+from backend.vllm_server.engine.completion import CompletionEngine
+from backend.vllm_server.engine.fake import FakeAsyncLLMEngine, SamplingParams
+from backend.vllm_server.schema.chat import ChatCompletionRequest
+from backend.vllm_server.service import ModelService
+from backend.vllm_server.wire import StreamDecoder
+
+MODEL_NAME = "mistralai/Mistral-7B-Instruct-v0.1"
+
+
+def _generate(engine, max_tokens, n=1, request_id="a"):
+    params = SamplingParams(n=n, max_tokens=max_tokens)
+    return engine.generate("p", params, request_id, [5, 6, 7])
+
+
+def test_outputs_are_cumulative():
+    """Every output holds the text and tokens generated so far."""
+    engine = FakeAsyncLLMEngine("tok", tokens_per_second=1000)
+
+    async def run():
+        return [
+            [(output.token_ids[:], output.finish_reason) for output in res.outputs]
+            async for res in _generate(engine, max_tokens=4, n=2)
+        ]
+
+    steps = asyncio.run(run())
+    assert steps[-1] == [([5, 6, 7, 5], "length")] * 2
+    assert [step[0][0] for step in steps] == [[5], [5, 6], [5, 6, 7], [5, 6, 7, 5]]
+    assert engine.generated_tokens == 8
+    assert engine.num_running == 0
+
+
+def test_abort_ends_the_stream():
+    """An aborted request stops generating before its next output."""
+    engine = FakeAsyncLLMEngine("tok", tokens_per_second=1000)
+
+    async def run():
+        steps = 0
+        async for _ in _generate(engine, max_tokens=100):
+            steps += 1
+            if steps == 3:
+                await engine.abort("a")
+        return steps
+
+    assert asyncio.run(run()) == 3
+    assert engine.aborted == ["a"]
+
+
+def test_service_streams_chat_completion(tokenizer):
+    """The model service streams a chat completion generated by the fake engine."""
+    engine = FakeAsyncLLMEngine("tok", tokens_per_second=1000)
+    fake = {"tokenizer": tokenizer, "sampling_params_class": SamplingParams}
+    service = ModelService(
+        engine,
+        ChatEngine(engine, MODEL_NAME, "assistant", **fake),
+        CompletionEngine(engine, MODEL_NAME, **fake),
+    )
+
+    async def run():
+        request = ChatCompletionRequest(
+            model=MODEL_NAME,
+            messages=[{"role": "user", "content": "the best player"}],
+            max_tokens=5,
+            stream=True,
+            stream_flush_tokens=1,
+        )
+        decoder = StreamDecoder()
+        return "".join(
+            [
+                decoder.render(message)
+                async for message in service.generate_chat_completion_stream(request)
+            ]
+        )
+
+    frames = asyncio.run(run()).split("\n\n")
+    assert frames[-2:] == ["data: [DONE]", ""]
+    chunks = [json.loads(frame[len("data: ") :]) for frame in frames[:-2]]
+    content = "".join(
+        chunk["choices"][0]["delta"].get("content") or "" for chunk in chunks
+    )
+    assert content == " token" * 5
+    assert chunks[-1]["choices"][0]["finish_reason"] == "length"
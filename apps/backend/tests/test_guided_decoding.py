@@ -0,0 +1,130 @@
+"""Tests for the guided decoding processor cache."""
+
+import asyncio
+import threading
+
+import pytest
+from backend.vllm_server.engine.guided_decoding import (
+    GuidedDecodingCache,
+    request_guide,
+)
+from backend.vllm_server.schema.chat import ChatCompletionRequest
+
+SCHEMA = {
+    "type": "object",
+    "properties": {"action": {"type": "string"}, "input": {"type": "string"}},
+}
+
+
+class FakeProcessor:
+    """Processor recording the constraint it was compiled for."""
+
+    def __init__(self, guide):
+        """Compile the constraint."""
+        self.fsm = guide
+        self.fsm_state = None
+
+    def init_state(self):
+        """Reset the decoding state."""
+        self.fsm_state = {}
+
+
+class FakeCompiler:
+    """Compile function counting compiles, blocking until released."""
+
+    def __init__(self):
+        """Start with no compiles."""
+        self.compiles = 0
+        self.release = threading.Event()
+        self.release.set()
+
+    def __call__(self, guide, tokenizer):
+        """Compile a fake processor."""
+        self.release.wait()
+        self.compiles += 1
+        if guide.guide == "(":
+            raise RuntimeError("unbalanced parenthesis")
+        return FakeProcessor(guide)
+
+
+def _request(**kwargs) -> ChatCompletionRequest:
+    return ChatCompletionRequest(
+        model="model", messages=[{"role": "user", "content": "Hi"}], **kwargs
+    )
+
+
+def test_equivalent_constraints_share_a_key():
+    """JSON schemas are canonicalized and choices are escaped into a regex."""
+    key = request_guide(_request(guided_json=SCHEMA)).key
+    reordered = dict(reversed(list(SCHEMA.items())))
+    assert request_guide(_request(guided_json=reordered)).key == key
+    assert (
+        request_guide(_request(guided_json=f" {SCHEMA} ".replace("'", '"'))).key == key
+    )
+
+    guide = request_guide(_request(guided_choice=["a.b", "c"]))
+    assert guide == ("regex", r"(a\.b|c)")
+    assert request_guide(_request()) is None
+    with pytest.raises(ValueError, match="guided_grammar"):
+        request_guide(_request(guided_grammar="root ::= 'a'"))
+
+
+def test_concurrent_requests_compile_once():
+    """Requests waiting on a compile share it and get their own processor."""
+    compiler = FakeCompiler()
+    cache = GuidedDecodingCache(tokenizer=None, compile_fn=compiler)
+
+    async def get_all():
+        compiler.release.clear()
+        pending = asyncio.gather(
+            *(
+                cache.get_logits_processor(_request(guided_json=SCHEMA))
+                for _ in range(4)
+            )
+        )
+        await asyncio.sleep(0.01)
+        compiler.release.set()
+        return await pending
+
+    processors = asyncio.run(get_all())
+    cache.shutdown()
+
+    assert compiler.compiles == 1
+    assert (cache.misses, cache.hits) == (1, 3)
+    assert len({id(processor) for processor in processors}) == 4
+    assert len({id(processor.fsm) for processor in processors}) == 1
+    assert len({id(processor.fsm_state) for processor in processors}) == 4
+
+
+def test_lru_eviction():
+    """The least recently used processor is evicted first."""
+    compiler = FakeCompiler()
+    cache = GuidedDecodingCache(tokenizer=None, max_entries=2, compile_fn=compiler)
+
+    async def get(regex):
+        return await cache.get_logits_processor(_request(guided_regex=regex))
+
+    async def run():
+        for regex in ("a", "b", "a", "c", "a", "b"):
+            await get(regex)
+
+    asyncio.run(run())
+    cache.shutdown()
+    assert compiler.compiles == 4
+    assert len(cache) == 2
+
+
+def test_failed_compiles_are_not_cached():
+    """Invalid constraints raise a ValueError and are compiled again next time."""
+    compiler = FakeCompiler()
+    cache = GuidedDecodingCache(tokenizer=None, compile_fn=compiler)
+
+    async def get():
+        return await cache.get_logits_processor(_request(guided_regex="("))
+
+    for _ in range(2):
+        with pytest.raises(ValueError, match="unbalanced parenthesis"):
+            asyncio.run(get())
+    cache.shutdown()
+    assert compiler.compiles == 2
+    assert len(cache) == 0
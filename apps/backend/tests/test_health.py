@@ -0,0 +1,100 @@
+"""Tests for the health of the model replicas from their heartbeats."""
+
+import asyncio
+import threading
+
+from backend.vllm_server.health import (
+    COLD,
+    HEARTBEATS_KEY,
+    UNHEALTHY,
+    WARM,
+    HealthMonitor,
+    Heartbeat,
+    HeartbeatStore,
+    send_heartbeats,
+)
+
+from tests.helpers import FakeClock, FakeDict
+
+
+def _heartbeat(container_id: str, replica: int, sent_at: float, *, healthy=True):
+    return Heartbeat(container_id, replica, sent_at, healthy, 2, 1, 0.5)
+
+
+def test_replica_states():
+    """Replicas are warm, unhealthy or cold from their fresh heartbeats."""
+    store = HeartbeatStore(FakeDict())
+    clock = FakeClock(1000.0)
+    store.publish(_heartbeat("a", 0, clock.now))
+    store.publish(_heartbeat("b", 0, clock.now, healthy=False))
+    store.publish(_heartbeat("c", 1, clock.now, healthy=False))
+    store.publish(_heartbeat("d", 2, clock.now - 60))
+    monitor = HealthMonitor(store, 3, staleness=30, clock=clock)
+
+    replicas = asyncio.run(monitor.replica_health())
+    assert [replica.state for replica in replicas] == [WARM, UNHEALTHY, COLD]
+    assert replicas[0].containers == 1
+    assert replicas[0].running == 2
+    assert replicas[0].kv_cache_usage == 0.5
+    assert replicas[2].age is None
+
+    # Heartbeats returned by deep probes count until the next read
+    monitor.record(_heartbeat("e", 1, clock.now))
+    replicas = asyncio.run(monitor.replica_health())
+    assert [replica.state for replica in replicas] == [WARM, WARM, COLD]
+
+    store.remove("a")
+    clock.now += monitor.cache_ttl
+    replicas = asyncio.run(monitor.replica_health())
+    assert [replica.state for replica in replicas] == [UNHEALTHY, UNHEALTHY, COLD]
+
+
+def test_publish_prunes_stale_heartbeats():
+    """Heartbeats older than the staleness bound are dropped on every publish."""
+    store = FakeDict()
+    heartbeats = HeartbeatStore(store, staleness=30)
+    heartbeats.publish(_heartbeat("a", 0, 1000.0))
+    heartbeats.publish(_heartbeat("b", 0, 1020.0))
+    heartbeats.publish(_heartbeat("c", 0, 1040.0))
+    assert sorted(store.data[HEARTBEATS_KEY]) == ["b", "c"]
+
+
+def test_reads_are_cached():
+    """Probes within the cache TTL share a read, failed reads keep the last one."""
+    store = FakeDict()
+    heartbeats = HeartbeatStore(store)
+    clock = FakeClock(1000.0)
+    heartbeats.publish(_heartbeat("a", 0, clock.now))
+    store.reads = 0
+    monitor = HealthMonitor(heartbeats, staleness=30, cache_ttl=2, clock=clock)
+
+    async def probe(times: int):
+        return await asyncio.gather(*(monitor.replica_health() for _ in range(times)))
+
+    asyncio.run(probe(10))
+    assert store.reads == 1
+
+    store.fail = True
+    clock.now += 2
+    assert asyncio.run(monitor.replica_health())[0].state == WARM
+    assert store.reads == 2
+
+    clock.now += 30
+    assert asyncio.run(monitor.replica_health())[0].state == COLD
+
+
+def test_send_heartbeats_until_stopped():
+    """Heartbeats are published until the container stops them."""
+    store = HeartbeatStore(FakeDict())
+    stopped = threading.Event()
+    sent = []
+
+    def heartbeat():
+        sent.append(len(sent))
+        if len(sent) == 3:
+            stopped.set()
+        return _heartbeat("a", 0, float(len(sent)))
+
+    send_heartbeats(store, heartbeat, 0.001, stopped)
+    assert len(sent) == 3
+    assert asyncio.run(store.read()) == [_heartbeat("a", 0, 3.0)]
@@ -0,0 +1,35 @@
+"""Tests that CPU-only modules import without the GPU dependencies."""
+
+import subprocess
+import sys
+
+import pytest
+
+CPU_MODULES = [
+    "backend.prewarm.scheduler",
+    "backend.tgi_server.fake",
+    "backend.tgi_server.launcher",
+    "backend.tgi_server.pool",
+    "backend.tgi_server.service",
+    "backend.vllm_server.config",
+    "backend.vllm_server.schema.chat",
+    "backend.vllm_server.schema.completion",
+    "backend.vllm_server.engine.chat",
+    "backend.vllm_server.engine.completion",
+    "backend.vllm_server.engine.fake",
+    "backend.vllm_server.service",
+]
+
+
+@pytest.mark.parametrize("module", CPU_MODULES)
+def test_cpu_modules_do_not_import_vllm(module: str):
+    """Importing the module leaves vLLM, torch and Modal unimported."""
+    # A fresh interpreter, as the modules imported by other tests are cached
+    code = (
+        f"import sys, {module}\n"
+        "print(','.join(m for m in ('vllm', 'torch', 'modal') if m in sys.modules))"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    )
+    assert result.stdout.strip() == ""
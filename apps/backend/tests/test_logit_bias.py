@@ -0,0 +1,53 @@
+"""Tests for the logit bias processor."""
+
+import pytest
+from backend.vllm_server.engine.logit_bias import (
+    canonical_logit_bias,
+    get_logit_bias_processor,
+    validate_logit_bias,
+)
+
+
+def test_canonical_logit_bias():
+    """Bias maps are sorted by token ID and clamped."""
+    assert canonical_logit_bias({"7": 1, "3": -250.0, "5": 300}) == (
+        (3, -100.0),
+        (5, 100.0),
+        (7, 1.0),
+    )
+
+
+def test_processors_are_cached_by_bias_map():
+    """Requests sharing a bias map share its compiled processor."""
+    pytest.importorskip("torch")
+    processor = get_logit_bias_processor({"1": 5.0, "2": -5.0})
+    assert get_logit_bias_processor({"2": -5, "1": 5}) is processor
+    assert get_logit_bias_processor({"1": 5.0}) is not processor
+
+
+def test_matches_python_loop():
+    """The scatter-add applies the same bias as looping over the map."""
+    torch = pytest.importorskip("torch")
+    logit_bias = {str(i): (i % 7 - 3) * 40.0 for i in range(0, 1000, 3)}
+    logits = torch.randn(1000)
+
+    expected = logits.clone()
+    for token_id, bias in logit_bias.items():
+        expected[int(token_id)] += min(100, max(-100, bias))
+
+    biased = get_logit_bias_processor(logit_bias)([], logits.clone())
+    torch.testing.assert_close(biased, expected)
+
+
+@pytest.mark.parametrize("token_id", ["10", "-1", "a"])
+def test_out_of_vocabulary_token(token_id):
+    """Token IDs outside the vocabulary are rejected with the request."""
+    with pytest.raises(ValueError, match="out of the vocabulary"):
+        validate_logit_bias({"3": 1.0, token_id: 1.0}, vocab_size=10)
+
+
+def test_processor_skips_tokens_past_the_logits():
+    """The processor never raises in the sampler."""
+    torch = pytest.importorskip("torch")
+    biased = get_logit_bias_processor({"2": 1.0, "10": 1.0})([], torch.zeros(10))
+    assert biased.tolist() == [0, 0, 1, 0, 0, 0, 0, 0, 0, 0]
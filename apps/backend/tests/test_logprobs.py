@@ -0,0 +1,58 @@
+"""Tests for building OpenAI style logprobs."""
+
+import random
+from types import SimpleNamespace
+
+from backend.vllm_server.engine.logprobs import create_logprobs
+
+
+def _steps(vocab_size: int, num_tokens: int, top_logprobs: int):
+    rng = random.Random(0)
+    token_ids, steps = [], []
+    for _ in range(num_tokens):
+        candidates = rng.sample(range(vocab_size), top_logprobs)
+        token_ids.append(candidates[0])
+        steps.append({c: -rng.random() for c in candidates})
+    return token_ids, steps
+
+
+def test_matches_per_token_construction(tokenizer):
+    """Tokens, offsets and top logprobs match converting one token at a time."""
+    token_ids, steps = _steps(len(tokenizer), 50, 5)
+    steps[3] = None
+    logprobs = create_logprobs(
+        tokenizer, token_ids, steps, num_output_top_logprobs=5, initial_text_offset=7
+    )
+
+    tokens = [tokenizer.convert_ids_to_tokens(i) for i in token_ids]
+    assert logprobs.tokens == tokens
+    assert logprobs.text_offset[0] == 7
+    assert all(
+        logprobs.text_offset[i + 1] - logprobs.text_offset[i] == len(tokens[i])
+        for i in range(len(tokens) - 1)
+    )
+    assert logprobs.token_logprobs[3] is None
+    assert logprobs.top_logprobs[3] is None
+    assert logprobs.token_logprobs[0] == steps[0][token_ids[0]]
+    assert logprobs.top_logprobs[0] == {
+        tokenizer.convert_ids_to_tokens(i): p for i, p in steps[0].items()
+    }
+
+
+def test_logprob_objects(tokenizer):
+    """Logprob objects reported by newer vLLM versions are unwrapped."""
+    token_ids, steps = _steps(len(tokenizer), 4, 3)
+    wrapped = [
+        {i: SimpleNamespace(logprob=p) for i, p in step.items()} for step in steps
+    ]
+    expected = create_logprobs(tokenizer, token_ids, steps, 3)
+    assert create_logprobs(tokenizer, token_ids, wrapped, 3) == expected
+
+
+def test_without_top_logprobs(tokenizer):
+    """Top logprob dicts are omitted unless requested."""
+    token_ids, steps = _steps(len(tokenizer), 4, 3)
+    logprobs = create_logprobs(tokenizer, token_ids, steps)
+    assert logprobs.top_logprobs is None
+    assert logprobs.model_dump_json(exclude_unset=True).endswith('"top_logprobs":null}')
+    assert create_logprobs(tokenizer, [], None, 3).tokens == []
@@ -0,0 +1,73 @@
+"""Tests for the request metrics."""
+
+import asyncio
+import time
+from types import SimpleNamespace
+
+from backend.vllm_server.metrics import (
+    INTER_TOKEN,
+    TIME_TO_FIRST_TOKEN,
+    Registry,
+    observe_request_outputs,
+)
+
+
+def test_render_histogram():
+    """Histograms render cumulative buckets, sum and count."""
+    registry = Registry()
+    latency = registry.histogram("latency_seconds", "Latency.", buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 5.0):
+        latency.observe(value)
+
+    lines = registry.render().splitlines()
+    assert lines[:2] == [
+        "# HELP latency_seconds Latency.",
+        "# TYPE latency_seconds histogram",
+    ]
+    assert 'latency_seconds_bucket{le="0.1"} 1' in lines
+    assert 'latency_seconds_bucket{le="1.0"} 2' in lines
+    assert 'latency_seconds_bucket{le="+Inf"} 3' in lines
+    assert "latency_seconds_sum 5.55" in lines
+    assert "latency_seconds_count 3" in lines
+
+
+def test_render_merges_snapshots():
+    """Snapshots of other registries are summed by name and labels."""
+    gateway, container = Registry(), Registry()
+    for registry in (gateway, container):
+        requests = registry.counter("requests_total", "Requests.", ("route",))
+        requests.labels("chat").inc()
+    container.counter("tokens_total", "Tokens.").inc(7)
+
+    lines = gateway.render([container.snapshot()]).splitlines()
+    assert 'requests_total{route="chat"} 2.0' in lines
+    assert "tokens_total 7.0" in lines
+
+
+def test_label_values_are_escaped():
+    """Quotes and newlines in label values are escaped."""
+    registry = Registry()
+    registry.gauge("info", "Info.", ("name",)).labels('a"b\nc').set(1)
+    assert 'info{name="a\\"b\\nc"} 1' in registry.render()
+
+
+def test_observe_request_outputs():
+    """Time to first token and inter-token gaps are recorded per request."""
+
+    async def engine():
+        for step in range(1, 4):
+            await asyncio.sleep(0.01)
+            completion = SimpleNamespace(token_ids=list(range(step)))
+            yield SimpleNamespace(outputs=[completion])
+
+    async def run():
+        return [res async for res in observe_request_outputs(engine(), started)]
+
+    ttft_count = sum(TIME_TO_FIRST_TOKEN._unlabeled.counts)
+    gaps_count = sum(INTER_TOKEN._unlabeled.counts)
+    started = time.perf_counter()
+    outputs = asyncio.run(run())
+
+    assert len(outputs) == 3
+    assert sum(TIME_TO_FIRST_TOKEN._unlabeled.counts) == ttft_count + 1
+    assert sum(INTER_TOKEN._unlabeled.counts) == gaps_count + 2
@@ -0,0 +1,120 @@
+"""Tests for pre-warming GPU containers ahead of games."""
+
+import asyncio
+
+from backend.prewarm.scheduler import (
+    Game,
+    HistoryStore,
+    PrewarmPlanner,
+    PrewarmPolicy,
+    RequestHistory,
+    RequestRecorder,
+    load_schedule,
+    simulate,
+)
+
+from tests.helpers import FakeDict
+
+HOUR = 60 * 60.0
+DAY = 24 * HOUR
+POLICY = PrewarmPolicy(
+    requests_per_container=1.0,
+    lead=15 * 60,
+    game_duration=2 * HOUR,
+    lookback=15 * 60,
+    headroom=1.0,
+    default_game_rate=1.0,
+)
+
+
+def _game_traffic(tip_off: float, rate: float) -> list:
+    """Requests at a constant rate over the first hour of a game."""
+    return [tip_off + i / rate for i in range(int(HOUR * rate))]
+
+
+def test_load_schedule(tmp_path):
+    """Games are parsed in UTC unless their time has an offset."""
+    path = tmp_path / "games.csv"
+    path.write_text(
+        "tip_off,away,home\n"
+        "2024-04-20T20:30:00-04:00,LAL,DEN\n"
+        "2024-04-20T17:00:00Z,IND,MIL\n"
+        ",,\n"
+    )
+    assert load_schedule(str(path)) == [
+        Game(1713632400.0, "IND @ MIL"),
+        Game(1713659400.0, "LAL @ DEN"),
+    ]
+
+
+def test_warm_containers_follow_past_games():
+    """Games are warmed ahead of tip-off for the traffic of past games."""
+    schedule = [Game(DAY, "first"), Game(2 * DAY, "second")]
+    planner = PrewarmPlanner(schedule, POLICY)
+    history = RequestHistory()
+
+    # Without past games the default game rate is expected
+    assert planner.warm_containers(history, DAY - 20 * 60) == 0
+    assert planner.warm_containers(history, DAY - 10 * 60) == 1
+
+    for at in _game_traffic(DAY, 3.0):
+        history.record(at)
+    assert planner.warm_containers(history, DAY + 30 * 60) == 3
+    assert planner.warm_containers(history, DAY + 3 * HOUR) == 0
+
+    # The second game expects the traffic of the first one, which ended an hour
+    # after tip-off
+    assert planner.warm_containers(history, 2 * DAY - 10 * 60) == 3
+    assert planner.warm_containers(history, 2 * DAY + 90 * 60) == 0
+    assert planner.warm_containers(history, 2 * DAY + 3 * HOUR) == 0
+
+    # Traffic above the past games raises the warm containers
+    for at in _game_traffic(2 * DAY, 5.0):
+        history.record(at)
+    assert planner.warm_containers(history, 2 * DAY + 30 * 60) == 5
+
+
+def test_past_games_without_history_are_ignored():
+    """Past games missing from the history fall back to the default game rate."""
+    schedule = [Game(DAY, "before deploy"), Game(2 * DAY, "next")]
+    planner = PrewarmPlanner(schedule, POLICY)
+    history = RequestHistory()
+    history.record(2 * DAY - HOUR)
+    assert planner.warm_containers(history, 2 * DAY - 10 * 60) == 1
+
+
+def test_recorder_flushes_counts():
+    """Requests are flushed to the shared history once the interval passed."""
+    store = HistoryStore(FakeDict(), "app")
+    now = [DAY]
+    recorder = RequestRecorder(store, flush_interval=60, clock=lambda: now[0])
+
+    async def run():
+        recorder.record()
+        recorder.record()
+        await asyncio.sleep(0)
+        assert (await store.read()).counts == {}
+
+        now[0] += 60
+        recorder.record()
+        await recorder._flush_task
+        return (await store.read()).counts
+
+    assert asyncio.run(run()) == {int(DAY): 2, int(DAY) + 60: 1}
+    assert recorder.pending.counts == {}
+
+
+def test_simulate_avoids_cold_starts():
+    """Pre-warming avoids the cold starts of games at the cost of GPU minutes."""
+    schedule = [Game(DAY, "first"), Game(2 * DAY, "second")]
+    arrivals = _game_traffic(DAY, 3.0) + _game_traffic(2 * DAY, 3.0)
+
+    planner = PrewarmPlanner(schedule, POLICY)
+    baseline = simulate(arrivals, None, requests_per_container=1.0)
+    prewarmed = simulate(arrivals, planner, requests_per_container=1.0)
+    assert prewarmed.requests == baseline.requests == len(arrivals)
+    assert baseline.cold_starts == 2 * 3
+    assert baseline.prewarmed == 0
+    assert prewarmed.cold_starts < baseline.cold_starts
+    assert prewarmed.prewarmed > 0
+    assert prewarmed.gpu_minutes > baseline.gpu_minutes
@@ -0,0 +1,49 @@
+"""Tests for the chat template and prompt prefix tokenization cache."""
+
+import random
+
+from backend.vllm_server.engine.prompt_cache import PromptCache
+
+from tests.helpers import WORDS
+
+
+def test_render_matches_transformers(tokenizer):
+    """The compiled template renders the same prompt as transformers."""
+    cache = PromptCache(tokenizer)
+    messages = [
+        {"role": "system", "content": "You are an NBA expert."},
+        {"role": "user", "content": "Who scored 30 points?"},
+    ]
+    assert cache.render(messages) == tokenizer.apply_chat_template(
+        messages, tokenize=False, add_generation_prompt=True
+    )
+
+
+def test_multi_turn_reuses_prefix(tokenizer):
+    """Multi-turn conversations reuse cached prefixes and tokenize identically."""
+    cache = PromptCache(tokenizer)
+    rng = random.Random(1)
+    for _ in range(5):
+        messages = [{"role": "system", "content": "You are an NBA expert. " * 3}]
+        for _ in range(4):
+            messages.append(
+                {"role": "user", "content": " ".join(rng.choices(WORDS, k=12))}
+            )
+            prompt = cache.render(messages)
+            assert cache.tokenize(messages, prompt) == tokenizer(prompt).input_ids
+            messages.append(
+                {"role": "assistant", "content": " ".join(rng.choices(WORDS, k=12))}
+            )
+
+    stats = cache.stats()
+    assert stats["hits"] > stats["misses"]
+    assert stats["reused_tokens"] > 0
+
+
+def test_lru_is_bounded(tokenizer):
+    """The cache never holds more than `max_entries` prefixes."""
+    cache = PromptCache(tokenizer, max_entries=3)
+    for i in range(10):
+        messages = [{"role": "user", "content": f"question {i}"}]
+        cache.tokenize(messages, cache.render(messages))
+    assert cache.stats()["entries"] == 3
@@ -0,0 +1,115 @@
+"""Tests for the deterministic chat completion response cache."""
+
+from backend.vllm_server.encoder import DONE_FRAME, ChatChunkEncoder
+from backend.vllm_server.response_cache import (
+    ResponseCache,
+    StreamRecorder,
+    cache_directives,
+    replay_stream,
+    request_cache_key,
+)
+from backend.vllm_server.schema.chat import ChatCompletionRequest
+
+from tests.helpers import FakeClock
+
+MODEL_NAME = "mistralai/Mistral-7B-Instruct-v0.1"
+MESSAGES = [{"role": "user", "content": "Hello"}]
+
+
+def _request(**kwargs) -> ChatCompletionRequest:
+    return ChatCompletionRequest(model=MODEL_NAME, messages=MESSAGES, **kwargs)
+
+
+def _stream_frames(n: int = 1):
+    encoder = ChatChunkEncoder("chatcmpl-1", 1712345678, MODEL_NAME)
+    frames = [encoder.role(i, "assistant") for i in range(n)]
+    for i in range(n):
+        frames.append(encoder.content(i, f"Hi {i}"))
+        frames.append(encoder.finish(i, "!", "stop", 5, 3 + i))
+    return [*frames, DONE_FRAME]
+
+
+def test_only_deterministic_requests_are_cacheable():
+    """Sampled requests without a seed are never cached."""
+    assert request_cache_key(_request(temperature=0.7)) is None
+    assert request_cache_key(_request(temperature=0)) is not None
+    assert request_cache_key(_request(temperature=0.7, seed=1)) is not None
+
+
+def test_key_ignores_delivery_fields():
+    """Streaming and flush settings do not change the cache key."""
+    key = request_cache_key(_request(temperature=0))
+    assert key == request_cache_key(
+        _request(temperature=0, stream=True, stream_flush_tokens=4, user="a")
+    )
+    assert key != request_cache_key(_request(temperature=0, max_tokens=5))
+    assert key != request_cache_key(_request(temperature=0, seed=1))
+
+
+def test_cache_directives():
+    """Cache-Control directives are parsed case insensitively."""
+    assert cache_directives("No-Cache, max-age=0") == {"no-cache", "max-age"}
+    assert cache_directives(None) == set()
+
+
+def test_lru_and_ttl():
+    """Entries are evicted least recently used first and expire after the TTL."""
+    clock = FakeClock()
+    cache = ResponseCache(max_entries=2, ttl=10, clock=clock)
+    response, completion_tokens = _record(_stream_frames())
+    for key in ("a", "b"):
+        cache.put(key, response, completion_tokens)
+
+    assert cache.get("a") is not None
+    cache.put("c", response, completion_tokens)
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+
+    clock.now = 10
+    assert cache.get("a") is None
+    assert len(cache) == 1
+
+
+def test_full_responses_with_several_choices_are_not_streamed():
+    """Per choice usage is unknown for full responses with several choices."""
+    cache = ResponseCache()
+    response, _ = _record(_stream_frames(n=2))
+    cache.put("key", response)
+    assert cache.get("key") is not None
+    assert cache.get("key", stream=True) is None
+
+
+def _record(frames):
+    recorder = StreamRecorder()
+    for frame in frames:
+        recorder.feed(frame)
+    return recorder.response()
+
+
+def test_record_stream():
+    """The full response is rebuilt from the frames of a stream."""
+    response, completion_tokens = _record(_stream_frames(n=2))
+    assert [choice.message.content for choice in response.choices] == [
+        "Hi 0!",
+        "Hi 1!",
+    ]
+    assert completion_tokens == [3, 4]
+    assert response.usage.prompt_tokens == 5
+    assert response.usage.completion_tokens == 7
+
+
+def test_incomplete_or_failed_streams_are_not_recorded():
+    """Streams that did not finish or reported an error are not cached."""
+    frames = _stream_frames()
+    assert _record(frames[:-1]) is None
+    assert _record([*frames[:-1], 'data: {"error": {}}\n\n', DONE_FRAME]) is None
+
+
+def test_replay_stream_round_trips():
+    """Replaying a cached response streams the same completion."""
+    cache = ResponseCache()
+    response, completion_tokens = _record(_stream_frames(n=2))
+    cache.put("key", response, completion_tokens)
+
+    replayed = _record(replay_stream(cache.get("key", stream=True)))
+    assert replayed == (response, completion_tokens)
@@ -0,0 +1,83 @@
+"""Tests for the prefix-affinity router of model replicas."""
+
+from collections import Counter
+
+import pytest
+from backend.vllm_server.router import (
+    PrefixRouter,
+    chat_routing_key,
+    completion_routing_key,
+)
+
+SYSTEM = {"role": "system", "content": "You are a basketball agent."}
+
+
+def _conversation(question: str, turns: int = 1):
+    messages = [SYSTEM, {"role": "user", "content": question}]
+    for turn in range(1, turns):
+        messages.append({"role": "assistant", "content": f"Answer {turn}"})
+        messages.append({"role": "user", "content": f"Follow up {turn}"})
+    return messages
+
+
+def test_turns_of_a_conversation_share_the_key():
+    """The key only covers the system prompt and the first turn."""
+    key = chat_routing_key(_conversation("Who is the best?"))
+    assert chat_routing_key(_conversation("Who is the best?", turns=3)) == key
+    assert chat_routing_key(_conversation("Who is the tallest?")) != key
+    assert chat_routing_key(_conversation("Who is the best?")[1:]) != key
+    assert chat_routing_key(_conversation("Who is the best?", 2), 3) != key
+
+
+def test_completion_key_uses_the_first_prompt_prefix():
+    """Completions sharing the leading part of their first prompt share the key."""
+    key = completion_routing_key("a" * 10 + "b", 10)
+    assert completion_routing_key(["a" * 10 + "c", "d"], 10) == key
+    assert completion_routing_key([[1, 2, 3], [4]], 2) == completion_routing_key(
+        [1, 2, 4], 2
+    )
+
+
+def test_routes_are_consistent_and_spread():
+    """Keys keep their replica and spread across all replicas."""
+    router = PrefixRouter(4)
+    keys = [chat_routing_key(_conversation(str(i))) for i in range(400)]
+    replicas = [router.candidates(key)[0] for key in keys]
+    assert replicas == [PrefixRouter(4).candidates(key)[0] for key in keys]
+    assert min(Counter(replicas).values()) > 50
+    assert sorted(router.candidates(keys[0])) == [0, 1, 2, 3]
+
+
+def test_bounded_load_falls_back_along_the_ring():
+    """A hot prefix spills over once its replica exceeds the load bound."""
+    router = PrefixRouter(4, load_factor=1.5)
+    key = chat_routing_key(_conversation("hot"))
+    home, second = router.candidates(key)[:2]
+
+    routed = [router.route(key) for _ in range(8)]
+    assert routed[0] == home
+    assert second in routed
+    assert max(router.in_flight) <= router.capacity()
+    assert sum(router.in_flight) == 8
+
+    for replica in routed:
+        router.release(replica)
+    assert router.in_flight == [0, 0, 0, 0]
+    assert router.route(key) == home
+
+
+def test_overloaded_replicas_are_excluded():
+    """Replicas that rejected a request are skipped unless none is left."""
+    router = PrefixRouter(2)
+    key = b"key"
+    home, other = router.candidates(key)
+    assert router.route(key, exclude={home}) == other
+    assert router.route(key, exclude={home, other}) in (home, other)
+
+
+def test_invalid_configuration():
+    """Routers need a replica and a load factor above 1."""
+    with pytest.raises(ValueError, match="replica"):
+        PrefixRouter(0)
+    with pytest.raises(ValueError, match="load factor"):
+        PrefixRouter(2, load_factor=1.0)
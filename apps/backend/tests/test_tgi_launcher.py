@@ -0,0 +1,122 @@
+"""Tests for supervising the TGI launcher, with a fake launcher process."""
+
+import asyncio
+import os
+import socket
+import sys
+import threading
+
+import pytest
+from backend.tgi_server.launcher import LauncherSupervisor, StartupLog
+from backend.tgi_server.pool import TGIClient
+from backend.tgi_server.service import ChatService
+
+from tests.helpers import tgi_chat_request
+
+# Logs the startup phases of text-generation-launcher, then serves the fake TGI
+FAKE_LAUNCHER = """
+import runpy, sys, time
+print("INFO download: text_generation_launcher: Starting download process.")
+time.sleep(0.05)
+print("INFO shard-manager: text_generation_launcher: Starting shard rank=0")
+time.sleep(0.05)
+print("INFO text_generation_router: router/src/main.rs: Warming up model")
+sys.stdout.flush()
+if len(sys.argv) > 2:
+    sys.exit(int(sys.argv[2]))
+sys.argv = ["fake", "--port", sys.argv[1], "--time-to-first-token", "0"]
+runpy.run_module("backend.tgi_server.fake", run_name="__main__")
+"""
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def launcher_command(tmp_path):
+    """Command starting the fake launcher on a free port."""
+    script = tmp_path / "launcher.py"
+    script.write_text(FAKE_LAUNCHER)
+    return [sys.executable, str(script), str(_free_port())]
+
+
+def _supervisor(command, on_failure=None) -> LauncherSupervisor:
+    return LauncherSupervisor(
+        command,
+        health_url=f"http://127.0.0.1:{command[-1]}/health",
+        env={**os.environ, "PYTHONPATH": os.pathsep.join(sys.path)},
+        startup_timeout=20,
+        initial_backoff=0.01,
+        max_backoff=0.2,
+        watch_interval=0.05,
+        max_restarts=2,
+        on_failure=on_failure,
+    )
+
+
+def test_startup_log_times_phases():
+    """Each phase lasts until the next one starts in the logs."""
+    now = [0.0]
+    log = StartupLog(0.0, clock=lambda: now[0])
+    now[0] = 30.0
+    log.feed("INFO text_generation_launcher: Starting shard rank=0")
+    now[0] = 42.0
+    log.feed("INFO text_generation_router: Warming up model")
+    timings = log.timings(ready_at=45.0)
+    assert timings == (30.0, 12.0, 3.0, 45.0)
+
+
+def test_restarts_crashed_launcher_and_holds_requests(launcher_command):
+    """Requests sent while the launcher restarts wait for it instead of failing."""
+    supervisor = _supervisor(launcher_command)
+    supervisor.start()
+    [timings] = supervisor.launches
+    # Timed from the forwarded logs, so slightly off the sleeps of the launcher
+    assert timings.shard_load > 0.03
+    assert timings.warmup is not None
+
+    async def run():
+        client = TGIClient(f"http://127.0.0.1:{launcher_command[-1]}")
+        service = ChatService(client, supervisor)
+        try:
+            await service.generate(tgi_chat_request(max_tokens=2))
+            supervisor.process.kill()
+            supervisor.process.wait()
+            return await service.generate(tgi_chat_request(max_tokens=2))
+        finally:
+            await client.aclose()
+
+    try:
+        response = asyncio.run(run())
+    finally:
+        supervisor.stop()
+    assert response["choices"][0]["message"]["content"] == "The Nuggets"
+    assert supervisor.restarts == 1
+    assert len(supervisor.launches) == 2
+
+
+def test_launcher_exiting_while_starting_fails(launcher_command):
+    """A launcher exiting before TGI is healthy fails the container start."""
+    supervisor = _supervisor([*launcher_command, "3"])
+    with pytest.raises(RuntimeError, match="exited with code 3"):
+        supervisor.start()
+
+
+def test_failed_restarts_fail_the_container(launcher_command):
+    """The container is failed once every restart of the launcher failed."""
+    failed = threading.Event()
+    supervisor = _supervisor(launcher_command, on_failure=failed.set)
+    supervisor.start()
+    # Every restart exits before TGI is healthy
+    supervisor.command.append("3")
+    supervisor.process.kill()
+    try:
+        assert failed.wait(timeout=20)
+        with pytest.raises(RuntimeError, match="could not be restarted"):
+            asyncio.run(supervisor.wait_ready())
+    finally:
+        supervisor.stop()
+    assert supervisor.restarts == 2
@@ -0,0 +1,95 @@
+"""Tests for the pooled client of the TGI server."""
+
+import asyncio
+
+import httpx
+import pytest
+from backend.tgi_server.fake import FakeTGIServer
+from backend.tgi_server.pool import (
+    BASE_TIMEOUT,
+    DEFAULT_MAX_TOKENS,
+    MAX_TIMEOUT,
+    MicroBatcher,
+    TGIClient,
+    TGIError,
+    request_timeout,
+)
+
+MESSAGES = [{"role": "user", "content": "Who won?"}]
+
+
+def test_request_timeout_grows_with_max_tokens():
+    """Long generations get longer timeouts, up to the container timeout."""
+    assert request_timeout(None) == request_timeout(DEFAULT_MAX_TOKENS)
+    assert BASE_TIMEOUT < request_timeout(16) < request_timeout(2048)
+    assert request_timeout(10**9) == MAX_TIMEOUT
+
+
+def test_connections_are_reused():
+    """Concurrent requests share the keep-alive connections of the pool."""
+
+    async def run():
+        async with FakeTGIServer(time_to_first_token=0.01) as tgi:
+            client = TGIClient(tgi.url, max_connections=4)
+            responses = await asyncio.gather(
+                *(client.chat(messages=MESSAGES, max_tokens=4) for _ in range(20))
+            )
+            chunks = [
+                chunk
+                async for chunk in await client.chat(
+                    messages=MESSAGES, max_tokens=4, stream=True
+                )
+            ]
+            await client.aclose()
+            return tgi, responses, chunks
+
+    tgi, responses, chunks = asyncio.run(run())
+    assert tgi.requests == 21
+    assert tgi.connections <= 4
+    assert tgi.peak_active <= 4
+    assert all(r["choices"][0]["finish_reason"] == "length" for r in responses)
+    assert [c["choices"][0]["delta"]["content"] for c in chunks] == [
+        "The",
+        " Nuggets",
+        " won",
+        " the",
+    ]
+
+
+def test_errors_of_tgi_are_raised():
+    """The error message of TGI is raised with its status."""
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(422, json={"error": "Input validation error"})
+
+    async def run():
+        client = TGIClient("http://tgi", transport=httpx.MockTransport(handler))
+        try:
+            await client.chat(messages=MESSAGES)
+        finally:
+            await client.aclose()
+
+    with pytest.raises(TGIError, match="Input validation error") as error:
+        asyncio.run(run())
+    assert error.value.status_code == 422
+
+
+def test_micro_batcher_releases_concurrent_requests_together():
+    """Short requests are released together, long ones are not held."""
+    batcher = MicroBatcher(window=0.05, max_batch=3, max_tokens=64)
+    assert batcher.accepts(64)
+    assert not batcher.accepts(65)
+    assert not batcher.accepts(None)
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        started_at = loop.time()
+        # The third request fills the batch before the window ends
+        await asyncio.gather(*(batcher.join() for _ in range(3)))
+        full_after = loop.time() - started_at
+        await asyncio.gather(*(batcher.join() for _ in range(2)))
+        return full_after
+
+    assert asyncio.run(run()) < 0.05
+    assert batcher.batches == 2
+    assert batcher.requests == 5
@@ -0,0 +1,132 @@
+"""Tests for streaming chat completions of the TGI server."""
+
+import asyncio
+import json
+
+import httpx
+from backend.tgi_server.fake import FakeTGIServer
+from backend.tgi_server.service import ChatService
+from backend.tgi_server.stream import DONE_FRAME, ChunkNormalizer
+
+from tests.helpers import tgi_chat_request
+
+TOOLS = [{"type": "function", "function": {"name": "get_score", "parameters": {}}}]
+
+
+def _events(frames) -> list:
+    """Decode the JSON payloads of server-sent event frames."""
+    return [json.loads(f[len("data: ") :]) for f in frames if f != DONE_FRAME]
+
+
+def _tool_chunk(arguments: str, finish_reason=None) -> dict:
+    """A chunk of a tool call streamed by TGI 1.4."""
+    tool_call = {
+        "index": 0,
+        "id": "",
+        "type": "function",
+        "function": {"name": None, "arguments": arguments},
+    }
+    delta = {"role": "assistant", "content": None, "tool_calls": tool_call}
+    return {
+        "id": "",
+        "object": "text_completion",
+        "created": 1,
+        "model": "fake/model",
+        "system_fingerprint": "1.4.0-native",
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }
+
+
+class FakeClient:
+    """TGI client streaming fixed chunks, optionally failing after them."""
+
+    def __init__(self, chunks, error=None):
+        """Stream the chunks, then raise the error if set."""
+        self.chunks = chunks
+        self.error = error
+        self.closed = False
+        self.calls = []
+
+    async def chat(self, **kwargs):
+        """Return a stream of the chunks."""
+        self.calls.append(kwargs)
+        return self._stream()
+
+    async def _stream(self):
+        try:
+            for chunk in self.chunks:
+                yield chunk
+            if self.error is not None:
+                raise self.error
+        finally:
+            self.closed = True
+
+
+def test_normalizer_rewrites_tool_call_deltas():
+    """Tool calls are sent as OpenAI deltas with their ID only once."""
+    normalizer = ChunkNormalizer("chatcmpl-1")
+    first = normalizer.normalize(_tool_chunk('{"fu'))
+    second = normalizer.normalize(_tool_chunk('nc"}', finish_reason="eos_token"))
+
+    assert first["id"] == "chatcmpl-1"
+    assert first["object"] == "chat.completion.chunk"
+    [choice] = first["choices"]
+    assert choice["delta"]["role"] == "assistant"
+    [tool_call] = choice["delta"]["tool_calls"]
+    assert tool_call["id"].startswith("call_")
+    assert tool_call["type"] == "function"
+    assert tool_call["function"] == {"name": "", "arguments": '{"fu'}
+
+    [choice] = second["choices"]
+    assert "role" not in choice["delta"]
+    assert choice["delta"]["tool_calls"] == [
+        {"index": 0, "function": {"arguments": 'nc"}'}}
+    ]
+    assert choice["finish_reason"] == "tool_calls"
+
+
+def test_stream_ends_with_error_and_done():
+    """A failing stream sends an error event and still ends with `[DONE]`."""
+    client = FakeClient([_tool_chunk("{}")], error=RuntimeError("shard died"))
+    service = ChatService(client)
+
+    async def run():
+        return [f async for f in service.generate_stream(tgi_chat_request(), "id")]
+
+    frames = asyncio.run(run())
+    assert frames[-1] == DONE_FRAME
+    chunk, error = _events(frames)
+    assert chunk["id"] == "id"
+    assert error["error"]["message"] == "shard died"
+    assert client.closed
+    assert client.calls[0]["stream"] is True
+
+
+def test_fake_server_streams_tool_call():
+    """The chunks of the fake TGI server rebuild the arguments of a tool call."""
+
+    async def run():
+        async with FakeTGIServer(time_to_first_token=0, tokens_per_second=1e6) as tgi:
+            normalizer = ChunkNormalizer()
+            chunks = []
+            async with httpx.AsyncClient(base_url=tgi.url) as client:
+                request = {
+                    "messages": [{"role": "user", "content": "Score?"}],
+                    "tools": TOOLS,
+                    "stream": True,
+                }
+                async with client.stream(
+                    "POST", "/v1/chat/completions", json=request
+                ) as response:
+                    async for line in response.aiter_lines():
+                        if line.startswith("data:"):
+                            chunk = json.loads(line[len("data:") :])
+                            chunks.append(normalizer.normalize(chunk))
+            return chunks
+
+    chunks = asyncio.run(run())
+    deltas = [chunk["choices"][0]["delta"] for chunk in chunks]
+    arguments = "".join(d["tool_calls"][0]["function"]["arguments"] for d in deltas)
+    assert json.loads(arguments)["function"]["_name"] == "get_score"
+    assert sum("id" in d["tool_calls"][0] for d in deltas) == 1
+    assert chunks[-1]["choices"][0]["finish_reason"] == "tool_calls"
@@ -0,0 +1,32 @@
+"""Tests for the asynchronous tokenizer pool."""
+
+import asyncio
+
+from backend.vllm_server.engine.tokenizer_pool import TokenizerPool
+
+from tests.helpers import WORDS
+
+
+def test_concurrent_encodes_are_batched(tokenizer):
+    """Texts submitted together are encoded in one batch with identical results."""
+    pool = TokenizerPool(tokenizer)
+    texts = [" ".join(WORDS[i:] + WORDS[:i]) for i in range(len(WORDS))]
+
+    async def encode_all():
+        return await asyncio.gather(
+            *(pool.encode(text) for text in texts),
+            pool.encode(texts[0], add_special_tokens=False),
+        )
+
+    *encodings, without_special = asyncio.run(encode_all())
+    pool.shutdown()
+
+    assert [encoding.input_ids for encoding in encodings] == [
+        tokenizer(text).input_ids for text in texts
+    ]
+    assert (
+        without_special.input_ids
+        == tokenizer(texts[0], add_special_tokens=False).input_ids
+    )
+    assert pool.batches == 1
+    assert pool.encoded_texts == len(texts) + 1
@@ -0,0 +1,113 @@
+"""Tests for the packed wire format of the model container streams."""
+
+import asyncio
+
+import pytest
+from backend.vllm_server.encoder import ChatChunkEncoder, CompletionChunkEncoder
+from backend.vllm_server.schema.common import LogProbs
+from backend.vllm_server.wire import (
+    PackedChatEncoder,
+    PackedCompletionEncoder,
+    StreamDecoder,
+    batch_records,
+)
+
+REQUEST_ID = 'cmpl-"quoted"'
+CREATED = 1712345678
+MODEL_NAME = "mistralai/Mistral-7B-Instruct-v0.1"
+TEXTS = ["", "hello", ' "quoted" \\ slash', "line\nbreak\t\x01\x7f", "über 🏀 </s>"]
+LOGPROBS = LogProbs(
+    text_offset=[0, 3],
+    token_logprobs=[-0.5, None],
+    tokens=["foo", "bar"],
+    top_logprobs=[{"foo": -0.5}, None],
+)
+
+
+def _chat_calls(text: str):
+    return [
+        ("role", (0, "assistant")),
+        ("echo", (0, text)),
+        ("content", (1, text)),
+        ("content", (0, text, LOGPROBS)),
+        ("finish", (1, text, "stop", 7, 3)),
+        ("finish", (0, text, "length", 7, 3, LOGPROBS)),
+        ("error", (f"failed: {text}",)),
+        ("done", ()),
+    ]
+
+
+def _completion_calls(text: str):
+    return [
+        ("text", (3, text)),
+        ("text", (0, text, LogProbs(tokens=["foo"], text_offset=[0]))),
+        ("finish", (3, text, "length", 7, 3, LOGPROBS)),
+        ("frame", (f"data: {text}\n\n",)),
+        ("done", ()),
+    ]
+
+
+def _render(encoder_class, packed_class, calls) -> tuple:
+    encoder = encoder_class(REQUEST_ID, CREATED, MODEL_NAME)
+    packed = packed_class(REQUEST_ID, CREATED, MODEL_NAME)
+    decoder = StreamDecoder()
+    expected, rendered = [], []
+    for name, args in calls:
+        if name == "frame":
+            # Frames rendered by the model container are forwarded as is
+            expected.append(args[0])
+        else:
+            expected.append(getattr(encoder, name)(*args))
+        rendered.append(decoder.render(getattr(packed, name)(*args)))
+    return expected, rendered
+
+
+@pytest.mark.parametrize("text", TEXTS)
+def test_chat_round_trip(text):
+    """Rendered chat records match the frames of the chunk encoder."""
+    expected, rendered = _render(ChatChunkEncoder, PackedChatEncoder, _chat_calls(text))
+    assert rendered == expected
+
+
+@pytest.mark.parametrize("text", TEXTS)
+def test_completion_round_trip(text):
+    """Rendered completion records match the frames of the chunk encoder."""
+    expected, rendered = _render(
+        CompletionChunkEncoder, PackedCompletionEncoder, _completion_calls(text)
+    )
+    assert rendered == expected
+
+
+def test_joined_records():
+    """Records joined in one message render as their concatenated frames."""
+    calls = _chat_calls("hello")
+    encoder = ChatChunkEncoder(REQUEST_ID, CREATED, MODEL_NAME)
+    packed = PackedChatEncoder(REQUEST_ID, CREATED, MODEL_NAME)
+    message = b"".join(getattr(packed, name)(*args) for name, args in calls)
+    expected = "".join(getattr(encoder, name)(*args) for name, args in calls)
+    assert StreamDecoder().render(message) == expected
+
+
+def test_records_are_smaller_than_frames():
+    """Only the varying parts of the chunks are sent."""
+    encoder = ChatChunkEncoder(REQUEST_ID, CREATED, MODEL_NAME)
+    packed = PackedChatEncoder(REQUEST_ID, CREATED, MODEL_NAME)
+    packed.role(0, "assistant")
+    assert len(packed.content(0, " token")) < len(encoder.content(0, " token")) / 10
+
+
+def test_batch_records():
+    """Records produced without waiting are joined, others are sent right away."""
+
+    async def records():
+        yield b"a"
+        yield b"b"
+        await asyncio.sleep(0.01)
+        yield b"c"
+        for _ in range(5):
+            yield b"d"
+
+    async def collect():
+        return [message async for message in batch_records(records(), 3)]
+
+    assert asyncio.run(collect()) == [b"ab", b"cdd", b"ddd"]
@@ -0,0 +1,6 @@
+#!/bin/bash
+
+# Usage: scripts/deploy_prewarm.sh path/to/games.csv
+# Deploys the scheduler pre-warming the vLLM and TGI model containers ahead of
+# the games of the schedule file, a CSV with the tip_off time of each game.
+HOOPER_PREWARM_SCHEDULE="$(realpath "${1:?Usage: scripts/deploy_prewarm.sh path/to/games.csv}")" rye run modal deploy backend/src/backend/prewarm/app.py
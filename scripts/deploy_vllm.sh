@@ -1,3 +1,6 @@
 #!/bin/bash
 
-rye run modal deploy backend/src/backend/vllm_server/api_server.py
+# Usage: scripts/deploy_vllm.sh [gateway|colocated]
+# gateway serves the API from a CPU container calling the model containers,
+# colocated serves it from the model containers themselves.
+HOOPER_SERVING_MODE="${1:-gateway}" rye run modal deploy backend/src/backend/vllm_server/api_server.py